@@ -23,6 +23,7 @@ TOKEN_REFRESH_INTERVAL_MS = 30 * 60 * 1000  # Periodic token refresh interval (3
 MAIN_VIEW_INIT_DELAY_MS = 200       # Delay before first MainViewWidget show (Anki init timing)
 STATE_CHANGE_DECK_DELAY_MS = 300    # Delay before sending deckSelected after state change (reviewer init timing)
 INIT_ADDON_LATE_DELAY_MS = 100      # Delay for init_addon when profile was already loaded at import time
+DB_MAINTENANCE_POLL_MS = 5 * 60 * 1000  # How often to check for idle-time SQLite maintenance
 
 # Global EmbeddingManager instance
 _embedding_manager = None
@@ -218,7 +219,11 @@ def _init_embedding_manager():
             backend_url=backend_url,
             auth_headers_fn=auth_headers_fn
         )
-        # Index is lazy-loaded on first search() call — no blocking at startup
+        # Warm the index off the UI thread: maps the on-disk snapshot so the
+        # first chat question does not pay the load cost.
+        import threading
+        threading.Thread(target=_embedding_manager.load_index, daemon=True,
+                         name="EmbeddingIndexWarmup").start()
 
         # Start background embedding after a delay to not slow down startup
         def get_all_cards():
@@ -226,7 +231,7 @@ def _init_embedding_manager():
                 return []
             card_ids = mw.col.find_cards("")
             cards = []
-            for cid in card_ids[:10000]:  # Limit to prevent memory issues
+            for cid in card_ids:
                 try:
                     card = mw.col.get_card(cid)
                     note = card.note()
@@ -238,6 +243,7 @@ def _init_embedding_manager():
                         'extra_fields': fields[2:] if len(fields) > 2 else [],
                         'tags': note.tags,
                         'deck_id': card.did,
+                        'mod': note.mod,
                     })
                 except (AttributeError, KeyError, IndexError) as card_err:
                     logger.debug("get_all_cards: skipping card %s: %s", cid, card_err)
@@ -323,6 +329,16 @@ def init_addon():
         mw._token_refresh_timer.timeout.connect(_periodic_token_refresh)
         mw._token_refresh_timer.start(TOKEN_REFRESH_INTERVAL_MS)  # 30 Minuten
 
+    # SQLite-Wartung (Checkpoint, ANALYZE, Compaction) — läuft nur, wenn der Writer idle ist
+    if not hasattr(mw, '_db_maintenance_timer'):
+        try:
+            from .storage.db_maintenance import run_if_idle as _db_maintenance_run_if_idle
+        except ImportError:
+            from storage.db_maintenance import run_if_idle as _db_maintenance_run_if_idle
+        mw._db_maintenance_timer = QTimer(mw)
+        mw._db_maintenance_timer.timeout.connect(_db_maintenance_run_if_idle)
+        mw._db_maintenance_timer.start(DB_MAINTENANCE_POLL_MS)
+
     try:
         mw.addonManager.setWebExports(__name__, r"(web|icons)/.*")
         setup_ui()
@@ -623,6 +639,44 @@ def on_reviewer_did_answer_card(reviewer, card, ease):
         logger.error("cardResult emission error: %s", e)
 
 
+def on_notes_will_be_deleted(col, note_ids):
+    """Evict the embeddings of cards whose notes are about to be deleted."""
+    if not _embedding_manager or not note_ids:
+        return
+    try:
+        from anki.utils import ids2str
+        card_ids = col.db.list("SELECT id FROM cards WHERE nid IN %s" % ids2str(note_ids))
+        _embedding_manager.forget_cards(card_ids)
+    except Exception as e:
+        logger.warning("Embedding eviction for deleted notes failed: %s", e)
+
+
+_last_card_count = None
+
+
+def on_operation_did_execute(changes, handler):
+    """Prune embeddings of cards removed outside note deletion (browser, Empty Cards).
+
+    Card moves and edits change neither the card set nor the count, so the
+    cheap count check keeps this a no-op after reviews and deck moves.
+    """
+    global _last_card_count
+    if not _embedding_manager or not getattr(changes, 'card', False) or not mw or not mw.col:
+        return
+    try:
+        count = mw.col.card_count()
+        previous, _last_card_count = _last_card_count, count
+        if previous is None or count >= previous:
+            return
+        card_ids = mw.col.db.list("SELECT id FROM cards")
+    except Exception as e:
+        logger.debug("on_operation_did_execute: card count failed: %s", e)
+        return
+    import threading
+    threading.Thread(target=_embedding_manager.prune_index, args=(card_ids,), daemon=True,
+                     name="EmbeddingIndexPrune").start()
+
+
 def on_state_will_change(new_state, old_state):
     """Wird aufgerufen, wenn sich der Anki-State ändert (z.B. review -> deckBrowser)"""
     try:
@@ -764,6 +818,15 @@ def cleanup_addon():
             _embedding_manager.stop_background_embedding()
             _embedding_manager = None
 
+        # Commit writes still queued on the database writer thread
+        # (includes chat messages queued by save_message)
+        try:
+            from .storage.card_sessions import flush as flush_db_writes
+            if not flush_db_writes(timeout=5):
+                logger.warning("cleanup: queued database writes did not finish in time")
+        except Exception as e:
+            logger.warning("cleanup: could not flush database writes: %s", e)
+
         # Restore addon proxy (uninstall eval wrapper)
         try:
             from .ui.addon_proxy import get_proxy
@@ -829,6 +892,16 @@ if mw is not None:
         logger.info("✅ Hook: state_will_change registriert")
     else:
         logger.warning("⚠️ WARNUNG: state_will_change Hook nicht verfügbar")
+
+    # Embedding-Index mit gelöschten Karten synchron halten
+    try:
+        from anki import hooks as anki_hooks
+        if hasattr(anki_hooks, 'notes_will_be_deleted'):
+            anki_hooks.notes_will_be_deleted.append(on_notes_will_be_deleted)
+    except ImportError as e:
+        logger.debug("anki.hooks not available: %s", e)
+    if hasattr(gui_hooks, 'operation_did_execute'):
+        gui_hooks.operation_did_execute.append(on_operation_did_execute)
     
     # Premium UI: CSS-Only Styling (robust & kompatibel mit allen Decks)
     # CSS wird in card_tracker.py injiziert
@@ -35,11 +35,31 @@ class AgentMemory:
             from storage.card_sessions import _get_db
         return _get_db()
 
+    def _write(self, sql, params=()):
+        """Execute one write statement and commit it.
+
+        A pooled read-only connection cannot write: the statement then runs
+        on card_sessions' writer thread (see storage/db_pool.py).
+        """
+        try:
+            from ..storage import card_sessions, db_pool
+        except ImportError:
+            from storage import card_sessions, db_pool
+
+        def run(db):
+            db.execute(sql, params)
+            db.commit()
+
+        db = self._get_db()
+        if isinstance(db, db_pool.ReadConnection):
+            card_sessions.run_write(lambda: run(card_sessions._get_db()))
+        else:
+            run(db)
+
     def _ensure_table(self):
         """Create the agent_memory table if it doesn't exist."""
         try:
-            db = self._get_db()
-            db.execute("""
+            self._write("""
                 CREATE TABLE IF NOT EXISTS agent_memory (
                     agent_name  TEXT NOT NULL,
                     key         TEXT NOT NULL,
@@ -48,7 +68,6 @@ class AgentMemory:
                     PRIMARY KEY (agent_name, key)
                 )
             """)
-            db.commit()
         except Exception as e:
             logger.warning("Could not create agent_memory table: %s", e)
 
@@ -70,24 +89,20 @@ class AgentMemory:
     def set(self, key, value):
         """Set a value in agent memory."""
         try:
-            db = self._get_db()
-            db.execute("""
+            self._write("""
                 INSERT OR REPLACE INTO agent_memory (agent_name, key, value, updated_at)
                 VALUES (?, ?, ?, ?)
             """, (self.agent_name, key, json.dumps(value), int(time.time() * 1000)))
-            db.commit()
         except Exception as e:
             logger.warning("AgentMemory.set error (%s/%s): %s", self.agent_name, key, e)
 
     def delete(self, key):
         """Delete a key from agent memory."""
         try:
-            db = self._get_db()
-            db.execute(
+            self._write(
                 "DELETE FROM agent_memory WHERE agent_name = ? AND key = ?",
                 (self.agent_name, key)
             )
-            db.commit()
         except Exception as e:
             logger.warning("AgentMemory.delete error (%s/%s): %s", self.agent_name, key, e)
 
@@ -107,11 +122,9 @@ class AgentMemory:
     def clear(self):
         """Clear all memory for this agent."""
         try:
-            db = self._get_db()
-            db.execute(
+            self._write(
                 "DELETE FROM agent_memory WHERE agent_name = ?",
                 (self.agent_name,)
             )
-            db.commit()
         except Exception as e:
             logger.warning("AgentMemory.clear error (%s): %s", self.agent_name, e)
@@ -0,0 +1,160 @@
+"""Two-level cache for query embeddings (in-memory LRU over SQLite).
+
+Chat turns embed the same short texts again and again — the user message,
+the resolved intent and every candidate term from extract_query_terms
+("Dünndarm", "Jejunum", ...). Entries are keyed by (model, normalized text);
+normalization only removes differences that cannot change the embedding
+(Unicode form, surrounding/repeated whitespace, the 2000-char cut the
+/embed call applies anyway). The SQLite layer lives in card_sessions.db so
+it survives restarts and is shared with the benchmark scripts.
+"""
+
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+try:
+    from ..utils.logging import get_logger
+except ImportError:
+    from utils.logging import get_logger
+logger = get_logger(__name__)
+
+try:
+    from .vector_index import encode_vector, decode_vector
+except ImportError:
+    from ai.vector_index import encode_vector, decode_vector
+
+MAX_TEXT_CHARS = 2000  # EmbeddingManager.embed_texts truncates to this
+
+
+def normalize_text(text):
+    """Canonical form of an embedding input (see module docstring)."""
+    text = unicodedata.normalize('NFC', text or '')
+    return re.sub(r'\s+', ' ', text).strip()[:MAX_TEXT_CHARS]
+
+
+def text_key(text):
+    """Fixed-size cache key for an already normalized text."""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class QueryEmbeddingCache:
+    """LRU of embeddings backed by the ``query_embeddings`` table.
+
+    Thread-safe. Storage errors are logged and degrade to memory-only.
+
+    Args:
+        model: Embedding model name, part of every key.
+        capacity: Entries kept in memory.
+        max_rows: Entries kept in SQLite; least recently used are pruned.
+    """
+
+    PRUNE_EVERY = 500  # new rows between two prune passes
+
+    def __init__(self, model, capacity=2048, max_rows=50000):
+        self.model = model
+        self.capacity = max(1, int(capacity))
+        self.max_rows = max(1, int(max_rows))
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._since_prune = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    # ── Storage ──
+
+    def _store_load(self, keys):
+        try:
+            from ..storage.card_sessions import load_query_embeddings
+        except ImportError:
+            from storage.card_sessions import load_query_embeddings
+        return load_query_embeddings(self.model, keys)
+
+    def _store_save(self, items):
+        try:
+            from ..storage.card_sessions import save_query_embeddings, prune_query_embeddings
+        except ImportError:
+            from storage.card_sessions import save_query_embeddings, prune_query_embeddings
+        save_query_embeddings(self.model, items)
+        self._since_prune += len(items)
+        if self._since_prune >= self.PRUNE_EVERY:
+            self._since_prune = 0
+            pruned = prune_query_embeddings(self.max_rows)
+            if pruned:
+                logger.debug("QueryEmbeddingCache: pruned %d rows", pruned)
+
+    # ── Public API ──
+
+    def get_many(self, texts):
+        """Return a list aligned with *texts*: the cached vector or None."""
+        keys = [text_key(normalize_text(t)) for t in texts]
+        results = [None] * len(keys)
+        missing = {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                vec = self._lru.get(key)
+                if vec is not None:
+                    self._lru.move_to_end(key)
+                    results[i] = vec
+                    self.memory_hits += 1
+                else:
+                    missing.setdefault(key, []).append(i)
+        if not missing:
+            return results
+
+        try:
+            stored = self._store_load(list(missing))
+        except Exception as e:  # cache must never break embedding
+            logger.warning("QueryEmbeddingCache: load failed: %s", e)
+            stored = {}
+        with self._lock:
+            for key, positions in missing.items():
+                blob = stored.get(key)
+                vec = decode_vector(blob, len(blob) // 4) if blob else None
+                if vec is None:
+                    self.misses += len(positions)
+                    continue
+                self._remember(key, vec)
+                self.disk_hits += len(positions)
+                for i in positions:
+                    results[i] = vec
+        return results
+
+    def put_many(self, texts, vectors):
+        """Store embeddings for *texts*; None/empty vectors are skipped."""
+        items = []
+        with self._lock:
+            for text, vec in zip(texts, vectors):
+                if not vec:
+                    continue
+                key = text_key(normalize_text(text))
+                vec = list(vec)
+                self._remember(key, vec)
+                items.append((key, encode_vector(vec)))
+        if not items:
+            return
+        try:
+            self._store_save(items)
+        except Exception as e:
+            logger.warning("QueryEmbeddingCache: save failed: %s", e)
+
+    def _remember(self, key, vec):
+        self._lru[key] = vec
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    def stats(self):
+        """Hit/miss counters since start, plus the hit rate."""
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_entries': len(self._lru),
+            }
@@ -0,0 +1,207 @@
+"""Pipelined, rate-adaptive backfill of card embeddings.
+
+BackgroundEmbeddingThread used to send one /embed batch at a time with a
+fixed pause in between, so initial indexing ran far below what the backend
+allows. AdaptiveEmbedPipeline keeps several batches in flight on a small
+thread pool and tunes batch size and concurrency AIMD-style:
+
+- every round of fast successes grows concurrency by one and the batch by
+  ``batch_step`` (up to the caps),
+- a slow answer (latency above ``target_latency``) shrinks the batch,
+- a 429 halves both and pauses new submissions for the backoff delay
+  (Retry-After when the backend sends one),
+- transient failures (timeouts, 5xx) are retried with exponential backoff
+  and jitter; non-retryable ones (auth, empty response) stop the run.
+
+Finished batches are handed to ``on_batch`` on the calling thread in
+completion order, so all SQLite writes stay on one thread and every batch
+is persisted as soon as it lands — a cancelled or crashed run resumes from
+the stored embeddings on the next start.
+
+Subclasses can drive other batched backend calls through the same control
+loop by overriding ``_call`` and ``_check`` (see ai/kg_extraction.py).
+"""
+
+import heapq
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+try:
+    from ..utils.logging import get_logger
+except ImportError:
+    from utils.logging import get_logger
+logger = get_logger(__name__)
+
+
+class EmbedError(Exception):
+    """An /embed call failed.
+
+    Args:
+        retryable: False for failures a retry cannot fix (auth, bad request).
+        retry_after: Seconds the backend asked us to wait, if any.
+    """
+
+    def __init__(self, message, retryable=True, retry_after=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.retry_after = retry_after
+
+
+class RateLimited(EmbedError):
+    """The backend answered 429."""
+
+    def __init__(self, message="rate limited (429)", retry_after=None):
+        super().__init__(message, retryable=True, retry_after=retry_after)
+
+
+class AdaptiveEmbedPipeline:
+    """Embed many items with a bounded pool of in-flight batches.
+
+    Args:
+        embed_fn: ``embed_fn(texts) -> list of vectors``; raises EmbedError
+            (or any other exception, treated as retryable).
+        batch_size: Initial texts per request.
+        concurrency: Initial number of requests in flight.
+    """
+
+    def __init__(self, embed_fn, batch_size=50, min_batch=8, max_batch=100, batch_step=10,
+                 concurrency=2, max_concurrency=4, target_latency=4.0,
+                 max_retries=5, base_backoff=1.0, max_backoff=60.0,
+                 sleep=time.sleep, clock=time.monotonic):
+        self._embed_fn = embed_fn
+        self.min_batch = max(1, int(min_batch))
+        self.max_batch = max(self.min_batch, int(max_batch))
+        self.batch_step = max(1, int(batch_step))
+        self.batch_size = min(self.max_batch, max(self.min_batch, int(batch_size)))
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.concurrency = min(self.max_concurrency, max(1, int(concurrency)))
+        self.target_latency = float(target_latency)
+        self.max_retries = int(max_retries)
+        self.base_backoff = float(base_backoff)
+        self.max_backoff = float(max_backoff)
+        self._sleep = sleep
+        self._clock = clock
+        self._streak = 0
+        self._paused_until = 0.0
+        self.stats = {'embedded': 0, 'batches': 0, 'retries': 0, 'throttled': 0}
+        self.error = None  # set when the run stopped on a failure
+
+    # ── AIMD control ──
+
+    def _on_success(self, latency):
+        if latency > self.target_latency:
+            self._streak = 0
+            self.batch_size = max(self.min_batch, int(self.batch_size * 0.75))
+            return
+        self._streak += 1
+        if self._streak >= self.concurrency:
+            self._streak = 0
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            self.batch_size = min(self.max_batch, self.batch_size + self.batch_step)
+
+    def _on_throttle(self):
+        self._streak = 0
+        self.concurrency = max(1, self.concurrency // 2)
+        self.batch_size = max(self.min_batch, self.batch_size // 2)
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(self.max_backoff, max(0.0, float(retry_after)))
+        delay = min(self.max_backoff, self.base_backoff * (2 ** (attempt - 1)))
+        return delay * (0.5 + random.random() / 2)
+
+    # ── Backend call ──
+
+    def _call(self, batch):
+        """Run on a pool thread: send one batch, return its result."""
+        return self._embed_fn([item['text'] for item in batch])
+
+    def _check(self, batch, result):
+        """Validate *result* of *batch* on the calling thread; raise EmbedError if unusable."""
+        if not result:
+            raise EmbedError("backend returned no embeddings", retryable=False)
+        if len(result) != len(batch):
+            raise EmbedError("backend returned %d of %d embeddings" % (len(result), len(batch)))
+
+    # ── Run ──
+
+    def run(self, items, on_batch, cancelled=None):
+        """Embed ``item['text']`` of every item; returns the number embedded.
+
+        ``on_batch(batch, vectors)`` is called for each finished batch. The
+        run stops early when *cancelled()* turns true, on a non-retryable
+        error, or when one batch failed more than ``max_retries`` times;
+        ``self.error`` then holds the reason.
+        """
+        pending = list(reversed(items))  # pop() from the end keeps input order
+        retries = []  # heap of (not_before, seq, attempt, batch)
+        seq = 0
+        inflight = {}
+        pool = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                  thread_name_prefix='embed-pipeline')
+        try:
+            while (pending or retries or inflight) and self.error is None:
+                if cancelled is not None and cancelled():
+                    break
+                now = self._clock()
+                while len(inflight) < self.concurrency and now >= self._paused_until:
+                    if retries and retries[0][0] <= now:
+                        _, _, attempt, batch = heapq.heappop(retries)
+                    elif pending:
+                        n = min(self.batch_size, len(pending))
+                        batch = [pending.pop() for _ in range(n)]
+                        attempt = 0
+                    else:
+                        break
+                    future = pool.submit(self._call, batch)
+                    inflight[future] = (batch, attempt, now)
+
+                if not inflight:
+                    wake = max(self._paused_until, retries[0][0] if retries else now)
+                    self._sleep(min(0.5, max(0.01, wake - now)))
+                    continue
+
+                done, _ = wait(inflight, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch, attempt, started = inflight.pop(future)
+                    try:
+                        vectors = future.result()
+                        self._check(batch, vectors)
+                    except Exception as e:  # classified below, never propagates
+                        seq += 1
+                        self._on_failure(e, batch, attempt, retries, seq)
+                        continue
+                    self._on_success(self._clock() - started)
+                    self.stats['batches'] += 1
+                    self.stats['embedded'] += len(batch)
+                    on_batch(batch, vectors)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+        if self.error is not None:
+            logger.warning("EmbedPipeline: stopped after %d embeddings: %s",
+                           self.stats['embedded'], self.error)
+        return self.stats['embedded']
+
+    def _on_failure(self, error, batch, attempt, retries, seq):
+        retryable = getattr(error, 'retryable', True)
+        if not retryable:
+            self.error = error
+            return
+        attempt += 1
+        if attempt > self.max_retries:
+            self.error = error
+            return
+        if isinstance(error, RateLimited):
+            self.stats['throttled'] += 1
+            self._on_throttle()
+        else:
+            self.concurrency = max(1, self.concurrency // 2)
+        self.stats['retries'] += 1
+        delay = self._backoff(attempt, getattr(error, 'retry_after', None))
+        not_before = self._clock() + delay
+        if isinstance(error, RateLimited):
+            self._paused_until = max(self._paused_until, not_before)
+        logger.debug("EmbedPipeline: %s — retry %d in %.1fs (batch %d, concurrency %d)",
+                     error, attempt, delay, self.batch_size, self.concurrency)
+        heapq.heappush(retries, (not_before, seq, attempt, batch))
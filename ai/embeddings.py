@@ -1,12 +1,15 @@
 """
 Manages vector embeddings for Anki cards.
 - Gemini Embedding API for vector generation
-- In-memory index for fast cosine similarity search (pure Python, no numpy required)
+- In-memory index for fast cosine similarity search (NumPy matrix when
+  available, pure-Python fallback otherwise — see ai/vector_index.py)
 - Lazy + background embedding schedule
 """
 import hashlib
 import math
+import os
 import re
+import sqlite3
 import struct
 import threading
 import time
@@ -19,51 +22,48 @@ except ImportError:
     from utils.logging import get_logger
 logger = get_logger(__name__)
 
+try:
+    from .embed_cache import QueryEmbeddingCache
+except ImportError:
+    from ai.embed_cache import QueryEmbeddingCache
 
-def _dot(a, b):
-    """Dot product of two float lists."""
-    return sum(x * y for x, y in zip(a, b))
-
-
-def _norm(a):
-    """L2 norm of a float list."""
-    return math.sqrt(sum(x * x for x in a))
-
-
-def _normalize(a):
-    """Normalize a float list to unit length."""
-    n = _norm(a)
-    if n > 0:
-        return [x / n for x in a]
-    return a
-
-
-def _pack_floats(floats):
-    """Pack list of floats into bytes (little-endian float32)."""
-    return struct.pack(f'<{len(floats)}f', *floats)
+try:
+    from .embed_pipeline import AdaptiveEmbedPipeline, EmbedError, RateLimited
+except ImportError:
+    from ai.embed_pipeline import AdaptiveEmbedPipeline, EmbedError, RateLimited
 
+try:
+    from .vector_index import (
+        VectorIndex, encode_vector, decode_vector, parse_quantization, parse_prefix_dim)
+except ImportError:
+    from ai.vector_index import (
+        VectorIndex, encode_vector, decode_vector, parse_quantization, parse_prefix_dim)
 
-def _unpack_floats(data, dim):
-    """Unpack bytes into list of floats (little-endian float32)."""
-    return list(struct.unpack(f'<{dim}f', data))
+try:
+    from .kg_term_index import as_term_index, default_snapshot_prefix, load_term_index
+except ImportError:
+    from ai.kg_term_index import as_term_index, default_snapshot_prefix, load_term_index
 
 
 class EmbeddingManager:
     MODEL = "gemini-embedding-001"
     EMBEDDING_DIM = 3072
     BATCH_SIZE = 50
+    MAX_CONCURRENT_BATCHES = 4  # /embed requests in flight during background indexing
     MIN_SIMILARITY = 0.3
 
     def __init__(self, api_key=None, backend_url=None, auth_headers_fn=None):
         self._api_key = api_key
         self._backend_url = backend_url
         self._auth_headers_fn = auth_headers_fn
-        self._index = []       # list of normalized float lists
-        self._card_ids = []    # card_id list aligned with index rows
+        self._index_options = self._load_index_options()
+        self._index = self._new_index()  # normalized card vectors
         self._lock = threading.Lock()
+        self._load_lock = threading.Lock()  # serializes load_index() callers
         self._background_thread = None
         self._index_loaded = False  # lazy-load flag
         self._kg_term_index = None  # cached KG term index
+        self._query_cache = QueryEmbeddingCache(self.MODEL)
 
     def set_credentials(self, api_key=None, backend_url=None, auth_headers_fn=None):
         if api_key is not None:
@@ -73,15 +73,117 @@ class EmbeddingManager:
         if auth_headers_fn is not None:
             self._auth_headers_fn = auth_headers_fn
 
+    def _load_index_options(self):
+        """Read the ``embedding_index`` config block (see config.DEFAULT_CONFIG)."""
+        try:
+            from ..config import get_config
+        except ImportError:
+            from config import get_config
+        try:
+            opts = dict(get_config().get('embedding_index') or {})
+        except (AttributeError, TypeError, ValueError):
+            opts = {}
+        try:
+            quantization = parse_quantization(opts.get('quantization'))
+        except ValueError as e:
+            logger.warning("EmbeddingManager: %s — using float32", e)
+            quantization = None
+        try:
+            prefix_dim = parse_prefix_dim(opts.get('prefix_dim'), self.EMBEDDING_DIM)
+        except ValueError as e:
+            logger.warning("EmbeddingManager: %s — prefix stage disabled", e)
+            prefix_dim = None
+        ann = str(opts.get('ann') or 'none').lower()
+        if ann not in ('none', 'ivf'):
+            logger.warning("EmbeddingManager: Unknown ann %r — using exact scan", ann)
+        return {
+            'quantization': quantization,
+            'quantize_storage': bool(opts.get('quantize_storage', False)),
+            'rescore_candidates': int(opts.get('rescore_candidates', 300)),
+            'prefix_dim': prefix_dim,
+            'ivf': ann == 'ivf',
+            'ivf_lists': int(opts.get('ivf_lists', 0) or 0),
+            'ivf_probes': int(opts.get('ivf_probes', 16)),
+            'ivf_min_rows': int(opts.get('ivf_min_rows', 20000)),
+        }
+
+    def _index_params(self):
+        opts = self._index_options
+        keys = ('quantization', 'rescore_candidates', 'prefix_dim',
+                'ivf', 'ivf_lists', 'ivf_probes', 'ivf_min_rows')
+        return {k: opts[k] for k in keys}
+
+    def _new_index(self):
+        return VectorIndex(self.EMBEDDING_DIM, **self._index_params())
+
+    def _encode_embedding(self, embedding):
+        """Serialize an embedding for card_embeddings (quantized if configured)."""
+        opts = self._index_options
+        return encode_vector(embedding, opts['quantization'] if opts['quantize_storage'] else None)
+
+    def _decode_embedding(self, blob):
+        """Decode a card_embeddings blob of any supported layout, or None."""
+        return decode_vector(blob, self.EMBEDDING_DIM)
+
     # ── Embedding API ──
 
     MODEL = "text-embedding-004"
 
-    def embed_texts(self, texts):
-        """Embed texts via backend /embed endpoint."""
+    def embed_texts(self, texts, use_cache=True):
+        """Embed texts via backend /embed endpoint.
+
+        Query texts go through the persistent query-embedding cache and only
+        misses are sent to the backend. Card texts (background indexing,
+        lazy embedding) pass ``use_cache=False`` — they are unique and
+        persisted in card_embeddings already.
+
+        Returns a list aligned with *texts*; entries whose backend call
+        failed are None, and the list is empty when nothing could be embedded.
+        """
         if not texts:
             return []
+        if not use_cache:
+            return self._embed_remote(texts)
+
+        cache = self._query_cache
+        results = cache.get_many(texts)
+        missing = [i for i, vec in enumerate(results) if vec is None]
+        if missing:
+            fetched = self._embed_remote([texts[i] for i in missing])
+            if len(fetched) == len(missing):
+                cache.put_many([texts[i] for i in missing], fetched)
+                for i, vec in zip(missing, fetched):
+                    results[i] = vec or None
+        stats = cache.stats()
+        logger.debug("EmbeddingManager: %d/%d texts from cache (hit rate %.0f%%)",
+                     len(texts) - len(missing), len(texts), stats['hit_rate'] * 100)
+        if all(vec is None for vec in results):
+            return []
+        return results
+
+    def cache_stats(self):
+        """Hit/miss counters of the query-embedding cache."""
+        return self._query_cache.stats()
+
+    def _embed_remote(self, texts):
+        """POST *texts* to the backend /embed endpoint (no caching).
+
+        Returns [] on any failure.
+        """
+        try:
+            embeddings = self._post_embed(texts)
+        except EmbedError as e:
+            logger.error("EmbeddingManager: Backend embed failed: %s", e)
+            return []
+        logger.debug("EmbeddingManager: %d texts embedded via backend", len(embeddings))
+        return embeddings
 
+    def _post_embed(self, texts):
+        """POST *texts* to /embed and return the embeddings.
+
+        Raises RateLimited on 429 and EmbedError otherwise (``retryable``
+        is False for missing credentials, 4xx and empty responses).
+        """
         import requests as http_requests
         try:
             from ..config import get_backend_url, get_auth_token
@@ -92,8 +194,7 @@ class EmbeddingManager:
         auth_token = get_auth_token()
 
         if not backend_url or not auth_token:
-            logger.warning("EmbeddingManager: No backend URL or auth token configured")
-            return []
+            raise EmbedError("No backend URL or auth token configured", retryable=False)
 
         try:
             response = http_requests.post(
@@ -105,17 +206,25 @@ class EmbeddingManager:
                 json={'texts': [t[:2000] for t in texts]},
                 timeout=30,
             )
-            response.raise_for_status()
-            data = response.json()
-            embeddings = data.get('embeddings', [])
-            if embeddings:
-                logger.debug("EmbeddingManager: %d texts embedded via backend", len(embeddings))
-                return embeddings
-            logger.warning("EmbeddingManager: Backend returned empty embeddings")
-            return []
-        except Exception as e:
-            logger.error("EmbeddingManager: Backend embed failed: %s", e)
-            return []
+        except Exception as e:  # timeouts, connection resets
+            raise EmbedError("Request failed: %s" % e) from e
+
+        status = response.status_code
+        if status == 429:
+            try:
+                retry_after = float(response.headers.get('Retry-After'))
+            except (TypeError, ValueError):
+                retry_after = None
+            raise RateLimited(retry_after=retry_after)
+        if status >= 400:
+            raise EmbedError("HTTP %d" % status, retryable=status >= 500)
+        try:
+            embeddings = response.json().get('embeddings', [])
+        except (ValueError, AttributeError) as e:
+            raise EmbedError("Invalid response: %s" % e) from e
+        if not embeddings:
+            raise EmbedError("Backend returned empty embeddings", retryable=False)
+        return embeddings
 
     def _card_to_text(self, card_data):
         """Build embedding text from card content.
@@ -190,33 +299,141 @@ class EmbeddingManager:
 
     # ── In-Memory Index ──
 
+    def _snapshot_prefix(self):
+        """Path prefix of the on-disk index snapshot (next to card_sessions.db)."""
+        try:
+            from storage.card_sessions import _DB_PATH
+        except ImportError:
+            from ..storage.card_sessions import _DB_PATH
+        return os.path.splitext(_DB_PATH)[0] + '.embeddings'
+
     def load_index(self):
-        """Load all embeddings from DB into memory. Safe to call multiple times."""
+        """Load the card index. Safe to call multiple times and from any thread.
+
+        Memory-maps the pre-normalized snapshot written by save_index_snapshot()
+        and applies only rows written to card_embeddings since it was taken.
+        Falls back to a full DB load when there is no usable snapshot or when
+        the snapshot cannot be reconciled with the DB, then writes a fresh
+        snapshot for the next start.
+        """
         if self._index_loaded:
             return
         try:
-            from storage.card_sessions import load_all_embeddings
+            from storage.card_sessions import (
+                load_all_embeddings, load_embeddings_since, get_embeddings_watermark,
+                load_embedded_card_ids)
         except ImportError:
-            from ..storage.card_sessions import load_all_embeddings
+            from ..storage.card_sessions import (
+                load_all_embeddings, load_embeddings_since, get_embeddings_watermark,
+                load_embedded_card_ids)
+
+        with self._load_lock:
+            if self._index_loaded:
+                return
+            t0 = time.time()
+            db_count, newest = get_embeddings_watermark()
+            index, meta = VectorIndex.load(
+                self._snapshot_prefix(), self.EMBEDDING_DIM, **self._index_params())
+            changed = 0
+            if index is not None and meta.get('watermark') and newest:
+                changed = self._apply_rows(index, load_embeddings_since(meta['watermark']))
+            if index is not None and len(index) > db_count:
+                # Rows deleted since the snapshot: tombstone them instead of rebuilding
+                in_db = load_embedded_card_ids()
+                for card_id in [cid for cid in index.ids if cid not in in_db]:
+                    index.remove(card_id)
+                    changed += 1
+            if index is not None and len(index) != db_count:
+                logger.info("EmbeddingManager: Snapshot out of sync (%d rows vs %d in DB), rebuilding",
+                            len(index), db_count)
+                index = None
+
+            source = 'snapshot'
+            if index is None:
+                rows = load_all_embeddings()
+                index = self._new_index()
+                index.build_from_bytes([r[0] for r in rows], [r[1] for r in rows])
+                source = 'database'
+
+            with self._lock:
+                self._index = index
+                self._index_loaded = True
+
+        logger.info("EmbeddingManager: Loaded %d embeddings from %s in %.0f ms "
+                    "(%d updated, %.1f MB private)",
+                    len(index), source, (time.time() - t0) * 1000, changed,
+                    index.memory_bytes() / 1e6)
+        if source == 'database' or changed or index.ivf_needs_training():
+            self.save_index_snapshot()
+
+    def _apply_rows(self, index, rows):
+        """Apply DB rows newer than a snapshot; unchanged vectors are skipped
+        so the snapshot stays memory-mapped. Returns number of rows applied."""
+        applied = 0
+        for card_id, emb_bytes, _ in rows:
+            vec = self._decode_embedding(emb_bytes)
+            if vec is None:
+                continue
+            current = index.get_vector(card_id)
+            if current is not None:
+                norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+                if max(abs(a / norm - b) for a, b in zip(vec, current)) < 1e-6:
+                    continue
+            index.add(card_id, vec)
+            applied += 1
+        return applied
+
+    def save_index_snapshot(self):
+        """Persist the in-memory index and re-open it memory-mapped.
 
-        rows = load_all_embeddings()
+        Called after a full load and at the end of background embedding, so
+        the next profile load (and every other process) maps the same pages.
+        """
+        if not self._index_loaded:
+            return False
+        try:
+            from storage.card_sessions import get_embeddings_watermark
+        except ImportError:
+            from ..storage.card_sessions import get_embeddings_watermark
+
+        # Read the watermark first: rows written meanwhile are re-checked on load
+        _, newest = get_embeddings_watermark()
+        prefix = self._snapshot_prefix()
+        with self._lock:
+            index = self._index
+        fitted = None
+        if index.ivf_needs_training():
+            # k-means only reads the rows, so searches keep running meanwhile
+            t0 = time.time()
+            fitted = index.fit_ivf()
+            logger.info("EmbeddingManager: IVF trained on %d rows in %.1f s",
+                        len(index), time.time() - t0)
+        with self._lock:
+            installed = False
+            if fitted is not None and self._index is index:
+                installed = index.install_ivf(fitted)
+                if not installed:
+                    logger.info("EmbeddingManager: index changed during IVF fit; "
+                                "training again with the next snapshot")
+            if not installed and self._index.is_mapped() and not self._index.tombstones:
+                return True  # already identical to the file on disk
+            current = self._index
+            state = current.snapshot()
+
+        # The file write only reads the frozen arrays: searches keep running
+        try:
+            current.write_snapshot(state, prefix, {'watermark': newest, 'model': self.MODEL})
+        except OSError as e:
+            logger.warning("EmbeddingManager: Could not write index snapshot: %s", e)
+            return False
+        mapped, _ = VectorIndex.load(prefix, self.EMBEDDING_DIM, **self._index_params())
         with self._lock:
-            if not rows:
-                self._index = []
-                self._card_ids = []
-            else:
-                card_ids = []
-                vectors = []
-                for card_id, emb_bytes, _ in rows:
-                    vec = _unpack_floats(emb_bytes, self.EMBEDDING_DIM)
-                    if len(vec) == self.EMBEDDING_DIM:
-                        vectors.append(_normalize(vec))
-                        card_ids.append(card_id)
-                self._card_ids = card_ids
-                self._index = vectors
-            self._index_loaded = True
-
-        logger.info("EmbeddingManager: Loaded %d embeddings into index", len(self._card_ids))
+            # Swap only if nothing changed since snapshot(); else keep the newer index
+            if (mapped is not None and self._index is current
+                    and current.version == state['version'] and len(mapped) == len(current)):
+                self._index = mapped
+        logger.debug("EmbeddingManager: Index snapshot written (%d rows)", state['count'])
+        return True
 
     def _ensure_index(self):
         """Lazy-load the index on first use."""
@@ -226,67 +443,61 @@ class EmbeddingManager:
     def search(self, query_embedding, top_k=10, exclude_card_ids=None):
         self._ensure_index()
         with self._lock:
-            if not self._index:
-                return []
+            return self._index.search(
+                query_embedding, top_k=top_k,
+                exclude=exclude_card_ids, min_score=self.MIN_SIMILARITY)
 
-            query = _normalize(query_embedding)
-            exclude_set = set(exclude_card_ids) if exclude_card_ids else set()
+    def search_many(self, query_embeddings, top_k=10, exclude_card_ids=None, fuse=False):
+        """Search several query embeddings in one pass over the index.
 
-            scored = []
-            for i, vec in enumerate(self._index):
-                cid = self._card_ids[i]
-                if cid in exclude_set:
-                    continue
-                score = _dot(query, vec)
-                if score >= self.MIN_SIMILARITY:
-                    scored.append((cid, score))
-
-            scored.sort(key=lambda x: x[1], reverse=True)
-            return scored[:top_k]
+        Empty/None embeddings (failed embed calls) get an empty result list.
+        Returns ``(per_query, fused)`` as in VectorIndex.search_many(); *fused*
+        keeps each card's best score across queries (None unless *fuse*).
+        """
+        self._ensure_index()
+        present = [i for i, emb in enumerate(query_embeddings or []) if emb]
+        per_query = [[] for _ in query_embeddings or []]
+        with self._lock:
+            found, fused = self._index.search_many(
+                [query_embeddings[i] for i in present], top_k=top_k,
+                exclude=exclude_card_ids, min_score=self.MIN_SIMILARITY, fuse=fuse)
+        for i, results in zip(present, found):
+            per_query[i] = results
+        return per_query, fused
+
+    def get_vectors(self, card_ids):
+        """Return {card_id: normalized vector} for the given cards that are indexed."""
+        self._ensure_index()
+        result = {}
+        with self._lock:
+            for cid in card_ids:
+                vec = self._index.get_vector(cid)
+                if vec is not None:
+                    result[cid] = vec
+        return result
 
     def load_kg_term_index(self):
         """Load pre-computed KG term embeddings into memory for fuzzy matching.
 
         Cached after first load — subsequent calls return the cached index.
-        Call invalidate_kg_term_index() after re-embedding terms.
+        Call invalidate_kg_term_index() after re-embedding terms. The index is
+        memory-mapped from its snapshot next to card_sessions.db while the
+        embedded kg_terms rows are unchanged (see ai/kg_term_index.py).
 
         Returns:
-            Dict of {term: normalized_vector (list of float)} or empty dict.
+            KGTermIndex (reads like {term: normalized_vector}); empty on error.
         """
         if self._kg_term_index is not None:
             return self._kg_term_index
 
-        import struct
-        import math
-
         try:
-            try:
-                from ..storage.kg_store import load_term_embeddings
-            except ImportError:
-                from storage.kg_store import load_term_embeddings
-
-            raw = load_term_embeddings()
-            if not raw:
-                self._kg_term_index = {}
-                return self._kg_term_index
-
-            index = {}
-            for term, emb_bytes in raw.items():
-                dim = len(emb_bytes) // 4
-                if dim == 0:
-                    continue
-                vec = list(struct.unpack('%df' % dim, emb_bytes))
-                norm = math.sqrt(sum(v * v for v in vec))
-                if norm > 0:
-                    vec = [v / norm for v in vec]
-                index[term] = vec
-
-            self._kg_term_index = index
-            logger.info("Loaded %d KG term embeddings for fuzzy matching", len(index))
-            return index
+            index = load_term_index(default_snapshot_prefix(), model=self.MODEL)
         except Exception as e:
             logger.warning("Failed to load KG term index: %s", e)
-            return {}
+            return as_term_index({})
+        self._kg_term_index = index
+        logger.info("Loaded %d KG term embeddings for fuzzy matching", len(index))
+        return index
 
     def invalidate_kg_term_index(self):
         """Clear cached KG term index so next load_kg_term_index() reloads from DB."""
@@ -297,7 +508,8 @@ class EmbeddingManager:
 
         Args:
             term_embedding: Embedding vector for the query term.
-            kg_term_index: Dict of {term: normalized_vector} from load_kg_term_index().
+            kg_term_index: KGTermIndex from load_kg_term_index() (or a
+                {term: normalized_vector} dict).
             top_k: Max number of matches to return.
             min_similarity: Minimum cosine similarity threshold.
 
@@ -306,33 +518,43 @@ class EmbeddingManager:
         """
         if not kg_term_index or not term_embedding:
             return []
-
-        import math
-        norm = math.sqrt(sum(v * v for v in term_embedding))
-        if norm > 0:
-            normed = [v / norm for v in term_embedding]
-        else:
-            return []
-
-        scored = []
-        for kg_term, kg_vec in kg_term_index.items():
-            score = sum(a * b for a, b in zip(normed, kg_vec))
-            if score >= min_similarity:
-                scored.append((kg_term, score))
-
-        scored.sort(key=lambda x: x[1], reverse=True)
-        return scored[:top_k]
+        index = as_term_index(kg_term_index)
+        return index.search([term_embedding], top_k=top_k, min_score=min_similarity)[0]
 
     def add_to_index(self, card_id, embedding):
         with self._lock:
-            vec = _normalize(embedding)
+            self._index.add(card_id, embedding)
 
-            if card_id in self._card_ids:
-                idx = self._card_ids.index(card_id)
-                self._index[idx] = vec
-            else:
-                self._card_ids.append(card_id)
-                self._index.append(vec)
+    def remove_from_index(self, card_ids):
+        """Tombstone cards in the in-memory index. Returns how many were indexed."""
+        with self._lock:
+            return sum(1 for cid in card_ids if self._index.remove(cid))
+
+    def forget_cards(self, card_ids):
+        """Drop embeddings of deleted cards from the DB and the index."""
+        card_ids = list(card_ids)
+        if not card_ids:
+            return 0
+        try:
+            from storage.card_sessions import delete_embeddings
+        except ImportError:
+            from ..storage.card_sessions import delete_embeddings
+        delete_embeddings(card_ids)
+        removed = self.remove_from_index(card_ids) if self._index_loaded else 0
+        logger.debug("EmbeddingManager: Forgot %d cards (%d indexed)", len(card_ids), removed)
+        return removed
+
+    def prune_index(self, live_card_ids):
+        """Forget every embedded card that is no longer in *live_card_ids*
+        (cards deleted through sync, Empty Cards, etc.). Returns the count."""
+        try:
+            from storage.card_sessions import load_embedded_card_ids
+        except ImportError:
+            from ..storage.card_sessions import load_embedded_card_ids
+        live = set(live_card_ids)
+        stale = [cid for cid in load_embedded_card_ids() if cid not in live]
+        self.forget_cards(stale)
+        return len(stale)
 
     # ── Lazy Embedding ──
 
@@ -350,18 +572,18 @@ class EmbeddingManager:
 
         existing = load_embedding(card_id)
         if existing and existing['content_hash'] == current_hash:
-            emb = _unpack_floats(existing['embedding'], self.EMBEDDING_DIM)
-            if len(emb) == self.EMBEDDING_DIM:
-                if card_id not in self._card_ids:
+            emb = self._decode_embedding(existing['embedding'])
+            if emb is not None:
+                if card_id not in self._index:
                     self.add_to_index(card_id, emb)
                 return emb
 
-        embeddings = self.embed_texts([text])
+        embeddings = self.embed_texts([text], use_cache=False)
         if not embeddings:
             return None
 
         emb = embeddings[0]
-        save_embedding(card_id, _pack_floats(emb), current_hash, self.MODEL)
+        save_embedding(card_id, self._encode_embedding(emb), current_hash, self.MODEL)
         self.add_to_index(card_id, emb)
         return emb
 
@@ -406,17 +628,20 @@ class BackgroundEmbeddingThread(QThread):
 
     def run(self):
         try:
-            from storage.card_sessions import load_all_embeddings, save_embedding
+            from storage.card_sessions import (load_embedding_states, save_embeddings_bulk,
+                                               touch_embedding_mods, run_write)
         except ImportError:
-            from ..storage.card_sessions import load_all_embeddings, save_embedding
+            from ..storage.card_sessions import (load_embedding_states, save_embeddings_bulk,
+                                                 touch_embedding_mods, run_write)
 
+        # This worker waits for its writes without write()'s time limit (run_write)
         try:
-            from storage.kg_store import save_card_content
+            from storage.kg_store import save_card_content_bulk, run_write as kg_run_write
         except ImportError:
             try:
-                from ..storage.kg_store import save_card_content
+                from ..storage.kg_store import save_card_content_bulk, run_write as kg_run_write
             except ImportError:
-                save_card_content = None
+                save_card_content_bulk = None
 
         try:
             all_cards = self.get_all_cards_fn()
@@ -429,9 +654,18 @@ class BackgroundEmbeddingThread(QThread):
             self.finished_signal.emit(0)
             return
 
+        # Cards deleted while Anki was closed or through sync
+        try:
+            pruned = self.manager.prune_index(
+                card.get('card_id') or card.get('cardId') for card in all_cards)
+            if pruned:
+                logger.info("BackgroundEmbedding: Pruned %d embeddings of deleted cards", pruned)
+        except Exception as e:  # housekeeping must never block embedding
+            logger.debug("BackgroundEmbedding: prune failed: %s", e)
+
         # Cache card content (question/answer/deck) for benchmark and offline search
-        if save_card_content:
-            cached_count = 0
+        if save_card_content_bulk:
+            content_rows = []
             for card in all_cards:
                 cid = card.get('card_id') or card.get('cardId')
                 if not cid:
@@ -440,185 +674,141 @@ class BackgroundEmbeddingThread(QThread):
                 answer = card.get('answer', '') or ''
                 deck_name = card.get('deckName', '') or card.get('deck_name', '') or ''
                 if question or answer:
-                    try:
-                        save_card_content(cid, question, answer, deck_name)
-                        cached_count += 1
-                    except Exception as e:
-                        logger.debug("BackgroundEmbedding: save_card_content failed for %s: %s", cid, e)
+                    content_rows.append((cid, question, answer, deck_name))
+            cached_count = 0
+            for i in range(0, len(content_rows), 1000):
+                cached_count += kg_run_write(save_card_content_bulk, content_rows[i:i + 1000])
             if cached_count > 0:
-                logger.info("BackgroundEmbedding: Cached content for %d cards", cached_count)
+                logger.info("BackgroundEmbedding: Cached content for %d new/changed cards (of %d)",
+                            cached_count, len(content_rows))
 
         existing = {}
         try:
-            for card_id, _, content_hash in load_all_embeddings():
-                existing[card_id] = content_hash
+            existing = load_embedding_states()
         except (AttributeError, OSError, ValueError) as e:
-            logger.debug("BackgroundEmbedding: load_all_embeddings error: %s", e)
+            logger.debug("BackgroundEmbedding: load_embedding_states error: %s", e)
 
+        # Cards whose note is unchanged since their embedding was stored are
+        # skipped without building/hashing their text (resume after restart).
         to_embed = []
+        unchanged = []
         for card in all_cards:
             if self._cancelled:
                 break
+            cid = card.get('card_id') or card.get('cardId')
+            if not cid:
+                continue
+            mod = card.get('mod')
+            state = existing.get(cid)
+            if state and mod is not None and state[1] == mod:
+                continue
             text = self.manager._card_to_text(card)
             if not text.strip():
                 continue
             h = self.manager._content_hash(text)
-            cid = card.get('card_id') or card.get('cardId')
-            if cid and (cid not in existing or existing[cid] != h):
-                to_embed.append({'card_id': cid, 'text': text, 'hash': h})
+            if state and state[0] == h:
+                if mod is not None:
+                    unchanged.append((cid, mod))
+                continue
+            to_embed.append({'card_id': cid, 'text': text, 'hash': h, 'mod': mod})
+        if unchanged:
+            try:
+                run_write(touch_embedding_mods, unchanged)
+            except (OSError, ValueError) as e:
+                logger.debug("BackgroundEmbedding: touch_embedding_mods error: %s", e)
 
         total = len(to_embed)
         embedded = 0
 
-        for i in range(0, total, self.manager.BATCH_SIZE):
-            if self._cancelled:
-                break
-
-            batch = to_embed[i:i + self.manager.BATCH_SIZE]
-            texts = [item['text'] for item in batch]
-
+        def _store(batch, embeddings):
+            nonlocal embedded
+            run_write(save_embeddings_bulk, [
+                (item['card_id'], self.manager._encode_embedding(emb), item['hash'],
+                 self.manager.MODEL, item['mod'])
+                for item, emb in zip(batch, embeddings)])
+            for item, emb in zip(batch, embeddings):
+                self.manager.add_to_index(item['card_id'], emb)
+            embedded += len(batch)
+            self.progress_signal.emit(embedded, total)
+
+        if to_embed:
+            pipeline = AdaptiveEmbedPipeline(
+                self.manager._post_embed,
+                batch_size=self.manager.BATCH_SIZE,
+                max_concurrency=self.manager.MAX_CONCURRENT_BATCHES)
+            t0 = time.time()
             try:
-                embeddings = self.manager.embed_texts(texts)
-                if not embeddings:
-                    logger.warning("BackgroundEmbedding: No embeddings returned, stopping (credentials issue?)")
-                    break
-                for j, emb in enumerate(embeddings):
-                    item = batch[j]
-                    save_embedding(item['card_id'], _pack_floats(emb), item['hash'], self.manager.MODEL)
-                    self.manager.add_to_index(item['card_id'], emb)
-                embedded += len(embeddings)
-                self.progress_signal.emit(embedded, total)
-            except (OSError, ValueError, KeyError) as e:
+                pipeline.run(to_embed, _store, cancelled=lambda: self._cancelled)
+            except (OSError, ValueError, KeyError, sqlite3.Error) as e:
                 logger.error("BackgroundEmbedding batch error: %s, stopping background embedding", e)
-                break  # Stop on error instead of continuing to spam API
+            logger.info("BackgroundEmbedding: %d/%d cards embedded in %.1fs "
+                        "(%d batches, %d retries, %d throttled; final batch %d x %d)",
+                        embedded, total, time.time() - t0, pipeline.stats['batches'],
+                        pipeline.stats['retries'], pipeline.stats['throttled'],
+                        pipeline.batch_size, pipeline.concurrency)
 
-            time.sleep(0.5)
+        try:
+            from .term_extractor import TermExtractor, compute_collocations
+        except ImportError:
+            from ai.term_extractor import TermExtractor, compute_collocations
+        try:
+            collocations = compute_collocations(
+                [self.manager._card_to_text(c) for c in all_cards])
+        except Exception as e:
+            logger.warning("Collocation computation failed: %s", e)
+            collocations = set()
 
-        # --- LLM-based batch term extraction (rate-limited: max 1 full run per 24h) ---
+        # --- Term extraction: local-first, LLM for low-confidence cards (ai/kg_extraction.py) ---
+        written_terms = set()  # recounted by builder.build() along with the changed cards' terms
         if all_cards and not self._cancelled:
             try:
                 try:
                     from ..ai.gemini import extract_terms_batch
+                    from ..ai.kg_extraction import run_extraction_queue, load_extraction_options
+                    from ..storage.kg_store import (enqueue_extraction, extraction_queue_stats,
+                                                    load_term_vocabulary, run_write as kg_run_write)
                 except ImportError:
                     from ai.gemini import extract_terms_batch
-                try:
-                    from ..storage.kg_store import save_card_terms, get_card_terms
-                except ImportError:
-                    from storage.kg_store import save_card_terms, get_card_terms
-
-                # Rate limit: prevent quota exploit by limiting full extractions
-                import os
-                _ts_path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
-                                        '..', 'storage', '.kg_extraction_ts')
-                _ts_path = os.path.normpath(_ts_path)
-                MIN_EXTRACTION_INTERVAL = 3600  # 1 hour minimum between full extractions
-                try:
-                    if os.path.exists(_ts_path):
-                        last_ts = float(open(_ts_path).read().strip())
-                        if time.time() - last_ts < MIN_EXTRACTION_INTERVAL:
-                            logger.info("KG extraction skipped: last run was %d min ago (min interval: %d min)",
-                                        int((time.time() - last_ts) / 60), MIN_EXTRACTION_INTERVAL // 60)
-                            raise StopIteration("rate limited")
-                except (ValueError, OSError):
-                    pass
-                except StopIteration:
-                    raise  # Re-raise to skip extraction
-
-
-                BATCH_SIZE_LLM = 15
-                extracted_count = 0
-                skipped_count = 0
-
-                # Only extract terms for cards that don't have terms yet
-                kg_cards_to_extract = []
-                for card in all_cards:
-                    cid = card.get('card_id') or card.get('cardId')
-                    if not cid:
-                        continue
-                    existing_terms = get_card_terms(cid)
-                    if existing_terms:
-                        continue  # Already extracted
-                    kg_text = ' '.join(filter(None, [card.get('question', ''), card.get('answer', '')]))
-                    if kg_text.strip():
-                        kg_cards_to_extract.append({
-                            'card_id': cid,
-                            'question': card.get('question', ''),
-                            'answer': card.get('answer', ''),
-                            'deck_id': card.get('deck_id', 0),
-                        })
-
-                logger.info("KG term extraction: %d cards need extraction (of %d total)",
-                            len(kg_cards_to_extract), len(all_cards))
-
-                for i in range(0, len(kg_cards_to_extract), BATCH_SIZE_LLM):
-                    if self._cancelled:
-                        break
-                    batch = kg_cards_to_extract[i:i + BATCH_SIZE_LLM]
-
-                    # LLM-only extraction — NO heuristic fallback
-                    try:
-                        llm_result = extract_terms_batch(batch)
-                    except Exception as e:
-                        err_str = str(e)
-                        if '403' in err_str or '429' in err_str or 'quota' in err_str.lower():
-                            logger.warning("KG extraction stopped: quota/auth error. %d cards extracted, %d remaining.",
-                                           extracted_count, len(kg_cards_to_extract) - i)
-                            break  # Stop entirely — retry on next startup
-                        logger.warning("KG batch extraction failed, skipping batch: %s", e)
-                        skipped_count += len(batch)
-                        continue
-
-                    if not llm_result:
-                        skipped_count += len(batch)
-                        continue
-
-                    for card in batch:
-                        cid = card['card_id']
-                        terms = llm_result.get(cid)
-
-                        # No fallback — if LLM didn't return terms, skip this card
-                        if not terms:
-                            skipped_count += 1
-                            continue
-
-                        save_card_terms(cid, terms, deck_id=card.get('deck_id', 0))
-                        extracted_count += 1
-
-                    time.sleep(0.3)
-
-                logger.info("KG term extraction: %d cards extracted, %d skipped (LLM-only, no fallback)",
-                            extracted_count, skipped_count)
-
-                # Save timestamp to prevent re-extraction within rate limit window
-                if extracted_count > 0:
-                    try:
-                        with open(_ts_path, 'w') as f:
-                            f.write(str(time.time()))
-                    except OSError:
-                        pass
-            except StopIteration:
-                pass  # Rate limited — skip silently
+                    from ai.kg_extraction import run_extraction_queue, load_extraction_options
+                    from storage.kg_store import (enqueue_extraction, extraction_queue_stats,
+                                                  load_term_vocabulary, run_write as kg_run_write)
+
+                # Cards without terms (and without an open queue entry) join the queue;
+                # finished cards are never sent to the LLM again.
+                queued = kg_run_write(enqueue_extraction, [
+                    (card.get('card_id') or card.get('cardId'), card.get('deck_id', 0))
+                    for card in all_cards if card.get('card_id') or card.get('cardId')])
+                pending = extraction_queue_stats().get('pending', 0)
+                logger.info("KG term extraction: %d cards queued, %d pending (of %d total)",
+                            queued, pending, len(all_cards))
+                if pending:
+                    options = load_extraction_options()
+                    local_extractor = None
+                    if options['local_first']:
+                        local_extractor = TermExtractor()
+                        local_extractor.set_collocations(collocations)
+                    stats = run_extraction_queue(
+                        lambda cards: extract_terms_batch(cards, raise_errors=True),
+                        cancelled=lambda: self._cancelled,
+                        local_extractor=local_extractor,
+                        threshold=options['threshold'],
+                        vocabulary=load_term_vocabulary() if local_extractor else None)
+                    written_terms = stats['written_terms']
             except Exception as e:
                 logger.warning("Batch KG term extraction failed: %s", e)
 
         # KG graph build (runs after all cards are processed)
         try:
-            try:
-                from .term_extractor import compute_collocations
-            except ImportError:
-                from ai.term_extractor import compute_collocations
             try:
                 from .kg_builder import GraphIndexBuilder
             except ImportError:
                 from ai.kg_builder import GraphIndexBuilder
 
-            all_texts = [self.manager._card_to_text(c) for c in all_cards]
-            collocations = compute_collocations(all_texts)
             if hasattr(self, '_term_extractor') and collocations:
                 self._term_extractor.set_collocations(collocations)
 
             builder = GraphIndexBuilder()
-            builder.build()
+            builder.build(terms=written_terms)
             logger.info("Knowledge Graph built successfully")
 
             try:
@@ -636,22 +826,28 @@ class BackgroundEmbeddingThread(QThread):
         # Embed unembedded KG terms
         try:
             try:
-                from ..storage.kg_store import get_unembedded_terms, save_term_embedding
+                from ..storage.kg_store import get_unembedded_terms, save_term_embedding, run_write as kg_run_write
             except ImportError:
-                from storage.kg_store import get_unembedded_terms, save_term_embedding
+                from storage.kg_store import get_unembedded_terms, save_term_embedding, run_write as kg_run_write
             unembedded = get_unembedded_terms()
             if unembedded and self.manager:
                 BATCH = 50
                 for i in range(0, len(unembedded), BATCH):
                     batch = unembedded[i:i + BATCH]
-                    embeddings = self.manager.embed_texts(batch)
+                    embeddings = self.manager.embed_texts(batch, use_cache=False)
                     if embeddings:
                         for term, emb in zip(batch, embeddings):
                             if emb is not None:
                                 emb_bytes = struct.pack(f'{len(emb)}f', *emb)
-                                save_term_embedding(term, emb_bytes)
+                                kg_run_write(save_term_embedding, term, emb_bytes)
                 logger.info("Embedded %d KG terms", len(unembedded))
         except Exception as e:
             logger.warning("KG term embedding failed: %s", e)
 
+        if embedded:
+            try:
+                self.manager.save_index_snapshot()
+            except Exception as e:
+                logger.warning("BackgroundEmbedding: index snapshot failed: %s", e)
+
         self.finished_signal.emit(embedded)
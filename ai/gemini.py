@@ -987,13 +987,16 @@ def generate_quick_answer(query, card_texts, cluster_labels=None, model=None):
 EXTRACTION_MODEL = "gemini-2.5-flash"
 
 
-def extract_terms_batch(cards, model=None):
+def extract_terms_batch(cards, model=None, raise_errors=False):
     """Extract medical/scientific terms from a batch of cards via LLM.
 
     Args:
         cards: List of dicts with 'card_id', 'question', 'answer' keys.
               Batch size should be 10-15 cards.
         model: Model ID (defaults to EXTRACTION_MODEL).
+        raise_errors: Raise EmbedError / RateLimited (ai.embed_pipeline) on
+              backend failures instead of returning {} — used by the
+              extraction queue to back off and retry.
 
     Returns:
         Dict mapping card_id → list of term strings.
@@ -1113,6 +1116,8 @@ def extract_terms_batch(cards, model=None):
 
     try:
         response = requests.post(url, json=backend_payload, headers=headers, timeout=30)
+        if raise_errors:
+            _raise_for_extraction_status(response)
         response.raise_for_status()
         result = response.json()
         text = result.get("text") or result.get("response") or ""
@@ -1124,12 +1129,44 @@ def extract_terms_batch(cards, model=None):
                     text = parts[0].get("text", "").strip()
         if text:
             return _parse_extraction_result(text, cards)
+        if raise_errors:
+            raise _extraction_error("empty extraction response")
         return {}
     except Exception as e:
+        if raise_errors:
+            if getattr(e, 'retryable', None) is not None:
+                raise
+            raise _extraction_error("extract_terms_batch failed: %s" % e) from e
         logger.error("extract_terms_batch failed: %s", e)
         return {}
 
 
+def _extraction_error(message, retryable=True, status=None, retry_after=None):
+    try:
+        from .embed_pipeline import EmbedError, RateLimited
+    except ImportError:
+        from ai.embed_pipeline import EmbedError, RateLimited
+    if status == 429:
+        return RateLimited(retry_after=retry_after)
+    return EmbedError(message, retryable=retryable)
+
+
+def _raise_for_extraction_status(response):
+    """Map an extraction HTTP error to EmbedError / RateLimited."""
+    status = response.status_code
+    if status < 400:
+        return
+    retry_after = None
+    if status == 429:
+        try:
+            retry_after = float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            pass
+    # 403 is the backend's quota answer: stop, the queue resumes on the next run
+    raise _extraction_error("HTTP %d" % status, retryable=status >= 500 or status == 429,
+                            status=status, retry_after=retry_after)
+
+
 def _parse_extraction_result(text, cards):
     """Parse LLM output into {card_id: [terms]} dict."""
     import re
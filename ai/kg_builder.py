@@ -4,7 +4,13 @@ Part of the Knowledge Graph pipeline. Reads from kg_card_terms (via kg_store)
 and writes co-occurrence edges to kg_edges plus term frequencies to kg_terms.
 """
 
+import hashlib
+import heapq
+import json
+import math
+import threading
 from collections import Counter
+from itertools import combinations
 
 try:
     from ..utils.logging import get_logger
@@ -18,6 +24,119 @@ except ImportError:
 
 logger = get_logger(__name__)
 
+_CARD_CHUNK = 500      # cards read and applied per writer job
+_ROW_CHUNK = 5000      # kg_pair_counts / kg_term_topk rows inserted per writer job (full rebuild)
+_TERM_CHUNK = 200      # terms whose neighbour lists and edges one writer job replaces
+_compute_lock = threading.Lock()  # one compute_edges() at a time
+
+
+def _fingerprint(terms):
+    """Order-independent fingerprint of a card's term set."""
+    return hashlib.sha1("\x1f".join(sorted(terms)).encode("utf-8")).hexdigest()
+
+
+def _npmi(count, df_a, df_b, n_cards):
+    """Normalized PMI of two terms sharing *count* of *n_cards* cards, in [-1, 1]."""
+    if n_cards <= 0 or count >= n_cards:
+        return 1.0
+    p_ab = count / n_cards
+    return math.log(count * n_cards / (df_a * df_b)) / -math.log(p_ab)
+
+
+def _push(heap, item, k):
+    """Keep the *k* largest items in a min-heap."""
+    if len(heap) < k:
+        heapq.heappush(heap, item)
+    elif item > heap[0]:
+        heapq.heapreplace(heap, item)
+
+
+def _card_frequencies(db, terms=None):
+    """{term: number of cards} for *terms* (all terms when None)."""
+    if terms is None:
+        return {r[0]: r[1] for r in db.execute(
+            "SELECT term, COUNT(*) FROM kg_card_terms GROUP BY term")}
+    terms = list(terms)
+    df = {}
+    for i in range(0, len(terms), 500):
+        chunk = terms[i:i + 500]
+        df.update((r[0], r[1]) for r in db.execute(
+            "SELECT term, COUNT(*) FROM kg_card_terms WHERE term IN (%s) GROUP BY term"
+            % ",".join("?" * len(chunk)), chunk))
+    return df
+
+
+def _current_terms(db, card_ids):
+    """{card_id: set of terms} for *card_ids* (empty set for cards without terms)."""
+    current = {cid: set() for cid in card_ids}
+    for row in db.execute(
+        "SELECT card_id, term FROM kg_card_terms WHERE card_id IN (%s)" % ",".join("?" * len(card_ids)),
+        card_ids,
+    ):
+        current[row[0]].add(row[1])
+    return current
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _write(kg, fn, *args):
+    """Run ``fn(db, *args)`` as one writer job (kg_store.run_write) and commit it."""
+    def job():
+        db = kg._get_db()
+        try:
+            result = fn(db, *args)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return result
+    return kg.run_write(job)
+
+
+def _write_pair_deltas(db, delta):
+    db.executemany(
+        """
+        INSERT INTO kg_pair_counts (term_a, term_b, count) VALUES (?, ?, ?)
+        ON CONFLICT(term_a, term_b) DO UPDATE SET count = count + excluded.count
+        """,
+        [(a, b, d) for (a, b), d in delta.items() if d],
+    )
+    db.executemany(
+        "DELETE FROM kg_pair_counts WHERE term_a = ? AND term_b = ? AND count <= 0",
+        [(a, b) for (a, b), d in delta.items() if d < 0],
+    )
+
+
+def _insert_topk(db, rows):
+    db.executemany("INSERT INTO kg_term_topk (term, neighbor, score) VALUES (?, ?, ?)",
+                   [(t, nb, score) for t, nb, score, _ in rows])
+
+
+def _rank_all(counts, df, min_weight, top_k, n_cards):
+    """Full pass over *counts* ({(a, b): shared cards}): bounded heap of *top_k* per term.
+
+    Returns kg_term_topk rows [(term, neighbor, score, count)].
+    """
+    heaps: dict = {}
+    for (a, b), count in counts.items():
+        if count < min_weight:
+            continue
+        score = _npmi(count, df.get(a, count), df.get(b, count), n_cards)
+        _push(heaps.setdefault(a, []), (score, count, b), top_k)
+        _push(heaps.setdefault(b, []), (score, count, a), top_k)
+    return [(term, nb, score, count) for term, heap in heaps.items() for score, count, nb in heap]
+
+
+def _pairs_touching(terms, changed):
+    """Canonical (a, b) pairs within *terms* that contain at least one *changed* term."""
+    for c in changed:
+        for t in terms:
+            if t != c and (t not in changed or c < t):
+                yield (c, t) if c < t else (t, c)
+
 
 class GraphIndexBuilder:
     """Builds the Knowledge Graph index from stored card terms.
@@ -29,94 +148,353 @@ class GraphIndexBuilder:
 
         # or individually:
         builder.update_frequencies()
-        builder.compute_edges(min_weight=2, max_edges=5000)
+        builder.compute_edges(min_weight=2, top_k=10)
     """
 
     # ------------------------------------------------------------------
     #  Public API
     # ------------------------------------------------------------------
 
-    def compute_edges(self, min_weight: int = 2, max_edges: int = 5000):
-        """Compute co-occurrence edges between terms that share cards.
-
-        Algorithm:
-            1. Group terms by card_id from kg_card_terms.
-            2. Count how many cards each (term_a, term_b) pair shares.
-            3. Prune pairs below *min_weight*.
-            4. Keep at most *max_edges* pairs (highest weight first).
-            5. Persist to kg_edges via kg_store.save_edges().
+    def compute_edges(self, min_weight: int = 2, max_edges: int = None, top_k: int = 10,
+                      full: bool = False):
+        """Bring kg_edges up to date with kg_card_terms.
+
+        Incremental algorithm:
+            1. Read the cards marked in kg_dirty_cards (kg_card_terms triggers).
+            2. Compare each card's term set with its stored fingerprint; for
+               changed cards subtract the pairs that lost a term and add the
+               pairs that gained one in kg_pair_counts (persistent counts of
+               shared cards per (term_a, term_b)).
+            3. For every term whose pair counts changed, re-select its *top_k*
+               neighbours by NPMI among pairs with count >= *min_weight*
+               (kg_term_topk).
+            4. kg_edges is the union of all neighbour lists: an edge survives
+               when it is in the top-k of either end, so rare but precise
+               terms keep neighbours instead of losing them all to hubs.
+               ``weight`` stays the shared-card count, ``score`` is the NPMI.
+            5. Optionally keep at most *max_edges* edges (lowest scores dropped).
+
+        A one-card edit therefore costs O(t²) for that card instead of a pass
+        over the whole collection, and kg_edges grows at most with
+        vocabulary × top_k. The first run (no fingerprints yet) and
+        ``full=True`` reset the state, count every card and swap in a freshly
+        built kg_edges table (kg_store._swap_edges).
+
+        Scores of untouched terms are not refreshed when the card count or
+        a neighbour's frequency drifts; a periodic ``full=True`` run
+        re-ranks everything.
 
         Args:
             min_weight: Minimum shared-card count for an edge to be kept.
-            max_edges:  Maximum number of edges to persist.
+            max_edges:  Optional global cap on the number of edges.
+            top_k:      Neighbours kept per term.
+            full:       Recount all cards and rebuild kg_edges from scratch.
         """
         try:
             from ..storage import kg_store as kg
         except ImportError:
             from storage import kg_store as kg
 
-        db = kg._get_db()
+        # Card terms, fingerprints, pair deltas and the NPMI ranking are all
+        # computed on this thread's reader connection; the writer only applies
+        # the results in bounded jobs (kg_store.run_write).
+        with _compute_lock:
+            reader = kg._get_db()
+            if not full:
+                full = reader.execute("SELECT 1 FROM kg_card_fingerprints LIMIT 1").fetchone() is None
 
-        # Step 1 — group terms by card
-        card_terms: dict = {}
-        for row in db.execute("SELECT card_id, term FROM kg_card_terms"):
-            card_terms.setdefault(row[0], []).append(row[1])
+            if full:
+                card_ids, changed, delta, touched = self._rebuild_all(kg, reader, min_weight, top_k)
+            else:
+                # Step 1 & 2 — pair deltas of changed cards
+                card_ids = [r[0] for r in reader.execute("SELECT card_id FROM kg_dirty_cards")]
+                delta: Counter = Counter()
+                changed = 0
+                for chunk in _chunks(card_ids, _CARD_CHUNK):
+                    seen, changes = self._read_card_changes(reader, chunk)
+                    changed += len(changes)
+                    delta.update(_write(kg, self._apply_card_changes, seen, changes))
+                delta = {pair: d for pair, d in delta.items() if d}
+
+                # Step 3 & 4 — neighbour selection and edges of touched terms
+                touched = {t for pair in delta for t in pair}
+                if touched:
+                    self._update_neighbours(kg, reader, touched, min_weight, top_k)
+
+            # Step 5 — optional cap
+            if max_edges is None:
+                n_edges = reader.execute("SELECT COUNT(*) FROM kg_edges").fetchone()[0]
+            else:
+                n_edges = _write(kg, self._cap_edges, max_edges)
+        kg.bump_graph_generation()
 
-        logger.debug(
-            "GraphIndexBuilder.compute_edges: %s cards loaded", len(card_terms)
+        logger.info(
+            "GraphIndexBuilder.compute_edges: %s/%s cards changed, %s pair counts and "
+            "%s terms touched, %s edges (min_weight=%s, top_k=%s, max_edges=%s, full=%s)",
+            changed, len(card_ids), len(delta), len(touched), n_edges,
+            min_weight, top_k, max_edges, full,
         )
 
-        # Step 2 — count co-occurrences
-        pair_counts: Counter = Counter()
-        for terms in card_terms.values():
-            # Deduplicate within a card to avoid inflated self-counts
-            unique_terms = list(dict.fromkeys(terms))
-            for i, a in enumerate(unique_terms):
-                for b in unique_terms[i + 1 :]:
-                    key = tuple(sorted([a, b]))
-                    pair_counts[key] += 1
-
-        # Step 3 & 4 — prune and limit
-        edges = [
-            (a, b, w)
-            for (a, b), w in pair_counts.most_common(max_edges)
-            if w >= min_weight
-        ]
+    @staticmethod
+    def _rebuild_all(kg, reader, min_weight, top_k):
+        """Full recount: reset the incremental state, count and rank every card's pairs.
 
-        logger.info(
-            "GraphIndexBuilder.compute_edges: %s edges computed (min_weight=%s, max_edges=%s)",
-            len(edges),
-            min_weight,
-            max_edges,
+        The reset (including kg_dirty_cards) is committed before the cards are
+        read, so an edit made meanwhile stays marked for the next run. Pair
+        counts and neighbour lists are inserted in chunks; the last job writes
+        the fingerprints and swaps in the new kg_edges, so until it commits
+        the next run finds no fingerprints and rebuilds again.
+
+        Returns (card_ids, number of cards counted, pair counts, terms ranked).
+        """
+        def reset(db):
+            for table in ("kg_pair_counts", "kg_card_fingerprints", "kg_term_topk", "kg_dirty_cards"):
+                db.execute("DELETE FROM %s" % table)
+        _write(kg, reset)
+
+        card_ids = [r[0] for r in reader.execute("SELECT DISTINCT card_id FROM kg_card_terms")]
+        counts: Counter = Counter()
+        df: Counter = Counter()
+        fingerprints = []
+        for chunk in _chunks(card_ids, _CARD_CHUNK):
+            for cid, terms in _current_terms(reader, chunk).items():
+                if terms:
+                    ordered = sorted(terms)
+                    counts.update(combinations(ordered, 2))
+                    df.update(ordered)
+                    fingerprints.append((cid, _fingerprint(terms), json.dumps(ordered, ensure_ascii=False)))
+        for chunk in _chunks(list(counts.items()), _ROW_CHUNK):
+            _write(kg, _write_pair_deltas, dict(chunk))
+
+        topk = _rank_all(counts, df, min_weight, top_k, len(fingerprints))
+        for chunk in _chunks(topk, _ROW_CHUNK):
+            _write(kg, _insert_topk, chunk)
+        edges = {(min(t, nb), max(t, nb)): (count, score) for t, nb, score, count in topk}
+
+        def finish(db):
+            try:
+                from ..storage.kg_store import _swap_edges
+            except ImportError:
+                from storage.kg_store import _swap_edges
+            db.executemany(
+                "INSERT INTO kg_card_fingerprints (card_id, fingerprint, terms) VALUES (?, ?, ?)",
+                fingerprints,
+            )
+            _swap_edges(db, ((a, b, count, score) for (a, b), (count, score) in edges.items()))
+        _write(kg, finish)
+        return card_ids, len(fingerprints), counts, {t for pair in counts for t in pair}
+
+    def _update_neighbours(self, kg, reader, terms, min_weight, top_k):
+        """Re-rank *terms* on the reader, then swap their kg_term_topk and
+        kg_edges rows on the writer, one job per chunk of terms."""
+        n_cards = reader.execute("SELECT COUNT(*) FROM kg_card_fingerprints").fetchone()[0]
+        topk = self._rank_neighbours(reader, terms, min_weight, top_k, n_cards)
+        edges = self._edge_rows(reader, terms, topk)
+
+        ordered = sorted(terms)
+        job_of = {t: i // _TERM_CHUNK for i, t in enumerate(ordered)}
+        jobs = [([], []) for _ in range(0, len(ordered), _TERM_CHUNK)]
+        for row in topk:
+            jobs[job_of[row[0]]][0].append(row)
+        # Each job deletes the edges of its terms, so an edge goes into the
+        # last job that touches one of its ends.
+        for (a, b), (count, score) in edges.items():
+            jobs[max(job_of.get(a, -1), job_of.get(b, -1))][1].append((a, b, count, score))
+        for i, (topk_rows, edge_rows) in enumerate(jobs):
+            _write(kg, self._write_neighbours, ordered[i * _TERM_CHUNK:(i + 1) * _TERM_CHUNK],
+                   topk_rows, edge_rows)
+
+    @staticmethod
+    def _cap_edges(db, max_edges):
+        """Keep at most *max_edges* edges (lowest scores dropped); returns the edge count."""
+        n_edges = db.execute("SELECT COUNT(*) FROM kg_edges").fetchone()[0]
+        if n_edges > max_edges:
+            db.execute(
+                "DELETE FROM kg_edges WHERE rowid IN "
+                "(SELECT rowid FROM kg_edges ORDER BY score ASC, weight ASC LIMIT ?)",
+                (n_edges - max_edges,),
+            )
+            n_edges = max_edges
+        return n_edges
+
+    @staticmethod
+    def _read_card_changes(db, card_ids):
+        """Reader side of step 2 for *card_ids*.
+
+        Returns ({card_id: fingerprint of its current terms},
+        {card_id: (sorted terms or None, pair-count delta)} for the cards
+        whose term set differs from the stored fingerprint).
+        """
+        current = _current_terms(db, card_ids)
+        stored = {
+            row[0]: (row[1], row[2])
+            for row in db.execute(
+                "SELECT card_id, fingerprint, terms FROM kg_card_fingerprints "
+                "WHERE card_id IN (%s)" % ",".join("?" * len(card_ids)),
+                card_ids,
+            )
+        }
+        seen, changes = {}, {}
+        for cid, terms in current.items():
+            fingerprint = seen[cid] = _fingerprint(terms)
+            old_fp, old_json = stored.get(cid, (None, None))
+            if old_fp == fingerprint:
+                continue
+            old = set(json.loads(old_json)) if old_json else set()
+            # Only pairs with a removed/added term change; shared pairs stay.
+            delta: Counter = Counter()
+            for pair in _pairs_touching(old, old - terms):
+                delta[pair] -= 1
+            for pair in _pairs_touching(terms, terms - old):
+                delta[pair] += 1
+            changes[cid] = (sorted(terms) if terms else None, delta)
+        return seen, changes
+
+    @staticmethod
+    def _apply_card_changes(db, seen, changes):
+        """Writer side of step 2: apply what _read_card_changes() found.
+
+        Only cards whose terms still match the fingerprint read are applied
+        and unmarked; a card edited in between keeps its kg_dirty_cards mark
+        for the next run. Returns the pair-count delta written.
+        """
+        current = _current_terms(db, list(seen))
+        fresh = [cid for cid, terms in current.items() if _fingerprint(terms) == seen[cid]]
+        delta: Counter = Counter()
+        upserts, deletes = [], []
+        for cid in fresh:
+            if cid not in changes:
+                continue
+            terms, card_delta = changes[cid]
+            delta.update(card_delta)
+            if terms:
+                upserts.append((cid, seen[cid], json.dumps(terms, ensure_ascii=False)))
+            else:
+                deletes.append((cid,))
+        db.executemany(
+            "INSERT OR REPLACE INTO kg_card_fingerprints (card_id, fingerprint, terms) "
+            "VALUES (?, ?, ?)",
+            upserts,
         )
+        db.executemany("DELETE FROM kg_card_fingerprints WHERE card_id = ?", deletes)
+        db.executemany("DELETE FROM kg_dirty_cards WHERE card_id = ?", [(cid,) for cid in fresh])
+        _write_pair_deltas(db, delta)
+        return delta
+
+    @staticmethod
+    def _rank_neighbours(db, terms, min_weight, top_k, n_cards):
+        """Reader side of step 3: the new kg_term_topk rows of *terms*.
 
-        # Step 5 — persist
-        kg.save_edges(edges)
+        Returns [(term, neighbor, score, count)].
+        """
+        pairs: dict = {}
+        for t in terms:
+            pairs[t] = [
+                (r[1] if r[0] == t else r[0], r[2])
+                for r in db.execute(
+                    "SELECT term_a, term_b, count FROM kg_pair_counts "
+                    "WHERE (term_a = ?1 OR term_b = ?1) AND count >= ?2",
+                    (t, min_weight),
+                )
+            ]
+        needed = set(terms).union(nb for rows in pairs.values() for nb, _ in rows)
+        df = _card_frequencies(db, needed)
+        rows = []
+        for t, neighbours in pairs.items():
+            heap: list = []
+            for nb, count in neighbours:
+                score = _npmi(count, df.get(t, count), df.get(nb, count), n_cards)
+                _push(heap, (score, count, nb), top_k)
+            rows.extend((t, nb, score, count) for score, count, nb in heap)
+        return rows
+
+    @staticmethod
+    def _edge_rows(db, terms, topk):
+        """Reader side of step 4: {(term_a, term_b): (weight, score)} of every
+        edge touching *terms* once *topk* replaces their neighbour lists."""
+        edges = {}
+        for t in terms:
+            for term, nb, score, count in db.execute(
+                "SELECT k.term, k.neighbor, k.score, p.count FROM kg_term_topk k "
+                "JOIN kg_pair_counts p ON p.term_a = MIN(k.term, k.neighbor) "
+                "AND p.term_b = MAX(k.term, k.neighbor) WHERE k.neighbor = ?",
+                (t,),
+            ):
+                if term not in terms:
+                    edges[(min(term, nb), max(term, nb))] = (count, score)
+        for t, nb, score, count in topk:
+            edges[(min(t, nb), max(t, nb))] = (count, score)
+        return edges
+
+    @staticmethod
+    def _write_neighbours(db, terms, topk_rows, edge_rows):
+        """Writer side of steps 3 & 4: replace the neighbour lists and edges of *terms*."""
+        db.executemany("DELETE FROM kg_term_topk WHERE term = ?", [(t,) for t in terms])
+        _insert_topk(db, topk_rows)
+        db.executemany("DELETE FROM kg_edges WHERE term_a = ?1 OR term_b = ?1",
+                       [(t,) for t in terms])
+        db.executemany(
+            "INSERT OR REPLACE INTO kg_edges (term_a, term_b, weight, score) VALUES (?, ?, ?, ?)",
+            edge_rows,
+        )
 
-    def update_frequencies(self):
+    def update_frequencies(self, terms=None):
         """Update kg_terms.frequency from kg_card_terms counts.
 
         Delegates to kg_store.update_term_frequencies() which performs an
         efficient GROUP BY upsert in a single SQL statement.
+
+        Args:
+            terms: Recount only these terms plus those of the cards changed
+                since the last compute_edges() (kg_dirty_cards, old terms
+                from their fingerprints) — which covers terms that lost
+                cards. None, or no fingerprints yet, recounts everything.
         """
         try:
             from ..storage import kg_store as kg
         except ImportError:
             from storage import kg_store as kg
 
-        logger.info("GraphIndexBuilder.update_frequencies: updating term frequencies")
-        kg.update_term_frequencies()
-
-    def build(self, min_weight: int = 2, max_edges: int = 5000):
+        if terms is not None:
+            dirty = self._dirty_card_terms(kg._get_db())
+            terms = None if dirty is None else set(terms) | dirty
+        logger.info("GraphIndexBuilder.update_frequencies: updating %s term frequencies",
+                    "all" if terms is None else len(terms))
+        if terms is None or terms:
+            kg.run_write(kg.update_term_frequencies, terms)
+
+    @staticmethod
+    def _dirty_card_terms(db):
+        """Old and current terms of the cards in kg_dirty_cards, or None
+        when there are no fingerprints to take the old terms from."""
+        if db.execute("SELECT 1 FROM kg_card_fingerprints LIMIT 1").fetchone() is None:
+            return None
+        card_ids = [r[0] for r in db.execute("SELECT card_id FROM kg_dirty_cards")]
+        terms = set()
+        for chunk in _chunks(card_ids, _CARD_CHUNK):
+            for current in _current_terms(db, chunk).values():
+                terms.update(current)
+            for row in db.execute(
+                "SELECT terms FROM kg_card_fingerprints WHERE card_id IN (%s)"
+                % ",".join("?" * len(chunk)), chunk,
+            ):
+                terms.update(json.loads(row[0]))
+        return terms
+
+    def build(self, min_weight: int = 2, max_edges: int = None, top_k: int = 10, terms=None):
         """Full index build: update frequencies then compute edges.
 
         Args:
             min_weight: Forwarded to compute_edges().
             max_edges:  Forwarded to compute_edges().
+            top_k:      Forwarded to compute_edges().
+            terms:      Terms written since the last build (e.g. the
+                        ``written_terms`` of run_extraction_queue), forwarded
+                        to update_frequencies(); None recounts every term.
         """
         logger.info("GraphIndexBuilder.build: starting full build")
-        self.update_frequencies()
-        self.compute_edges(min_weight=min_weight, max_edges=max_edges)
+        self.update_frequencies(terms)
+        self.compute_edges(min_weight=min_weight, max_edges=max_edges, top_k=top_k)
         logger.info("GraphIndexBuilder.build: complete")
 
 
@@ -134,9 +512,13 @@ def build_term_embeddings(embed_fn, db=None, batch_size=50):
     import struct
 
     try:
-        from ..storage.kg_store import _get_db as kg_get_db
+        from ..storage.kg_store import _get_db as kg_get_db, run_write as kg_run_write
     except ImportError:
-        from storage.kg_store import _get_db as kg_get_db
+        from storage.kg_store import _get_db as kg_get_db, run_write as kg_run_write
+
+    def _store(conn, updates):
+        conn.executemany("UPDATE kg_terms SET embedding = ? WHERE term = ?", updates)
+        conn.commit()
 
     conn = db or kg_get_db()
 
@@ -176,15 +558,13 @@ def build_term_embeddings(embed_fn, db=None, batch_size=50):
             embeddings = embed_fn(texts_to_embed)
             if not embeddings:
                 continue
-            for term, emb in zip(batch, embeddings):
-                if emb:
-                    packed = struct.pack('%df' % len(emb), *emb)
-                    conn.execute(
-                        "UPDATE kg_terms SET embedding = ? WHERE term = ?",
-                        (packed, term)
-                    )
-                    total_embedded += 1
-            conn.commit()
+            updates = [(struct.pack('%df' % len(emb), *emb), term)
+                       for term, emb in zip(batch, embeddings) if emb]
+            if db is not None:
+                _store(db, updates)
+            else:
+                kg_run_write(lambda: _store(kg_get_db(), updates))
+            total_embedded += len(updates)
         except Exception as e:
             logger.warning("build_term_embeddings: batch %d failed: %s", i, e)
 
@@ -12,7 +12,11 @@ Two-tier architecture:
   Tier 2 (Secondary): NEW terms from Router's resolved_intent
 """
 import re
-import math
+
+try:
+    from .kg_term_index import as_term_index
+except ImportError:
+    from ai.kg_term_index import as_term_index
 
 try:
     from ..utils.logging import get_logger
@@ -48,6 +52,8 @@ _KEEP_ABBREVIATIONS = frozenset({
 # Embedding similarity thresholds
 EMB_SIMILARITY_MIN = 0.75   # Minimum to consider a KG term related (was 0.55 — too noisy)
 EMB_EXPANSION_TOP_K = 8     # Max embedding-similar terms per input term (raised back: threshold 0.75 filters noise)
+TERM_SIMILARITY_MIN = 0.75  # Higher threshold for term-level (morphological only)
+TERM_EXPANSION_TOP_K = 3     # Max embedding-similar terms per term-level query
 STEM_OVERLAP_MIN = 4         # Min shared prefix to consider a morphological variant
 MAX_PRECISE_QUERIES = 5      # Max individual SQL queries (was 8 — too noisy)
 
@@ -237,9 +243,12 @@ def _embedding_expand_terms(terms, kg_term_index, term_embeddings, sentence_embe
     1. Sentence-level: embed the full question → find nearest KG terms (best for synonyms)
     2. Term-level: embed individual terms → find morphological variants (fallback)
 
+    Both run as one batched search over the KG term matrix; the query-term
+    and stem filters only look at the top candidates (see KGTermIndex.search).
+
     Args:
         terms: List of query term strings (from extract_query_terms).
-        kg_term_index: Dict of {kg_term: normalized_vector}.
+        kg_term_index: KGTermIndex, or a dict of {kg_term: normalized_vector}.
         term_embeddings: Dict of {query_term: embedding_vector} from batch embed.
         sentence_embedding: Embedding of the full user question (preferred for expansion).
 
@@ -249,68 +258,51 @@ def _embedding_expand_terms(terms, kg_term_index, term_embeddings, sentence_embe
     """
     if not kg_term_index:
         return {}
+    index = as_term_index(kg_term_index)
 
     result = {}
     terms_lower = {t.lower() for t in terms}
+    sentence_top_k = EMB_EXPANSION_TOP_K * 2
+
+    # Query 0 is the sentence (when given), then one query per embedded term
+    queries = [sentence_embedding] if sentence_embedding else []
+    query_terms = [t for t in terms if term_embeddings.get(t)]
+    queries.extend(term_embeddings[t] for t in query_terms)
+    offset = 1 if sentence_embedding else 0
+
+    def _accept(position, kg_term):
+        kg_lower = kg_term.lower()
+        if position < offset:
+            # Skip terms already in the query and morphological variants —
+            # terms sharing a stem with query terms. Filters: "Dünndarms",
+            # "Dünndarmkonvolut", "Darmdrehung", "Darmtätigkeit" when query
+            # has "dünndarm" (shared stem "darm" ≥ 4 chars)
+            return kg_lower not in terms_lower and not any(
+                _shares_stem(kg_lower, t) for t in terms_lower)
+        return kg_lower != query_terms[position - offset].lower()
+
+    # Term-level hits drop sentence hits afterwards, so over-fetch by that many
+    hits = index.search(queries, top_k=sentence_top_k + TERM_EXPANSION_TOP_K,
+                        min_score=min(EMB_SIMILARITY_MIN, TERM_SIMILARITY_MIN),
+                        accept=_accept)
 
     # Strategy 1: Sentence-level embedding → best for finding synonyms
     # "Wie lang ist der Dünndarm?" → finds Jejunum, Ileum, Duodenum
     if sentence_embedding:
-        norm = math.sqrt(sum(v * v for v in sentence_embedding))
-        if norm > 0:
-            normed = [v / norm for v in sentence_embedding]
-            scored = []
-            for kg_term, kg_vec in kg_term_index.items():
-                # Skip terms that are already in the query
-                if kg_term.lower() in terms_lower:
-                    continue
-                # Skip morphological variants — terms sharing a stem with query terms.
-                # Filters: "Dünndarms", "Dünndarmkonvolut", "Darmdrehung", "Darmtätigkeit"
-                # when query has "dünndarm" (shared stem "darm" ≥ 4 chars)
-                kg_lower = kg_term.lower()
-                is_morph_variant = False
-                for t in terms_lower:
-                    if _shares_stem(kg_lower, t):
-                        is_morph_variant = True
-                        break
-                if is_morph_variant:
-                    continue
-
-                score = sum(a * b for a, b in zip(normed, kg_vec))
-                if score >= EMB_SIMILARITY_MIN:
-                    scored.append((kg_term, score))
-
-            scored.sort(key=lambda x: x[1], reverse=True)
-            if scored:
-                result['_sentence'] = scored[:EMB_EXPANSION_TOP_K * 2]
-                logger.info("Sentence expansion -> %s",
-                            [(t, round(s, 2)) for t, s in scored[:8]])
+        scored = [(t, score) for t, score in hits[0] if score >= EMB_SIMILARITY_MIN]
+        if scored:
+            result['_sentence'] = scored[:sentence_top_k]
+            logger.info("Sentence expansion -> %s",
+                        [(t, round(s, 2)) for t, s in scored[:8]])
 
     # Strategy 2: Term-level embedding → finds morphological variants + typo matches
-    for term in terms:
-        emb = term_embeddings.get(term)
-        if not emb:
-            continue
-
-        norm = math.sqrt(sum(v * v for v in emb))
-        if norm == 0:
-            continue
-        normed = [v / norm for v in emb]
-
-        scored = []
-        for kg_term, kg_vec in kg_term_index.items():
-            if kg_term.lower() == term.lower():
-                continue
-            # Skip terms already found by sentence expansion
-            if '_sentence' in result and any(kg_term == t for t, _ in result['_sentence']):
-                continue
-            score = sum(a * b for a, b in zip(normed, kg_vec))
-            if score >= 0.75:  # Higher threshold for term-level (morphological only)
-                scored.append((kg_term, score))
-
-        scored.sort(key=lambda x: x[1], reverse=True)
+    sentence_terms = {t for t, _ in result.get('_sentence', [])}
+    for term, matches in zip(query_terms, hits[offset:]):
+        # Skip terms already found by sentence expansion
+        scored = [(t, score) for t, score in matches
+                  if score >= TERM_SIMILARITY_MIN and t not in sentence_terms]
         if scored:
-            result[term] = scored[:3]  # Fewer results for term-level
+            result[term] = scored[:TERM_EXPANSION_TOP_K]  # Fewer results for term-level
 
     return result
 
@@ -321,24 +313,36 @@ def _get_edge_expansions(terms, db=None):
     Performs case-insensitive lookup: normalizes each term to its canonical
     KG form before querying edges (e.g. "dünndarm" → "Dünndarm").
 
+    Served from the in-memory KG snapshot (kg_adjacency) when available,
+    otherwise from SQLite.
+
     Returns dict of {original_term: [(connected_term, weight), ...]}
     """
     try:
         try:
             from ..storage.kg_store import get_term_expansions, exact_term_lookup
+            from ..storage.kg_adjacency import get_adjacency
         except ImportError:
             from storage.kg_store import get_term_expansions, exact_term_lookup
+            from storage.kg_adjacency import get_adjacency
     except ImportError:
         return {}
 
+    graph = get_adjacency(db)
+
+    def _expand(term):
+        if graph is not None:
+            return graph.expansions(term, max_terms=5)
+        return get_term_expansions(term, max_terms=5, db=db)
+
     expansions = {}
     for term in terms:
         # Try exact match first, then case-insensitive canonical lookup
-        edges = get_term_expansions(term, max_terms=5, db=db)
+        edges = _expand(term)
         if not edges:
-            canonical = exact_term_lookup(term, db=db)
+            canonical = graph.lookup(term) if graph is not None else exact_term_lookup(term, db=db)
             if canonical and canonical != term:
-                edges = get_term_expansions(canonical, max_terms=5, db=db)
+                edges = _expand(canonical)
         if edges:
             expansions[term] = edges
     return expansions
@@ -450,15 +454,19 @@ def _filter_by_kg_presence(candidates, db=None):
     try:
         try:
             from ..storage.kg_store import exact_term_lookup
+            from ..storage.kg_adjacency import get_adjacency
         except ImportError:
             from storage.kg_store import exact_term_lookup
+            from storage.kg_adjacency import get_adjacency
     except ImportError:
         return candidates, []  # Can't check — keep all
 
+    graph = get_adjacency(db)
+
     kg_terms = []
     non_kg_terms = []
     for term in candidates:
-        canonical = exact_term_lookup(term, db=db)
+        canonical = graph.lookup(term) if graph is not None else exact_term_lookup(term, db=db)
         if canonical:
             kg_terms.append(canonical)
         else:
@@ -0,0 +1,179 @@
+"""Resumable, parallel LLM term extraction for the Knowledge Graph.
+
+Work lives in kg_store's ``kg_extraction_queue`` (one row per card with
+status, attempt count and last error), so an interrupted run — cancel,
+quota stop, crash — continues with exactly the cards that are still open.
+run_extraction_queue() claims chunks of pending cards and drains them
+through ExtractionPipeline, the adaptive control loop of
+ai/embed_pipeline.py: several LLM batches in flight, concurrency and batch
+size tuned AIMD-style, Retry-After/backoff on 429 and a hard stop on
+quota/auth errors. Every finished batch is committed (terms + queue status)
+on the calling thread as soon as it lands.
+
+Extraction is local-first when a TermExtractor is passed: each claimed card
+is scored with TermExtractor.score() and only cards below the confidence
+threshold (no terms, chemistry, dense abbreviations, noisy candidates) are
+sent to the LLM. The queue records which extractor closed each card
+(``method``); scripts/eval_term_extraction.py measures the trade-off on a
+fixture deck.
+"""
+
+try:
+    from .embed_pipeline import AdaptiveEmbedPipeline, EmbedError
+except ImportError:
+    from ai.embed_pipeline import AdaptiveEmbedPipeline, EmbedError
+
+try:
+    from .term_extractor import LOCAL_CONFIDENCE_THRESHOLD
+except ImportError:
+    from ai.term_extractor import LOCAL_CONFIDENCE_THRESHOLD
+
+try:
+    from ..storage import kg_store
+except ImportError:
+    from storage import kg_store
+
+try:
+    from ..utils.logging import get_logger
+except ImportError:
+    from utils.logging import get_logger
+logger = get_logger(__name__)
+
+# The extraction prompt is sized for 10-15 cards per call
+EXTRACTION_PIPELINE_OPTIONS = {
+    'batch_size': 15,
+    'min_batch': 5,
+    'max_batch': 15,
+    'batch_step': 5,
+    'concurrency': 2,
+    'max_concurrency': 4,
+    'target_latency': 20.0,
+}
+CLAIM_CHUNK = 300  # cards claimed from the queue per pipeline run
+MAX_ATTEMPTS = 3
+
+
+def load_extraction_options():
+    """Read the ``kg_extraction`` config block (see config.DEFAULT_CONFIG)."""
+    try:
+        from ..config import get_config
+    except ImportError:
+        from config import get_config
+    try:
+        opts = dict(get_config().get('kg_extraction') or {})
+    except (AttributeError, TypeError, ValueError):
+        opts = {}
+    try:
+        threshold = float(opts.get('local_confidence_threshold', LOCAL_CONFIDENCE_THRESHOLD))
+    except (TypeError, ValueError):
+        threshold = LOCAL_CONFIDENCE_THRESHOLD
+    return {'local_first': bool(opts.get('local_first', True)), 'threshold': threshold}
+
+
+class ExtractionPipeline(AdaptiveEmbedPipeline):
+    """AdaptiveEmbedPipeline over ``extract_fn(cards) -> {card_id: [terms]}``."""
+
+    def _call(self, batch):
+        return self._embed_fn(batch)
+
+    def _check(self, batch, result):
+        if not isinstance(result, dict):
+            raise EmbedError("invalid extraction result: %r" % type(result), retryable=False)
+
+
+def split_by_confidence(cards, local_extractor, threshold=LOCAL_CONFIDENCE_THRESHOLD,
+                        vocabulary=None):
+    """Score *cards* locally.
+
+    Returns:
+        (local_results, llm_cards): {card_id: [terms]} for cards at or above
+        *threshold*, and the card dicts that need the LLM.
+    """
+    local_results = {}
+    llm_cards = []
+    for card in cards:
+        scored = local_extractor.score(card.get('question', ''), card.get('answer', ''),
+                                       vocabulary=vocabulary)
+        if scored.confidence >= threshold:
+            local_results[card['card_id']] = scored.terms
+        else:
+            llm_cards.append(card)
+    return local_results, llm_cards
+
+
+def run_extraction_queue(extract_fn, cancelled=None, chunk_size=CLAIM_CHUNK,
+                         max_attempts=MAX_ATTEMPTS, local_extractor=None,
+                         threshold=LOCAL_CONFIDENCE_THRESHOLD, vocabulary=None,
+                         **pipeline_options):
+    """Drain the pending cards of kg_extraction_queue.
+
+    Args:
+        extract_fn: ``extract_fn(cards) -> {card_id: [terms]}``, raising
+            EmbedError / RateLimited on backend failures
+            (``extract_terms_batch(..., raise_errors=True)``).
+        cancelled: Optional callable; the run stops when it returns True.
+        local_extractor: Optional TermExtractor; confident cards are closed
+            with its terms and never reach *extract_fn*.
+        threshold: Minimum TermExtractor.score() confidence to stay local.
+        vocabulary: Optional set of normalized known terms for scoring.
+        pipeline_options: Overrides for EXTRACTION_PIPELINE_OPTIONS.
+
+    Returns:
+        Dict with ``cards`` (cards closed), ``local`` / ``llm`` (cards per
+        extractor), ``terms`` (number of distinct terms written),
+        ``written_terms`` (the terms themselves, for
+        GraphIndexBuilder.build(terms=...)), ``error`` (reason the run
+        stopped early, or None) and the pipeline counters.
+    """
+    options = dict(EXTRACTION_PIPELINE_OPTIONS, **pipeline_options)
+    pipeline = ExtractionPipeline(extract_fn, **options)
+    terms = set()
+    processed = 0
+    local_count = 0
+
+    while pipeline.error is None and not (cancelled is not None and cancelled()):
+        claimed = kg_store.run_write(kg_store.claim_extraction_batch, chunk_size,
+                                     max_attempts=max_attempts)
+        if not claimed:
+            break
+        finished = set()
+
+        if local_extractor is not None:
+            local_results, llm_cards = split_by_confidence(
+                claimed, local_extractor, threshold, vocabulary)
+            local_cards = [c for c in claimed if c['card_id'] in local_results]
+            if local_cards:
+                terms.update(kg_store.run_write(kg_store.finish_extraction, local_cards,
+                                                local_results, method='local'))
+                finished.update(local_results)
+                local_count += len(local_cards)
+        else:
+            llm_cards = claimed
+
+        def _on_batch(batch, result):
+            terms.update(kg_store.run_write(kg_store.finish_extraction, batch, result))
+            finished.update(card['card_id'] for card in batch)
+
+        try:
+            if llm_cards:
+                processed += pipeline.run(llm_cards, _on_batch, cancelled=cancelled)
+        finally:
+            leftover = [c['card_id'] for c in claimed if c['card_id'] not in finished]
+            if leftover:
+                error = pipeline.error
+                kg_store.run_write(
+                    kg_store.release_extraction,
+                    leftover,
+                    error=str(error) if error is not None else None,
+                    failed=error is not None and getattr(error, 'retryable', True),
+                    max_attempts=max_attempts,
+                )
+
+    stats = dict(pipeline.stats, cards=processed + local_count, local=local_count,
+                 llm=processed, terms=len(terms), written_terms=terms,
+                 error=str(pipeline.error) if pipeline.error is not None else None)
+    logger.info("KG extraction queue: %d cards (%d local, %d LLM), %d terms (%d batches, "
+                "%d retries, %d throttled)%s", stats['cards'], local_count, processed, len(terms),
+                stats['batches'], stats['retries'], stats['throttled'],
+                " — stopped: %s" % stats['error'] if stats['error'] else "")
+    return stats
@@ -0,0 +1,236 @@
+"""Matrix-backed index of KG term embeddings for fuzzy and expansion search.
+
+Query enrichment compares the question's sentence vector and every query
+term's vector against all embedded KG terms. KGTermIndex keeps those term
+vectors as one L2-normalized VectorIndex (row ``i`` belongs to
+``terms[i]``), so all query vectors are scored in a single batched
+search_many() call instead of one pure-Python dot product per term pair.
+
+Post-filters that only make sense per pair (skip the query's own terms,
+skip morphological variants via _shares_stem) run on the top candidates
+only: search() takes ``accept`` and widens the candidate window until
+enough accepted hits are found or the similarity floor is reached, so the
+result equals filtering the full scan.
+
+The index is persisted as a VectorIndex snapshot next to card_sessions.db
+(``<db>.kg_terms.*``, term strings in the JSON header) and reused while
+kg_store.get_term_embeddings_watermark() still matches, so a profile load
+maps the file instead of unpacking every kg_terms.embedding BLOB.
+
+For callers that still build ``{term: vector}`` dicts (scripts, tests),
+as_term_index() wraps them; KGTermIndex itself also reads like that dict.
+"""
+
+import json
+import os
+import sqlite3
+import time
+from collections import Counter
+
+try:
+    from .vector_index import VectorIndex
+except ImportError:
+    from ai.vector_index import VectorIndex
+
+try:
+    from ..storage import kg_store
+except ImportError:
+    from storage import kg_store
+
+try:
+    from ..utils.logging import get_logger
+except ImportError:
+    from utils.logging import get_logger
+logger = get_logger(__name__)
+
+
+class KGTermIndex:
+    """Term strings plus their normalized embedding matrix."""
+
+    def __init__(self, terms, index):
+        """
+        Args:
+            terms: Term strings; position ``i`` is VectorIndex key ``i``.
+            index: VectorIndex holding one row per term.
+        """
+        self.terms = list(terms)
+        self._index = index
+        self._row_of = {t: i for i, t in enumerate(self.terms)}
+
+    @classmethod
+    def from_vectors(cls, vectors):
+        """Build from a ``{term: vector}`` mapping (vectors normalized here)."""
+        items = [(t, v) for t, v in vectors.items() if v]
+        if not items:
+            return cls([], VectorIndex(1))
+        dim = Counter(len(v) for _, v in items).most_common(1)[0][0]
+        items = [(t, v) for t, v in items if len(v) == dim]
+        index = VectorIndex(dim)
+        index.build(range(len(items)), [v for _, v in items])
+        return cls([t for t, _ in items], index)
+
+    @classmethod
+    def from_blobs(cls, rows):
+        """Build from ``(term, float32 blob)`` rows as stored in kg_terms.
+
+        The dimension is the most common blob size; other rows are skipped.
+        """
+        rows = [(t, b) for t, b in rows if b]
+        if not rows:
+            return cls([], VectorIndex(1))
+        dim = Counter(len(b) for _, b in rows).most_common(1)[0][0] // 4
+        rows = [(t, b) for t, b in rows if len(b) == 4 * dim]
+        if not dim or not rows:
+            return cls([], VectorIndex(1))
+        index = VectorIndex(dim)
+        index.build_from_bytes(range(len(rows)), [b for _, b in rows])
+        return cls([t for t, _ in rows], index)
+
+    # ── dict-like view ({term: normalized vector}) ──
+
+    def __len__(self):
+        return len(self.terms)
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def __contains__(self, term):
+        return term in self._row_of
+
+    def __getitem__(self, term):
+        return self._index.get_vector(self._row_of[term])
+
+    def get(self, term, default=None):
+        row = self._row_of.get(term)
+        return self._index.get_vector(row) if row is not None else default
+
+    def items(self):
+        for i, term in enumerate(self.terms):
+            yield term, self._index.get_vector(i)
+
+    @property
+    def dim(self):
+        return self._index.dim
+
+    # ── search ──
+
+    def search(self, vectors, top_k=10, min_score=None, accept=None):
+        """Nearest terms for several query vectors in one batched pass.
+
+        Args:
+            vectors: Query vectors (need not be normalized); vectors of the
+                wrong dimension or all zeros get no results.
+            top_k: Accepted results per query.
+            min_score: Cosine similarity floor.
+            accept: Optional ``accept(query_position, term) -> bool``; rejected
+                candidates do not count towards *top_k*.
+
+        Returns:
+            One ``[(term, score), ...]`` list per query, best first.
+        """
+        results = [[] for _ in vectors]
+        pending = [i for i, v in enumerate(vectors) if v and len(v) == self.dim]
+        size = len(self)
+        if not size or top_k <= 0:
+            return results
+        k = top_k
+        while pending:
+            k = min(k, size)
+            hits_per_query, _ = self._index.search_many(
+                [vectors[i] for i in pending], top_k=k, min_score=min_score)
+            still_open = []
+            for i, hits in zip(pending, hits_per_query):
+                kept = [(self.terms[key], score) for key, score in hits
+                        if accept is None or accept(i, self.terms[key])]
+                if len(kept) >= top_k or len(hits) < k or k >= size:
+                    results[i] = kept[:top_k]
+                else:
+                    still_open.append(i)
+            pending = still_open
+            k *= 4
+        return results
+
+    # ── snapshot ──
+
+    def save(self, path_prefix, meta=None):
+        header = dict(meta or {})
+        header['terms'] = self.terms
+        self._index.save(path_prefix, header)
+
+    @classmethod
+    def load(cls, path_prefix, dim):
+        """Open a snapshot written by save(). Returns ``(index, meta)`` or ``(None, None)``."""
+        index, meta = VectorIndex.load(path_prefix, dim)
+        if index is None:
+            return None, None
+        terms = meta.pop('terms', None)
+        if not isinstance(terms, list) or len(terms) != len(index):
+            return None, None
+        return cls(terms, index), meta
+
+
+def as_term_index(obj):
+    """KGTermIndex for *obj* (a KGTermIndex, a ``{term: vector}`` dict or None)."""
+    if isinstance(obj, KGTermIndex):
+        return obj
+    return KGTermIndex.from_vectors(obj or {})
+
+
+def _snapshot_meta(path_prefix):
+    """Header of an existing snapshot without mapping it, or None."""
+    try:
+        with open(path_prefix + '.json', 'rb') as f:
+            return json.loads(f.read().decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+
+
+def load_term_index(snapshot_prefix=None, model=None, db=None):
+    """Load the KG term index, from the snapshot when it is still current.
+
+    Args:
+        snapshot_prefix: Snapshot path prefix; None disables persistence.
+        model: Embedding model name stored with the snapshot; a snapshot
+            written for another model is rebuilt.
+        db: Optional connection (default: the shared KG connection).
+
+    Returns:
+        KGTermIndex (empty when there are no term embeddings or the table
+        cannot be read).
+    """
+    t0 = time.time()
+    try:
+        watermark = list(kg_store.get_term_embeddings_watermark(db))
+    except sqlite3.Error as e:
+        logger.warning("kg_term_index: could not read term embeddings: %s", e)
+        return KGTermIndex([], VectorIndex(1))
+    if not watermark[0]:
+        return KGTermIndex([], VectorIndex(1))
+
+    if snapshot_prefix:
+        meta = _snapshot_meta(snapshot_prefix)
+        if meta and meta.get('watermark') == watermark and meta.get('model') == model:
+            index, _ = KGTermIndex.load(snapshot_prefix, int(meta.get('dim', 0)))
+            if index is not None:
+                logger.info("kg_term_index: mapped %d term vectors from snapshot in %.0f ms",
+                            len(index), (time.time() - t0) * 1000)
+                return index
+
+    index = KGTermIndex.from_blobs(kg_store.load_term_embeddings(db).items())
+    logger.info("kg_term_index: built %d term vectors from database in %.0f ms",
+                len(index), (time.time() - t0) * 1000)
+    if snapshot_prefix and len(index):
+        try:
+            index.save(snapshot_prefix, {'watermark': watermark, 'model': model})
+        except OSError as e:
+            logger.warning("kg_term_index: could not write snapshot: %s", e)
+    return index
+
+
+def default_snapshot_prefix():
+    """``<card_sessions db>.kg_terms`` — next to the card index snapshot."""
+    try:
+        from ..storage.card_sessions import _DB_PATH
+    except ImportError:
+        from storage.card_sessions import _DB_PATH
+    return os.path.splitext(_DB_PATH)[0] + '.kg_terms'
@@ -154,23 +154,15 @@ class HybridRetrieval:
                 if context and context.get('cardId'):
                     exclude.append(context['cardId'])
 
-                # Batch all embedding queries into a single call, then search per embedding
-                seen_cards = {}  # card_id -> best_score
+                # Batch all embedding queries into a single call and score them in one
+                # pass; fused keeps each card's best score, sorted, top max_notes
                 all_embeddings = self.emb.embed_texts(embedding_queries)
-                for eq, emb in zip(embedding_queries, all_embeddings or []):
-                    if not emb:
-                        continue
-                    results = self.emb.search(
-                        emb,
-                        top_k=max_notes,
-                        exclude_card_ids=exclude
-                    )
-                    for card_id, score in results:
-                        if card_id not in seen_cards or score > seen_cards[card_id]:
-                            seen_cards[card_id] = score
-
-                # Sort merged results by score descending, take top max_notes
-                semantic_results = sorted(seen_cards.items(), key=lambda x: x[1], reverse=True)[:max_notes]
+                _, semantic_results = self.emb.search_many(
+                    all_embeddings or [],
+                    top_k=max_notes,
+                    exclude_card_ids=exclude,
+                    fuse=True
+                )
                 semantic_total = len(semantic_results)
 
                 # Build chunk previews for top 3
@@ -386,9 +378,9 @@ class HybridRetrieval:
         """Knowledge Graph retrieval: find cards via exact term matching + co-occurrence."""
         try:
             try:
-                from ..storage.kg_store import _get_db as kg_get_db
+                from ..storage.kg_store import _get_db as kg_get_db, exact_term_lookup, prefix_term_lookup
             except ImportError:
-                from storage.kg_store import _get_db as kg_get_db
+                from storage.kg_store import _get_db as kg_get_db, exact_term_lookup, prefix_term_lookup
 
             db = kg_get_db()
 
@@ -401,21 +393,15 @@ class HybridRetrieval:
             # Exact term matching (case-insensitive) — no LIKE wildcards
             matched_terms = []
             for candidate in candidates[:8]:
-                rows = db.execute(
-                    "SELECT term FROM kg_terms WHERE LOWER(term) = LOWER(?) ORDER BY frequency DESC LIMIT 1",
-                    (candidate,)
-                ).fetchall()
-                matched_terms.extend([r[0] for r in rows])
+                canonical = exact_term_lookup(candidate, db=db)
+                if canonical:
+                    matched_terms.append(canonical)
 
             # If no exact matches, try prefix matching (starts with) as softer fallback
             if not matched_terms:
                 for candidate in candidates[:5]:
                     if len(candidate) >= 4:
-                        rows = db.execute(
-                            "SELECT term FROM kg_terms WHERE LOWER(term) LIKE ? ORDER BY frequency DESC LIMIT 3",
-                            (candidate.lower() + '%',)
-                        ).fetchall()
-                        matched_terms.extend([r[0] for r in rows])
+                        matched_terms.extend(prefix_term_lookup(candidate, limit=3, db=db))
 
             if not matched_terms:
                 return [], []
@@ -609,11 +595,14 @@ class EnrichedRetrieval:
                 if context and context.get('cardId'):
                     exclude.append(context['cardId'])
 
+                # Both vectors scored in one pass over the index
+                (results, sec_results), _ = self.emb.search_many(
+                    [primary_vec, secondary_vec], top_k=max_notes,
+                    exclude_card_ids=exclude)
+
                 rank = 1
                 # Primary vector — only accept score ≥0.65 (below is noise)
                 if primary_vec:
-                    results = self.emb.search(primary_vec, top_k=max_notes,
-                                              exclude_card_ids=exclude) or []
                     for card_id, score in results:
                         if score < 0.65:
                             continue
@@ -630,8 +619,6 @@ class EnrichedRetrieval:
                 # Secondary vector — only accept score ≥0.55
                 if secondary_vec:
                     sec_rank = 1
-                    sec_results = self.emb.search(secondary_vec, top_k=max_notes,
-                                                  exclude_card_ids=exclude) or []
                     for card_id, score in sec_results:
                         if score < 0.55:
                             continue
@@ -8,11 +8,17 @@ Extracts technical/medical terms from card text using pure heuristics:
   4. Filter stopwords and short non-abbreviation tokens
   5. Merge collocations (optional, set via set_collocations())
   6. Deduplicate
+
+TermExtractor.score() adds a confidence estimate so term extraction can
+run local-first: cards scoring below LOCAL_CONFIDENCE_THRESHOLD (or with
+chemistry / dense unknown abbreviations) go to the LLM extractor, the rest
+keep the local terms (see ai/kg_extraction.py).
 """
 
 import math
 import re
 from collections import Counter
+from dataclasses import dataclass, field
 from typing import List, Optional, Set, Tuple
 
 try:
@@ -20,6 +26,11 @@ try:
 except ImportError:
     from utils.logging import get_logger
 
+try:
+    from ..storage.kg_store import normalize_term
+except ImportError:
+    from storage.kg_store import normalize_term
+
 logger = get_logger(__name__)
 
 # ---------------------------------------------------------------------------
@@ -167,6 +178,29 @@ _COMPOUND_RE = re.compile(
     r'\b[\w]+(?:[/\-][\w]+)+\b'
 )
 
+# Chemistry: sum formulas (H2O, CO2), ions (Ca2+, HCO3-), reaction arrows
+_FORMULA_RE = re.compile(r'\b(?:[A-Z][a-z]?\d*){2,6}\b')
+_ION_RE = re.compile(r'\b(?:[A-Z][a-z]?\d*){1,6}[+-](?=\s|$|[,;.)/])')
+_ARROW_RE = re.compile(r'->|→|⇌|↔|<=>')
+# Abbreviation-like tokens: 2-6 chars, mostly uppercase (HZV, RAAS, pCO2)
+_ABBREV_RE = re.compile(r'^(?=.*[A-Z].*[A-Z])[A-Za-z0-9]{2,6}$')
+_CLOZE_RE = re.compile(r'\{\{c\d+::(.*?)(?:::[^}]*)?\}\}')
+
+LOCAL_CONFIDENCE_THRESHOLD = 0.6
+MAX_LOCAL_TERMS = 8  # same cap the LLM prompt uses
+
+
+@dataclass
+class ScoredTerms:
+    """Local extraction result with a confidence in [0, 1].
+
+    ``reasons`` names every signal that lowered the confidence
+    ('no_terms', 'chemistry', 'abbreviations', 'noisy', 'unknown_vocabulary').
+    """
+    terms: List[str]
+    confidence: float
+    reasons: List[str] = field(default_factory=list)
+
 # HTML tag and entity stripping
 _HTML_TAG_RE = re.compile(r'<[^>]+>')
 _HTML_ENTITY_RE = re.compile(r'&[a-zA-Z#\d]+;')
@@ -312,6 +346,65 @@ class TermExtractor:
             logger.exception("TermExtractor.extract failed")
             return []
 
+    def score(self, question: str, answer: str = '',
+              vocabulary: Optional[Set[str]] = None) -> ScoredTerms:
+        """Extract terms from a card and estimate how trustworthy they are.
+
+        Signals (multiplicative penalties on 1.0):
+          - no candidate terms at all → 0
+          - chemistry (two or more sum formulas, ions, reaction arrows) → × 0.3
+          - more than a quarter of the content tokens unknown abbreviations → × 0.5
+          - mostly lowercase single words (verbs/adjectives slipping through
+            the stopword list) or far more candidates than a card carries → × 0.5
+          - *vocabulary* given (normalized known KG terms) and less than half
+            of the terms known → × 0.8
+
+        Near-empty cards (< 10 chars of text, which the LLM prompt skips as
+        well) return no terms with confidence 1.0.
+
+        Returns:
+            ScoredTerms with at most MAX_LOCAL_TERMS terms, multi-word and
+            known terms first.
+        """
+        text = _strip_html(_CLOZE_RE.sub(r'\1', ' '.join(filter(None, [question, answer]))))
+        if len(text) < 10:
+            return ScoredTerms([], 1.0)
+
+        terms = self.extract(text)
+        if not terms:
+            return ScoredTerms([], 0.0, ['no_terms'])
+
+        confidence = 1.0
+        reasons = []
+        formulas = [f for f in _FORMULA_RE.findall(text) if any(c.isdigit() for c in f)]
+        if len(formulas) >= 2 or _ION_RE.search(text) or _ARROW_RE.search(text):
+            confidence *= 0.3
+            reasons.append('chemistry')
+
+        tokens = [t for t in re.split(r'[\s,;:.!?()\[\]{}"\'/]+', text) if _should_keep(t)]
+        unknown_abbrevs = [t for t in tokens if _ABBREV_RE.match(t)
+                           and t not in _KEEP_ABBREVIATIONS and t.upper() not in _KEEP_ABBREVIATIONS]
+        if len(unknown_abbrevs) * 4 > len(tokens):
+            confidence *= 0.5
+            reasons.append('abbreviations')
+
+        lowercase_singles = [t for t in terms if ' ' not in t and t[:1].islower()]
+        if len(lowercase_singles) * 2 > len(terms) or len(terms) > 2 * MAX_LOCAL_TERMS:
+            confidence *= 0.5
+            reasons.append('noisy')
+
+        known = set()
+        if vocabulary is not None:
+            known = {t for t in terms if normalize_term(t) in vocabulary}
+            if len(known) * 2 < len(terms):
+                confidence *= 0.8
+                reasons.append('unknown_vocabulary')
+
+        # Lowercase single words are mostly verbs/adjectives; keep them only when known
+        kept = [t for t in terms if t in known or ' ' in t or not t[:1].islower()] or terms
+        ranked = sorted(kept, key=lambda t: (t not in known, ' ' not in t and '-' not in t))
+        return ScoredTerms(ranked[:MAX_LOCAL_TERMS], round(confidence, 3), reasons)
+
     def is_definition_card(self, term: str, question: str, answer: str) -> bool:
         """
         Return True if this card likely defines the given term.
@@ -0,0 +1,936 @@
+"""Contiguous in-memory vector index for embedding search.
+
+All vectors live in one L2-normalized float32 matrix so a query is a single
+matrix-vector product followed by an ``argpartition`` top-k selection.
+NumPy is optional (Anki does not bundle it on every platform); without it the
+index keeps plain float lists and scores them in pure Python.
+
+Optionally the index also keeps a smaller *coarse* copy of every row:
+quantized (float16, or int8 with one float32 scale per row) and/or truncated
+to a renormalized Matryoshka prefix (the leading 256/512 dims of Gemini
+embeddings carry most of the meaning). Queries then scan the coarse matrix
+and rescore only the best few hundred candidates against the full float32
+rows, which usually stay in a memory-mapped snapshot and are paged in on
+demand.
+
+Keys map to rows through a dict, so lookups and inserts are O(1). remove()
+only tombstones a row (it stays in the arrays, masked out of every query)
+and compact() drops tombstoned rows in one pass — automatically once they
+pile up, and before every snapshot save.
+
+For large collections an IVF layer (spherical k-means centroids plus one
+list id per row) restricts each query to the rows of the ``ivf_probes``
+nearest lists, so the scan no longer grows linearly with the collection.
+"""
+
+import heapq
+import json
+import math
+import os
+import struct
+import sys
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - depends on the host Python
+    np = None
+
+try:
+    from ..utils.logging import get_logger
+except ImportError:
+    from utils.logging import get_logger
+logger = get_logger(__name__)
+
+
+def has_numpy():
+    """True when the vectorized NumPy backend is available."""
+    return np is not None
+
+
+QUANTIZATIONS = (None, 'float16', 'int8')
+
+
+def _normalize_list(vec):
+    """Normalize a float list to unit length (pure Python)."""
+    n = math.sqrt(sum(x * x for x in vec))
+    if n > 0:
+        return [x / n for x in vec]
+    return list(vec)
+
+
+def parse_prefix_dim(value, dim):
+    """Map a config prefix dimension to an int in (0, dim), or None (disabled)."""
+    try:
+        value = int(value or 0)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid embedding prefix_dim: %r" % (value,))
+    if value <= 0 or value >= dim:
+        return None
+    return value
+
+
+def parse_quantization(value):
+    """Map a config value ('none', 'float16', 'int8', ...) to a QUANTIZATIONS entry."""
+    if value in (None, '', 'none', 'float32', False):
+        return None
+    if value not in QUANTIZATIONS:
+        raise ValueError("Unknown embedding quantization: %r" % (value,))
+    return value
+
+
+def encode_vector(vec, quantization=None):
+    """Serialize a float vector for the card_embeddings BLOB column.
+
+    Layouts (all little-endian): float32 = 4*dim bytes, float16 = 2*dim bytes,
+    int8 = 4-byte float32 scale followed by dim signed bytes.
+    """
+    quantization = parse_quantization(quantization)
+    dim = len(vec)
+    if quantization is None:
+        return struct.pack('<%df' % dim, *vec)
+    if quantization == 'float16':
+        return struct.pack('<%de' % dim, *vec)
+    peak = max((abs(x) for x in vec), default=0.0)
+    scale = peak / 127.0 if peak > 0 else 1.0
+    return struct.pack('<f%db' % dim, scale,
+                       *[max(-127, min(127, int(round(x / scale)))) for x in vec])
+
+
+def decode_vector(blob, dim):
+    """Inverse of encode_vector(); the layout is inferred from the blob length
+    (unambiguous for every dim except 4).
+
+    Returns a float list, or None when the length matches no layout.
+    """
+    if blob is None:
+        return None
+    size = len(blob)
+    if size == 4 * dim:
+        return list(struct.unpack('<%df' % dim, blob))
+    if size == 2 * dim:
+        return list(struct.unpack('<%de' % dim, blob))
+    if size == dim + 4:
+        values = struct.unpack('<f%db' % dim, blob)
+        scale = values[0]
+        return [v * scale for v in values[1:]]
+    return None
+
+
+def _decode_blobs_numpy(blobs, dim):
+    """Decode equal-layout blobs into an (n, dim) float32 array in one shot."""
+    size = len(blobs[0])
+    raw = b''.join(blobs)
+    if size == 4 * dim:
+        return np.frombuffer(raw, dtype='<f4').reshape(len(blobs), dim)
+    if size == 2 * dim:
+        return np.frombuffer(raw, dtype='<f2').reshape(len(blobs), dim).astype(np.float32)
+    packed = np.frombuffer(raw, dtype=np.uint8).reshape(len(blobs), dim + 4)
+    scale = packed[:, :4].copy().view('<f4').astype(np.float32)
+    values = packed[:, 4:].copy().view(np.int8).astype(np.float32)
+    return values * scale
+
+
+def _top_rows(scores, k):
+    """Row indices of the *k* highest scores, best first."""
+    size = scores.shape[0]
+    if k < size:
+        top = np.argpartition(-scores, k - 1)[:k]
+    else:
+        top = np.arange(size)
+    return top[np.argsort(-scores[top], kind='stable')]
+
+
+class VectorIndex:
+    """Cosine-similarity index over fixed-dimension vectors keyed by id.
+
+    Rows are stored normalized, so the dot product equals cosine similarity.
+    Not thread-safe on its own — callers (EmbeddingManager) hold a lock.
+
+    Args:
+        dim: Vector dimension.
+        quantization: None, 'float16' or 'int8' (NumPy backend only).
+        rescore_candidates: Candidates taken from the coarse pass and
+            rescored exactly on all dims in float32.
+        prefix_dim: Scan only the first *prefix_dim* dims (renormalized) in
+            the coarse pass; None or >= dim disables the prefix stage.
+        ivf: Enable the IVF layer (NumPy backend only). It is trained once
+            the index holds *ivf_min_rows* rows; below that a full scan is
+            fast enough.
+        ivf_lists: Number of k-means lists; 0 picks ~sqrt(rows).
+        ivf_probes: Lists scanned per query — the recall/latency knob.
+    """
+
+    _GROWTH = 1.5
+    _MIN_CAPACITY = 256
+    _CHUNK = 1024  # rows dequantized per block during a quantized scan
+    _COMPACT_MIN = 1024    # tombstones tolerated before remove() compacts ...
+    _COMPACT_RATIO = 0.2   # ... and only once they are this share of all rows
+    _KMEANS_ITERS = 10
+    _KMEANS_SAMPLE_PER_LIST = 32
+
+    def __init__(self, dim, quantization=None, rescore_candidates=300, prefix_dim=None,
+                 ivf=False, ivf_lists=0, ivf_probes=16, ivf_min_rows=20000):
+        self.dim = dim
+        self.quantization = parse_quantization(quantization) if np is not None else None
+        self.rescore_candidates = max(1, int(rescore_candidates))
+        self.prefix_dim = parse_prefix_dim(prefix_dim, dim)
+        self.ivf = bool(ivf) and np is not None
+        self.ivf_lists = max(0, int(ivf_lists or 0))
+        self.ivf_probes = max(1, int(ivf_probes))
+        self.ivf_min_rows = max(1, int(ivf_min_rows))
+        self._version = 0         # any mutation
+        self._layout_version = 0  # rows changed in place or renumbered (invalidates an IVF fit)
+        self.clear()
+
+    @property
+    def two_stage(self):
+        """True when queries run a coarse pass before the exact rescoring."""
+        return bool(self.quantization or self.prefix_dim)
+
+    @property
+    def coarse_dim(self):
+        return self.prefix_dim or self.dim
+
+    def __len__(self):
+        return len(self._row_of)
+
+    def __contains__(self, key):
+        return key in self._row_of
+
+    @property
+    def ids(self):
+        """Live keys in row order (do not mutate)."""
+        if not self._dead:
+            return self._ids
+        return [key for key in self._ids if key is not None]
+
+    @property
+    def tombstones(self):
+        """Number of removed rows still occupying space until compact()."""
+        return len(self._dead)
+
+    @property
+    def version(self):
+        """Counter bumped by every mutation (add, update, remove, compact, build)."""
+        return self._version
+
+    def _set_ids(self, ids):
+        """Adopt a row-aligned key list; rows shadowed by a later duplicate become tombstones."""
+        self._version += 1
+        self._layout_version += 1
+        self._frozen = False
+        self._ids = ids
+        self._row_of = {key: row for row, key in enumerate(ids)}
+        self._dead = set()
+        if len(self._row_of) < len(ids):
+            for row, key in enumerate(ids):
+                if self._row_of[key] != row:
+                    self._dead.add(row)
+            for row in self._dead:
+                ids[row] = None
+
+    def clear(self):
+        self._set_ids([])
+        self._reset_ivf()
+        if np is not None:
+            self._matrix = np.empty((0, self.dim), dtype=np.float32)
+            self._qmatrix = None  # coarse copy (quantized and/or prefix rows)
+            self._qscale = None
+            self._quantize_all()
+        else:
+            self._rows = []
+            self._prefix_rows = []
+
+    # ── Building ──
+
+    def build(self, ids, vectors):
+        """Replace the index contents.
+
+        Args:
+            ids: Sequence of keys, aligned with *vectors*.
+            vectors: Either an (n, dim) float array (NumPy backend) or a
+                sequence of float lists. Rows are normalized here.
+        """
+        ids = list(ids)
+        if np is not None:
+            matrix = np.array(vectors, dtype=np.float32, copy=True).reshape(len(ids), self.dim)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            matrix /= norms
+            self._matrix = matrix
+            self._set_ids(ids)
+            self._quantize_all()
+            self._reset_ivf()
+            if self.ivf_needs_training():
+                self.train_ivf()
+        else:
+            self._rows = [_normalize_list(v) for v in vectors]
+            self._set_ids(ids)
+            self._prefix_rows = [self._prefix_list(v) for v in self._rows]
+
+    def build_from_bytes(self, ids, blobs):
+        """Build from card_embeddings blobs (any encode_vector() layout).
+
+        Blobs that match no layout for this dimension are skipped. Returns
+        the number of rows.
+        """
+        valid_sizes = (4 * self.dim, 2 * self.dim, self.dim + 4)
+        if np is None:
+            keep_ids, vectors = [], []
+            for key, blob in zip(ids, blobs):
+                vec = decode_vector(blob, self.dim)
+                if vec is not None:
+                    keep_ids.append(key)
+                    vectors.append(vec)
+            self.build(keep_ids, vectors)
+            return len(self)
+
+        groups = {}
+        for key, blob in zip(ids, blobs):
+            if blob is not None and len(blob) in valid_sizes:
+                group = groups.setdefault(len(blob), ([], []))
+                group[0].append(key)
+                group[1].append(blob)
+        if not groups:
+            self.clear()
+            return 0
+        keep_ids = []
+        parts = []
+        for group_ids, group_blobs in groups.values():
+            keep_ids.extend(group_ids)
+            parts.append(_decode_blobs_numpy(group_blobs, self.dim))
+        self.build(keep_ids, parts[0] if len(parts) == 1 else np.concatenate(parts))
+        return len(self)
+
+    def add(self, key, vector):
+        """Insert or replace a single vector."""
+        self._version += 1
+        if key in self._row_of:
+            self._layout_version += 1  # an existing row changes in place
+        if np is None:
+            if self._frozen:
+                self._frozen = False
+                self._ids, self._rows = list(self._ids), list(self._rows)
+                self._prefix_rows = list(self._prefix_rows)
+            vec = _normalize_list(vector)
+            row = self._row_of.get(key)
+            if row is not None:
+                self._rows[row] = vec
+                self._prefix_rows[row] = self._prefix_list(vec)
+                return
+            self._row_of[key] = len(self._ids)
+            self._ids.append(key)
+            self._rows.append(vec)
+            self._prefix_rows.append(self._prefix_list(vec))
+            return
+
+        vec = np.asarray(vector, dtype=np.float32).reshape(self.dim)
+        n = float(np.linalg.norm(vec))
+        if n > 0:
+            vec = vec / n
+        self._ensure_writable()
+        size = len(self._ids)
+        row = self._row_of.get(key)
+        if row is None:
+            row = size
+            if size >= self._matrix.shape[0]:
+                self._grow(max(self._MIN_CAPACITY, int(size * self._GROWTH) + 1))
+        self._matrix[row] = vec
+        if self.two_stage:
+            q, scale = self._quantize_block(vec[None, :])
+            self._qmatrix[row] = q[0]
+            if scale is not None:
+                self._qscale[row] = scale[0]
+        if self._centroids is not None:
+            self._assign[row] = int(np.argmax(self._centroids @ vec))
+        if row == size:
+            self._row_of[key] = row
+            self._ids.append(key)
+
+    def update(self, key, vector):
+        """Replace the vector of an indexed *key* in place. Returns False if absent."""
+        if key not in self._row_of:
+            return False
+        self.add(key, vector)
+        return True
+
+    def remove(self, key):
+        """Tombstone *key*'s row. Returns False if absent.
+
+        The row's data is left untouched (a memory-mapped snapshot is not
+        copied); compact() reclaims the space once enough rows are dead.
+        """
+        row = self._row_of.pop(key, None)
+        if row is None:
+            return False
+        self._version += 1
+        if self._frozen:
+            self._ids = list(self._ids)  # a snapshot still reads the old list
+        self._ids[row] = None
+        self._dead.add(row)
+        if len(self._dead) >= max(self._COMPACT_MIN, self._COMPACT_RATIO * len(self._ids)):
+            self.compact()
+        return True
+
+    def compact(self):
+        """Drop tombstoned rows, keeping row order. Returns the number dropped."""
+        dropped = len(self._dead)
+        if not dropped:
+            return 0
+        live = [row for row in range(len(self._ids)) if row not in self._dead]
+        if np is None:
+            self._rows = [self._rows[row] for row in live]
+            self._prefix_rows = [self._prefix_rows[row] for row in live]
+        else:
+            rows = np.asarray(live, dtype=np.int64)
+            self._matrix = np.asarray(self._matrix[rows], dtype=np.float32)
+            if self._qmatrix is not None:
+                self._qmatrix = np.asarray(self._qmatrix[rows])
+            if self._qscale is not None:
+                self._qscale = np.asarray(self._qscale[rows])
+            if self._assign is not None:
+                self._assign = np.asarray(self._assign[rows])
+        self._set_ids([self._ids[row] for row in live])
+        return dropped
+
+    def _grow(self, capacity):
+        size = len(self._ids)
+        grown = np.empty((capacity, self.dim), dtype=np.float32)
+        grown[:size] = self._matrix[:size]
+        self._matrix = grown
+        if self._qmatrix is not None:
+            grown_q = np.empty((capacity, self.coarse_dim), dtype=self._qmatrix.dtype)
+            grown_q[:size] = self._qmatrix[:size]
+            self._qmatrix = grown_q
+        if self._qscale is not None:
+            grown_s = np.empty(capacity, dtype=np.float32)
+            grown_s[:size] = self._qscale[:size]
+            self._qscale = grown_s
+        if self._assign is not None:
+            grown_a = np.empty(capacity, dtype=np.int32)
+            grown_a[:size] = self._assign[:size]
+            self._assign = grown_a
+
+    def _ensure_writable(self):
+        """Copy memory-mapped or snapshot()-frozen arrays into RAM before the first mutation."""
+        size = len(self._ids)
+        if self._frozen:
+            self._frozen = False
+            self._ids = list(self._ids)
+            self._matrix = np.array(self._matrix[:size])
+            for name in ('_qmatrix', '_qscale', '_assign'):
+                arr = getattr(self, name)
+                if arr is not None:
+                    setattr(self, name, np.array(arr[:size]))
+            return
+        if not self._matrix.flags.writeable:
+            self._matrix = np.array(self._matrix[:size])
+        if self._qmatrix is not None and not self._qmatrix.flags.writeable:
+            self._qmatrix = np.array(self._qmatrix[:size])
+        if self._qscale is not None and not self._qscale.flags.writeable:
+            self._qscale = np.array(self._qscale[:size])
+        if self._assign is not None and not self._assign.flags.writeable:
+            self._assign = np.array(self._assign[:size])
+
+    # ── Coarse copy (quantization / Matryoshka prefix) ──
+
+    def _prefix_list(self, vec):
+        """Renormalized prefix of a normalized float list (pure-Python backend)."""
+        if not self.prefix_dim:
+            return None
+        return _normalize_list(vec[:self.prefix_dim])
+
+    def _quantize_block(self, block):
+        """Coarse rows for normalized float32 rows. Returns (values, scales or None)."""
+        if self.prefix_dim:
+            block = block[:, :self.prefix_dim]
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            block = block / norms
+        if self.quantization is None:
+            return block.astype(np.float32), None
+        if self.quantization == 'float16':
+            return block.astype(np.float16), None
+        scale = np.abs(block).max(axis=1) / 127.0
+        scale[scale == 0] = 1.0
+        q = np.rint(block / scale[:, None]).astype(np.int8)
+        return q, scale.astype(np.float32)
+
+    def _quantize_all(self):
+        """(Re)build the coarse copy from the float32 rows, block by block."""
+        if not self.two_stage:
+            self._qmatrix = None
+            self._qscale = None
+            return
+        size = len(self._ids)
+        self._qmatrix = np.empty((size, self.coarse_dim), dtype=self._coarse_dtype())
+        self._qscale = np.empty(size, dtype=np.float32) if self.quantization == 'int8' else None
+        for start in range(0, size, self._CHUNK):
+            stop = min(size, start + self._CHUNK)
+            q, scale = self._quantize_block(np.asarray(self._matrix[start:stop], dtype=np.float32))
+            self._qmatrix[start:stop] = q
+            if scale is not None:
+                self._qscale[start:stop] = scale
+
+    def _coarse_dtype(self):
+        return {None: np.float32, 'float16': np.float16, 'int8': np.int8}[self.quantization]
+
+    def _coarse_scores(self, queries, rows=None):
+        """Approximate scores from the coarse matrix, for every row or only
+        *rows*, against an (m, dim) query block. Returns (n, m)."""
+        n = len(self._ids) if rows is None else len(rows)
+        qt = np.ascontiguousarray(queries[:, :self.coarse_dim].T)
+        out = np.empty((n, queries.shape[0]), dtype=np.float32)
+        for start in range(0, n, self._CHUNK):
+            stop = min(n, start + self._CHUNK)
+            sel = slice(start, stop) if rows is None else rows[start:stop]
+            out[start:stop] = self._qmatrix[sel].astype(np.float32, copy=False) @ qt
+            if self._qscale is not None:
+                out[start:stop] *= self._qscale[sel][:, None]
+        return out
+
+    # ── IVF (inverted file) layer ──
+
+    def _reset_ivf(self):
+        self._centroids = None  # (lists, dim) unit centroids
+        self._assign = None     # list id per row
+        self._ivf_trained_size = 0
+
+    def ivf_needs_training(self):
+        """True when IVF is enabled and untrained, or the index has doubled since training."""
+        if not self.ivf or len(self._ids) < self.ivf_min_rows:
+            return False
+        return self._centroids is None or len(self._ids) > 2 * self._ivf_trained_size
+
+    def _auto_lists(self, size):
+        lists = self.ivf_lists or int(math.sqrt(size))
+        return max(1, min(lists, size // 8 or 1))
+
+    def fit_ivf(self, seed=0):
+        """Run spherical k-means on a row sample. Read-only, so it can run
+        outside the caller's lock; pass the result to install_ivf().
+
+        Returns ``(centroids, assignments, size, layout_version)`` where
+        *assignments* covers the first *size* rows, or None when the index
+        is too small.
+        """
+        size = len(self._ids)
+        if np is None or size == 0:
+            return None
+        layout_version = self._layout_version
+        matrix = self._matrix  # add() may swap the reference; keep ours
+        lists = self._auto_lists(size)
+        rng = np.random.default_rng(seed)
+        n_sample = min(size, lists * self._KMEANS_SAMPLE_PER_LIST)
+        sample = np.sort(rng.choice(size, n_sample, replace=False))
+        data = np.asarray(matrix[sample], dtype=np.float32)
+        centroids = data[rng.choice(n_sample, lists, replace=False)].copy()
+        for _ in range(self._KMEANS_ITERS):
+            labels = _nearest_centroids(data, centroids, self._CHUNK)
+            order = np.argsort(labels, kind='stable')
+            bounds = np.searchsorted(labels[order], np.arange(lists + 1))
+            for c in range(lists):
+                lo, hi = bounds[c], bounds[c + 1]
+                if hi > lo:
+                    centroids[c] = data[order[lo:hi]].sum(axis=0)
+                else:  # empty list: reseed from a random sample row
+                    centroids[c] = data[rng.integers(n_sample)]
+            norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids /= norms
+        assign = _nearest_centroids(matrix[:size], centroids, self._CHUNK)
+        return centroids, assign, size, layout_version
+
+    def install_ivf(self, fitted):
+        """Adopt a fit_ivf() result; rows added since the fit are assigned here.
+
+        Returns False, installing nothing, when rows were changed in place or
+        renumbered (compact, build) since the fit: its assignments no longer
+        match the rows. ivf_needs_training() stays True, so the caller refits.
+        """
+        if fitted is None:
+            self._reset_ivf()
+            return True
+        centroids, assign, fitted_size, layout_version = fitted
+        if layout_version != self._layout_version:
+            return False
+        size = len(self._ids)
+        full = np.empty(max(size, self._matrix.shape[0]), dtype=np.int32)
+        full[:fitted_size] = assign[:fitted_size]
+        if size > fitted_size:
+            full[fitted_size:size] = _nearest_centroids(
+                self._matrix[fitted_size:size], centroids, self._CHUNK)
+        self._centroids = centroids
+        self._assign = full
+        self._ivf_trained_size = size
+        return True
+
+    def train_ivf(self, seed=0):
+        """Fit and install the IVF layer in one step."""
+        self.install_ivf(self.fit_ivf(seed))
+
+    def _probe_rows(self, queries, nprobe):
+        """Sorted row indices of the union of each query's *nprobe* closest lists."""
+        size = len(self._ids)
+        nprobe = min(nprobe, len(self._centroids))
+        sims = queries @ self._centroids.T
+        probe = np.unique(np.concatenate([_top_rows(row, nprobe) for row in sims]))
+        return np.flatnonzero(np.isin(self._assign[:size], probe))
+
+    # ── Queries ──
+
+    def get_vector(self, key):
+        """Return the normalized vector for *key* as a float list, or None."""
+        row = self._row_of.get(key)
+        if row is None:
+            return None
+        if np is not None:
+            return self._matrix[row].tolist()
+        return list(self._rows[row])
+
+    def search(self, query, top_k=10, exclude=None, min_score=None, nprobe=None):
+        """Return up to *top_k* ``(key, score)`` pairs, best first.
+
+        Scores are always exact float32 cosines over all dims; in two-stage
+        mode only the ``max(rescore_candidates, top_k)`` best rows of the
+        coarse pass are rescored and can appear in the result.
+
+        Args:
+            query: Query vector (any length-``dim`` float sequence).
+            top_k: Maximum number of results.
+            exclude: Optional iterable of keys to skip.
+            min_score: Optional cosine threshold; lower scores are dropped.
+            nprobe: IVF lists to scan (default ``ivf_probes``); ignored while
+                the IVF layer is untrained.
+        """
+        return self.search_many([query], top_k, exclude, min_score, nprobe)[0][0]
+
+    def search_many(self, queries, top_k=10, exclude=None, min_score=None, nprobe=None,
+                    fuse=False):
+        """Score several queries in one pass over the index.
+
+        With NumPy this is one matrix-matrix product (per coarse chunk in
+        two-stage mode) instead of one full scan per query. Candidates of
+        all queries are rescored together, so each query sees at least the
+        rows search() would have returned for it.
+
+        Args:
+            queries: Sequence of query vectors; zero vectors yield no results.
+            top_k, exclude, min_score, nprobe: As in search().
+            fuse: Also return the queries' results merged by best score.
+
+        Returns:
+            ``(per_query, fused)`` — one result list per query, aligned with
+            *queries*, and the fused top-*top_k* list (None unless *fuse*).
+        """
+        per_query = [[] for _ in queries]
+        if self._row_of and top_k > 0 and len(queries):
+            exclude_set = set(exclude) if exclude else set()
+            if np is None:
+                per_query = [self._search_python(q, top_k, exclude_set, min_score)
+                             for q in queries]
+            else:
+                per_query = self._search_numpy(queries, top_k, exclude_set, min_score, nprobe)
+        return per_query, (fuse_max(per_query, top_k) if fuse else None)
+
+    def _search_numpy(self, queries, top_k, exclude_set, min_score, nprobe):
+        size = len(self._ids)
+        q = np.array(queries, dtype=np.float32).reshape(len(queries), self.dim)
+        norms = np.linalg.norm(q, axis=1)
+        live = norms > 0
+        q[live] /= norms[live, None]
+        excluded = [self._row_of[key] for key in exclude_set if key in self._row_of]
+        excluded.extend(self._dead)
+
+        if not live.any():
+            return [[] for _ in queries]
+
+        # pool: None = every row, else the sorted rows of the probed IVF lists
+        pool = None
+        if self._centroids is not None:
+            pool = self._probe_rows(q[live], nprobe or self.ivf_probes)
+            if excluded:
+                pool = pool[~np.isin(pool, excluded)]
+            excluded = []
+        pool_size = size if pool is None else len(pool)
+        if pool_size == 0:
+            return [[] for _ in queries]
+
+        n_candidates = max(self.rescore_candidates, top_k)
+        if self.two_stage and pool_size > n_candidates:
+            coarse = self._coarse_scores(q, pool)
+            if excluded:
+                coarse[excluded] = -np.inf
+            picked = []
+            for j in np.flatnonzero(live):
+                top = _top_rows(coarse[:, j], n_candidates)
+                picked.append(top[coarse[top, j] != -np.inf])
+            top = np.unique(np.concatenate(picked)) if picked else np.empty(0, dtype=np.int64)
+            rows_space = top if pool is None else pool[top]
+            scores = np.asarray(self._matrix[rows_space] @ q.T, dtype=np.float32)
+        else:
+            rows_space = pool
+            matrix = self._matrix[:size] if pool is None else self._matrix[pool]
+            scores = np.asarray(matrix @ q.T, dtype=np.float32)
+            if excluded:
+                scores[excluded] = -np.inf
+
+        results = []
+        for j in range(len(queries)):
+            if not live[j] or scores.shape[0] == 0:
+                results.append([])
+                continue
+            col = scores[:, j]
+            top = _top_rows(col, min(top_k, len(col)))
+            rows = top if rows_space is None else rows_space[top]
+            hits = []
+            for row, score in zip(rows.tolist(), col[top].tolist()):
+                if score == float('-inf') or (min_score is not None and score < min_score):
+                    break
+                hits.append((self._ids[row], score))
+            results.append(hits)
+        return results
+
+    def _search_python(self, query, top_k, exclude_set, min_score):
+        q = _normalize_list(query)
+        if not any(q):
+            return []
+        rows = range(len(self._ids))
+        n_candidates = max(self.rescore_candidates, top_k)
+        if self.prefix_dim and len(self._ids) > n_candidates:
+            # Prefix pass first: ~dim/prefix_dim times fewer multiplications
+            qp = q[:self.prefix_dim]
+            coarse = [(sum(x * y for x, y in zip(qp, self._prefix_rows[row])), row)
+                      for row in rows
+                      if self._ids[row] is not None and self._ids[row] not in exclude_set]
+            rows = [row for _, row in heapq.nlargest(n_candidates, coarse)]
+        scored = []
+        for row in rows:
+            key, vec = self._ids[row], self._rows[row]
+            if key is None or key in exclude_set:
+                continue
+            score = sum(x * y for x, y in zip(q, vec))
+            if min_score is None or score >= min_score:
+                scored.append((key, score))
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored[:top_k]
+
+    # ── Snapshot ──
+
+    def snapshot(self):
+        """Freeze the current rows for write_snapshot().
+
+        Compacts, then hands out the current arrays and key list without
+        copying them; the index copies them on its next mutation instead
+        (like a memory-mapped snapshot). Call it under the caller's lock —
+        write_snapshot() can then run outside it while searches continue.
+        """
+        self.compact()
+        self._frozen = True
+        count = len(self._ids)
+        state = {'count': count, 'ids': self._ids, 'version': self._version,
+                 'ivf_trained': np is not None and self._centroids is not None}
+        if np is not None:
+            state.update({'matrix': self._matrix, 'qmatrix': self._qmatrix,
+                          'qscale': self._qscale, 'centroids': self._centroids,
+                          'assign': self._assign, 'ivf_trained_size': self._ivf_trained_size})
+        else:
+            state['rows'] = self._rows
+        return state
+
+    def save(self, path_prefix, meta=None):
+        """Persist the index as a flat snapshot next to *path_prefix*.
+
+        Writes ``<prefix>.vec`` (normalized little-endian float32 rows),
+        ``<prefix>.ids`` (int64 keys, row-aligned), the quantized copy
+        (``<prefix>.q`` coarse rows plus ``<prefix>.qs`` int8 scales) in
+        two-stage mode, the IVF layer (``<prefix>.ivf`` centroids and
+        ``<prefix>.ivfa`` int32 list ids) once trained, and ``<prefix>.json``
+        (dim, count, quantization, prefix_dim, ivf_lists and caller-supplied
+        *meta*). Each file is written to a temp name and renamed so a crash
+        never leaves a torn snapshot. Keys must be integers. Tombstoned
+        rows are compacted away first.
+        """
+        self.write_snapshot(self.snapshot(), path_prefix, meta)
+
+    def write_snapshot(self, state, path_prefix, meta=None):
+        """Write a snapshot() state to disk (see save()); needs no lock."""
+        count = state['count']
+        if np is not None:
+            vec_bytes = np.ascontiguousarray(state['matrix'][:count], dtype='<f4').tobytes()
+        else:
+            flat = array('f')
+            for row in state['rows']:
+                flat.extend(row)
+            vec_bytes = _to_le(flat).tobytes()
+        ids_bytes = _to_le(array('q', state['ids'])).tobytes()
+        header = dict(meta or {})
+        ivf_trained = state['ivf_trained']
+        header.update({'dim': self.dim, 'count': count, 'quantization': self.quantization,
+                       'prefix_dim': self.prefix_dim,
+                       'ivf_lists': len(state['centroids']) if ivf_trained else None,
+                       'ivf_trained_size': state['ivf_trained_size'] if ivf_trained else 0})
+
+        _atomic_write(path_prefix + '.vec', vec_bytes)
+        _atomic_write(path_prefix + '.ids', ids_bytes)
+        if np is not None and self.two_stage:
+            _atomic_write(path_prefix + '.q', np.ascontiguousarray(
+                state['qmatrix'][:count], dtype=self._coarse_le_dtype()).tobytes())
+            if state['qscale'] is not None:
+                _atomic_write(path_prefix + '.qs',
+                              np.ascontiguousarray(state['qscale'][:count], dtype='<f4').tobytes())
+        if ivf_trained:
+            _atomic_write(path_prefix + '.ivf',
+                          np.ascontiguousarray(state['centroids'], dtype='<f4').tobytes())
+            _atomic_write(path_prefix + '.ivfa',
+                          np.ascontiguousarray(state['assign'][:count], dtype='<i4').tobytes())
+        _atomic_write(path_prefix + '.json', json.dumps(header).encode('utf-8'))
+
+    @classmethod
+    def load(cls, path_prefix, dim, quantization=None, rescore_candidates=300, prefix_dim=None,
+             ivf=False, ivf_lists=0, ivf_probes=16, ivf_min_rows=20000):
+        """Open a snapshot written by save().
+
+        With NumPy the vectors are memory-mapped read-only, so loading is
+        O(1) and the pages are shared through the OS page cache; the first
+        add() copies them into RAM. The coarse copy is mapped too when the
+        snapshot has one in the requested format, otherwise it is rebuilt.
+        A stored IVF layer is reused when IVF is enabled; an index that
+        still lacks one reports ivf_needs_training() and is not trained here.
+        Returns ``(index, meta)`` or ``(None, None)`` when the snapshot is
+        missing or inconsistent.
+        """
+        try:
+            with open(path_prefix + '.json', 'rb') as f:
+                meta = json.loads(f.read().decode('utf-8'))
+            count = int(meta.get('count', -1))
+            if int(meta.get('dim', 0)) != dim or count < 0:
+                return None, None
+            if os.path.getsize(path_prefix + '.vec') != count * dim * 4:
+                return None, None
+            ids = array('q')
+            with open(path_prefix + '.ids', 'rb') as f:
+                ids.frombytes(f.read())
+            ids = _to_le(ids)
+            if len(ids) != count:
+                return None, None
+        except (OSError, ValueError) as e:
+            logger.debug("VectorIndex: snapshot %s not usable: %s", path_prefix, e)
+            return None, None
+
+        index = cls(dim, quantization=quantization, rescore_candidates=rescore_candidates,
+                    prefix_dim=prefix_dim, ivf=ivf, ivf_lists=ivf_lists,
+                    ivf_probes=ivf_probes, ivf_min_rows=ivf_min_rows)
+        index._set_ids(ids.tolist())
+        if count == 0:
+            index.clear()
+            return index, meta
+        if np is None:
+            flat = array('f')
+            with open(path_prefix + '.vec', 'rb') as f:
+                flat.frombytes(f.read())
+            flat = _to_le(flat).tolist()
+            index._rows = [flat[i * dim:(i + 1) * dim] for i in range(count)]
+            index._prefix_rows = [index._prefix_list(v) for v in index._rows]
+            return index, meta
+
+        index._matrix = np.memmap(path_prefix + '.vec', dtype='<f4', mode='r',
+                                  shape=(count, dim))
+        if index.two_stage and not index._map_quantized(path_prefix, meta, count):
+            index._quantize_all()
+        if index.ivf:
+            index._map_ivf(path_prefix, meta, count)
+        return index, meta
+
+    def _map_quantized(self, path_prefix, meta, count):
+        """Memory-map the snapshot's coarse copy if it matches our format."""
+        if (meta.get('quantization') != self.quantization
+                or meta.get('prefix_dim') != self.prefix_dim):
+            return False
+        q_dtype = self._coarse_le_dtype()
+        try:
+            expected = count * self.coarse_dim * np.dtype(q_dtype).itemsize
+            if os.path.getsize(path_prefix + '.q') != expected:
+                return False
+            if self.quantization == 'int8' and os.path.getsize(path_prefix + '.qs') != count * 4:
+                return False
+        except OSError:
+            return False
+        self._qmatrix = np.memmap(path_prefix + '.q', dtype=q_dtype, mode='r',
+                                  shape=(count, self.coarse_dim))
+        self._qscale = None
+        if self.quantization == 'int8':
+            self._qscale = np.memmap(path_prefix + '.qs', dtype='<f4', mode='r', shape=(count,))
+        return True
+
+    def _map_ivf(self, path_prefix, meta, count):
+        """Load the snapshot's centroids and memory-map its list ids."""
+        lists = meta.get('ivf_lists')
+        if not lists or (self.ivf_lists and lists != self.ivf_lists):
+            return False
+        try:
+            if (os.path.getsize(path_prefix + '.ivf') != lists * self.dim * 4
+                    or os.path.getsize(path_prefix + '.ivfa') != count * 4):
+                return False
+            centroids = np.fromfile(path_prefix + '.ivf', dtype='<f4')
+        except OSError:
+            return False
+        self._centroids = centroids.astype(np.float32).reshape(lists, self.dim)
+        self._assign = np.memmap(path_prefix + '.ivfa', dtype='<i4', mode='r', shape=(count,))
+        self._ivf_trained_size = int(meta.get('ivf_trained_size') or count)
+        return True
+
+    def _coarse_le_dtype(self):
+        return {None: '<f4', 'float16': '<f2', 'int8': 'i1'}[self.quantization]
+
+    # ── Introspection ──
+
+    def is_mapped(self):
+        """True while the vectors are served straight from a memory-mapped snapshot."""
+        return np is not None and not self._matrix.flags.writeable
+
+    def memory_bytes(self):
+        """Approximate private RAM held by the vector payload (mapped pages excluded)."""
+        if np is not None:
+            arrays = (self._matrix, self._qmatrix, self._qscale, self._centroids, self._assign)
+            return int(sum(a.nbytes for a in arrays if a is not None and a.flags.writeable))
+        # list object + one boxed float (24 B) and pointer (8 B) per element
+        per_row = 56 + self.dim * 32
+        if self.prefix_dim:
+            per_row += 56 + self.prefix_dim * 32
+        return per_row * len(self._rows)
+
+
+def fuse_max(result_lists, top_k):
+    """Merge ``(key, score)`` lists keeping each key's best score, best first."""
+    best = {}
+    for results in result_lists:
+        for key, score in results:
+            if score > best.get(key, float('-inf')):
+                best[key] = score
+    return sorted(best.items(), key=lambda x: x[1], reverse=True)[:top_k]
+
+
+def _nearest_centroids(rows, centroids, chunk):
+    """Index of the most similar centroid for every row, computed in blocks."""
+    labels = np.empty(len(rows), dtype=np.int32)
+    for start in range(0, len(rows), chunk):
+        block = np.asarray(rows[start:start + chunk], dtype=np.float32)
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def _to_le(arr):
+    """Return *arr* in little-endian byte order (snapshot files are LE)."""
+    if sys.byteorder != 'little':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    return arr
+
+
+def _atomic_write(path, data):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
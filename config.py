@@ -72,6 +72,22 @@ DEFAULT_CONFIG = {
     "router_model": "gemini-2.5-flash",  # Router model selection
     "max_chain_depth": 2,            # Max agents in a handoff chain
     "system_quality": "standard",    # Response quality tier: 'standard', 'high'
+    # Card embedding index (ai/vector_index.py)
+    "embedding_index": {
+        "quantization": "none",       # 'none', 'float16', 'int8' — quantized first-pass scan
+        "quantize_storage": False,    # Also store card_embeddings blobs quantized (smaller DB)
+        "rescore_candidates": 300,    # Candidates rescored exactly in float32
+        "prefix_dim": 0,              # Matryoshka prefilter on the first N dims (e.g. 256/512), 0 = off
+        "ann": "none",                # 'none' (exact scan) or 'ivf' (k-means inverted lists)
+        "ivf_lists": 0,               # IVF lists, 0 = ~sqrt(cards)
+        "ivf_probes": 16,             # Lists scanned per query — higher = better recall, slower
+        "ivf_min_rows": 20000,        # Below this many cards the exact scan is used
+    },
+    # KG term extraction (ai/kg_extraction.py)
+    "kg_extraction": {
+        "local_first": True,          # Keep confident local TermExtractor results, LLM for the rest
+        "local_confidence_threshold": 0.6,  # Lower = fewer LLM calls, noisier terms
+    },
 }
 
 # Standard Backend URL (v2 — Cloud Run, supports HTTP streaming)
@@ -144,6 +160,10 @@ def load_config():
                         for k, v in default_autonomy.items():
                             if k not in config[key]:
                                 config[key][k] = v
+                    elif key == "embedding_index" and isinstance(value, dict):
+                        for k, v in DEFAULT_CONFIG["embedding_index"].items():
+                            if k not in config[key]:
+                                config[key][k] = v
                     elif key == "research_sources" and isinstance(value, dict):
                         default_sources = DEFAULT_CONFIG["research_sources"]
                         for source_key, source_value in default_sources.items():
@@ -1045,6 +1045,8 @@ function AppInner() {
           const data = payload.data || payload;
           if (data && data.messages && data.messages.length > 0) {
             _chat.setMessages(normalizeMessages(data.messages));
+            // Steps/Citations/AgentCells kommen getrennt (cardMessageDetails)
+            _cardSession.requestMessageDetails(enrichedPayload.data.cardId, data.messages);
           } else if (data && (!data.messages || data.messages.length === 0)) {
             _chat.setMessages([]);
           }
@@ -1059,6 +1061,31 @@ function AppInner() {
           }
         }
 
+        // Ältere Seite einer Card-Session (beim Hochscrollen angefordert)
+        if (payload.type === 'cardMessagesPage') {
+          const older = _cardSession.handleAnkiReceive(payload) || [];
+          if (Number(payload.cardId) === Number(_cardSession.currentCardId) && older.length > 0) {
+            _chat.setMessages(prev => {
+              const knownIds = new Set(prev.map(m => m.id));
+              return [...normalizeMessages(older.filter(m => !knownIds.has(m.id))), ...prev];
+            });
+            setVisibleMessageCount(prev => prev + older.length);
+          }
+        }
+
+        // Nachgeladene JSON-Spalten in die angezeigten Nachrichten mergen
+        if (payload.type === 'cardMessageDetails') {
+          _cardSession.handleAnkiReceive(payload);
+          const details = payload.data || {};
+          if (Number(payload.cardId) === Number(_cardSession.currentCardId)) {
+            _chat.setMessages(prev => prev.map(m => (
+              details[m.id]
+                ? normalizeMessages([{ ...m, ...details[m.id], detailsLoaded: true }])[0]
+                : m
+            )));
+          }
+        }
+
         // Review Result Events
         if (payload.type === 'reviewResult' && payload.data) {
           const { cardId, ease, rating, timeSeconds, score } = payload.data;
@@ -1428,6 +1455,7 @@ function AppInner() {
       const data = payload.data || payload;
       if (data && data.messages && data.messages.length > 0) {
         _chat.setMessages(normalizeMessages(data.messages));
+        _cardSession.requestMessageDetails(payload.cardId || data.cardId, data.messages);
       } else if (data && (!data.messages || data.messages.length === 0)) {
         _chat.setMessages([]);
       }
@@ -2148,10 +2176,14 @@ function AppInner() {
     return chatHook.messages.slice(-visibleMessageCount);
   }, [chatHook.messages, visibleMessageCount]);
 
+  // Older pages of the card session still in SQLite (fetched page by page)
+  const hasOlderMessages = cardSessionHook.hasOlderMessages;
+
   // Performance: Intersection Observer for loading more messages when scrolling up
   useEffect(() => {
     if (!messagesContainerRef.current || !loadMoreTriggerRef.current) return;
-    if (chatHook.messages.length <= visibleMessageCount) return; // All messages already visible
+    const hasHidden = chatHook.messages.length > visibleMessageCount;
+    if (!hasHidden && !hasOlderMessages) return; // All messages loaded and visible
 
     let debounceTimer = null;
     const observer = new IntersectionObserver(
@@ -2160,7 +2192,12 @@ function AppInner() {
           if (entry.isIntersecting) {
             if (debounceTimer) clearTimeout(debounceTimer);
             debounceTimer = setTimeout(() => {
-              setVisibleMessageCount((prev) => Math.min(prev + 20, chatHook.messages.length));
+              if (hasHidden) {
+                setVisibleMessageCount((prev) => Math.min(prev + 20, chatHook.messages.length));
+              } else {
+                const _cardSession = cardSessionHookRef.current;
+                _cardSession.loadOlderMessages(_cardSession.currentCardId);
+              }
             }, 150);
           }
         });
@@ -2174,7 +2211,7 @@ function AppInner() {
       if (debounceTimer) clearTimeout(debounceTimer);
       observer.disconnect();
     };
-  }, [visibleMessageCount, chatHook.messages.length]);
+  }, [visibleMessageCount, chatHook.messages.length, hasOlderMessages]);
 
   // Reset visible count when messages change significantly (e.g., new session loaded)
   useEffect(() => {
@@ -2597,7 +2634,7 @@ function AppInner() {
                 return (
                   <>
                     {/* Load More Trigger - invisible element at top to detect scroll */}
-                    {chatHook.messages.length > visibleMessageCount && (
+                    {(chatHook.messages.length > visibleMessageCount || hasOlderMessages) && (
                       <div ref={loadMoreTriggerRef} className="h-1 w-full" aria-hidden="true" />
                     )}
                     
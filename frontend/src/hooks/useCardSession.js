@@ -1,5 +1,27 @@
 import { useState, useCallback, useRef, useEffect } from 'react';
 
+function parseJsonField(raw) {
+  if (!raw) return null;
+  // Might be double-encoded string from SQLite
+  if (typeof raw === 'string') {
+    try { return JSON.parse(raw); } catch { return null; }
+  }
+  return raw;
+}
+
+function normalizeSessionMessage(m) {
+  return {
+    ...m,
+    // Normalize field names
+    sectionId: m.section_id || m.sectionId,
+    from: m.sender || m.from || 'user',
+    createdAt: m.created_at || m.createdAt,
+    timestamp: m.created_at || m.createdAt || m.timestamp,
+    agentCells: parseJsonField(m.agent_cells || m.agentCells),
+    orchestration: parseJsonField(m.orchestration),
+  };
+}
+
 /**
  * Hook für per-Card Session Management
  * Ersetzt das deck-basierte Session-System.
@@ -7,13 +29,19 @@ import { useState, useCallback, useRef, useEffect } from 'react';
  * Jede Karte hat ihre eigene persistente Session mit Review-Historie.
  * Sessions werden in SQLite gespeichert (via Python Bridge).
  *
+ * Python liefert nur die neueste Seite an Nachrichten (ohne schwere JSON-Spalten);
+ * ältere Seiten kommen per loadOlderMessages() beim Hochscrollen, Steps/Citations/
+ * AgentCells per requestMessageDetails() nach.
+ *
  * State:
  * - currentCardId: Aktuell angezeigte Karte
- * - currentSession: { session, sections[], messages[] } oder null
+ * - currentSession: { session, sections[], messages[], hasMore, before } oder null
  * - sessionCache: Map<cardId, SessionData> für In-Memory Caching
  *
  * Methoden:
  * - loadCardSession(cardId): Cache-Check → Bridge-Call
+ * - loadOlderMessages(cardId): Nächstältere Seite via Bridge
+ * - requestMessageDetails(cardId, messages): JSON-Spalten nachladen
  * - saveMessage(cardId, msg): Einzelne Nachricht sofort speichern
  * - saveSection(cardId, section): Section erstellen/updaten
  * - clearCurrentSession(): Session-State zurücksetzen
@@ -27,6 +55,9 @@ export function useCardSession(bridge) {
   const sessionCacheRef = useRef(new Map());
   const bridgeRef = useRef(bridge);
   const saveTimeoutRef = useRef(null);
+  // Offene Bridge-Requests (Seiten pro Karte, Details pro Nachricht)
+  const pageRequestsRef = useRef(new Set());
+  const detailRequestsRef = useRef(new Set());
 
   useEffect(() => {
     bridgeRef.current = bridge;
@@ -85,31 +116,9 @@ export function useCardSession(bridge) {
         performanceType: s.performance_type || s.performanceType,
         performanceData: s.performance_data || s.performanceData,
       })),
-      messages: (data.messages || []).map(m => ({
-        ...m,
-        // Normalize field names
-        sectionId: m.section_id || m.sectionId,
-        from: m.sender || m.from || 'user',
-        createdAt: m.created_at || m.createdAt,
-        timestamp: m.created_at || m.createdAt || m.timestamp,
-        agentCells: (() => {
-          const raw = m.agent_cells || m.agentCells;
-          if (!raw) return null;
-          // Might be double-encoded string from SQLite
-          if (typeof raw === 'string') {
-            try { return JSON.parse(raw); } catch { return null; }
-          }
-          return raw;
-        })(),
-        orchestration: (() => {
-          const raw = m.orchestration;
-          if (!raw) return null;
-          if (typeof raw === 'string') {
-            try { return JSON.parse(raw); } catch { return null; }
-          }
-          return raw;
-        })(),
-      })),
+      messages: (data.messages || []).map(normalizeSessionMessage),
+      hasMore: Boolean(data.has_more ?? data.hasMore),
+      before: data.before || null,
     };
 
     // Cache aktualisieren
@@ -128,6 +137,91 @@ export function useCardSession(bridge) {
     }));
   }, [currentCardId]);
 
+  /**
+   * Nächstältere Seite einer Karte anfordern (Antwort: cardMessagesPage)
+   */
+  const loadOlderMessages = useCallback((cardId) => {
+    if (!cardId) return;
+    const numericCardId = Number(cardId);
+    const cached = sessionCacheRef.current.get(numericCardId);
+    if (!cached || !cached.hasMore || !cached.before) return;
+    if (pageRequestsRef.current.has(numericCardId)) return;
+
+    pageRequestsRef.current.add(numericCardId);
+    if (window.ankiBridge) {
+      window.ankiBridge.addMessage('loadCardMessages', JSON.stringify({
+        cardId: numericCardId,
+        before: cached.before,
+      }));
+    }
+  }, []);
+
+  /**
+   * JSON-Spalten (steps, citations, agentCells, ...) für Nachrichten nachladen,
+   * die welche haben (Antwort: cardMessageDetails)
+   */
+  const requestMessageDetails = useCallback((cardId, messages) => {
+    const ids = (messages || [])
+      .filter(m => m.has_details && !m.detailsLoaded && !detailRequestsRef.current.has(m.id))
+      .map(m => m.id);
+    if (ids.length === 0) return;
+
+    ids.forEach(id => detailRequestsRef.current.add(id));
+    if (window.ankiBridge) {
+      window.ankiBridge.addMessage('loadMessageDetails', JSON.stringify({
+        cardId: Number(cardId),
+        messageIds: ids,
+      }));
+    }
+  }, []);
+
+  /**
+   * Handler für cardMessagesPage (ältere Seite) von Python
+   */
+  const handleMessagesPage = useCallback((cardId, page) => {
+    const numericCardId = Number(cardId);
+    pageRequestsRef.current.delete(numericCardId);
+
+    const older = (page?.messages || []).map(normalizeSessionMessage);
+    const cached = sessionCacheRef.current.get(numericCardId);
+    if (cached) {
+      const knownIds = new Set((cached.messages || []).map(m => m.id));
+      const updated = {
+        ...cached,
+        messages: [...older.filter(m => !knownIds.has(m.id)), ...(cached.messages || [])],
+        hasMore: Boolean(page?.has_more),
+        before: page?.before || null,
+      };
+      sessionCacheRef.current.set(numericCardId, updated);
+      if (numericCardId === currentCardId) {
+        setCurrentSession(updated);
+      }
+    }
+    requestMessageDetails(numericCardId, older);
+    return older;
+  }, [currentCardId, requestMessageDetails]);
+
+  /**
+   * Handler für cardMessageDetails von Python — merged die Details in den Cache
+   */
+  const handleMessageDetails = useCallback((cardId, details) => {
+    const numericCardId = Number(cardId);
+    Object.keys(details || {}).forEach(id => detailRequestsRef.current.delete(id));
+
+    const cached = sessionCacheRef.current.get(numericCardId);
+    if (!cached || !details) return;
+    const updated = {
+      ...cached,
+      messages: (cached.messages || []).map(m => (
+        details[m.id] ? normalizeSessionMessage({ ...m, ...details[m.id], detailsLoaded: true }) : m
+      )),
+    };
+    sessionCacheRef.current.set(numericCardId, updated);
+    if (numericCardId === currentCardId) {
+      setCurrentSession(updated);
+    }
+  }, [currentCardId]);
+
   /**
    * Einzelne Nachricht speichern (Echtzeit-Persistence)
    */
@@ -310,8 +404,12 @@ export function useCardSession(bridge) {
   const handleAnkiReceive = useCallback((payload) => {
     if (payload.type === 'cardSessionLoaded') {
       handleCardSessionLoaded(payload.data || payload);
+    } else if (payload.type === 'cardMessagesPage') {
+      return handleMessagesPage(payload.cardId, payload.data);
+    } else if (payload.type === 'cardMessageDetails') {
+      handleMessageDetails(payload.cardId, payload.data);
     }
-  }, [handleCardSessionLoaded]);
+  }, [handleCardSessionLoaded, handleMessagesPage, handleMessageDetails]);
 
   // Cleanup
   useEffect(() => {
@@ -328,6 +426,8 @@ export function useCardSession(bridge) {
     isLoading,
 
     loadCardSession,
+    loadOlderMessages,
+    requestMessageDetails,
     saveMessage,
     saveSection,
     saveFullSession,
@@ -341,5 +441,6 @@ export function useCardSession(bridge) {
     messages: currentSession?.messages || [],
     sections: currentSession?.sections || [],
     hasSession: currentSession?.session != null,
+    hasOlderMessages: Boolean(currentSession?.hasMore),
   };
 }
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Benchmark the IVF approximate index against the exact scan.
+
+Builds clustered synthetic collections and reports k-means training time,
+per-query latency and recall@30 (overlap with the exact top-30) for a range
+of ivf_probes values — the knob exposed as embedding_index.ivf_probes.
+
+Usage:
+  python3 scripts/benchmark_ann.py                          # 50k, 100k cards
+  python3 scripts/benchmark_ann.py --sizes 200000 --probes 8 16 32
+  python3 scripts/benchmark_ann.py --lists 512 --prefix 256  # combine with the prefix pass
+"""
+import sys
+import os
+import time
+import argparse
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from ai import vector_index as vi  # noqa: E402
+
+DIM = 3072
+TOP_K = 30
+QUERIES = 50
+
+
+def make_data(n, seed):
+    """Topic clusters of very different sizes, like decks in a real collection."""
+    np = vi.np
+    rng = np.random.default_rng(seed)
+    n_topics = max(1, n // 100)
+    centers = rng.standard_normal((n_topics, DIM), dtype=np.float32)
+    weights = rng.pareto(1.5, n_topics) + 1
+    assign = rng.choice(n_topics, n, p=weights / weights.sum())
+    data = centers[assign]
+    data += 0.7 * rng.standard_normal((n, DIM), dtype=np.float32)
+    picks = rng.integers(0, n, QUERIES)
+    queries = data[picks] + 0.5 * rng.standard_normal((QUERIES, DIM), dtype=np.float32)
+    return data, queries
+
+
+def time_queries(index, queries, nprobe=None):
+    t0 = time.perf_counter()
+    results = [index.search(q, top_k=TOP_K, nprobe=nprobe) for q in queries]
+    return (time.perf_counter() - t0) / len(queries) * 1000, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50000, 100000])
+    parser.add_argument('--probes', type=int, nargs='+', default=[4, 8, 16, 32])
+    parser.add_argument('--lists', type=int, default=0, help='IVF lists (0 = ~sqrt(n))')
+    parser.add_argument('--prefix', type=int, default=0, help='Matryoshka prefix dims (0 = off)')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if not vi.has_numpy():
+        print("NumPy is required for the IVF index.")
+        return 1
+
+    print("%-8s %-12s | %9s %9s %10s" % ('cards', 'index', 'ms/query', 'recall', 'train s'))
+    print('-' * 56)
+    for n in args.sizes:
+        data, queries = make_data(n, args.seed)
+        exact = vi.VectorIndex(DIM, prefix_dim=args.prefix or None)
+        exact.build(range(n), data)
+        base_ms, base = time_queries(exact, queries)
+        print("%-8d %-12s | %9.2f %9s %10s" % (n, 'exact', base_ms, '1.0000', '-'))
+
+        ann = vi.VectorIndex(DIM, prefix_dim=args.prefix or None, ivf=True,
+                             ivf_lists=args.lists, ivf_min_rows=1)
+        t0 = time.perf_counter()
+        ann.build(range(n), data)
+        train_s = time.perf_counter() - t0
+        lists = len(ann._centroids)
+        for nprobe in args.probes:
+            ms, got = time_queries(ann, queries, nprobe)
+            overlap = sum(len({c for c, _ in g} & {c for c, _ in b}) for g, b in zip(got, base))
+            print("%-8d %-12s | %9.2f %9.4f %10.1f" % (
+                n, 'ivf %d/%d' % (nprobe, lists), ms, overlap / (TOP_K * len(queries)), train_s))
+        del exact, ann, data
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Benchmark deck cross-links: kg_card_terms self-join vs. the kg_deck_terms rollup.
+
+Builds a temporary KG with a synthetic collection (default 50 decks /
+50k cards, ~8 terms per card from a Zipf-like vocabulary where each deck
+has its own topic terms plus a shared core) and times:
+
+- the old compute_deck_links() query (kg_card_terms self-join on term
+  with GROUP_CONCAT; aborted after --old-timeout seconds),
+- compute_deck_links(full=True) over the per-deck rollup,
+- an incremental compute_deck_links() after re-extracting cards of a few
+  decks (only those decks are recompared),
+- the write overhead of the rollup triggers on the initial bulk insert.
+
+Usage:
+  python3 scripts/benchmark_deck_links.py
+  python3 scripts/benchmark_deck_links.py --decks 100 --cards 100000 --touched-decks 5
+"""
+import sys
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import storage.kg_store as kg  # noqa: E402
+
+OLD_QUERY = """
+    SELECT a.deck_id AS deck_a, b.deck_id AS deck_b,
+           COUNT(DISTINCT a.term) AS shared_terms,
+           GROUP_CONCAT(DISTINCT a.term) AS terms
+    FROM kg_card_terms a
+    JOIN kg_card_terms b ON a.term = b.term AND a.deck_id < b.deck_id
+    WHERE a.deck_id IS NOT NULL AND b.deck_id IS NOT NULL
+    GROUP BY a.deck_id, b.deck_id
+    HAVING shared_terms >= ?
+    ORDER BY shared_terms DESC
+    LIMIT ?
+"""
+
+
+def make_cards(n_decks, n_cards, rng, per_card=8):
+    """(card_id, terms, deck_id) with a shared core and per-deck topic terms."""
+    core = ['Kern%d' % i for i in range(2000)]
+    topics = {d: ['Deck%dTerm%d' % (d, i) for i in range(800)] for d in range(n_decks)}
+    weights = [1.0 / (i + 1) for i in range(2000)]
+    cards = []
+    for card_id in range(n_cards):
+        deck = card_id % n_decks
+        terms = set(rng.choices(core, weights=weights, k=per_card // 2))
+        terms.update(rng.sample(topics[deck], per_card - len(terms)))
+        cards.append((card_id, sorted(terms), deck))
+    return cards
+
+
+def build_db(path, cards, triggers=True):
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    kg._init_kg_schema(db)
+    if not triggers:
+        for name in ('kg_card_terms_deck_ai', 'kg_card_terms_deck_ad', 'kg_card_terms_deck_au'):
+            db.execute("DROP TRIGGER %s" % name)
+    kg._db = db
+    t0 = time.perf_counter()
+    for i in range(0, len(cards), 5000):
+        kg.save_card_terms_bulk(cards[i:i + 5000])
+    return db, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--decks', type=int, default=50)
+    parser.add_argument('--cards', type=int, default=50000)
+    parser.add_argument('--touched-decks', type=int, default=2)
+    parser.add_argument('--touched-cards', type=int, default=200)
+    parser.add_argument('--old-timeout', type=float, default=60.0,
+                        help='seconds before the old query is aborted')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    cards = make_cards(args.decks, args.cards, rng)
+    tmp = tempfile.mkdtemp()
+
+    plain, insert_plain = build_db(os.path.join(tmp, 'plain.db'), cards, triggers=False)
+    plain.close()
+    db, insert_rollup = build_db(os.path.join(tmp, 'kg.db'), cards)
+    n_rows = db.execute("SELECT COUNT(*) FROM kg_card_terms").fetchone()[0]
+    n_deck_terms = db.execute("SELECT COUNT(*) FROM kg_deck_terms").fetchone()[0]
+    print("%d decks, %d cards, %d kg_card_terms rows, %d kg_deck_terms rows"
+          % (args.decks, args.cards, n_rows, n_deck_terms))
+    print("bulk insert: %.2fs without rollup triggers, %.2fs with" % (insert_plain, insert_rollup))
+
+    # The self-join grows with the square of cards per shared term; give up after a limit
+    deadline = time.perf_counter() + args.old_timeout
+    db.set_progress_handler(lambda: time.perf_counter() > deadline, 100000)
+    t0 = time.perf_counter()
+    try:
+        old_rows = db.execute(OLD_QUERY, (3, 200)).fetchall()
+        old_label = 'old self-join (%d links)' % len(old_rows)
+    except sqlite3.OperationalError:
+        old_label = 'old self-join (aborted)'
+    old_s = time.perf_counter() - t0
+    db.set_progress_handler(None, 0)
+
+    t0 = time.perf_counter()
+    kg.compute_deck_links(full=True)
+    full_s = time.perf_counter() - t0
+
+    # Re-extract a few cards of some decks: new topic terms appear there
+    touched = rng.sample(range(args.decks), args.touched_decks)
+    updates = []
+    for i in range(args.touched_cards):
+        deck = touched[i % len(touched)]
+        card_id = deck + args.decks * rng.randrange(args.cards // args.decks)
+        updates.append((card_id, ['Neu%d' % rng.randrange(50), 'Kern%d' % rng.randrange(50)], deck))
+    kg.save_card_terms_bulk(updates)
+    dirty = db.execute("SELECT COUNT(*) FROM kg_dirty_decks").fetchone()[0]
+    t0 = time.perf_counter()
+    links = kg.compute_deck_links()
+    incr_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    kg.compute_deck_links()
+    noop_s = time.perf_counter() - t0
+
+    print()
+    print("%-34s | %9s" % ('deck links', 'seconds'))
+    print('-' * 46)
+    print("%-34s | %9.3f" % (old_label, old_s))
+    print("%-34s | %9.3f" % ('rollup, full', full_s))
+    print("%-34s | %9.3f" % ('rollup, %d dirty decks' % dirty, incr_s))
+    print("%-34s | %9.3f" % ('rollup, nothing changed', noop_s))
+    print("\n%d links stored" % links)
+    db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Benchmark case-insensitive KG term lookups: LOWER() scans vs. term_norm seeks.
+
+Builds a temporary KG with N kg_card_terms rows (default 100k) and times the
+lookups a chat turn issues — exact_term_lookup (KG filter, edge expansion,
+tier-2 lane) and the prefix fallback — with the old LOWER(term) / LIKE
+queries and the indexed term_norm queries, plus the substring search of
+SearchCardsThread (LIKE '%q%' vs. the kg_terms_fts trigram index). Also
+times the one-off migration of an existing DB without term_norm.
+
+Usage:
+  python3 scripts/benchmark_kg_terms.py
+  python3 scripts/benchmark_kg_terms.py --rows 300000 --lookups 500
+"""
+import sys
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import storage.kg_store as kg  # noqa: E402
+
+SYLLABLES = ['ar', 'te', 'ri', 'en', 'dünn', 'darm', 'glu', 'ko', 'se', 'leber', 'ös',
+             'pha', 'gus', 'zell', 'kern', 'mem', 'bran', 'straß', 'en', 'io', 'nal']
+
+OLD_EXACT = "SELECT term FROM kg_terms WHERE LOWER(term) = LOWER(?) LIMIT 1"
+OLD_PREFIX = "SELECT term FROM kg_terms WHERE LOWER(term) LIKE ? ORDER BY frequency DESC LIMIT 3"
+
+
+def make_terms(n_terms, rng):
+    terms = set()
+    while len(terms) < n_terms:
+        word = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 5)))
+        terms.add(word.capitalize())
+    return sorted(terms)
+
+
+def build_db(path, rows, rng):
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    kg._init_kg_schema(db)
+    kg._db = db
+    terms = make_terms(max(1000, rows // 5), rng)
+    per_card = 8
+    batch = []
+    for card_id in range(rows // per_card):
+        for term in rng.sample(terms, per_card):
+            batch.append((card_id, term, kg.normalize_term(term), card_id % 40))
+    db.executemany("INSERT OR IGNORE INTO kg_card_terms (card_id, term, term_norm, deck_id) "
+                   "VALUES (?, ?, ?, ?)", batch)
+    db.commit()
+    kg.update_term_frequencies()
+    return db, terms
+
+
+def time_it(fn, queries):
+    t0 = time.perf_counter()
+    for q in queries:
+        fn(q)
+    return (time.perf_counter() - t0) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tmp = tempfile.mkdtemp()
+    db, terms = build_db(os.path.join(tmp, 'kg.db'), args.rows, rng)
+    n_rows = db.execute("SELECT COUNT(*) FROM kg_card_terms").fetchone()[0]
+    n_terms = db.execute("SELECT COUNT(*) FROM kg_terms").fetchone()[0]
+    print("kg_card_terms: %d rows, kg_terms: %d terms" % (n_rows, n_terms))
+
+    # Half hits in another case, half misses — like the candidate lists of a turn
+    queries = [rng.choice(terms).upper() for _ in range(args.lookups // 2)]
+    queries += ['Unbekannt%d' % i for i in range(args.lookups - len(queries))]
+    prefixes = [rng.choice(terms)[:5].lower() for _ in range(args.lookups)]
+
+    rows = [
+        ('exact LOWER()', time_it(lambda q: db.execute(OLD_EXACT, (q,)).fetchone(), queries)),
+        ('exact term_norm', time_it(lambda q: kg.exact_term_lookup(q, db=db), queries)),
+        ('prefix LIKE', time_it(lambda p: db.execute(OLD_PREFIX, (p + '%',)).fetchall(), prefixes)),
+        ('prefix term_norm', time_it(lambda p: kg.prefix_term_lookup(p, db=db), prefixes)),
+        ('card terms LIKE', time_it(lambda p: db.execute(
+            "SELECT DISTINCT term FROM kg_card_terms WHERE term = ? OR term LIKE ?",
+            (p, p + '%')).fetchall(), prefixes)),
+        ('card terms norm', time_it(kg.search_terms_exact, prefixes)),
+        ('substring LIKE', time_it(lambda p: db.execute(
+            "SELECT DISTINCT card_id FROM kg_card_terms WHERE term LIKE ?",
+            ('%' + p[1:] + '%',)).fetchall(), prefixes)),
+        ('substring fts5', time_it(lambda p: kg.search_card_ids_by_term(p[1:]), prefixes)),
+    ]
+    print("%-18s | %10s" % ('lookup', 'ms/call'))
+    print('-' * 31)
+    for name, ms in rows:
+        print("%-18s | %10.3f" % (name, ms))
+
+    # Migration of a pre-term_norm DB
+    db.executescript("""
+        DROP TRIGGER kg_card_terms_fts_ai; DROP TRIGGER kg_card_terms_fts_ad;
+        DROP TABLE kg_terms_fts;
+        DROP INDEX idx_kg_card_terms_norm; DROP INDEX idx_kg_terms_norm;
+        ALTER TABLE kg_card_terms DROP COLUMN term_norm;
+        ALTER TABLE kg_terms DROP COLUMN term_norm;
+    """)
+    t0 = time.perf_counter()
+    kg._init_kg_schema(db)
+    print("\nmigration of %d rows (term_norm + term FTS): %.2fs" % (n_rows, time.perf_counter() - t0))
+    db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Benchmark the Matryoshka prefix prefilter against the full-dimension scan.
+
+Replays the search patterns of the three semantic-search callers and compares
+latency and recall of the fused result against the exact 3072-dim scan:
+
+  hybrid        HybridRetrieval      3 queries x top_k 30, best score per card
+  enriched      EnrichedRetrieval    2 queries x top_k 30
+  search_cards  SearchCardsThread    5 queries x top_k 200 (topK 100 * 2), union
+
+Usage:
+  python3 scripts/benchmark_matryoshka.py                    # storage/card_sessions.db
+  python3 scripts/benchmark_matryoshka.py --synthetic 50000
+  python3 scripts/benchmark_matryoshka.py --prefix 128 256 512 --rescore 300 1000
+  python3 scripts/benchmark_matryoshka.py --quantization int8
+
+Synthetic vectors get a decaying per-dimension variance to mimic the energy
+concentration of Matryoshka-trained embeddings; on plain isotropic noise a
+prefix carries no more signal than any other slice and recall is meaningless.
+"""
+import sys
+import os
+import time
+import argparse
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from ai import vector_index as vi  # noqa: E402
+from benchmark_quantization import DB_PATH, EMBEDDING_DIM, load_real  # noqa: E402
+
+MIN_SIMILARITY = 0.3  # EmbeddingManager.MIN_SIMILARITY
+PATTERNS = (
+    ('hybrid', 3, 30),
+    ('enriched', 2, 30),
+    ('search_cards', 5, 200),
+)
+
+
+def load_synthetic(n, n_queries=60, seed=42):
+    np = vi.np
+    rng = np.random.default_rng(seed)
+    decay = (1.0 / np.sqrt(1.0 + np.arange(EMBEDDING_DIM) / 64.0)).astype(np.float32)
+    centers = rng.standard_normal((max(1, n // 50), EMBEDDING_DIM), dtype=np.float32) * decay
+    assign = rng.integers(0, len(centers), n)
+    noise = rng.standard_normal((n, EMBEDDING_DIM), dtype=np.float32) * decay
+    vectors = centers[assign] + 0.6 * noise
+    picks = rng.integers(0, n, n_queries)
+    queries = [(vectors[i] + 0.4 * rng.standard_normal(EMBEDDING_DIM, dtype=np.float32) * decay, None)
+               for i in picks]
+    return list(range(n)), vectors, queries
+
+
+def run_pattern(index, groups, top_k):
+    """Run every query group like the caller does. Returns (ms per group, fused results)."""
+    fused_all = []
+    t0 = time.perf_counter()
+    for group in groups:
+        _, fused = index.search_many(group, top_k=top_k, min_score=MIN_SIMILARITY, fuse=True)
+        fused_all.append({cid for cid, _ in fused})
+    return (time.perf_counter() - t0) / max(1, len(groups)) * 1000, fused_all
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='Use N synthetic cards instead of the DB')
+    parser.add_argument('--prefix', type=int, nargs='+', default=[256, 512])
+    parser.add_argument('--rescore', type=int, nargs='+', default=[300])
+    parser.add_argument('--quantization', default='none',
+                        help="Coarse-pass quantization for the prefix rows (none/float16/int8)")
+    args = parser.parse_args()
+
+    if not vi.has_numpy():
+        print("NumPy is required for this benchmark.")
+        return 1
+    if args.synthetic or not os.path.exists(args.db):
+        print("Synthetic data: %d cards" % (args.synthetic or 10000))
+        ids, vectors, queries = load_synthetic(args.synthetic or 10000)
+    else:
+        ids, vectors, queries = load_real(args.db)
+    query_vecs = [q for q, _ in queries]
+    if not query_vecs:
+        print("No query vectors available.")
+        return 1
+    quantization = vi.parse_quantization(args.quantization)
+
+    full = vi.VectorIndex(EMBEDDING_DIM)
+    full.build(ids, vectors)
+    configs = [(p, r) for p in args.prefix for r in args.rescore]
+    indexes = {}
+    for prefix_dim, rescore in configs:
+        index = vi.VectorIndex(EMBEDDING_DIM, quantization=quantization,
+                               rescore_candidates=rescore, prefix_dim=prefix_dim)
+        index.build(ids, vectors)
+        indexes[(prefix_dim, rescore)] = index
+
+    print("%-13s %-14s | %9s %10s %9s" % ('pattern', 'index', 'ms/turn', 'speedup', 'recall'))
+    print('-' * 62)
+    for name, n_queries, top_k in PATTERNS:
+        groups = [query_vecs[i:i + n_queries] for i in range(0, len(query_vecs), n_queries)]
+        base_ms, base_results = run_pattern(full, groups, top_k)
+        print("%-13s %-14s | %9.2f %10s %9s" % (name, 'full %d' % EMBEDDING_DIM, base_ms, '1.0x', '1.0000'))
+        for (prefix_dim, rescore), index in indexes.items():
+            ms, results = run_pattern(index, groups, top_k)
+            hits = sum(len(got & want) for got, want in zip(results, base_results))
+            total = sum(len(want) for want in base_results)
+            label = '%d/r%d%s' % (prefix_dim, rescore, '/' + quantization if quantization else '')
+            print("%-13s %-14s | %9.2f %9.1fx %9.4f" % (
+                name, label, ms, base_ms / ms if ms else 0.0, hits / total if total else 1.0))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
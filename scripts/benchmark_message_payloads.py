@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""Benchmark chat message storage: inline JSON columns vs. the message_payloads side table.
+
+Builds a card_sessions database with a synthetic chat history (default
+2000 cards x 40 messages; assistant turns carry steps, citations drawn from
+a small pool so they repeat across turns, agent cells and pipeline data)
+stored the old way — JSON inline in the messages row — then copies it and
+moves the payloads out with _migrate_inline_payloads(), the migration that
+_migrate_schema runs. Both files are vacuumed and compared on:
+
+- file size and size of the messages table (dbstat, when available),
+- a plain row scan of messages (what _enforce_message_limit and the deck
+  chat queries walk through),
+- load_deck_messages(), load_card_session() and a first page plus its
+  details (load_messages_page + load_message_details),
+- _enforce_message_limit() over every card (rolled back).
+
+Usage:
+  python3 scripts/benchmark_message_payloads.py
+  python3 scripts/benchmark_message_payloads.py --cards 5000 --per-card 100
+"""
+import sys
+import os
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+import storage.card_sessions as cs  # noqa: E402
+
+FIELDS = cs.MESSAGE_DETAIL_FIELDS
+
+
+def make_messages(n_cards, per_card, n_decks, rng):
+    """Message rows (id, card_id, deck_id, text, sender, created_at, *FIELDS as JSON)."""
+    sources = [{"title": "Quelle %d — %s" % (i, "Physiologie des Herzens " * 3),
+                "url": "https://example.org/doc/%d" % i,
+                "snippet": "Der Sinusknoten erzeugt den Grundrhythmus. " * 6}
+               for i in range(60)]
+    rows = []
+    for card_id in range(n_cards):
+        deck_id = card_id % n_decks
+        for i in range(per_card):
+            created = "2024-01-%02dT%02d:%02d:00" % (1 + card_id % 28, i // 60, i % 60)
+            mid = "c%d-m%d" % (card_id, i)
+            if i % 2 == 0:
+                rows.append((mid, card_id, deck_id, "Frage %d zu Karte %d" % (i, card_id),
+                             "user", created) + (None,) * len(FIELDS))
+                continue
+            cited = rng.sample(range(len(sources)), 3)
+            citations = {str(k + 1): sources[j] for k, j in enumerate(sorted(cited))}
+            steps = [{"step": s, "status": "done", "data": {"query": "Herz %d" % rng.randrange(50)}}
+                     for s in ("router", "search", "rerank", "answer")]
+            cells = [{"agent": "tutor", "text": "Antwort %d. " % i + "Erklärung des Reizleitungssystems. " * 20,
+                      "citations": sorted(cited)}]
+            pipeline = {"steps": steps, "timings": {s["step"]: rng.randrange(20, 900) for s in steps}}
+            orchestration = {"agent": "tutor", "mode": "card", "routed_by": "router"}
+            rows.append((mid, card_id, deck_id, cells[0]["text"], "assistant", created,
+                         json.dumps(steps), json.dumps(citations), json.dumps(pipeline),
+                         json.dumps(cells, ensure_ascii=False), json.dumps(orchestration)))
+    return rows
+
+
+def build_inline(path, rows, n_cards, n_decks):
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    cs._init_db(db)
+    db.executemany(
+        "INSERT INTO card_sessions (card_id, deck_id, deck_name, created_at, updated_at) "
+        "VALUES (?, ?, ?, '2024-01-01', '2024-01-01')",
+        [(c, c % n_decks, "Deck %d" % (c % n_decks)) for c in range(n_cards)])
+    db.executemany(
+        "INSERT INTO messages (id, card_id, deck_id, text, sender, created_at, %s) "
+        "VALUES (?, ?, ?, ?, ?, ?, %s)" % (", ".join(FIELDS), ", ".join("?" * len(FIELDS))), rows)
+    db.commit()
+    return db
+
+
+def table_bytes(db, name):
+    try:
+        return db.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (name,)).fetchone()[0] or 0
+    except sqlite3.OperationalError:  # SQLite built without dbstat
+        return None
+
+
+def timed(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat
+
+
+def measure(path, card_sample, n_decks, repeat):
+    db = sqlite3.connect(path)
+    db.row_factory = sqlite3.Row
+    cs._db = db
+    result = {
+        'file MB': os.path.getsize(path) / 1048576.0,
+        'messages table MB': (table_bytes(db, 'messages') or 0) / 1048576.0,
+        'payload table MB': (table_bytes(db, 'message_payloads') or 0) / 1048576.0,
+    }
+    result['row scan ms'] = 1000 * timed(lambda: db.execute(
+        "SELECT id, card_id, created_at, length(text) FROM messages").fetchall(), repeat)
+    result['load_deck_messages ms'] = 1000 * timed(
+        lambda: [cs.load_deck_messages(d, limit=50) for d in range(min(n_decks, 10))], repeat) / min(n_decks, 10)
+    result['load_card_session ms'] = 1000 * timed(
+        lambda: [cs.load_card_session(c) for c in card_sample], repeat) / len(card_sample)
+
+    def page_with_details():
+        for c in card_sample:
+            page = cs.load_messages_page(c)
+            cs.load_message_details([m['id'] for m in page['messages'] if m['has_details']])
+    result['page + details ms'] = 1000 * timed(page_with_details, repeat) / len(card_sample)
+
+    card_ids = [r[0] for r in db.execute("SELECT card_id FROM card_sessions")]
+
+    def enforce():
+        cs._enforce_message_limit(db, card_ids)
+        db.rollback()
+    result['enforce limit ms'] = 1000 * timed(enforce, repeat)
+    db.close()
+    cs._db = None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--cards', type=int, default=2000)
+    parser.add_argument('--per-card', type=int, default=40)
+    parser.add_argument('--decks', type=int, default=20)
+    parser.add_argument('--sample', type=int, default=50, help='cards timed per load call')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    # Card front texts come from the Anki collection, which is not part of this comparison
+    cs._get_card_front_texts = lambda card_ids: {}
+
+    rng = random.Random(args.seed)
+    rows = make_messages(args.cards, args.per_card, args.decks, rng)
+    tmp = tempfile.mkdtemp()
+    inline_path = os.path.join(tmp, 'inline.db')
+    side_path = os.path.join(tmp, 'side.db')
+
+    db = build_inline(inline_path, rows, args.cards, args.decks)
+    db.execute("VACUUM")
+    db.close()
+    shutil.copy(inline_path, side_path)
+
+    db = sqlite3.connect(side_path)
+    t0 = time.perf_counter()
+    moved = cs._migrate_inline_payloads(db)
+    db.commit()
+    migrate_s = time.perf_counter() - t0
+    payloads = db.execute("SELECT COUNT(*), SUM(size), SUM(length(data)) FROM message_payloads").fetchone()
+    db.execute("VACUUM")
+    db.close()
+
+    print("%d cards, %d messages (%d with payloads)" % (args.cards, len(rows), moved))
+    print("migration: %.2fs; %d payloads for %d values (%.1f MB JSON -> %.1f MB stored)"
+          % (migrate_s, payloads[0], moved * len(FIELDS), payloads[1] / 1048576.0,
+             payloads[2] / 1048576.0))
+
+    sample = rng.sample(range(args.cards), min(args.sample, args.cards))
+    inline = measure(inline_path, sample, args.decks, args.repeat)
+    side = measure(side_path, sample, args.decks, args.repeat)
+
+    print()
+    print("%-24s | %10s | %10s | %7s" % ('', 'inline', 'side table', 'ratio'))
+    print('-' * 60)
+    for key in inline:
+        if key == 'payload table MB':  # empty before the migration
+            print("%-24s | %10.2f | %10.2f | %7s" % (key, inline[key], side[key], '-'))
+            continue
+        print("%-24s | %10.2f | %10.2f | %6.2fx" % (key, inline[key], side[key], side[key] / inline[key]))
+    shutil.rmtree(tmp, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
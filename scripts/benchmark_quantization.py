@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Benchmark quantized card-embedding storage (float16 / int8 + float32 rescoring).
+
+For each mode it reports the card_embeddings blob footprint, the private RAM
+of the index once the float32 rows are served from the memory-mapped
+snapshot, query latency, and recall@30 parity against the exact float32 scan.
+With real data it also reports hit@30 of each test case's expected card.
+
+Usage:
+  python3 scripts/benchmark_quantization.py                  # storage/card_sessions.db
+  python3 scripts/benchmark_quantization.py --synthetic 20000
+  python3 scripts/benchmark_quantization.py --rescore 100 300 1000
+
+Query vectors for benchmark/test_cases.json come from the query-embedding
+cache (query_embeddings in card_sessions.db, filled by benchmark_run.py);
+uncached queries are skipped.
+"""
+import sys
+import os
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from ai import vector_index as vi  # noqa: E402
+from ai.embed_cache import QueryEmbeddingCache  # noqa: E402
+from ai.embeddings import EmbeddingManager  # noqa: E402
+
+DB_PATH = os.path.join(PROJECT_ROOT, 'storage', 'card_sessions.db')
+TEST_CASES_PATH = os.path.join(PROJECT_ROOT, 'benchmark', 'test_cases.json')
+EMBED_MODEL = EmbeddingManager.MODEL
+EMBEDDING_DIM = 3072
+TOP_K = 30
+MODES = (None, 'float16', 'int8')
+
+
+def load_real(db_path):
+    db = sqlite3.connect(db_path)
+    rows = db.execute("SELECT card_id, embedding FROM card_embeddings").fetchall()
+    db.close()
+    ids, vectors = [], []
+    for card_id, blob in rows:
+        vec = vi.decode_vector(blob, EMBEDDING_DIM)
+        if vec is not None:
+            ids.append(card_id)
+            vectors.append(vec)
+
+    queries = []
+    with open(TEST_CASES_PATH) as f:
+        cases = json.load(f)
+    cached = QueryEmbeddingCache(EMBED_MODEL).get_many([case['query'] for case in cases])
+    for case, emb in zip(cases, cached):
+        if emb:
+            queries.append((emb, case.get('expected_card_id')))
+    print("  %d cards, %d/%d test queries found in embed cache" % (len(ids), len(queries), len(cases)))
+    return ids, vi.np.asarray(vectors, dtype=vi.np.float32), queries
+
+
+def load_synthetic(n, n_queries=80, seed=42):
+    """Clustered vectors so that neighbourhoods are meaningful."""
+    np = vi.np
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 50), EMBEDDING_DIM), dtype=np.float32)
+    assign = rng.integers(0, len(centers), n)
+    vectors = centers[assign] + 0.6 * rng.standard_normal((n, EMBEDDING_DIM), dtype=np.float32)
+    picks = rng.integers(0, n, n_queries)
+    queries = [(vectors[i] + 0.3 * rng.standard_normal(EMBEDDING_DIM, dtype=np.float32), None)
+               for i in picks]
+    return list(range(n)), vectors, queries
+
+
+def run_mode(mode, rescore, ids, vectors, queries, exact_results, tmpdir):
+    index = vi.VectorIndex(EMBEDDING_DIM, quantization=mode, rescore_candidates=rescore)
+    index.build(ids, vectors)
+    prefix = os.path.join(tmpdir, 'idx_%s_%d' % (mode or 'f32', rescore))
+    index.save(prefix)
+    index, _ = vi.VectorIndex.load(prefix, EMBEDDING_DIM, quantization=mode,
+                                   rescore_candidates=rescore)
+
+    blob_bytes = len(vi.encode_vector([0.0] * EMBEDDING_DIM, mode)) * len(ids)
+    overlap = hits = with_target = 0
+    t0 = time.perf_counter()
+    results = [index.search(q, top_k=TOP_K) for q, _ in queries]
+    ms = (time.perf_counter() - t0) / max(1, len(queries)) * 1000
+    for got, want, (_, target) in zip(results, exact_results, queries):
+        overlap += len({c for c, _ in got} & {c for c, _ in want})
+        if target is not None:
+            with_target += 1
+            hits += any(c == target for c, _ in got)
+    return {
+        'disk_mb': blob_bytes / 1e6,
+        # float32 rows for rescoring stay in the mapped snapshot
+        'ram_mb': (index.memory_bytes() if mode else len(ids) * EMBEDDING_DIM * 4) / 1e6,
+        'query_ms': ms,
+        'recall': overlap / max(1, TOP_K * len(queries)),
+        'hit': (hits / with_target) if with_target else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='Use N synthetic cards instead of the DB')
+    parser.add_argument('--rescore', type=int, nargs='+', default=[300])
+    args = parser.parse_args()
+
+    if not vi.has_numpy():
+        print("NumPy is required for quantized indexes.")
+        return 1
+    if args.synthetic or not os.path.exists(args.db):
+        print("Synthetic data: %d cards" % (args.synthetic or 10000))
+        ids, vectors, queries = load_synthetic(args.synthetic or 10000)
+    else:
+        ids, vectors, queries = load_real(args.db)
+    if not queries:
+        print("No query vectors available.")
+        return 1
+
+    exact = vi.VectorIndex(EMBEDDING_DIM)
+    exact.build(ids, vectors)
+    exact_results = [exact.search(q, top_k=TOP_K) for q, _ in queries]
+
+    print("%-8s %8s | %9s %9s %9s %11s %7s" % (
+        'mode', 'rescore', 'disk MB', 'RAM MB', 'query ms', 'recall@30', 'hit@30'))
+    print('-' * 72)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for mode in MODES:
+            for rescore in (args.rescore if mode else [0]):
+                res = run_mode(mode, max(1, rescore), ids, vectors, queries, exact_results, tmpdir)
+                print("%-8s %8s | %9.1f %9.1f %9.2f %11.4f %7s" % (
+                    mode or 'float32', rescore or '-', res['disk_mb'], res['ram_mb'],
+                    res['query_ms'], res['recall'],
+                    '-' if res['hit'] is None else '%.3f' % res['hit']))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
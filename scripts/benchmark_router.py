@@ -26,6 +26,10 @@ RESULTS_PATH = os.path.join(PROJECT_ROOT, 'benchmark', 'router_results.json')
 ROUTER_CACHE_PATH = os.path.join(PROJECT_ROOT, 'benchmark', '.router_cache.json')
 EMBED_CACHE_PATH = os.path.join(PROJECT_ROOT, 'benchmark', '.embed_cache.json')
 
+sys.path.insert(0, PROJECT_ROOT)
+from ai.embed_cache import QueryEmbeddingCache  # noqa: E402
+from ai.embeddings import EmbeddingManager  # noqa: E402
+
 # ── Config ───────────────────────────────────────────────────────────────────
 
 def _load_config():
@@ -37,36 +41,34 @@ def _load_config():
 
 # ── Embed Cache (shared with benchmark_run.py) ──────────────────────────────
 
-_embed_cache = {}
+EMBED_MODEL = EmbeddingManager.MODEL
+_embed_cache = QueryEmbeddingCache(EMBED_MODEL)
 
 def _load_embed_cache():
-    global _embed_cache
-    if os.path.exists(EMBED_CACHE_PATH):
-        try:
-            with open(EMBED_CACHE_PATH) as f:
-                _embed_cache = json.load(f)
-        except Exception:
-            _embed_cache = {}
-
-def _save_embed_cache():
+    """Import the legacy benchmark/.embed_cache.json once into the shared
+    query-embedding cache (query_embeddings table in card_sessions.db)."""
+    if not os.path.exists(EMBED_CACHE_PATH):
+        return
     try:
-        with open(EMBED_CACHE_PATH, 'w') as f:
-            json.dump(_embed_cache, f)
+        with open(EMBED_CACHE_PATH) as f:
+            legacy = json.load(f)
+        _embed_cache.put_many(list(legacy), list(legacy.values()))
+        os.replace(EMBED_CACHE_PATH, EMBED_CACHE_PATH + '.imported')
+        print("  Embed cache: imported %d queries from %s" % (len(legacy), EMBED_CACHE_PATH))
     except Exception:
         pass
 
 def embed_texts(texts, config):
     """Call backend /embed endpoint with caching."""
-    global _embed_cache
     if not texts:
         return []
 
     results = [None] * len(texts)
     uncached_indices = []
     uncached_texts = []
-    for i, text in enumerate(texts):
-        if text in _embed_cache:
-            results[i] = _embed_cache[text]
+    for i, (text, cached) in enumerate(zip(texts, _embed_cache.get_many(texts))):
+        if cached is not None:
+            results[i] = cached
         else:
             uncached_indices.append(i)
             uncached_texts.append(text)
@@ -91,9 +93,7 @@ def embed_texts(texts, config):
         for j, emb in enumerate(embeddings):
             idx = uncached_indices[j]
             results[idx] = emb
-            if emb:
-                _embed_cache[uncached_texts[j]] = emb
-        _save_embed_cache()
+        _embed_cache.put_many(uncached_texts, embeddings)
         return results
     except Exception:
         return results
@@ -483,7 +483,6 @@ def main():
     _load_router_cache()
     _load_embed_cache()
     print('  Router cache: %d cached responses' % len(_router_cache))
-    print('  Embed cache: %d cached embeddings' % len(_embed_cache))
 
     print('Running %d router test cases...' % len(cases))
     print()
@@ -531,6 +530,9 @@ def main():
         json.dump(output, f, indent=2, ensure_ascii=False)
 
     print('Results saved to %s' % RESULTS_PATH)
+    stats = _embed_cache.stats()
+    print('Embed cache: %d memory / %d disk hits, %d misses (hit rate %.0f%%)' % (
+        stats['memory_hits'], stats['disk_hits'], stats['misses'], stats['hit_rate'] * 100))
 
     # Print summary
     print_summary(aggregate)
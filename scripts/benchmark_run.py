@@ -11,7 +11,6 @@ Scores each pipeline step and writes results to benchmark/results.json.
 import sys
 import os
 import json
-import struct
 import math
 import time
 import sqlite3
@@ -22,6 +21,9 @@ import argparse
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, PROJECT_ROOT)
 
+from ai.embed_cache import QueryEmbeddingCache  # noqa: E402
+from ai.embeddings import EmbeddingManager  # noqa: E402
+
 DB_PATH = os.path.join(PROJECT_ROOT, 'storage', 'card_sessions.db')
 TEST_CASES_PATH = os.path.join(PROJECT_ROOT, 'benchmark', 'test_cases.json')
 RESULTS_PATH = os.path.join(PROJECT_ROOT, 'benchmark', 'results.json')
@@ -29,6 +31,7 @@ RESULTS_PATH = os.path.join(PROJECT_ROOT, 'benchmark', 'results.json')
 # ── Constants ────────────────────────────────────────────────────────────────
 
 TOP_K = 30          # Match production: Tutor receives top-30 cards
+EMBEDDING_DIM = 3072  # EmbeddingManager.EMBEDDING_DIM
 SQL_TOP_K = 50      # SQL search candidates before ranking
 
 # ── Tunable Parameters (saved with each benchmark run) ────────────────────
@@ -65,28 +68,25 @@ def _load_config():
 
 
 EMBED_CACHE_PATH = os.path.join(PROJECT_ROOT, 'benchmark', '.embed_cache.json')
-_embed_cache = {}
+EMBED_MODEL = EmbeddingManager.MODEL
+_embed_cache = QueryEmbeddingCache(EMBED_MODEL)
 
 def _load_embed_cache():
-    global _embed_cache
-    if os.path.exists(EMBED_CACHE_PATH):
-        try:
-            with open(EMBED_CACHE_PATH) as f:
-                _embed_cache = json.load(f)
-            print("  Embed cache: %d cached queries (no API calls needed for these)" % len(_embed_cache))
-        except Exception:
-            _embed_cache = {}
-
-def _save_embed_cache():
+    """Import the legacy benchmark/.embed_cache.json once into the shared
+    query-embedding cache (query_embeddings table in card_sessions.db)."""
+    if not os.path.exists(EMBED_CACHE_PATH):
+        return
     try:
-        with open(EMBED_CACHE_PATH, 'w') as f:
-            json.dump(_embed_cache, f)
+        with open(EMBED_CACHE_PATH) as f:
+            legacy = json.load(f)
+        _embed_cache.put_many(list(legacy), list(legacy.values()))
+        os.replace(EMBED_CACHE_PATH, EMBED_CACHE_PATH + '.imported')
+        print("  Embed cache: imported %d queries from %s" % (len(legacy), EMBED_CACHE_PATH))
     except Exception:
         pass
 
 def embed_texts(texts, config=None):
     """Call backend /embed endpoint with caching. Cached queries skip the API call."""
-    global _embed_cache
     if not texts:
         return []
 
@@ -94,9 +94,9 @@ def embed_texts(texts, config=None):
     results = [None] * len(texts)
     uncached_indices = []
     uncached_texts = []
-    for i, text in enumerate(texts):
-        if text in _embed_cache:
-            results[i] = _embed_cache[text]
+    for i, (text, cached) in enumerate(zip(texts, _embed_cache.get_many(texts))):
+        if cached is not None:
+            results[i] = cached
         else:
             uncached_indices.append(i)
             uncached_texts.append(text)
@@ -124,9 +124,7 @@ def embed_texts(texts, config=None):
         for j, emb in enumerate(embeddings):
             idx = uncached_indices[j]
             results[idx] = emb
-            if emb:
-                _embed_cache[uncached_texts[j]] = emb  # Cache for next run
-        _save_embed_cache()
+        _embed_cache.put_many(uncached_texts, embeddings)
         return results
     except Exception as e:
         return results  # Return partial (cached) results on API failure
@@ -340,37 +338,27 @@ Begriffe:""" % query
 # ── Index Loading ────────────────────────────────────────────────────────────
 
 def load_kg_term_index(db):
-    """Load all KG term embeddings, L2-normalized, into a dict."""
-    rows = db.execute(
+    """Load all KG term embeddings into a KGTermIndex (normalized matrix)."""
+    from ai.kg_term_index import KGTermIndex
+    return KGTermIndex.from_blobs(db.execute(
         "SELECT term, embedding FROM kg_terms WHERE embedding IS NOT NULL"
-    ).fetchall()
-    index = {}
-    for term, emb_bytes in rows:
-        if not emb_bytes:
-            continue
-        dim = len(emb_bytes) // 4
-        if dim == 0:
-            continue
-        vec = list(struct.unpack('%df' % dim, emb_bytes))
-        norm = math.sqrt(sum(v * v for v in vec))
-        vec = [v / norm for v in vec] if norm > 0 else vec
-        index[term] = vec
-    return index
+    ).fetchall())
 
 
 def load_card_embeddings(db):
-    """Load all card embeddings, L2-normalized, into a dict {card_id: vector}."""
+    """Load all card embeddings, L2-normalized, into a dict {card_id: vector}.
+
+    Blobs may be float32, float16 or int8 (see ai/vector_index.encode_vector).
+    """
+    from ai.vector_index import decode_vector
     rows = db.execute(
         "SELECT card_id, embedding FROM card_embeddings WHERE embedding IS NOT NULL"
     ).fetchall()
     index = {}
     for card_id, emb_bytes in rows:
-        if not emb_bytes:
-            continue
-        dim = len(emb_bytes) // 4
-        if dim == 0:
+        vec = decode_vector(emb_bytes, EMBEDDING_DIM)
+        if vec is None:
             continue
-        vec = list(struct.unpack('%df' % dim, emb_bytes))
         norm = math.sqrt(sum(v * v for v in vec))
         vec = [v / norm for v in vec] if norm > 0 else vec
         index[card_id] = vec
@@ -1458,6 +1446,9 @@ def main():
             continue
 
     print('Results saved to %s' % RESULTS_PATH)
+    stats = _embed_cache.stats()
+    print('Embed cache: %d memory / %d disk hits, %d misses (hit rate %.0f%%)' % (
+        stats['memory_hits'], stats['disk_hits'], stats['misses'], stats['hit_rate'] * 100))
     if current_recall > prev_best:
         ts = aggregate.get('timestamp', time.strftime('%Y-%m-%d_%H-%M-%S'))
         safe_ts = ts.replace(' ', '_').replace(':', '-')
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Benchmark the in-memory card embedding index (ai/vector_index.py).
+
+Builds synthetic 3072-dim indexes and reports RAM held by the vectors plus
+query latency for the NumPy matrix backend vs. the legacy list-of-lists scan.
+
+Usage:
+  python3 scripts/benchmark_vector_index.py                  # 10k, 50k, 100k
+  python3 scripts/benchmark_vector_index.py --sizes 10000    # one size
+  python3 scripts/benchmark_vector_index.py --python-max 0   # skip pure-Python timing
+
+The pure-Python scan is only timed up to --python-max rows (default 10k);
+beyond that its latency is extrapolated linearly and marked with "~".
+"""
+import sys
+import os
+import time
+import random
+import argparse
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from ai import vector_index as vi  # noqa: E402
+
+DIM = 3072
+TOP_K = 30
+QUERIES = 20
+
+
+def _python_list_bytes(rows, dim):
+    """RAM of the legacy index: one list object + boxed float per element."""
+    return rows * (56 + dim * 32)
+
+
+def _time_queries(index, queries):
+    t0 = time.perf_counter()
+    for q in queries:
+        index.search(q, top_k=TOP_K, min_score=0.3)
+    return (time.perf_counter() - t0) / len(queries) * 1000
+
+
+def bench_numpy(n, queries, rng_seed):
+    np = vi.np
+    rng = np.random.default_rng(rng_seed)
+    index = vi.VectorIndex(DIM)
+    data = rng.standard_normal((n, DIM), dtype=np.float32)
+    t0 = time.perf_counter()
+    index.build(range(n), data)
+    build_s = time.perf_counter() - t0
+    return {
+        'build_s': build_s,
+        'mem_mb': index.memory_bytes() / 1e6,
+        'query_ms': _time_queries(index, queries),
+    }
+
+
+def bench_python(n, python_max, rng_seed):
+    """Time the pure-Python scan on min(n, python_max) rows, extrapolate to n."""
+    measured = min(n, python_max)
+    if measured <= 0:
+        return None
+    rnd = random.Random(rng_seed)
+    saved_np = vi.np
+    vi.np = None  # force the fallback backend
+    try:
+        index = vi.VectorIndex(DIM)
+        index.build(range(measured),
+                    [[rnd.gauss(0, 1) for _ in range(DIM)] for _ in range(measured)])
+        queries = [[rnd.gauss(0, 1) for _ in range(DIM)] for _ in range(3)]
+        ms = _time_queries(index, queries)
+    finally:
+        vi.np = saved_np
+    return {'query_ms': ms * n / measured, 'extrapolated': measured < n}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 50000, 100000])
+    parser.add_argument('--python-max', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    if not vi.has_numpy():
+        print("NumPy not installed — only the pure-Python backend can be measured.")
+
+    print("%-8s | %12s %12s | %10s %10s %10s" % (
+        'cards', 'list MB', 'list ms', 'numpy MB', 'numpy ms', 'build s'))
+    print('-' * 72)
+    for n in args.sizes:
+        py = bench_python(n, args.python_max, args.seed)
+        py_ms = '-' if py is None else ('%s%.1f' % ('~' if py['extrapolated'] else '', py['query_ms']))
+        row = [str(n), '%.0f' % (_python_list_bytes(n, DIM) / 1e6), py_ms]
+        if vi.has_numpy():
+            rng = vi.np.random.default_rng(args.seed + 1)
+            queries = list(rng.standard_normal((QUERIES, DIM), dtype=vi.np.float32))
+            res = bench_numpy(n, queries, args.seed)
+            row += ['%.0f' % res['mem_mb'], '%.2f' % res['query_ms'], '%.2f' % res['build_s']]
+        else:
+            row += ['-', '-', '-']
+        print("%-8s | %12s %12s | %10s %10s %10s" % tuple(row))
+
+
+if __name__ == '__main__':
+    main()
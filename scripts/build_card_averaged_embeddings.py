@@ -14,6 +14,10 @@ import sys, os, sqlite3, struct, math, time
 
 PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_PATH = os.path.join(PROJECT_ROOT, 'storage', 'card_sessions.db')
+EMBEDDING_DIM = 3072
+sys.path.insert(0, PROJECT_ROOT)
+
+from ai.vector_index import decode_vector  # noqa: E402
 
 
 def main():
@@ -25,10 +29,9 @@ def main():
     card_embs = {}
     rows = db.execute("SELECT card_id, embedding FROM card_embeddings WHERE embedding IS NOT NULL").fetchall()
     for card_id, emb_bytes in rows:
-        dim = len(emb_bytes) // 4
-        if dim == 0:
+        vec = decode_vector(emb_bytes, EMBEDDING_DIM)  # float32, float16 or int8 blobs
+        if vec is None:
             continue
-        vec = list(struct.unpack('%df' % dim, emb_bytes))
         card_embs[card_id] = vec
     dim = len(next(iter(card_embs.values()))) if card_embs else 0
     print("  %d card embeddings loaded (%d-dim) in %.1fs" % (len(card_embs), dim, time.time() - t0))
@@ -12,8 +12,6 @@ No Anki needed — reads KG database directly.
 import sys
 import os
 import json
-import struct
-import math
 import time
 import sqlite3
 
@@ -40,23 +38,11 @@ TEST_QUERIES = [
 # ── Helpers ─────────────────────────────────────────────────────────────────
 
 def load_kg_term_index(db):
-    """Load pre-computed KG term embeddings into memory."""
-    rows = db.execute(
+    """Load all KG term embeddings into a KGTermIndex (normalized matrix)."""
+    from ai.kg_term_index import KGTermIndex
+    return KGTermIndex.from_blobs(db.execute(
         "SELECT term, embedding FROM kg_terms WHERE embedding IS NOT NULL"
-    ).fetchall()
-    index = {}
-    for term, emb_bytes in rows:
-        if not emb_bytes:
-            continue
-        dim = len(emb_bytes) // 4
-        if dim == 0:
-            continue
-        vec = list(struct.unpack('%df' % dim, emb_bytes))
-        norm = math.sqrt(sum(v * v for v in vec))
-        if norm > 0:
-            vec = [v / norm for v in vec]
-        index[term] = vec
-    return index
+    ).fetchall())
 
 
 def _load_config_direct():
@@ -154,21 +140,13 @@ def evaluate_query(query, db, kg_term_index, resolved_intent=None):
     print_step("3. Sentence-Level KG Expansion")
     sentence_emb = sentence_embeddings.get(query)
     if sentence_emb and kg_term_index:
-        norm = math.sqrt(sum(v * v for v in sentence_emb))
-        normed = [v / norm for v in sentence_emb] if norm > 0 else sentence_emb
         terms_lower = {t.lower() for t in terms}
-
-        scored = []
-        for kg_term, kg_vec in kg_term_index.items():
-            if kg_term.lower() in terms_lower:
-                continue
-            score = sum(a * b for a, b in zip(normed, kg_vec))
-            if score >= 0.55:
-                scored.append((kg_term, score))
-        scored.sort(key=lambda x: x[1], reverse=True)
+        scored = kg_term_index.search(
+            [sentence_emb], top_k=15, min_score=0.55,
+            accept=lambda _, kg_term: kg_term.lower() not in terms_lower)[0]
 
         if scored:
-            print_list(["%s (%.3f)" % (t, s) for t, s in scored[:15]])
+            print_list(["%s (%.3f)" % (t, s) for t, s in scored])
         else:
             print("  │  (no matches above threshold 0.55)")
     else:
@@ -176,24 +154,13 @@ def evaluate_query(query, db, kg_term_index, resolved_intent=None):
 
     # Step 4: Term-level KG expansion (manual, for visibility)
     print_step("4. Term-Level KG Expansion (threshold 0.75)")
-    for term in terms:
-        emb = term_embeddings.get(term)
-        if not emb or not kg_term_index:
-            continue
-        norm = math.sqrt(sum(v * v for v in emb))
-        if norm == 0:
-            continue
-        normed = [v / norm for v in emb]
-        scored = []
-        for kg_term, kg_vec in kg_term_index.items():
-            if kg_term.lower() == term.lower():
-                continue
-            score = sum(a * b for a, b in zip(normed, kg_vec))
-            if score >= 0.75:
-                scored.append((kg_term, score))
-        scored.sort(key=lambda x: x[1], reverse=True)
+    embedded = [t for t in terms if term_embeddings.get(t)] if kg_term_index else []
+    matches = kg_term_index.search(
+        [term_embeddings[t] for t in embedded], top_k=5, min_score=0.75,
+        accept=lambda i, kg_term: kg_term.lower() != embedded[i].lower()) if embedded else []
+    for term, scored in zip(embedded, matches):
         if scored:
-            print("  │  '%s' → %s" % (term, [(t, round(s, 3)) for t, s in scored[:5]]))
+            print("  │  '%s' → %s" % (term, [(t, round(s, 3)) for t, s in scored]))
 
     # Step 5: Edge expansion
     print_step("5. Graph Edge Expansion")
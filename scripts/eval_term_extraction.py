@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""Offline evaluation of local-first KG term extraction.
+
+Compares TermExtractor.score() terms with reference (LLM) term sets on a
+fixture deck and shows, per confidence threshold, how many cards would
+still need an LLM call and how close the tiered result (local terms for
+confident cards, LLM terms for the rest) stays to all-LLM extraction.
+
+Run from project root:
+  python3 scripts/eval_term_extraction.py
+  python3 scripts/eval_term_extraction.py --threshold 0.5 --verbose
+  python3 scripts/eval_term_extraction.py --refresh-llm   # re-label with extract_terms_batch (network)
+
+Fixture format (benchmark/term_extraction_cases.json): a list of
+{"card_id", "question", "answer", "llm_terms"}.
+"""
+import sys
+import os
+import json
+import argparse
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_ROOT)
+
+from ai.term_extractor import (TermExtractor, compute_collocations,  # noqa: E402
+                               LOCAL_CONFIDENCE_THRESHOLD)
+from storage.kg_store import normalize_term  # noqa: E402
+
+DEFAULT_FIXTURE = os.path.join(PROJECT_ROOT, 'benchmark', 'term_extraction_cases.json')
+THRESHOLDS = [0.0, 0.2, 0.4, 0.5, 0.6, 0.7, 0.8, 1.0]
+
+
+def _match(a, b):
+    """Loose term match: equal keys, or one key contains the other (inflection, compounds)."""
+    return a == b or (min(len(a), len(b)) >= 4 and (a in b or b in a))
+
+
+def prf(predicted, reference):
+    """Precision, recall and F1 of *predicted* against *reference* terms."""
+    pred = [normalize_term(t) for t in predicted]
+    ref = [normalize_term(t) for t in reference]
+    if not pred and not ref:
+        return 1.0, 1.0, 1.0
+    if not pred or not ref:
+        return 0.0, 0.0, 0.0
+    precision = sum(any(_match(p, r) for r in ref) for p in pred) / len(pred)
+    recall = sum(any(_match(r, p) for p in pred) for r in ref) / len(ref)
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def score_cards(cases):
+    extractor = TermExtractor()
+    extractor.set_collocations(compute_collocations(
+        ['%s %s' % (c['question'], c['answer']) for c in cases]))
+    scored = []
+    for case in cases:
+        result = extractor.score(case['question'], case['answer'])
+        scored.append((case, result, prf(result.terms, case['llm_terms'])))
+    return scored
+
+
+def sweep(scored, thresholds):
+    """Rows of (threshold, llm_fraction, local_f1_of_kept, tiered_f1)."""
+    rows = []
+    for threshold in thresholds:
+        kept = [f1 for _, result, (_, _, f1) in scored if result.confidence >= threshold]
+        tiered = kept + [1.0] * (len(scored) - len(kept))
+        rows.append((
+            threshold,
+            1 - len(kept) / len(scored),
+            sum(kept) / len(kept) if kept else float('nan'),
+            sum(tiered) / len(tiered),
+        ))
+    return rows
+
+
+def refresh_llm(cases, path):
+    from ai.gemini import extract_terms_batch
+    for i in range(0, len(cases), 15):
+        batch = cases[i:i + 15]
+        result = extract_terms_batch(batch, raise_errors=True)
+        for case in batch:
+            case['llm_terms'] = result.get(case['card_id'], [])
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(cases, f, ensure_ascii=False, indent=2)
+    print("Re-labelled %d cards with the LLM extractor -> %s" % (len(cases), path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--fixture', default=DEFAULT_FIXTURE)
+    parser.add_argument('--threshold', type=float, default=LOCAL_CONFIDENCE_THRESHOLD)
+    parser.add_argument('--refresh-llm', action='store_true')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    with open(args.fixture, encoding='utf-8') as f:
+        cases = json.load(f)
+    if args.refresh_llm:
+        refresh_llm(cases, args.fixture)
+
+    scored = score_cards(cases)
+    if args.verbose:
+        for case, result, (p, r, f1) in scored:
+            route = 'local' if result.confidence >= args.threshold else 'LLM  '
+            print("%s conf=%.2f F1=%.2f %-28s %s" % (
+                route, result.confidence, f1, ','.join(result.reasons) or '-',
+                case['question'][:50]))
+            print("      local: %s\n      llm:   %s" % (result.terms, case['llm_terms']))
+        print()
+
+    mean_p = sum(p for _, _, (p, _, _) in scored) / len(scored)
+    mean_r = sum(r for _, _, (_, r, _) in scored) / len(scored)
+    mean_f1 = sum(f1 for _, _, (_, _, f1) in scored) / len(scored)
+    print("%d cards — local only vs LLM: P=%.2f R=%.2f F1=%.2f" % (len(scored), mean_p, mean_r, mean_f1))
+    print()
+    print("%9s | %12s | %14s | %9s" % ('threshold', 'LLM cards', 'local F1 kept', 'tiered F1'))
+    print('-' * 53)
+    thresholds = sorted(set(THRESHOLDS + [args.threshold]))
+    for threshold, llm_fraction, kept_f1, tiered_f1 in sweep(scored, thresholds):
+        marker = ' <' if threshold == args.threshold else ''
+        print("%9.2f | %11.0f%% | %14.2f | %9.2f%s" % (
+            threshold, llm_fraction * 100, kept_f1, tiered_f1, marker))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,10 +6,19 @@ Jede Karte hat ihre eigene persistente Session mit Review-Historie.
 
 import os
 import json
+import hashlib
 import sqlite3
+import threading
 import uuid
+import zlib
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime
 
+try:
+    from . import db_pool
+except ImportError:
+    import db_pool
+
 try:
     from ..utils.logging import get_logger
 except ImportError:
@@ -18,9 +27,16 @@ logger = get_logger(__name__)
 
 
 _DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'card_sessions.db')
-_db = None
+_db = None  # injected connection (tests, scripts); None = pooled access to _DB_PATH
 
 MAX_MESSAGES_PER_CARD = 200  # Maximum chat messages retained per card (prevents unbounded growth)
+MESSAGE_PAGE_SIZE = 30       # Messages per load_messages_page() call
+PENDING_READ_WAIT_S = 0.5    # Longest a read waits for queued messages to be written
+
+# JSON columns of a message that are only decoded on request (load_message_details).
+# Their values live compressed in message_payloads; messages.<field>_ref holds the hash.
+MESSAGE_DETAIL_FIELDS = ('steps', 'citations', 'pipeline_data', 'agent_cells', 'orchestration')
+PAYLOAD_COMPRESS_LEVEL = 6
 
 
 # ---------------------------------------------------------------------------
@@ -47,18 +63,170 @@ def _parse_json_fields(row_dict: dict, fields: tuple) -> dict:
     return row_dict
 
 
-def _get_db():
-    """Lazy-init SQLite connection (one per process)."""
-    global _db
+# ---------------------------------------------------------------------------
+#  Message payloads: heavy JSON columns, zlib-compressed and deduplicated by hash
+# ---------------------------------------------------------------------------
+
+def _ref_column(field):
+    return field + '_ref'
+
+
+def _encode_payload(text):
+    """(codec, data) for a JSON string — raw when compression does not pay off."""
+    raw = text.encode('utf-8')
+    packed = zlib.compress(raw, PAYLOAD_COMPRESS_LEVEL)
+    return ('zlib', packed) if len(packed) < len(raw) else ('raw', raw)
+
+
+def _decode_payload(codec, data):
+    raw = zlib.decompress(data) if codec == 'zlib' else data
+    return bytes(raw).decode('utf-8')
+
+
+def _store_payloads(db, texts):
+    """
+    Store JSON strings in message_payloads and return their refs.
+
+    Identical strings (e.g. citations repeated across turns) share one row.
+    None stays None.
+    """
+    refs, new_rows = [], {}
+    for text in texts:
+        if text is None:
+            refs.append(None)
+            continue
+        raw = text.encode('utf-8')
+        ref = hashlib.blake2b(raw, digest_size=16).digest()
+        if ref not in new_rows:
+            new_rows[ref] = _encode_payload(text) + (len(raw),)
+        refs.append(ref)
+    if new_rows:
+        db.executemany(
+            "INSERT OR IGNORE INTO message_payloads (hash, codec, data, size) VALUES (?, ?, ?, ?)",
+            [(ref,) + row for ref, row in new_rows.items()])
+    return refs
+
+
+def _load_payloads(db, refs):
+    """{ref: JSON string} for the given refs (one query per 500)."""
+    refs = list({bytes(r) for r in refs if r is not None})
+    texts = {}
+    for i in range(0, len(refs), 500):
+        chunk = refs[i:i + 500]
+        for ref, codec, data in db.execute(
+                "SELECT hash, codec, data FROM message_payloads WHERE hash IN (%s)"
+                % ",".join("?" * len(chunk)), chunk):
+            texts[bytes(ref)] = _decode_payload(codec, data)
+    return texts
+
+
+def _resolve_payloads(db, messages, fields=MESSAGE_DETAIL_FIELDS):
+    """
+    Replace the <field>_ref values of message dicts by the parsed JSON (in-place).
+
+    Rows written before the side table still carry the JSON inline in <field>;
+    that value is kept when there is no ref.
+    """
+    texts = _load_payloads(db, [m.get(_ref_column(f)) for m in messages for f in fields])
+    for m in messages:
+        for f in fields:
+            ref = m.pop(_ref_column(f), None)
+            if ref is not None:
+                m[f] = texts.get(bytes(ref))
+            else:
+                m.setdefault(f, None)
+        _parse_json_fields(m, fields)
+    return messages
+
+
+def _migrate_inline_payloads(db, batch=500):
+    """Move JSON still stored inline in messages into message_payloads."""
+    inline = " OR ".join("%s IS NOT NULL" % f for f in MESSAGE_DETAIL_FIELDS)
+    moved, last_rowid = 0, -1
+    while True:
+        rows = db.execute(
+            "SELECT rowid, %s FROM messages WHERE rowid > ? AND (%s) ORDER BY rowid LIMIT ?" % (
+                ", ".join(MESSAGE_DETAIL_FIELDS), inline), (last_rowid, batch)).fetchall()
+        if not rows:
+            break
+        last_rowid = rows[-1][0]
+        n = len(MESSAGE_DETAIL_FIELDS)
+        refs = _store_payloads(db, [row[1 + i] for row in rows for i in range(n)])
+        db.executemany(
+            "UPDATE messages SET %s, %s WHERE rowid = ?" % (
+                ", ".join("%s = COALESCE(?, %s)" % (_ref_column(f), _ref_column(f))
+                          for f in MESSAGE_DETAIL_FIELDS),
+                ", ".join("%s = NULL" % f for f in MESSAGE_DETAIL_FIELDS)),
+            [tuple(refs[j * n:(j + 1) * n]) + (row[0],) for j, row in enumerate(rows)])
+        moved += len(rows)
+    if moved:
+        logger.info("CardSessionsDB: moved payloads of %d messages into message_payloads", moved)
+    return moved
+
+
+def prune_message_payloads(db):
+    """Delete payloads no message refers to any more. Returns the number deleted."""
+    referenced = " UNION ALL ".join(
+        "SELECT %s FROM messages WHERE %s IS NOT NULL" % (_ref_column(f), _ref_column(f))
+        for f in MESSAGE_DETAIL_FIELDS)
+    return db.execute(
+        "DELETE FROM message_payloads WHERE hash NOT IN (%s)" % referenced).rowcount
+
+
+def _pool():
+    """ConnectionPool for _DB_PATH, or None while a connection is injected into _db."""
     if _db is not None:
-        return _db
-    _db = sqlite3.connect(_DB_PATH, check_same_thread=False)
-    _db.row_factory = sqlite3.Row
-    _db.execute("PRAGMA journal_mode=WAL")
-    _db.execute("PRAGMA foreign_keys=ON")
-    _init_schema(_db)
-    _migrate_schema(_db)
-    return _db
+        return None
+    pool = db_pool.get_pool(_DB_PATH)
+    pool.initialize('card_sessions', _init_db)
+    return pool
+
+
+def _get_db():
+    """Connection for the calling thread.
+
+    The injected ``_db`` when set (tests, scripts). Otherwise the writer
+    connection inside a write (functions decorated with @_writes) and this
+    thread's read-only WAL connection everywhere else — see db_pool.
+    """
+    pool = _pool()
+    return _db if pool is None else pool.connection()
+
+
+_writes = db_pool.writes(_pool)
+
+
+def run_write(fn, *args, **kwargs):
+    """Run ``fn(*args, **kwargs)`` as one write (for callers outside this module).
+
+    Waits for the commit without a time limit — for worker threads that need
+    the result even when the writer is busy longer than write_timeout.
+    """
+    pool = _pool()
+    return fn(*args, **kwargs) if pool is None else pool.submit(fn, *args, **kwargs).result()
+
+
+def submit_write(fn, *args, **kwargs):
+    """Queue a write without waiting for it; flush() makes it durable.
+
+    Runs immediately on an injected connection.
+    """
+    pool = _pool()
+    if pool is None:
+        fn(*args, **kwargs)
+    else:
+        pool.submit(fn, *args, **kwargs)
+
+
+def flush(timeout=None):
+    """Wait until all queued writes are committed. False on timeout."""
+    pool = _pool()
+    return True if pool is None else pool.flush(timeout)
+
+
+def _init_db(db):
+    _init_schema(db)
+    _migrate_schema(db)
 
 
 def _init_schema(db):
@@ -105,14 +273,33 @@ def _init_schema(db):
             embedding     BLOB NOT NULL,
             content_hash  TEXT NOT NULL,
             model_version TEXT NOT NULL,
+            source_mod    INTEGER,
             created_at    TEXT DEFAULT (datetime('now')),
             updated_at    TEXT DEFAULT (datetime('now'))
         );
 
+        CREATE TABLE IF NOT EXISTS query_embeddings (
+            model        TEXT NOT NULL,
+            text_key     TEXT NOT NULL,
+            embedding    BLOB NOT NULL,
+            hits         INTEGER DEFAULT 0,
+            created_at   TEXT DEFAULT (datetime('now')),
+            last_used_at TEXT DEFAULT (datetime('now')),
+            PRIMARY KEY (model, text_key)
+        );
+
+        CREATE TABLE IF NOT EXISTS message_payloads (
+            hash  BLOB PRIMARY KEY,
+            codec TEXT NOT NULL,
+            data  BLOB NOT NULL,
+            size  INTEGER NOT NULL
+        );
+
         CREATE INDEX IF NOT EXISTS idx_messages_card   ON messages(card_id);
         CREATE INDEX IF NOT EXISTS idx_sections_card   ON review_sections(card_id);
         CREATE INDEX IF NOT EXISTS idx_card_sessions_deck ON card_sessions(deck_id);
         CREATE INDEX IF NOT EXISTS idx_embeddings_hash ON card_embeddings(content_hash);
+        CREATE INDEX IF NOT EXISTS idx_query_embeddings_used ON query_embeddings(last_used_at);
     """)
     db.commit()
 
@@ -179,6 +366,8 @@ def _migrate_schema(db):
             CREATE INDEX IF NOT EXISTS idx_messages_card      ON messages(card_id);
             CREATE INDEX IF NOT EXISTS idx_messages_deck_time ON messages(deck_id, created_at);
         """)
+        # The rebuilt table lacks the columns added below
+        cols = {row[1] for row in db.execute("PRAGMA table_info(messages)").fetchall()}
 
     # Type column migration: add type column to review_sections for preview marker
     try:
@@ -209,6 +398,21 @@ def _migrate_schema(db):
         except sqlite3.OperationalError:
             pass
 
+    # Embedding backfill resume: note mod time each embedding was computed from
+    emb_cols = {row[1] for row in db.execute("PRAGMA table_info(card_embeddings)").fetchall()}
+    if 'source_mod' not in emb_cols:
+        db.execute("ALTER TABLE card_embeddings ADD COLUMN source_mod INTEGER")
+
+    # Payload side table: <field>_ref columns, then move inline JSON out of the rows
+    cols = {row[1] for row in db.execute("PRAGMA table_info(messages)").fetchall()}
+    for field in MESSAGE_DETAIL_FIELDS:
+        if _ref_column(field) not in cols:
+            db.execute("ALTER TABLE messages ADD COLUMN %s BLOB" % _ref_column(field))
+    _migrate_inline_payloads(db)
+
+    # Keyset pagination of a card's chat (load_messages_page)
+    db.execute("CREATE INDEX IF NOT EXISTS idx_messages_card_time ON messages(card_id, created_at, id)")
+
     db.commit()
 
 
@@ -223,6 +427,7 @@ def load_card_session(card_id):
     Returns:
         dict with keys 'session' (dict|None), 'sections' (list), 'messages' (list)
     """
+    _await_pending_messages()
     db = _get_db()
     card_id = int(card_id)
 
@@ -250,10 +455,7 @@ def load_card_session(card_id):
         "SELECT * FROM messages WHERE card_id = ? ORDER BY created_at ASC",
         (card_id,)
     ).fetchall()
-    messages = []
-    for r in rows:
-        m = _parse_json_fields(dict(r), ('steps', 'citations', 'pipeline_data', 'agent_cells', 'orchestration'))
-        messages.append(m)
+    messages = _resolve_payloads(db, [dict(r) for r in rows])
 
     return {
         'session': session,
@@ -262,6 +464,103 @@ def load_card_session(card_id):
     }
 
 
+def load_card_session_page(card_id, limit=MESSAGE_PAGE_SIZE):
+    """
+    Like load_card_session(), but with only the newest page of messages.
+
+    Returns:
+        dict with keys 'session', 'sections', 'messages' (see load_messages_page),
+        'has_more' and 'before'
+    """
+    page = load_messages_page(card_id, limit=limit)
+    db = _get_db()
+    card_id = int(card_id)
+
+    row = db.execute("SELECT * FROM card_sessions WHERE card_id = ?", (card_id,)).fetchone()
+    rows = db.execute(
+        "SELECT * FROM review_sections WHERE card_id = ? ORDER BY created_at ASC",
+        (card_id,)
+    ).fetchall()
+    page['session'] = dict(row) if row else None
+    page['sections'] = [_parse_json_fields(dict(r), ('performance_data',)) for r in rows]
+    return page
+
+
+def load_messages_page(card_id, before_created_at=None, limit=MESSAGE_PAGE_SIZE, before_id=None):
+    """
+    Load one page of a card's messages, newest first from the cursor backwards.
+
+    Seeks through idx_messages_card_time, so the cost depends on *limit*, not on
+    how many messages the card has. The JSON columns (MESSAGE_DETAIL_FIELDS) are
+    not read; 'has_details' tells whether load_message_details() has any.
+
+    Args:
+        card_id: Card whose chat to page through.
+        before_created_at: Only messages older than this created_at (None = newest page).
+        limit: Page size.
+        before_id: Message id at *before_created_at* — breaks ties between messages
+            with the same timestamp. Pass the 'before' cursor of the previous page.
+
+    Returns:
+        dict with keys 'messages' (list, oldest first), 'has_more' (bool) and
+        'before' ({'created_at', 'id'} cursor for the next older page, or None)
+    """
+    _await_pending_messages()
+    db = _get_db()
+    params = [int(card_id)]
+    where = "card_id = ?"
+    if before_created_at is not None:
+        if before_id is not None:
+            where += " AND (created_at < ? OR (created_at = ? AND id < ?))"
+            params += [before_created_at, before_created_at, before_id]
+        else:
+            where += " AND created_at < ?"
+            params.append(before_created_at)
+    rows = db.execute(
+        "SELECT id, card_id, deck_id, section_id, text, sender, source, created_at, request_id, "
+        "(%s) AS has_details FROM messages WHERE %s "
+        "ORDER BY created_at DESC, id DESC LIMIT ?" % (
+            " OR ".join("%s IS NOT NULL OR %s IS NOT NULL" % (_ref_column(f), f)
+                        for f in MESSAGE_DETAIL_FIELDS), where),
+        params + [int(limit) + 1]
+    ).fetchall()
+
+    has_more = len(rows) > limit
+    messages = [dict(r) for r in rows[:limit]]
+    for m in messages:
+        m['has_details'] = bool(m['has_details'])
+    messages.reverse()
+    before = ({'created_at': messages[0]['created_at'], 'id': messages[0]['id']}
+              if has_more else None)
+    return {'messages': messages, 'has_more': has_more, 'before': before}
+
+
+def load_message_details(message_ids):
+    """
+    Decode the JSON columns that load_messages_page() leaves out.
+
+    Returns:
+        dict message_id -> {field: value} for MESSAGE_DETAIL_FIELDS (unknown ids are omitted)
+    """
+    _await_pending_messages()
+    db = _get_db()
+    ids = [str(i) for i in message_ids]
+    details = {}
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        rows = db.execute(
+            "SELECT id, %s, %s FROM messages WHERE id IN (%s)" % (
+                ", ".join(MESSAGE_DETAIL_FIELDS),
+                ", ".join(_ref_column(f) for f in MESSAGE_DETAIL_FIELDS),
+                ",".join("?" * len(chunk))),
+            chunk
+        ).fetchall()
+        for d in _resolve_payloads(db, [dict(r) for r in rows]):
+            details[d.pop('id')] = d
+    return details
+
+
+@_writes
 def save_card_session(card_id, data):
     """
     Save/update a full card session (session meta + sections + messages).
@@ -328,9 +627,11 @@ def save_card_session(card_id, data):
             pipeline_data = _to_json(msg.get('pipeline_data'))
             agent_cells = _to_json(msg.get('agent_cells') or msg.get('agentCells'))
             orchestration = _to_json(msg.get('orchestration'))
+            steps, citations, pipeline_data, agent_cells, orchestration = _store_payloads(
+                db, [steps, citations, pipeline_data, agent_cells, orchestration])
             request_id = msg.get('request_id') or msg.get('requestId')
             db.execute("""
-                INSERT OR REPLACE INTO messages (id, card_id, section_id, text, sender, created_at, steps, citations, request_id, pipeline_data, agent_cells, orchestration)
+                INSERT OR REPLACE INTO messages (id, card_id, section_id, text, sender, created_at, steps_ref, citations_ref, request_id, pipeline_data_ref, agent_cells_ref, orchestration_ref)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """, (
                 msg.get('id'),
@@ -348,7 +649,7 @@ def save_card_session(card_id, data):
             ))
 
         # Enforce message limit
-        _enforce_message_limit(db, card_id)
+        _enforce_message_limit(db, [card_id])
 
         db.commit()
         return True
@@ -359,76 +660,210 @@ def save_card_session(card_id, data):
         return False
 
 
-def _get_deck_for_card(card_id):
-    """Get deck_id and deck_name from Anki for a card. Returns (deck_id, deck_name) or (None, None)."""
+def _get_decks_for_cards(card_ids):
+    """{card_id: (deck_id, deck_name)} from Anki for many cards (one cards query)."""
+    result = {}
     try:
         import aqt
-        if aqt.mw and aqt.mw.col:
-            card = aqt.mw.col.get_card(card_id)
-            if card:
-                return card.did, aqt.mw.col.decks.name(card.did)
-    except (sqlite3.Error, KeyError, ValueError, AttributeError):
+        if not (aqt.mw and aqt.mw.col) or not card_ids:
+            return result
+        col = aqt.mw.col
+        for i in range(0, len(card_ids), 500):
+            chunk = card_ids[i:i + 500]
+            rows = col.db.all("SELECT id, did FROM cards WHERE id IN (%s)"
+                              % ",".join(str(int(cid)) for cid in chunk))
+            for cid, did in rows:
+                result[cid] = (did, col.decks.name(did))
+    except (ImportError, sqlite3.Error, KeyError, ValueError, AttributeError, TypeError):
         pass
-    return None, None
+    return result
+
+
+# ── Write-behind message queue ──
+#
+# save_message() resolves the card's deck on the calling thread (from
+# _card_decks, then the card_sessions row, then Anki), appends the message
+# to _pending_messages and makes sure one _flush_messages job is queued on
+# the writer. That job takes everything queued by then, so messages arriving
+# while the writer is busy (background embedding, KG writes) are persisted
+# together: one session upsert per card, one executemany for the messages,
+# one windowed delete for the message limit and a single commit. The job
+# itself never calls into Anki. Reads of messages wait briefly for the
+# queued job first (_await_pending_messages); cleanup_addon's flush() and
+# the pool's exit hook persist what is left.
+
+_pending_messages = []      # (card_id, message, saved_at, deck_id, deck_name) in call order
+_pending_lock = threading.Lock()
+_pending_flush = None       # Future of the queued job that will take _pending_messages
+_last_flush = None          # Future of the most recently queued job
+_card_decks = {}            # card_id -> (deck_id, deck_name)
+_CARD_DECK_CACHE_MAX = 20000
+_MESSAGE_ERRORS = (sqlite3.Error, KeyError, ValueError, TypeError)
 
 
 def save_message(card_id, message):
-    """Append a single message to a card's session."""
-    db = _get_db()
+    """Append a single message to a card's session (write-behind).
+
+    Returns True once the message is queued; it is committed by the writer
+    shortly after (flush_messages() waits for that). With an injected
+    connection it is written immediately and the result reflects the write.
+    """
+    global _pending_flush, _last_flush
     card_id = int(card_id)
-    now = datetime.now().isoformat()
+    entry = (card_id, message, datetime.now().isoformat()) + _card_deck(card_id)
+    pool = _pool()
+    with _pending_lock:
+        _pending_messages.append(entry)
+        if pool is not None and _pending_flush is None:
+            _pending_flush = _last_flush = pool.submit(_flush_messages)
+    if pool is None:
+        return _flush_messages()
+    return True
 
+
+def flush_messages(timeout=None):
+    """Wait until every message queued by save_message() is committed.
+
+    Returns the result of the last flush (False if it failed or timed out).
+    """
+    future = _last_flush
+    pool = _pool()
+    if future is None or pool is None or pool.on_writer_thread():
+        return True
     try:
-        # Ensure card session exists — include deck_id from Anki
-        deck_id, deck_name = _get_deck_for_card(card_id)
-        db.execute("""
-            INSERT OR IGNORE INTO card_sessions (card_id, deck_id, deck_name, created_at, updated_at)
-            VALUES (?, ?, ?, ?, ?)
-        """, (card_id, deck_id, deck_name, now, now))
+        return future.result(timeout)
+    except FutureTimeout:
+        logger.warning("CardSessionsDB: queued messages not written after %ss", timeout)
+        return False
+    except Exception as e:
+        logger.error("CardSessionsDB: waiting for queued messages failed: %s", e)
+        return False
 
-        # Backfill deck_id on existing entries that are missing it
-        if deck_id:
-            db.execute("""
-                UPDATE card_sessions SET deck_id = ?, deck_name = ?
-                WHERE card_id = ? AND deck_id IS NULL
-            """, (deck_id, deck_name, card_id))
-
-        steps = _to_json(message.get('steps'))
-        citations = _to_json(message.get('citations'))
-        pipeline_data = _to_json(message.get('pipeline_data'))
-        agent_cells = _to_json(message.get('agent_cells') or message.get('agentCells'))
-        orchestration = _to_json(message.get('orchestration'))
-        request_id = message.get('request_id') or message.get('requestId')
 
-        msg_id = message.get('id') or str(uuid.uuid4())
-        db.execute("""
-            INSERT OR REPLACE INTO messages (id, card_id, section_id, text, sender, created_at, steps, citations, request_id, deck_id, source, pipeline_data, agent_cells, orchestration)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            msg_id,
-            card_id,
-            message.get('section_id') or message.get('sectionId'),
-            message.get('text', ''),
-            message.get('sender') or message.get('from', 'user'),
-            message.get('created_at') or message.get('createdAt') or now,
-            steps,
-            citations,
-            request_id,
-            deck_id,
-            message.get('source', 'tutor'),
-            pipeline_data,
-            agent_cells,
-            orchestration,
-        ))
+def _await_pending_messages():
+    """Let a read see messages that save_message() has queued but not yet written.
 
-        db.execute("UPDATE card_sessions SET updated_at = ? WHERE card_id = ?", (now, card_id))
+    Waits at most PENDING_READ_WAIT_S: reads run on the UI thread, and a
+    message still queued behind a long write shows up on the next load.
+    """
+    future = _last_flush
+    if future is not None and not future.done():
+        flush_messages(PENDING_READ_WAIT_S)
+
+
+def _card_deck(card_id):
+    """(deck_id, deck_name) of *card_id*, or (None, None) while unknown."""
+    deck = _card_decks.get(card_id)
+    if deck is not None:
+        return deck
+    row = _get_db().execute(
+        "SELECT deck_id, deck_name FROM card_sessions WHERE card_id = ? AND deck_id IS NOT NULL",
+        (card_id,)
+    ).fetchone()
+    deck = (row[0], row[1]) if row else _get_decks_for_cards([card_id]).get(card_id)
+    if deck is None:
+        return (None, None)
+    if len(_card_decks) >= _CARD_DECK_CACHE_MAX:
+        _card_decks.clear()
+    _card_decks[card_id] = deck
+    return deck
+
+
+def _message_params(db, card_id, message, saved_at, deck_id):
+    steps, citations, pipeline_data, agent_cells, orchestration = _store_payloads(db, [
+        _to_json(message.get('steps')),
+        _to_json(message.get('citations')),
+        _to_json(message.get('pipeline_data')),
+        _to_json(message.get('agent_cells') or message.get('agentCells')),
+        _to_json(message.get('orchestration')),
+    ])
+    return (
+        message.get('id') or str(uuid.uuid4()),
+        card_id,
+        message.get('section_id') or message.get('sectionId'),
+        message.get('text', ''),
+        message.get('sender') or message.get('from', 'user'),
+        message.get('created_at') or message.get('createdAt') or saved_at,
+        steps,
+        citations,
+        message.get('request_id') or message.get('requestId'),
+        deck_id,
+        message.get('source', 'tutor'),
+        pipeline_data,
+        agent_cells,
+        orchestration,
+    )
 
-        _enforce_message_limit(db, card_id)
-        db.commit()
+
+def _write_messages(db, entries, now):
+    decks = {cid: (deck_id, deck_name) for cid, _, _, deck_id, deck_name in entries}
+    # Ensure card sessions exist — include deck_id from Anki
+    db.executemany("""
+        INSERT OR IGNORE INTO card_sessions (card_id, deck_id, deck_name, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(cid, deck_id, deck_name, now, now) for cid, (deck_id, deck_name) in decks.items()])
+    # Backfill deck_id on existing entries that are missing it
+    db.executemany("""
+        UPDATE card_sessions SET deck_id = ?, deck_name = ?
+        WHERE card_id = ? AND deck_id IS NULL
+    """, [(deck_id, deck_name, cid) for cid, (deck_id, deck_name) in decks.items() if deck_id])
+
+    db.executemany("""
+        INSERT OR REPLACE INTO messages (id, card_id, section_id, text, sender, created_at, steps_ref, citations_ref, request_id, deck_id, source, pipeline_data_ref, agent_cells_ref, orchestration_ref)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [_message_params(db, cid, message, saved_at, deck_id)
+          for cid, message, saved_at, deck_id, _ in entries])
+
+    db.executemany("UPDATE card_sessions SET updated_at = ? WHERE card_id = ?",
+                   [(now, cid) for cid in decks])
+
+
+def _flush_messages():
+    """Persist every queued message in one transaction (writer job).
+
+    If the batch fails it is retried message by message, each under its own
+    savepoint, so only the messages that fail on their own are dropped.
+    Returns False if any message was dropped.
+    """
+    global _pending_flush
+    with _pending_lock:
+        entries = _pending_messages[:]
+        del _pending_messages[:]
+        _pending_flush = None
+    if not entries:
         return True
 
-    except (sqlite3.Error, KeyError, ValueError) as e:
-        logger.error("CardSessionsDB: Error saving message for card %s: %s", card_id, e)
+    db = _get_db()
+    now = datetime.now().isoformat()
+    try:
+        db.execute("SAVEPOINT flush_messages")
+        try:
+            _write_messages(db, entries, now)
+            saved = entries
+        except _MESSAGE_ERRORS as e:
+            db.execute("ROLLBACK TO flush_messages")
+            logger.warning("CardSessionsDB: Saving %d messages failed (%s), retrying one by one",
+                           len(entries), e)
+            saved = []
+            for entry in entries:
+                db.execute("SAVEPOINT flush_message")
+                try:
+                    _write_messages(db, [entry], now)
+                    saved.append(entry)
+                except _MESSAGE_ERRORS as e:
+                    db.execute("ROLLBACK TO flush_message")
+                    logger.error("CardSessionsDB: Error saving message for card %s: %s", entry[0], e)
+                db.execute("RELEASE flush_message")
+        db.execute("RELEASE flush_messages")
+        if saved:
+            _enforce_message_limit(db, list(dict.fromkeys(entry[0] for entry in saved)))
+        db.commit()
+        return len(saved) == len(entries)
+
+    except sqlite3.Error as e:
+        card_ids = list(dict.fromkeys(entry[0] for entry in entries))
+        logger.error("CardSessionsDB: Error saving %d messages for cards %s: %s",
+                     len(entries), card_ids[:10], e)
         db.rollback()
         return False
 
@@ -439,6 +874,7 @@ def load_deck_messages(deck_id, limit=50):
 
     Returns list of message dicts in chronological order (oldest first).
     """
+    _await_pending_messages()
     db = _get_db()
     deck_id = int(deck_id)
 
@@ -447,7 +883,7 @@ def load_deck_messages(deck_id, limit=50):
         rows = db.execute("""
             SELECT m.id, m.card_id, m.deck_id, m.section_id, m.text, m.sender,
                    m.source, m.created_at, m.steps, m.citations, m.request_id,
-                   cs.deck_name
+                   m.steps_ref, m.citations_ref, cs.deck_name
             FROM messages m
             LEFT JOIN card_sessions cs ON m.card_id = cs.card_id
             ORDER BY m.created_at DESC
@@ -458,7 +894,7 @@ def load_deck_messages(deck_id, limit=50):
         rows = db.execute("""
             SELECT m.id, m.card_id, m.deck_id, m.section_id, m.text, m.sender,
                    m.source, m.created_at, m.steps, m.citations, m.request_id,
-                   cs.deck_name
+                   m.steps_ref, m.citations_ref, cs.deck_name
             FROM messages m
             LEFT JOIN card_sessions cs ON m.card_id = cs.card_id
             WHERE m.deck_id = ?
@@ -466,10 +902,7 @@ def load_deck_messages(deck_id, limit=50):
             LIMIT ?
         """, (deck_id, limit)).fetchall()
 
-    messages = []
-    for r in rows:
-        m = _parse_json_fields(dict(r), ('steps', 'citations', 'pipeline_data', 'agent_cells', 'orchestration'))
-        messages.append(m)
+    messages = _resolve_payloads(db, [dict(r) for r in rows], ('steps', 'citations'))
 
     # Reverse to get chronological (oldest first) order
     messages.reverse()
@@ -511,6 +944,7 @@ def _get_card_front_texts(card_ids):
         return {}
 
 
+@_writes
 def save_deck_message(deck_id, message):
     """Append a deck-level message (no associated card)."""
     db = _get_db()
@@ -518,15 +952,15 @@ def save_deck_message(deck_id, message):
     now = datetime.now().isoformat()
 
     try:
-        steps = _to_json(message.get('steps'))
-        citations = _to_json(message.get('citations'))
+        steps, citations = _store_payloads(
+            db, [_to_json(message.get('steps')), _to_json(message.get('citations'))])
         request_id = message.get('request_id') or message.get('requestId')
         source = message.get('source', 'tutor')
         msg_id = message.get('id') or str(uuid.uuid4())
 
         db.execute("""
             INSERT OR REPLACE INTO messages
-                (id, card_id, deck_id, section_id, text, sender, source, created_at, steps, citations, request_id)
+                (id, card_id, deck_id, section_id, text, sender, source, created_at, steps_ref, citations_ref, request_id)
             VALUES (?, NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         """, (
             msg_id,
@@ -550,6 +984,7 @@ def save_deck_message(deck_id, message):
         return False
 
 
+@_writes
 def clear_deck_messages():
     """Delete all free-chat messages (card_id IS NULL). Returns count of deleted rows."""
     db = _get_db()
@@ -565,6 +1000,7 @@ def clear_deck_messages():
         return 0
 
 
+@_writes
 def save_section(card_id, section):
     """Create or update a review section for a card."""
     db = _get_db()
@@ -612,6 +1048,7 @@ def save_section(card_id, section):
         return False
 
 
+@_writes
 def update_summary(card_id, summary):
     """Update the compressed summary for a card."""
     db = _get_db()
@@ -643,6 +1080,7 @@ def load_insights(card_id):
         return {"version": 1, "insights": []}
 
 
+@_writes
 def save_insights(card_id, insights_data):
     """Save insights JSON to card_sessions.summary"""
     try:
@@ -699,6 +1137,7 @@ def get_card_revlog(card_id, max_points=50):
         return []
 
 
+@_writes
 def delete_card_session(card_id):
     """Delete a card's entire session (cascade deletes sections + messages)."""
     db = _get_db()
@@ -713,6 +1152,7 @@ def delete_card_session(card_id):
 
 def get_card_ids_with_sessions(deck_id=None):
     """List card IDs that have sessions, optionally filtered by deck."""
+    _await_pending_messages()
     db = _get_db()
     if deck_id:
         rows = db.execute(
@@ -730,6 +1170,7 @@ def get_card_ids_with_sessions(deck_id=None):
 #  Migration from sessions.json
 # ──────────────────────────────────────────────
 
+@_writes
 def migrate_from_json(sessions_json_path=None):
     """
     One-time migration: convert deck-based sessions.json to per-card SQLite.
@@ -813,11 +1254,11 @@ def migrate_from_json(sessions_json_path=None):
                 if not card_id:
                     continue
 
-                steps = _to_json(msg.get('steps'))
-                citations = _to_json(msg.get('citations'))
+                steps, citations = _store_payloads(
+                    db, [_to_json(msg.get('steps')), _to_json(msg.get('citations'))])
 
                 db.execute("""
-                    INSERT OR IGNORE INTO messages (id, card_id, section_id, text, sender, created_at, steps, citations)
+                    INSERT OR IGNORE INTO messages (id, card_id, section_id, text, sender, created_at, steps_ref, citations_ref)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                 """, (
                     msg.get('id', f"migrated-{msg.get('timestamp', 0)}"),
@@ -853,41 +1294,76 @@ def migrate_from_json(sessions_json_path=None):
 #  Internal helpers
 # ──────────────────────────────────────────────
 
-def _enforce_message_limit(db, card_id):
-    """Delete oldest messages if card exceeds MAX_MESSAGES_PER_CARD."""
-    count = db.execute(
-        "SELECT COUNT(*) FROM messages WHERE card_id = ?", (card_id,)
-    ).fetchone()[0]
-
-    if count > MAX_MESSAGES_PER_CARD:
-        excess = count - MAX_MESSAGES_PER_CARD
+def _enforce_message_limit(db, card_ids):
+    """Delete the oldest messages of cards beyond MAX_MESSAGES_PER_CARD (one windowed delete)."""
+    card_ids = list(card_ids)
+    for i in range(0, len(card_ids), 500):
+        chunk = card_ids[i:i + 500]
         db.execute("""
             DELETE FROM messages WHERE id IN (
-                SELECT id FROM messages WHERE card_id = ?
-                ORDER BY created_at ASC LIMIT ?
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY card_id ORDER BY created_at DESC, rowid DESC) AS rn
+                    FROM messages WHERE card_id IN (%s)
+                ) WHERE rn > ?
             )
-        """, (card_id, excess))
+        """ % ",".join("?" * len(chunk)), chunk + [MAX_MESSAGES_PER_CARD])
 
 
 # ──────────────────────────────────────────────
 #  Card Embeddings CRUD
 # ──────────────────────────────────────────────
 
-def save_embedding(card_id, embedding_bytes, content_hash, model_version):
-    """Save or update a card's vector embedding."""
+@_writes
+def save_embedding(card_id, embedding_bytes, content_hash, model_version, source_mod=None):
+    """Save or update a card's vector embedding.
+
+    source_mod: note modification time the text was built from (lets the
+    background indexer skip unchanged cards without re-hashing them).
+    """
     db = _get_db()
     db.execute(
-        """INSERT INTO card_embeddings (card_id, embedding, content_hash, model_version, updated_at)
-           VALUES (?, ?, ?, ?, datetime('now'))
+        """INSERT INTO card_embeddings (card_id, embedding, content_hash, model_version, source_mod, updated_at)
+           VALUES (?, ?, ?, ?, ?, datetime('now'))
            ON CONFLICT(card_id) DO UPDATE SET
                embedding = excluded.embedding,
                content_hash = excluded.content_hash,
                model_version = excluded.model_version,
+               source_mod = excluded.source_mod,
                updated_at = excluded.updated_at""",
-        (card_id, embedding_bytes, content_hash, model_version)
+        (card_id, embedding_bytes, content_hash, model_version, source_mod)
     )
     db.commit()
 
+@_writes
+def save_embeddings_bulk(rows):
+    """Save or update many embeddings in one transaction.
+
+    rows: iterable of (card_id, embedding_bytes, content_hash, model_version, source_mod).
+    Returns the number of rows written.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    db = _get_db()
+    try:
+        db.executemany(
+            """INSERT INTO card_embeddings (card_id, embedding, content_hash, model_version, source_mod, updated_at)
+               VALUES (?, ?, ?, ?, ?, datetime('now'))
+               ON CONFLICT(card_id) DO UPDATE SET
+                   embedding = excluded.embedding,
+                   content_hash = excluded.content_hash,
+                   model_version = excluded.model_version,
+                   source_mod = excluded.source_mod,
+                   updated_at = excluded.updated_at""",
+            rows
+        )
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+    return len(rows)
+
 def load_embedding(card_id):
     """Load a single card's embedding. Returns dict with card_id, embedding, content_hash, model_version or None."""
     db = _get_db()
@@ -908,6 +1384,27 @@ def load_all_embeddings():
     ).fetchall()
     return [(row[0], row[1], row[2]) for row in rows]
 
+def get_embeddings_watermark():
+    """Return (row_count, newest updated_at) of card_embeddings.
+
+    Used to decide whether an on-disk index snapshot is still current.
+    """
+    db = _get_db()
+    row = db.execute(
+        "SELECT COUNT(*), MAX(updated_at) FROM card_embeddings"
+    ).fetchone()
+    return row[0], row[1]
+
+def load_embeddings_since(updated_at):
+    """Load embeddings written at or after *updated_at* (ISO/SQLite timestamp).
+    Returns list of (card_id, embedding_bytes, content_hash)."""
+    db = _get_db()
+    rows = db.execute(
+        "SELECT card_id, embedding, content_hash FROM card_embeddings WHERE updated_at >= ?",
+        (updated_at,)
+    ).fetchall()
+    return [(row[0], row[1], row[2]) for row in rows]
+
 def get_stale_card_ids(card_content_hashes):
     """Given {card_id: content_hash}, return card_ids where hash changed or embedding missing.
     card_content_hashes: dict of {card_id: current_content_hash}"""
@@ -923,6 +1420,7 @@ def get_stale_card_ids(card_content_hashes):
             stale.append(card_id)
     return stale
 
+@_writes
 def delete_embedding(card_id):
     """Delete embedding for a card."""
     db = _get_db()
@@ -930,6 +1428,111 @@ def delete_embedding(card_id):
     db.commit()
 
 
+@_writes
+def delete_embeddings(card_ids):
+    """Delete embeddings for many cards in one transaction. Returns rows deleted."""
+    card_ids = list(card_ids)
+    if not card_ids:
+        return 0
+    db = _get_db()
+    cur = db.executemany("DELETE FROM card_embeddings WHERE card_id = ?",
+                         [(cid,) for cid in card_ids])
+    db.commit()
+    return cur.rowcount
+
+
+def load_embedding_states():
+    """Return {card_id: (content_hash, source_mod)} without loading the vectors."""
+    db = _get_db()
+    rows = db.execute("SELECT card_id, content_hash, source_mod FROM card_embeddings").fetchall()
+    return {row[0]: (row[1], row[2]) for row in rows}
+
+
+@_writes
+def touch_embedding_mods(card_mods):
+    """Record the note mod time for embeddings whose content hash was still current.
+
+    card_mods: iterable of (card_id, source_mod).
+    """
+    card_mods = [(mod, cid) for cid, mod in card_mods]
+    if not card_mods:
+        return
+    db = _get_db()
+    db.executemany("UPDATE card_embeddings SET source_mod = ? WHERE card_id = ?", card_mods)
+    db.commit()
+
+
+def load_embedded_card_ids():
+    """Return the set of card_ids that have an embedding."""
+    db = _get_db()
+    return {row[0] for row in db.execute("SELECT card_id FROM card_embeddings")}
+
+
+# ──────────────────────────────────────────────
+#  Query-embedding cache (see ai/embed_cache.py)
+# ──────────────────────────────────────────────
+
+def load_query_embeddings(model, text_keys):
+    """Return {text_key: embedding_bytes} for cached keys and bump their hit counters.
+
+    The counter update is queued, not awaited — a lookup never waits for a write.
+    """
+    text_keys = list(text_keys)
+    if not text_keys:
+        return {}
+    db = _get_db()
+    found = {}
+    for i in range(0, len(text_keys), 500):  # stay below SQLITE_MAX_VARIABLE_NUMBER
+        chunk = text_keys[i:i + 500]
+        rows = db.execute(
+            "SELECT text_key, embedding FROM query_embeddings WHERE model = ? AND text_key IN (%s)"
+            % ','.join('?' * len(chunk)), [model] + chunk
+        ).fetchall()
+        found.update((row[0], row[1]) for row in rows)
+    if found:
+        submit_write(_bump_query_hits, model, list(found))
+    return found
+
+
+def _bump_query_hits(model, text_keys):
+    db = _get_db()
+    db.executemany(
+        """UPDATE query_embeddings SET hits = hits + 1, last_used_at = datetime('now')
+           WHERE model = ? AND text_key = ?""",
+        [(model, key) for key in text_keys])
+    db.commit()
+
+
+@_writes
+def save_query_embeddings(model, items):
+    """Upsert [(text_key, embedding_bytes)] in one transaction."""
+    items = list(items)
+    if not items:
+        return
+    db = _get_db()
+    db.executemany(
+        """INSERT INTO query_embeddings (model, text_key, embedding)
+           VALUES (?, ?, ?)
+           ON CONFLICT(model, text_key) DO UPDATE SET
+               embedding = excluded.embedding,
+               last_used_at = datetime('now')""",
+        [(model, key, blob) for key, blob in items])
+    db.commit()
+
+
+@_writes
+def prune_query_embeddings(max_rows):
+    """Keep only the *max_rows* most recently used cache entries. Returns rows deleted."""
+    db = _get_db()
+    cur = db.execute(
+        """DELETE FROM query_embeddings WHERE rowid IN (
+               SELECT rowid FROM query_embeddings
+               ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)""",
+        (int(max_rows),))
+    db.commit()
+    return cur.rowcount
+
+
 def count_embeddings():
     """Return total number of embedded cards."""
     db = _get_db()
@@ -937,8 +1540,9 @@ def count_embeddings():
 
 
 def close_db():
-    """Close DB connection (call on addon unload)."""
+    """Commit queued writes and close all connections (call on addon unload)."""
     global _db
     if _db:
         _db.close()
         _db = None
+    db_pool.close_pool(_DB_PATH)
@@ -0,0 +1,317 @@
+"""Idle-time maintenance of card_sessions.db.
+
+Nothing else ever checkpoints, analyzes or compacts the database: the
+``-wal`` file grows with every background embedding run, the query planner
+works from statistics taken before the tables grew, and deleted messages
+leave free pages and unreferenced payloads behind. This module decides when
+each of four tasks is due and runs them on the db_pool writer thread:
+
+- ``prune`` — deletes message_payloads rows no message refers to any more
+  (card_sessions.prune_message_payloads) after PRUNE_MIN_CHANGES changed
+  rows or once a day.
+- ``optimize`` — ``PRAGMA optimize`` (a full ``ANALYZE`` when there are no
+  statistics yet) after OPTIMIZE_MIN_CHANGES changed rows or once a day.
+- ``compact`` — when free pages exceed COMPACT_FREE_RATIO of the file.
+  The first run converts the file to ``auto_vacuum=INCREMENTAL`` with one
+  VACUUM; later runs only release the free pages (``incremental_vacuum``).
+- ``checkpoint`` — ``wal_checkpoint(TRUNCATE)`` once the WAL exceeds
+  WAL_CHECKPOINT_BYTES, or hourly when it is not empty.
+
+run_if_idle() is polled from a timer (__init__.py). It does nothing until
+the writer has had no work for IDLE_SECONDS, then queues one pass with
+ConnectionPool.submit_unbatched() — the UI never waits for it. Each task
+run is recorded in the ``db_maintenance`` table; status() reports those
+runs, the current file statistics, the pragma profile and what is due.
+"""
+
+import os
+import sqlite3
+import time
+
+try:
+    from . import card_sessions, db_pool
+except ImportError:
+    import card_sessions
+    import db_pool
+
+try:
+    from ..utils.logging import get_logger
+except ImportError:
+    from utils.logging import get_logger
+logger = get_logger(__name__)
+
+IDLE_SECONDS = 120                    # writer quiet this long before maintenance starts
+WAL_CHECKPOINT_BYTES = 8 * 1024 * 1024
+CHECKPOINT_INTERVAL_S = 60 * 60
+OPTIMIZE_MIN_CHANGES = 5000           # rows changed since the last optimize
+OPTIMIZE_INTERVAL_S = 24 * 60 * 60
+OPTIMIZE_ANALYSIS_LIMIT = 400         # rows sampled per index by PRAGMA optimize
+PRUNE_MIN_CHANGES = 1000              # rows changed since the last payload prune
+PRUNE_INTERVAL_S = 24 * 60 * 60
+COMPACT_MIN_FREE_PAGES = 2048
+COMPACT_FREE_RATIO = 0.2
+
+TASKS = ('prune', 'optimize', 'compact', 'checkpoint')  # execution order: checkpoint last
+
+_AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _ensure_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS db_maintenance (
+            task         TEXT PRIMARY KEY,
+            last_run_at  REAL,
+            duration_ms  REAL,
+            session      REAL,
+            changes_at   INTEGER,
+            reason       TEXT,
+            result       TEXT
+        )
+    """)
+
+
+def _load_state(conn):
+    try:
+        return {row[0]: {'last_run_at': row[1], 'duration_ms': row[2], 'session': row[3],
+                         'changes_at': row[4], 'reason': row[5], 'result': row[6]}
+                for row in conn.execute(
+                    "SELECT task, last_run_at, duration_ms, session, changes_at, reason, result "
+                    "FROM db_maintenance")}
+    except sqlite3.OperationalError:  # table not created yet
+        return {}
+
+
+def _wal_bytes(conn):
+    for row in conn.execute("PRAGMA database_list"):
+        if row[1] == 'main' and row[2]:
+            try:
+                return os.path.getsize(row[2] + '-wal')
+            except OSError:
+                return 0
+    return 0
+
+
+def _pragma(conn, name):
+    row = conn.execute("PRAGMA %s" % name).fetchone()
+    return row[0] if row else None  # e.g. mmap_size of an in-memory database
+
+
+def collect_facts(conn, session=0.0, changes=0):
+    """File statistics the planner decides on.
+
+    Args:
+        conn: Any connection to the database.
+        session: Identifies the writer connection *changes* counts for
+            (ConnectionPool.opened_at); counters of another session are stale.
+        changes: Rows changed through that writer so far.
+    """
+    return {
+        'wal_bytes': _wal_bytes(conn),
+        'page_count': conn.execute("PRAGMA page_count").fetchone()[0],
+        'freelist_count': conn.execute("PRAGMA freelist_count").fetchone()[0],
+        'page_size': conn.execute("PRAGMA page_size").fetchone()[0],
+        'auto_vacuum': conn.execute("PRAGMA auto_vacuum").fetchone()[0],
+        'has_stats': conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None,
+        'session': session,
+        'changes': changes,
+    }
+
+
+def _churn(facts, last):
+    """Rows changed since *last* ran (all of this session's when it ran in another)."""
+    if not last or last.get('session') != facts['session']:
+        return facts['changes']
+    return max(0, facts['changes'] - (last.get('changes_at') or 0))
+
+
+def plan(facts, state, now=None):
+    """Due tasks as ``[(task, reason), ...]`` in execution order.
+
+    Args:
+        facts: collect_facts() result.
+        state: ``{task: {'last_run_at': ..., ...}}`` from the db_maintenance table.
+        now: Wall-clock seconds (default: time.time()).
+    """
+    now = time.time() if now is None else now
+
+    def age(task):
+        last = (state.get(task) or {}).get('last_run_at')
+        return float('inf') if last is None else now - last
+
+    due = {}
+    churn = _churn(facts, state.get('prune'))
+    if churn >= PRUNE_MIN_CHANGES:
+        due['prune'] = '%d rows changed' % churn
+    elif churn and age('prune') >= PRUNE_INTERVAL_S:
+        due['prune'] = 'daily'
+
+    churn = _churn(facts, state.get('optimize'))
+    if not facts['has_stats'] and facts['page_count'] > 1:
+        due['optimize'] = 'no planner statistics'
+    elif churn >= OPTIMIZE_MIN_CHANGES:
+        due['optimize'] = '%d rows changed' % churn
+    elif churn and age('optimize') >= OPTIMIZE_INTERVAL_S:
+        due['optimize'] = 'daily'
+
+    free, pages = facts['freelist_count'], facts['page_count']
+    if free >= COMPACT_MIN_FREE_PAGES and pages and free / pages >= COMPACT_FREE_RATIO:
+        due['compact'] = '%d of %d pages free' % (free, pages)
+
+    wal = facts['wal_bytes']
+    if wal >= WAL_CHECKPOINT_BYTES or 'compact' in due:
+        due['checkpoint'] = 'wal %.1f MB' % (wal / 1048576.0)
+    elif wal and age('checkpoint') >= CHECKPOINT_INTERVAL_S:
+        due['checkpoint'] = 'hourly'
+
+    return [(task, due[task]) for task in TASKS if task in due]
+
+
+def _prune(conn, facts):
+    return '%d payloads deleted' % card_sessions.prune_message_payloads(conn)
+
+
+def _optimize(conn, facts):
+    if not facts['has_stats']:
+        conn.execute("ANALYZE")
+        return 'analyze'
+    conn.execute("PRAGMA analysis_limit = %d" % OPTIMIZE_ANALYSIS_LIMIT)
+    conn.execute("PRAGMA optimize")
+    return 'optimize'
+
+
+def _compact(conn, facts):
+    free_before = facts['freelist_count']
+    if facts['auto_vacuum'] != _AUTO_VACUUM_INCREMENTAL:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")  # applies the new auto_vacuum mode
+        how = 'vacuum, now auto_vacuum=incremental'
+    else:
+        conn.execute("PRAGMA incremental_vacuum").fetchall()
+        how = 'incremental_vacuum'
+    free_after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return '%s, %d pages released' % (how, free_before - free_after)
+
+
+def _checkpoint(conn, facts):
+    busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    if busy:
+        return 'partial (readers active): %d of %d frames' % (checkpointed, log_frames)
+    return 'truncated %.1f MB' % (facts['wal_bytes'] / 1048576.0)
+
+
+_RUNNERS = {'prune': _prune, 'optimize': _optimize, 'compact': _compact, 'checkpoint': _checkpoint}
+
+
+def maintain(conn, session=0.0, changes=0, tasks=None, now=None):
+    """Run the due maintenance tasks on *conn* (outside any transaction).
+
+    Args:
+        conn: The writer connection (autocommit), e.g. from
+            ConnectionPool.submit_unbatched().
+        session, changes: See collect_facts().
+        tasks: Run exactly these tasks instead of the planned ones.
+
+    Returns:
+        List of ``{'task', 'reason', 'result', 'durationMs'}`` dicts.
+    """
+    _ensure_table(conn)
+    if conn.in_transaction:
+        conn.commit()
+    facts = collect_facts(conn, session, changes)
+    if tasks is None:
+        due = plan(facts, _load_state(conn), now)
+    else:
+        due = [(task, 'requested') for task in TASKS if task in tasks]
+
+    actions = []
+    for task, reason in due:
+        t0 = time.perf_counter()
+        try:
+            result = _RUNNERS[task](conn, facts)
+        except sqlite3.Error as e:
+            logger.warning("db_maintenance: %s failed: %s", task, e)
+            result = 'failed: %s' % e
+        duration_ms = (time.perf_counter() - t0) * 1000
+        conn.execute(
+            "INSERT OR REPLACE INTO db_maintenance "
+            "(task, last_run_at, duration_ms, session, changes_at, reason, result) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (task, time.time() if now is None else now, duration_ms, session, changes,
+             reason, result))
+        if conn.in_transaction:
+            conn.commit()
+        logger.info("db_maintenance: %s (%s) -> %s in %.0f ms", task, reason, result, duration_ms)
+        actions.append({'task': task, 'reason': reason, 'result': result,
+                        'durationMs': round(duration_ms, 1)})
+        facts = collect_facts(conn, session, changes)
+    return actions
+
+
+def _pool_job(pool, tasks=None):
+    def job(conn):
+        return maintain(conn, pool.opened_at, pool.total_changes(), tasks)
+    return job
+
+
+def run(tasks=None, wait=True):
+    """Run maintenance now, regardless of idleness.
+
+    Args:
+        tasks: Names from TASKS to force; None runs only what is due.
+        wait: Block until done (default) or return the Future.
+
+    Returns:
+        The action list of maintain() (or a Future of it with ``wait=False``).
+    """
+    pool = card_sessions._pool()
+    if pool is None:  # injected connection (tests, scripts)
+        conn = card_sessions._get_db()
+        return maintain(conn, changes=conn.total_changes, tasks=tasks)
+    future = pool.submit_unbatched(_pool_job(pool, tasks))
+    return future.result() if wait else future
+
+
+def run_if_idle():
+    """Timer entry point: queue a maintenance pass when the writer is idle.
+
+    Returns the Future of the queued pass, or None when skipped.
+    """
+    try:
+        pool = card_sessions._pool()
+        if pool is None or pool.idle_seconds() < IDLE_SECONDS:
+            return None
+        return pool.submit_unbatched(_pool_job(pool))
+    except sqlite3.Error as e:
+        logger.warning("db_maintenance: could not schedule maintenance: %s", e)
+        return None
+
+
+def status():
+    """Maintenance report for the UI: last runs, file statistics and what is due."""
+    conn = card_sessions._get_db()
+    pool = card_sessions._pool()
+    if pool is not None:
+        facts = collect_facts(conn, pool.opened_at, pool.total_changes())
+        idle = pool.idle_seconds()
+    else:
+        facts = collect_facts(conn, 0.0, conn.total_changes)
+        idle = None
+    state = _load_state(conn)
+    return {
+        'walBytes': facts['wal_bytes'],
+        'fileBytes': facts['page_count'] * facts['page_size'],
+        'freePages': facts['freelist_count'],
+        'pageCount': facts['page_count'],
+        'autoVacuum': facts['auto_vacuum'],
+        'idleSeconds': None if idle is None else round(idle, 1),
+        'pragmas': {
+            'journal_mode': _pragma(conn, 'journal_mode'),
+            **{name: _pragma(conn, name) for name, _ in db_pool.PRAGMA_PROFILE},
+            **{name: value for name, value in db_pool.WRITER_PRAGMAS},
+        },
+        'due': [{'task': task, 'reason': reason} for task, reason in plan(facts, state)],
+        'lastRuns': {task: {'at': row['last_run_at'], 'durationMs': row['duration_ms'],
+                            'reason': row['reason'], 'result': row['result']}
+                     for task, row in state.items()},
+    }
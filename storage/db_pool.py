@@ -0,0 +1,476 @@
+"""Per-thread SQLite readers and a single group-committing writer.
+
+card_sessions and kg_store used to share one ``check_same_thread=False``
+connection across the UI thread, AIRequestThread, BackgroundEmbeddingThread,
+SearchCardsThread and the citation thread, so every read waited behind
+every write on the same handle. ConnectionPool splits that up per database
+file:
+
+- connection() on any ordinary thread returns that thread's own read-only
+  connection (``mode=ro``). In WAL mode readers never block each other or
+  the writer and always see the last committed state.
+- Writes run on one writer thread that owns the only read-write
+  connection. write()/submit() queue a callable; the writer drains
+  everything queued so far into one transaction (group commit), runs each
+  callable inside its own SAVEPOINT so one that raises rolls back
+  entirely and alone, commits, and only then resolves the callers' futures. Inside a queued
+  callable connection() returns the writer connection, so the storage
+  functions keep calling ``_get_db()`` unchanged; their commit() and
+  rollback() map to the savepoint. write() waits at most write_timeout
+  seconds (the UI thread must not hang behind a long job) and then raises
+  WriteTimeout; the write stays queued and commits later. Worker threads
+  that need the result wait on submit() instead (the storage modules'
+  run_write()). Writer jobs only apply precomputed rows —
+  computations run on a reader first.
+- flush() waits until everything queued so far is committed — the
+  durability point for fire-and-forget submit() writes and for tests.
+- submit_unbatched() runs a job between group commits, outside any
+  transaction (VACUUM, WAL checkpoints — see db_maintenance).
+
+Every connection gets PRAGMA_PROFILE (page cache, mmap, in-memory temp
+tables); the writer additionally runs synchronous=NORMAL.
+
+The storage modules only use a pool when they open the database file
+themselves; a connection injected into their ``_db`` (tests, scripts) is
+used directly, as before.
+"""
+
+import atexit
+import functools
+import queue
+import sqlite3
+import threading
+import time
+import weakref
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from urllib.request import pathname2url
+
+try:
+    from ..utils.logging import get_logger
+except ImportError:
+    from utils.logging import get_logger
+logger = get_logger(__name__)
+
+BATCH_LIMIT = 256        # queued writes committed together at most
+BUSY_TIMEOUT_MS = 5000   # other processes (Anki's own DB tools) holding the file
+WRITE_TIMEOUT_S = 5.0    # longest write() waits for its commit
+
+# Connection tuning, applied to the writer and every reader. synchronous=NORMAL
+# is durable across application crashes in WAL mode; only an OS crash or power
+# loss can drop the last commits before a checkpoint.
+PRAGMA_PROFILE = (
+    ('cache_size', -16000),          # KiB (negative), per connection
+    ('mmap_size', 64 * 1024 * 1024),
+    ('temp_store', 'MEMORY'),
+)
+WRITER_PRAGMAS = (
+    ('synchronous', 'NORMAL'),
+)
+
+
+def _apply_pragmas(conn, pragmas):
+    for name, value in pragmas:
+        conn.execute("PRAGMA %s = %s" % (name, value))
+
+
+def _split_script(script):
+    """Statements of an SQL script (triggers and string literals intact)."""
+    stmt = ''
+    for part in script.split(';'):
+        stmt += part + ';'
+        if sqlite3.complete_statement(stmt):
+            if stmt.strip(' \t\r\n;'):
+                yield stmt
+            stmt = ''
+
+
+class _WriteConnection:
+    """The writer connection as seen by one queued write.
+
+    commit() checkpoints and rollback() returns to the last checkpoint
+    inside the write's savepoint; the real COMMIT is issued once for the
+    whole batch, and a write that raises is undone completely. executescript()
+    runs statement by statement, because sqlite3's version commits first.
+    """
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def execute(self, sql, parameters=()):
+        return self._conn.execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._conn.executemany(sql, seq_of_parameters)
+
+    def executescript(self, script):
+        cursor = None
+        for stmt in _split_script(script):
+            cursor = self._conn.execute(stmt)
+        return cursor
+
+    def commit(self):
+        self._conn.execute("RELEASE pool_write")
+        self._conn.execute("SAVEPOINT pool_write")
+
+    def rollback(self):
+        self._conn.execute("ROLLBACK TO pool_write")
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+_UNBATCHED = object()  # queue marker of submit_unbatched() jobs
+
+
+class WriteTimeout(sqlite3.OperationalError):
+    """write() gave up waiting; the write is still queued and will commit."""
+
+
+class ReadConnection(sqlite3.Connection):
+    """A thread's read-only connection (``mode=ro``) handed out by ConnectionPool.
+
+    Callers that may get either a pooled reader or an injected connection
+    check for this type to know their writes must go through the pool.
+    """
+
+
+class ConnectionPool:
+    """Thread-local read connections plus one writer thread for *path*."""
+
+    def __init__(self, path, batch_limit=BATCH_LIMIT, write_timeout=WRITE_TIMEOUT_S):
+        self.path = path
+        self.batch_limit = max(1, int(batch_limit))
+        self.write_timeout = write_timeout
+        self._local = threading.local()
+        self._readers = weakref.WeakSet()
+        self._readers_lock = threading.Lock()
+        self._initialized = set()
+        self._init_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._closed = False
+        self._conn = None
+        self._write_conn = None
+        self.opened_at = time.time()  # tells apart total_changes() of successive pools
+        self._last_write = time.monotonic()
+        self._started = threading.Event()
+        self._start_error = None
+        self._thread = threading.Thread(
+            target=self._run, name='sqlite-writer', daemon=True)
+        self._thread.start()
+        self._started.wait()
+        if self._start_error is not None:
+            raise self._start_error
+
+    # ── connections ──
+
+    def on_writer_thread(self):
+        return threading.current_thread() is self._thread
+
+    def connection(self):
+        """The writer connection inside a queued write, else this thread's reader."""
+        if self.on_writer_thread():
+            return self._write_conn
+        return self.reader()
+
+    def reader(self):
+        """This thread's read-only connection (opened on first use)."""
+        conn = getattr(self._local, 'reader', None)
+        if conn is None:
+            uri = 'file:%s?mode=ro' % pathname2url(self.path)
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                                   factory=ReadConnection)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA busy_timeout = %d" % BUSY_TIMEOUT_MS)
+            _apply_pragmas(conn, PRAGMA_PROFILE)
+            self._local.reader = conn
+            with self._readers_lock:
+                self._readers.add(conn)
+        return conn
+
+    def initialize(self, key, init):
+        """Run ``init(conn)`` once per *key* as a write (schema setup)."""
+        if key in self._initialized:
+            return
+        with self._init_lock:
+            if key not in self._initialized:
+                self.submit(lambda: init(self.connection())).result()
+                self._initialized.add(key)
+
+    # ── writes ──
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue ``fn(*args, **kwargs)`` for the writer.
+
+        Returns a Future that resolves (result or exception) once the
+        batch containing the write is committed. Called from the writer
+        thread itself (a write issuing another write) *fn* runs inline.
+        """
+        if self.on_writer_thread():
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            return future
+        if self._closed:
+            raise sqlite3.ProgrammingError("connection pool for %s is closed" % self.path)
+        future = Future()
+        self._queue.put((fn, args, kwargs, future))
+        return future
+
+    def write(self, fn, *args, **kwargs):
+        """Run ``fn(*args, **kwargs)`` on the writer and wait for its commit.
+
+        Raises WriteTimeout after write_timeout seconds behind other jobs;
+        the write itself still runs. Use submit() to wait without a limit.
+        """
+        try:
+            return self.submit(fn, *args, **kwargs).result(self.write_timeout)
+        except FutureTimeout:
+            raise WriteTimeout("write to %s still queued after %.1fs"
+                               % (self.path, self.write_timeout)) from None
+
+    def submit_unbatched(self, fn):
+        """Queue ``fn(conn)`` to run on the writer outside any transaction.
+
+        For statements SQLite refuses inside one (VACUUM, wal_checkpoint,
+        changing auto_vacuum). *conn* is the raw writer connection in
+        autocommit mode. Returns a Future like submit().
+        """
+        if self.on_writer_thread():
+            raise sqlite3.ProgrammingError("submit_unbatched() from inside a write")
+        if self._closed:
+            raise sqlite3.ProgrammingError("connection pool for %s is closed" % self.path)
+        future = Future()
+        self._queue.put((_UNBATCHED, (fn,), {}, future))
+        return future
+
+    def flush(self, timeout=None):
+        """Wait until every write queued before this call is committed.
+
+        Returns False when *timeout* (seconds) expired first.
+        """
+        if self.on_writer_thread() or self._closed:
+            return True
+        future = Future()
+        self._queue.put((None, (), {}, future))
+        try:
+            future.result(timeout)
+        except FutureTimeout:
+            return False
+        return True
+
+    def idle_seconds(self):
+        """Seconds since the writer last finished a batch (0 while writes are queued)."""
+        if not self._queue.empty():
+            return 0.0
+        return time.monotonic() - self._last_write
+
+    def total_changes(self):
+        """Rows changed through the writer since the pool was opened."""
+        return self._conn.total_changes if self._conn is not None else 0
+
+    # ── writer thread ──
+
+    def _run(self):
+        try:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            conn.execute("PRAGMA busy_timeout = %d" % BUSY_TIMEOUT_MS)
+            _apply_pragmas(conn, PRAGMA_PROFILE + WRITER_PRAGMAS)
+        except sqlite3.Error as e:
+            self._start_error = e
+            self._started.set()
+            return
+        self._conn = conn
+        self._write_conn = _WriteConnection(conn)
+        self._started.set()
+
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_limit:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if any(job is None for job in batch):
+                stop = True
+                batch = [job for job in batch if job is not None]
+            try:
+                self._run_batch(batch)
+            except BaseException as e:  # never let the writer thread die
+                logger.exception("db_pool: writer batch of %d jobs failed: %s", len(batch), e)
+                self._abort(batch, e)
+            self._last_write = time.monotonic()
+        conn.close()
+
+    def _run_batch(self, batch):
+        # Unbatched jobs split the batch: each runs between two group commits
+        group = []
+        for job in batch:
+            if job[0] is _UNBATCHED:
+                if group:
+                    self._commit_batch(group)
+                    group = []
+                self._run_unbatched(job)
+            else:
+                group.append(job)
+        if group:
+            self._commit_batch(group)
+
+    def _abort(self, jobs, error):
+        """Roll back what is open and fail every job not resolved yet."""
+        try:
+            if self._conn.in_transaction:
+                self._conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            pass
+        for job in jobs:
+            future = job[3]
+            if not future.done():
+                future.set_exception(error)
+
+    def _run_unbatched(self, job):
+        _, (fn,), _, future = job
+        try:
+            future.set_result(fn(self._conn))
+        except BaseException as e:
+            self._abort([job], e)
+
+    def _commit_batch(self, batch):
+        """Run *batch* in one transaction, each job inside its own savepoint.
+
+        A job that raises is rolled back alone. Should the transaction itself
+        break (savepoint statements failing, a job ending it), the jobs of that
+        transaction fail and the next job starts a new one.
+        """
+        conn = self._conn
+        pending = []   # (job, result) of the open transaction, resolved on COMMIT
+        for job in batch:
+            fn, args, kwargs, future = job
+            if fn is None:  # flush marker
+                pending.append((job, None))
+                continue
+            try:
+                if not conn.in_transaction:
+                    conn.execute("BEGIN IMMEDIATE")
+                conn.execute("SAVEPOINT pool_job")
+                conn.execute("SAVEPOINT pool_write")
+            except sqlite3.Error as e:
+                future.set_exception(e)
+                continue
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+                try:
+                    conn.execute("ROLLBACK TO pool_job")
+                    conn.execute("RELEASE pool_job")
+                except sqlite3.Error as undo_error:
+                    self._fail_transaction(pending, undo_error)
+                    pending = []
+                continue
+            try:
+                conn.execute("RELEASE pool_job")
+            except sqlite3.Error as e:
+                self._fail_transaction(pending + [(job, None)], e)
+                pending = []
+                continue
+            pending.append((job, result))
+        self._commit(pending)
+
+    def _fail_transaction(self, pending, error):
+        logger.error("db_pool: writer transaction broken, failing %d writes: %s", len(pending), error)
+        self._abort([job for job, _ in pending], error)
+
+    def _commit(self, pending):
+        conn = self._conn
+        try:
+            if conn.in_transaction:
+                conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.error("db_pool: group commit of %d writes failed: %s", len(pending), e)
+            self._abort([job for job, _ in pending], e)
+            return
+        for job, result in pending:
+            job[3].set_result(result)
+
+    # ── shutdown ──
+
+    def close(self):
+        """Commit pending writes, stop the writer and close all readers."""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join(5)
+        with self._readers_lock:
+            readers = list(self._readers)
+        for conn in readers:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(path):
+    """The process-wide ConnectionPool for the database file *path*."""
+    pool = _pools.get(path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(path)
+            if pool is None:
+                pool = _pools[path] = ConnectionPool(path)
+    return pool
+
+
+def close_pool(path):
+    """Flush and close the pool of *path* (profile close, addon unload)."""
+    with _pools_lock:
+        pool = _pools.pop(path, None)
+    if pool is not None:
+        pool.close()
+
+
+@atexit.register
+def close_all():
+    """Flush and close every pool; registered for interpreter exit, where the
+    daemon writer thread would otherwise die with writes still queued."""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        try:
+            pool.close()
+        except sqlite3.Error as e:
+            logger.error("db_pool: closing %s failed: %s", pool.path, e)
+
+
+def writes(get_pool_fn):
+    """Decorator factory: run the decorated storage function as a pooled write.
+
+    *get_pool_fn* returns the module's ConnectionPool, or None when the
+    module uses an injected connection — the function then runs directly.
+    When the writer is busy longer than write_timeout the wrapper raises
+    WriteTimeout (a sqlite3.OperationalError); the write is still committed
+    afterwards, so callers must not redo or undo it. Worker threads that
+    need the result call the function through run_write() instead, which
+    waits without a limit (inside a write the wrapper runs inline).
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            pool = get_pool_fn()
+            if pool is None:
+                return fn(*args, **kwargs)
+            return pool.write(fn, *args, **kwargs)
+        return wrapper
+    return decorator
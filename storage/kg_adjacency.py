@@ -0,0 +1,161 @@
+"""Process-local CSR snapshot of the Knowledge Graph for query enrichment.
+
+enrich_query() asks, for every candidate term, whether it is a KG term
+(exact_term_lookup) and what its strongest co-occurrence neighbours are
+(get_term_expansions) — 16+ small queries per chat turn on the shared
+connection the background indexer writes through. KGAdjacency loads
+kg_terms and kg_edges once into flat arrays:
+
+- ``terms[i]`` / ``_ids[term]``: term ids,
+- ``_norm[term_norm]``: id of the most frequent spelling of a lookup key,
+- ``freq[i]``: card frequency (kg_terms.frequency),
+- ``offsets`` / ``neighbors`` / ``weights``: compressed sparse rows; the
+  neighbours of term ``i`` are ``neighbors[offsets[i]:offsets[i + 1]]``,
+  pre-sorted best edge first (score, then weight) like get_term_expansions.
+
+The snapshot is tagged with kg_store.graph_generation(), which every write
+to kg_terms / kg_edges (update_term_frequencies, save_edges,
+GraphIndexBuilder) bumps; get_adjacency() reloads it lazily on the next
+call after a bump.
+"""
+
+import sqlite3
+import threading
+from array import array
+
+try:
+    from . import kg_store
+except ImportError:
+    import kg_store
+
+try:
+    from ..utils.logging import get_logger
+except ImportError:
+    from utils.logging import get_logger
+logger = get_logger(__name__)
+
+
+class KGAdjacency:
+    """Immutable in-memory view of kg_terms + kg_edges."""
+
+    def __init__(self, terms, norms, freqs, edges):
+        """
+        Args:
+            terms: Term strings; list position is the term id.
+            norms: term_norm per term (None when unknown).
+            freqs: Card frequency per term.
+            edges: Iterable of (term_a, term_b, weight, score) rows.
+        """
+        self.terms = list(terms)
+        self._ids = {t: i for i, t in enumerate(self.terms)}
+        self.freq = array('l', freqs)
+        self._norm = {}
+        for i, norm in enumerate(norms):
+            key = norm if norm is not None else kg_store.normalize_term(self.terms[i])
+            best = self._norm.get(key)
+            if best is None or self.freq[i] > self.freq[best]:
+                self._norm[key] = i
+
+        rows = [[] for _ in self.terms]
+        for term_a, term_b, weight, score in edges:
+            a = self._intern(term_a, rows)
+            b = self._intern(term_b, rows)
+            rank = (score if score is not None else 0.0, weight or 0)
+            rows[a].append((rank, b, weight))
+            rows[b].append((rank, a, weight))
+
+        self.offsets = array('l', [0])
+        self.neighbors = array('l')
+        self.weights = array('l')
+        for row in rows:
+            row.sort(key=lambda e: e[0], reverse=True)
+            self.neighbors.extend(b for _, b, _ in row)
+            self.weights.extend(w or 0 for _, _, w in row)
+            self.offsets.append(len(self.neighbors))
+
+    def _intern(self, term, rows):
+        """Id of *term*; edge endpoints missing from kg_terms get one too."""
+        i = self._ids.get(term)
+        if i is None:
+            i = len(self.terms)
+            self.terms.append(term)
+            self._ids[term] = i
+            self.freq.append(0)
+            rows.append([])
+        return i
+
+    def __len__(self):
+        return len(self.terms)
+
+    @property
+    def edge_count(self):
+        return len(self.neighbors) // 2
+
+    def lookup(self, query):
+        """Canonical term for *query* (case/umlaut-insensitive), like exact_term_lookup."""
+        i = self._norm.get(kg_store.normalize_term(query))
+        return self.terms[i] if i is not None else None
+
+    def frequency(self, term):
+        """Card frequency of *term*, 0 if unknown."""
+        i = self._ids.get(term)
+        return self.freq[i] if i is not None else 0
+
+    def expansions(self, term, max_terms=5):
+        """Strongest neighbours of *term* as (term, weight), like get_term_expansions."""
+        i = self._ids.get(term)
+        if i is None:
+            return []
+        start = self.offsets[i]
+        end = min(self.offsets[i + 1], start + max_terms)
+        return [(self.terms[self.neighbors[k]], self.weights[k]) for k in range(start, end)]
+
+    @classmethod
+    def load(cls, db):
+        """Read kg_terms and kg_edges from *db*."""
+        terms, norms, freqs = [], [], []
+        for term, norm, freq in db.execute("SELECT term, term_norm, frequency FROM kg_terms"):
+            terms.append(term)
+            norms.append(norm)
+            freqs.append(freq or 0)
+        edges = db.execute("SELECT term_a, term_b, weight, score FROM kg_edges")
+        return cls(terms, norms, freqs, edges)
+
+
+_lock = threading.Lock()
+_cache = None  # (source, generation, KGAdjacency)
+
+
+def get_adjacency(db=None):
+    """Current KGAdjacency for *db* (default: the shared KG connection).
+
+    Returns None when the KG tables cannot be read; callers then fall
+    back to the SQL lookups in kg_store.
+    """
+    global _cache
+    # Pooled access gives every thread its own reader; they all see one file
+    source = db if db is not None else (kg_store._db or kg_store._db_path())
+    generation = kg_store.graph_generation()
+    cached = _cache
+    if cached is not None and cached[0] == source and cached[1] == generation:
+        return cached[2]
+    with _lock:
+        cached = _cache
+        if cached is not None and cached[0] == source and cached[1] == generation:
+            return cached[2]
+        try:
+            adjacency = KGAdjacency.load(db or kg_store._get_db())
+        except sqlite3.Error as e:
+            logger.warning("kg_adjacency: could not load graph: %s", e)
+            return None
+        _cache = (source, generation, adjacency)
+        logger.debug("kg_adjacency: loaded %d terms, %d edges (generation %d)",
+                     len(adjacency), adjacency.edge_count, generation)
+        return adjacency
+
+
+def clear_cache():
+    """Drop the cached snapshot (tests, profile switch)."""
+    global _cache
+    with _lock:
+        _cache = None
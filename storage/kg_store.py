@@ -4,10 +4,19 @@ Stores extracted terms, co-occurrence edges, definitions, and embeddings
 for the Knowledge Graph feature. Shares the card_sessions.db SQLite file.
 """
 
+import functools
+import heapq
 import json
+import re
 import sqlite3
+import unicodedata
 from datetime import datetime
 
+try:
+    from . import db_pool
+except ImportError:
+    import db_pool
+
 try:
     from ..utils.logging import get_logger
 except ImportError:
@@ -31,7 +40,29 @@ DECK_COLORS = [
     "#AC8E68",  # Apple Brown
 ]
 
-_db = None
+_db = None  # injected connection (tests, scripts); None = pooled access to the file
+
+# Bumped on every write to kg_terms / kg_edges; in-memory views of the graph
+# (kg_adjacency) reload when it changes.
+_graph_generation = 0
+
+_UMLAUTS = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue'})
+
+
+def normalize_term(term):
+    """Lookup key for a term: NFC, casefolded (ß → ss), umlauts spelled out.
+
+    "Dünndarm", "DÜNNDARM" and "duenndarm" share one key, so
+    case-insensitive lookups are plain index seeks on ``term_norm``.
+    """
+    term = unicodedata.normalize('NFC', term or '').casefold().translate(_UMLAUTS)
+    return re.sub(r'\s+', ' ', term).strip()
+
+
+def _prefix_bounds(prefix):
+    """(low, high) so that ``low <= term_norm < high`` is a prefix match."""
+    prefix = normalize_term(prefix)
+    return prefix, prefix + '\U0010ffff'
 
 
 # ---------------------------------------------------------------------------
@@ -44,6 +75,7 @@ def _init_kg_schema(db):
         CREATE TABLE IF NOT EXISTS kg_card_terms (
             card_id        INTEGER,
             term           TEXT,
+            term_norm      TEXT,
             deck_id        INTEGER,
             is_definition  BOOLEAN DEFAULT 0,
             PRIMARY KEY (card_id, term)
@@ -52,6 +84,7 @@ def _init_kg_schema(db):
 
         CREATE TABLE IF NOT EXISTS kg_terms (
             term       TEXT PRIMARY KEY,
+            term_norm  TEXT,
             frequency  INTEGER,
             embedding  BLOB
         );
@@ -60,8 +93,112 @@ def _init_kg_schema(db):
             term_a     TEXT,
             term_b     TEXT,
             weight     INTEGER,
+            score      REAL,
+            PRIMARY KEY (term_a, term_b)
+        );
+        CREATE INDEX IF NOT EXISTS idx_kg_edges_term_b ON kg_edges(term_b);
+
+        -- Per-term neighbour lists kg_edges is derived from
+        CREATE TABLE IF NOT EXISTS kg_term_topk (
+            term      TEXT,
+            neighbor  TEXT,
+            score     REAL,
+            PRIMARY KEY (term, neighbor)
+        );
+        CREATE INDEX IF NOT EXISTS idx_kg_term_topk_neighbor ON kg_term_topk(neighbor);
+
+        -- Incremental co-occurrence state (see GraphIndexBuilder.compute_edges)
+        CREATE TABLE IF NOT EXISTS kg_pair_counts (
+            term_a     TEXT,
+            term_b     TEXT,
+            count      INTEGER,
             PRIMARY KEY (term_a, term_b)
         );
+        CREATE INDEX IF NOT EXISTS idx_kg_pair_counts_b ON kg_pair_counts(term_b);
+
+        CREATE TABLE IF NOT EXISTS kg_card_fingerprints (
+            card_id      INTEGER PRIMARY KEY,
+            fingerprint  TEXT,
+            terms        TEXT
+        );
+
+        CREATE TABLE IF NOT EXISTS kg_dirty_cards (
+            card_id  INTEGER PRIMARY KEY
+        );
+
+        CREATE TRIGGER IF NOT EXISTS kg_card_terms_dirty_ai AFTER INSERT ON kg_card_terms BEGIN
+            INSERT OR IGNORE INTO kg_dirty_cards(card_id) VALUES (new.card_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS kg_card_terms_dirty_ad AFTER DELETE ON kg_card_terms BEGIN
+            INSERT OR IGNORE INTO kg_dirty_cards(card_id) VALUES (old.card_id);
+        END;
+        CREATE TRIGGER IF NOT EXISTS kg_card_terms_dirty_au
+        AFTER UPDATE OF card_id, term ON kg_card_terms BEGIN
+            INSERT OR IGNORE INTO kg_dirty_cards(card_id) VALUES (old.card_id);
+            INSERT OR IGNORE INTO kg_dirty_cards(card_id) VALUES (new.card_id);
+        END;
+
+        -- Per-deck term counts (each deck's sparse term vector) and the
+        -- decks whose term set changed since the last compute_deck_links()
+        CREATE TABLE IF NOT EXISTS kg_deck_terms (
+            deck_id  INTEGER,
+            term     TEXT,
+            count    INTEGER,
+            PRIMARY KEY (deck_id, term)
+        );
+        CREATE INDEX IF NOT EXISTS idx_kg_deck_terms_term ON kg_deck_terms(term);
+
+        CREATE TABLE IF NOT EXISTS kg_dirty_decks (
+            deck_id  INTEGER PRIMARY KEY
+        );
+
+        CREATE TRIGGER IF NOT EXISTS kg_card_terms_deck_ai AFTER INSERT ON kg_card_terms
+        WHEN new.deck_id IS NOT NULL BEGIN
+            INSERT OR IGNORE INTO kg_dirty_decks(deck_id) SELECT new.deck_id
+            WHERE NOT EXISTS (SELECT 1 FROM kg_deck_terms
+                              WHERE deck_id = new.deck_id AND term = new.term);
+            INSERT INTO kg_deck_terms(deck_id, term, count) VALUES (new.deck_id, new.term, 1)
+            ON CONFLICT(deck_id, term) DO UPDATE SET count = count + 1;
+        END;
+        CREATE TRIGGER IF NOT EXISTS kg_card_terms_deck_ad AFTER DELETE ON kg_card_terms
+        WHEN old.deck_id IS NOT NULL BEGIN
+            UPDATE kg_deck_terms SET count = count - 1
+            WHERE deck_id = old.deck_id AND term = old.term;
+            INSERT OR IGNORE INTO kg_dirty_decks(deck_id) SELECT deck_id FROM kg_deck_terms
+            WHERE deck_id = old.deck_id AND term = old.term AND count <= 0;
+            DELETE FROM kg_deck_terms
+            WHERE deck_id = old.deck_id AND term = old.term AND count <= 0;
+        END;
+        CREATE TRIGGER IF NOT EXISTS kg_card_terms_deck_au AFTER UPDATE OF deck_id, term ON kg_card_terms
+        WHEN old.deck_id IS NOT new.deck_id OR old.term IS NOT new.term BEGIN
+            UPDATE kg_deck_terms SET count = count - 1
+            WHERE deck_id = old.deck_id AND term = old.term;
+            INSERT OR IGNORE INTO kg_dirty_decks(deck_id) SELECT deck_id FROM kg_deck_terms
+            WHERE deck_id = old.deck_id AND term = old.term AND count <= 0;
+            DELETE FROM kg_deck_terms
+            WHERE deck_id = old.deck_id AND term = old.term AND count <= 0;
+            INSERT OR IGNORE INTO kg_dirty_decks(deck_id) SELECT new.deck_id
+            WHERE new.deck_id IS NOT NULL AND NOT EXISTS (
+                SELECT 1 FROM kg_deck_terms WHERE deck_id = new.deck_id AND term = new.term);
+            INSERT INTO kg_deck_terms(deck_id, term, count)
+            SELECT new.deck_id, new.term, 1 WHERE new.deck_id IS NOT NULL
+            ON CONFLICT(deck_id, term) DO UPDATE SET count = count + 1;
+        END;
+
+        -- LLM term extraction work queue (ai/kg_extraction.py)
+        -- status: pending | running | done | empty (no terms found) | failed
+        -- method: extractor that closed the entry (local | llm)
+        CREATE TABLE IF NOT EXISTS kg_extraction_queue (
+            card_id     INTEGER PRIMARY KEY,
+            deck_id     INTEGER,
+            status      TEXT DEFAULT 'pending',
+            attempts    INTEGER DEFAULT 0,
+            last_error  TEXT,
+            method      TEXT,
+            updated_at  TEXT DEFAULT (datetime('now'))
+        );
+        CREATE INDEX IF NOT EXISTS idx_kg_extraction_queue_status
+            ON kg_extraction_queue(status, card_id);
 
         CREATE TABLE IF NOT EXISTS kg_definitions (
             term           TEXT PRIMARY KEY,
@@ -90,35 +227,248 @@ def _init_kg_schema(db):
         );
     """)
     db.commit()
+    _migrate_kg_schema(db)
+    _init_fts_schema(db)
+
+
+def _migrate_kg_schema(db):
+    """Add and backfill columns/rollups that older databases lack (idempotent).
+
+    term_norm on kg_card_terms/kg_terms, kg_edges.score,
+    kg_extraction_queue.method and the kg_deck_terms rollup.
+    """
+    for table in ('kg_card_terms', 'kg_terms'):
+        cols = {row[1] for row in db.execute("PRAGMA table_info(%s)" % table).fetchall()}
+        if 'term_norm' not in cols:
+            db.execute("ALTER TABLE %s ADD COLUMN term_norm TEXT" % table)
+        terms = [row[0] for row in db.execute(
+            "SELECT DISTINCT term FROM %s WHERE term_norm IS NULL AND term IS NOT NULL" % table)]
+        if terms:
+            db.executemany("UPDATE %s SET term_norm = ? WHERE term = ?" % table,
+                           [(normalize_term(t), t) for t in terms])
+            logger.info("kg_store: Normalized %d terms in %s", len(terms), table)
+    edge_cols = {row[1] for row in db.execute("PRAGMA table_info(kg_edges)").fetchall()}
+    if edge_cols and 'score' not in edge_cols:
+        db.execute("ALTER TABLE kg_edges ADD COLUMN score REAL")
+    queue_cols = {row[1] for row in db.execute("PRAGMA table_info(kg_extraction_queue)").fetchall()}
+    if queue_cols and 'method' not in queue_cols:
+        db.execute("ALTER TABLE kg_extraction_queue ADD COLUMN method TEXT")
+    # kg_deck_terms is new: roll up the existing card terms once
+    if (_has_table(db, 'kg_deck_terms')
+            and db.execute("SELECT 1 FROM kg_deck_terms LIMIT 1").fetchone() is None
+            and db.execute("SELECT 1 FROM kg_card_terms WHERE deck_id IS NOT NULL LIMIT 1")
+            .fetchone() is not None):
+        db.execute("""
+            INSERT INTO kg_deck_terms (deck_id, term, count)
+            SELECT deck_id, term, COUNT(*) FROM kg_card_terms
+            WHERE deck_id IS NOT NULL GROUP BY deck_id, term
+        """)
+        db.execute("INSERT OR IGNORE INTO kg_dirty_decks (deck_id) "
+                   "SELECT DISTINCT deck_id FROM kg_deck_terms")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_kg_card_terms_norm ON kg_card_terms(term_norm)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_kg_terms_norm ON kg_terms(term_norm)")
+    db.commit()
+
+
+def _has_table(db, name):
+    return db.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = ?", (name,)
+    ).fetchone() is not None
+
+
+def _create_fts(db, name, ddl, triggers, fill=None):
+    """Create one FTS5 table with its sync triggers; False if unsupported.
+
+    *fill* runs once when the table is new so existing rows get indexed.
+    """
+    if _has_table(db, name):
+        return True
+    try:
+        db.execute(ddl)
+    except sqlite3.OperationalError as e:  # no fts5 module / no trigram tokenizer
+        logger.info("kg_store: %s unavailable (%s), using LIKE fallback", name, e)
+        return False
+    db.executescript(triggers)
+    if fill:
+        db.execute(fill)
+    db.commit()
+    return True
+
+
+def _init_fts_schema(db):
+    """Full-text indexes over card_content and the KG term vocabulary.
+
+    card_content_fts      unicode61, diacritics folded — word/prefix hits, BM25
+    card_content_trigram  trigram — substrings inside compounds ("insuffizienz")
+    kg_terms_fts          trigram over term_norm of every distinct
+                          kg_card_terms term (kg_terms itself is only
+                          filled on graph build)
+
+    All are kept in sync by triggers. Builds without FTS5/trigram simply
+    skip them and the search functions fall back to LIKE.
+    """
+    _create_fts(db, 'card_content_fts', """
+        CREATE VIRTUAL TABLE card_content_fts USING fts5(
+            question, answer, content='card_content', content_rowid='card_id',
+            tokenize='unicode61 remove_diacritics 2', prefix='3')
+    """, """
+        CREATE TRIGGER IF NOT EXISTS card_content_fts_ai AFTER INSERT ON card_content BEGIN
+            INSERT INTO card_content_fts(rowid, question, answer)
+            VALUES (new.card_id, new.question, new.answer);
+        END;
+        CREATE TRIGGER IF NOT EXISTS card_content_fts_ad AFTER DELETE ON card_content BEGIN
+            INSERT INTO card_content_fts(card_content_fts, rowid, question, answer)
+            VALUES ('delete', old.card_id, old.question, old.answer);
+        END;
+        CREATE TRIGGER IF NOT EXISTS card_content_fts_au AFTER UPDATE ON card_content BEGIN
+            INSERT INTO card_content_fts(card_content_fts, rowid, question, answer)
+            VALUES ('delete', old.card_id, old.question, old.answer);
+            INSERT INTO card_content_fts(rowid, question, answer)
+            VALUES (new.card_id, new.question, new.answer);
+        END;
+    """, "INSERT INTO card_content_fts(card_content_fts) VALUES ('rebuild')")
+
+    _create_fts(db, 'card_content_trigram', """
+        CREATE VIRTUAL TABLE card_content_trigram USING fts5(
+            question, answer, content='card_content', content_rowid='card_id',
+            tokenize='trigram')
+    """, """
+        CREATE TRIGGER IF NOT EXISTS card_content_tri_ai AFTER INSERT ON card_content BEGIN
+            INSERT INTO card_content_trigram(rowid, question, answer)
+            VALUES (new.card_id, new.question, new.answer);
+        END;
+        CREATE TRIGGER IF NOT EXISTS card_content_tri_ad AFTER DELETE ON card_content BEGIN
+            INSERT INTO card_content_trigram(card_content_trigram, rowid, question, answer)
+            VALUES ('delete', old.card_id, old.question, old.answer);
+        END;
+        CREATE TRIGGER IF NOT EXISTS card_content_tri_au AFTER UPDATE ON card_content BEGIN
+            INSERT INTO card_content_trigram(card_content_trigram, rowid, question, answer)
+            VALUES ('delete', old.card_id, old.question, old.answer);
+            INSERT INTO card_content_trigram(rowid, question, answer)
+            VALUES (new.card_id, new.question, new.answer);
+        END;
+    """, "INSERT INTO card_content_trigram(card_content_trigram) VALUES ('rebuild')")
+
+    # A term enters the index with its first card and leaves with its last one.
+    _create_fts(db, 'kg_terms_fts', """
+        CREATE VIRTUAL TABLE kg_terms_fts USING fts5(
+            term UNINDEXED, term_norm, tokenize='trigram')
+    """, """
+        CREATE TRIGGER IF NOT EXISTS kg_card_terms_fts_ai AFTER INSERT ON kg_card_terms
+        WHEN NOT EXISTS (SELECT 1 FROM kg_card_terms
+                         WHERE term = new.term AND rowid != new.rowid) BEGIN
+            INSERT INTO kg_terms_fts(term, term_norm) VALUES (new.term, new.term_norm);
+        END;
+        CREATE TRIGGER IF NOT EXISTS kg_card_terms_fts_ad AFTER DELETE ON kg_card_terms
+        WHEN NOT EXISTS (SELECT 1 FROM kg_card_terms WHERE term = old.term) BEGIN
+            DELETE FROM kg_terms_fts WHERE term = old.term;
+        END;
+    """, """
+        INSERT INTO kg_terms_fts(term, term_norm)
+        SELECT term, MIN(term_norm) FROM kg_card_terms GROUP BY term
+    """)
+
+
+def _fts_prefix_query(text):
+    """FTS5 query: every word of *text* as a prefix, all required."""
+    return ' '.join('"%s"*' % w for w in re.findall(r'\w+', text or ''))
+
+
+def _fts_phrase(text):
+    """FTS5 query for *text* as one literal phrase (substring for trigram)."""
+    return '"%s"' % (text or '').replace('"', '""')
+
+
+def _term_match(db, query):
+    """(SQL, params) selecting (term, rank) of vocabulary terms containing *query*.
+
+    Trigram seeks need >= 3 characters; shorter queries and builds without
+    FTS5 fall back to LIKE over kg_card_terms.
+    """
+    norm = normalize_term(query)
+    if len(norm) >= 3 and _has_table(db, 'kg_terms_fts'):
+        return ("SELECT term, rank FROM kg_terms_fts WHERE kg_terms_fts MATCH ?",
+                (_fts_phrase(norm),))
+    return ("SELECT DISTINCT term, 0 AS rank FROM kg_card_terms WHERE term LIKE ?",
+            ("%%%s%%" % query,))
 
 
 # ---------------------------------------------------------------------------
 #  DB connection
 # ---------------------------------------------------------------------------
 
-def _get_db():
-    """Return (and lazily initialise) the shared SQLite connection."""
-    global _db
-    if _db is not None:
-        return _db
-
+def _db_path():
     try:
         try:
             from .card_sessions import _DB_PATH
         except ImportError:
             from card_sessions import _DB_PATH
-        db_path = _DB_PATH
+        return _DB_PATH
     except ImportError:
         import os
-        db_path = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)), "card_sessions.db"
-        )
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), "card_sessions.db")
+
+
+def _pool():
+    """ConnectionPool of the shared database file, or None while _db is injected."""
+    if _db is not None:
+        return None
+    pool = db_pool.get_pool(_db_path())
+    pool.initialize('kg_store', _init_kg_schema)
+    return pool
 
-    _db = sqlite3.connect(db_path, check_same_thread=False)
-    _db.row_factory = sqlite3.Row
-    _db.execute("PRAGMA journal_mode=WAL")
-    _init_kg_schema(_db)
-    return _db
+
+def _get_db():
+    """Connection for the calling thread: the injected ``_db``, else the pool's
+    writer connection inside a write and this thread's reader otherwise."""
+    pool = _pool()
+    return _db if pool is None else pool.connection()
+
+
+_writes = db_pool.writes(_pool)
+
+
+def _graph_write(fn):
+    """@_writes for kg_terms / kg_edges writers; bumps the graph generation
+    once the write is committed, so no reader caches pre-commit data under
+    the new generation."""
+    write = _writes(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return write(*args, **kwargs)
+        finally:
+            bump_graph_generation()
+    return wrapper
+
+
+def run_write(fn, *args, **kwargs):
+    """Run ``fn(*args, **kwargs)`` as one write (for callers outside this module).
+
+    Waits for the commit without a time limit — for the KG builder and
+    extraction worker threads, which need the result even behind a long
+    job (the @_writes functions raise WriteTimeout instead).
+    """
+    pool = _pool()
+    return fn(*args, **kwargs) if pool is None else pool.submit(fn, *args, **kwargs).result()
+
+
+def flush(timeout=None):
+    """Wait until all queued writes are committed. False on timeout."""
+    pool = _pool()
+    return True if pool is None else pool.flush(timeout)
+
+
+def graph_generation():
+    """Counter identifying the current contents of kg_terms and kg_edges."""
+    return _graph_generation
+
+
+def bump_graph_generation():
+    """Invalidate in-memory graph snapshots after kg_terms / kg_edges changed."""
+    global _graph_generation
+    _graph_generation += 1
 
 
 # ---------------------------------------------------------------------------
@@ -134,24 +484,63 @@ def save_card_terms(card_id, terms, deck_id, definition_terms=None):
         deck_id: Anki deck ID (int).
         definition_terms: Optional subset of terms that are definitions.
     """
-    db = _get_db()
-    definition_set = set(definition_terms or [])
     try:
-        for term in terms:
-            db.execute(
-                """
-                INSERT INTO kg_card_terms (card_id, term, deck_id, is_definition)
-                VALUES (?, ?, ?, ?)
-                ON CONFLICT(card_id, term) DO UPDATE SET
-                    deck_id       = excluded.deck_id,
-                    is_definition = excluded.is_definition
-                """,
-                (int(card_id), term, int(deck_id), 1 if term in definition_set else 0),
-            )
-        db.commit()
+        save_card_terms_bulk([(card_id, terms, deck_id, definition_terms)])
     except sqlite3.Error as e:
         logger.error("kg_store: Error saving card terms for card %s: %s", card_id, e)
+
+
+@_writes
+def save_card_terms_bulk(cards):
+    """Upsert the terms of many cards in one transaction.
+
+    Args:
+        cards: Iterable of (card_id, terms, deck_id) or
+            (card_id, terms, deck_id, definition_terms) tuples.
+
+    Returns:
+        Set of the terms written (for update_term_frequencies(terms=...)).
+        Rolls back and re-raises sqlite3.Error.
+    """
+    db = _get_db()
+    try:
+        written = _insert_card_terms(db, cards)
+        db.commit()
+    except sqlite3.Error:
         db.rollback()
+        raise
+    return written
+
+
+def _insert_card_terms(db, cards):
+    """executemany upsert behind save_card_terms_bulk (no commit)."""
+    rows = []
+    written = set()
+    for card in cards:
+        card_id, terms, deck_id = card[:3]
+        definition_set = set(card[3] or []) if len(card) > 3 else set()
+        for term in terms:
+            rows.append((int(card_id), term, normalize_term(term), int(deck_id),
+                         1 if term in definition_set else 0))
+            written.add(term)
+    if rows:
+        db.executemany(
+            """
+            INSERT INTO kg_card_terms (card_id, term, term_norm, deck_id, is_definition)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(card_id, term) DO UPDATE SET
+                deck_id       = excluded.deck_id,
+                is_definition = excluded.is_definition
+            """,
+            rows,
+        )
+    return written
+
+
+def get_cards_with_terms():
+    """Set of card_ids that have at least one extracted term."""
+    db = _get_db()
+    return {r[0] for r in db.execute("SELECT DISTINCT card_id FROM kg_card_terms")}
 
 
 def get_card_terms(card_id):
@@ -163,6 +552,7 @@ def get_card_terms(card_id):
     return [r["term"] for r in rows]
 
 
+@_writes
 def delete_card_terms(card_id):
     """Remove all terms for a card."""
     db = _get_db()
@@ -183,27 +573,218 @@ def get_term_card_ids(term):
     return [r["card_id"] for r in rows]
 
 
+# ---------------------------------------------------------------------------
+#  Term extraction queue
+# ---------------------------------------------------------------------------
+
+@_writes
+def enqueue_extraction(cards, retry_failed_after=86400):
+    """Queue cards that still need LLM term extraction.
+
+    One set-based INSERT … SELECT picks the cards that have cached content
+    (card_content) but no kg_card_terms. Cards already queued keep their
+    state, except ``done`` cards whose terms were deleted since and
+    ``failed`` cards older than *retry_failed_after* seconds, which are
+    queued again.
+
+    Args:
+        cards: Iterable of (card_id, deck_id) tuples (the live collection).
+
+    Returns:
+        Number of cards added or re-queued.
+    """
+    db = _get_db()
+    try:
+        db.execute("CREATE TEMP TABLE IF NOT EXISTS kg_extraction_candidates "
+                   "(card_id INTEGER PRIMARY KEY, deck_id INTEGER)")
+        db.execute("DELETE FROM kg_extraction_candidates")
+        db.executemany("INSERT OR REPLACE INTO kg_extraction_candidates (card_id, deck_id) "
+                       "VALUES (?, ?)", ((int(c), int(d or 0)) for c, d in cards))
+        cur = db.execute(
+            """
+            INSERT INTO kg_extraction_queue (card_id, deck_id)
+            SELECT c.card_id, c.deck_id FROM kg_extraction_candidates c
+            JOIN card_content cc ON cc.card_id = c.card_id
+            WHERE NOT EXISTS (SELECT 1 FROM kg_card_terms t WHERE t.card_id = c.card_id)
+            ON CONFLICT(card_id) DO UPDATE SET
+                deck_id = excluded.deck_id, status = 'pending', attempts = 0,
+                last_error = NULL, updated_at = datetime('now')
+            WHERE kg_extraction_queue.status = 'done'
+               OR (kg_extraction_queue.status = 'failed'
+                   AND kg_extraction_queue.updated_at < datetime('now', ?))
+            """,
+            ('%+d seconds' % -int(retry_failed_after),),
+        )
+        queued = cur.rowcount
+        # Claims of a crashed or killed run go back to the queue
+        db.execute("UPDATE kg_extraction_queue SET status = 'pending' WHERE status = 'running'")
+        db.execute("DELETE FROM kg_extraction_candidates")
+        db.commit()
+        return queued
+    except sqlite3.Error:
+        db.rollback()
+        raise
+
+
+@_writes
+def claim_extraction_batch(limit, max_attempts=3):
+    """Mark up to *limit* pending cards as running and return them.
+
+    Returns:
+        List of dicts with card_id, deck_id, question, answer (the input
+        format of extract_terms_batch), in card_id order.
+    """
+    db = _get_db()
+    rows = db.execute(
+        """
+        SELECT q.card_id, q.deck_id, cc.question, cc.answer
+        FROM kg_extraction_queue q JOIN card_content cc ON cc.card_id = q.card_id
+        WHERE q.status = 'pending' AND q.attempts < ?
+        ORDER BY q.card_id LIMIT ?
+        """,
+        (int(max_attempts), int(limit)),
+    ).fetchall()
+    claimed = [{'card_id': r[0], 'deck_id': r[1], 'question': r[2] or '', 'answer': r[3] or ''}
+               for r in rows]
+    if claimed:
+        db.executemany(
+            "UPDATE kg_extraction_queue SET status = 'running', updated_at = datetime('now') "
+            "WHERE card_id = ?", [(c['card_id'],) for c in claimed])
+        db.commit()
+    return claimed
+
+
+@_writes
+def finish_extraction(cards, results, method='llm'):
+    """Store the terms of an extracted batch and close its queue entries.
+
+    Terms and statuses are written in one transaction: cards with terms
+    become ``done``, cards the extractor found nothing in become ``empty``.
+
+    Args:
+        cards: Claimed card dicts (card_id, deck_id) of the batch.
+        results: {card_id: [term, ...]} from extract_terms_batch.
+        method: Recorded in the queue ('llm' or 'local').
+
+    Returns:
+        Set of terms written.
+    """
+    db = _get_db()
+    found = [(c['card_id'], results[c['card_id']], c.get('deck_id') or 0)
+             for c in cards if results.get(c['card_id'])]
+    with_terms = {cid for cid, _, _ in found}
+    try:
+        written = _insert_card_terms(db, found)
+        db.executemany(
+            "UPDATE kg_extraction_queue SET status = ?, method = ?, last_error = NULL, "
+            "updated_at = datetime('now') WHERE card_id = ?",
+            [('done' if c['card_id'] in with_terms else 'empty', method, c['card_id'])
+             for c in cards])
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+    return written
+
+
+@_writes
+def release_extraction(card_ids, error=None, failed=False, max_attempts=3):
+    """Return claimed cards to the queue.
+
+    Args:
+        error: Reason stored in last_error.
+        failed: Count this as a failed attempt; cards reaching
+            *max_attempts* become ``failed`` (retried after a cooldown,
+            see enqueue_extraction).
+    """
+    db = _get_db()
+    try:
+        db.executemany(
+            """
+            UPDATE kg_extraction_queue SET
+                attempts   = attempts + ?1,
+                status     = CASE WHEN attempts + ?1 >= ?2 THEN 'failed' ELSE 'pending' END,
+                last_error = ?3,
+                updated_at = datetime('now')
+            WHERE card_id = ?4
+            """,
+            [(1 if failed else 0, int(max_attempts), error, int(cid)) for cid in card_ids],
+        )
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+
+
+def extraction_queue_stats(by_method=False):
+    """{status: card count} of the extraction queue ({(status, method): count} with *by_method*)."""
+    db = _get_db()
+    if by_method:
+        return {(r[0], r[1]): r[2] for r in db.execute(
+            "SELECT status, method, COUNT(*) FROM kg_extraction_queue GROUP BY status, method")}
+    return {r[0]: r[1] for r in db.execute(
+        "SELECT status, COUNT(*) FROM kg_extraction_queue GROUP BY status")}
+
+
 # ---------------------------------------------------------------------------
 #  Term Frequencies
 # ---------------------------------------------------------------------------
 
-def update_term_frequencies():
-    """Recompute term frequencies from kg_card_terms and upsert into kg_terms."""
+_FREQUENCY_UPSERT = """
+    INSERT INTO kg_terms (term, term_norm, frequency)
+    SELECT term, MIN(term_norm), COUNT(*) AS frequency
+    FROM kg_card_terms
+    %s
+    GROUP BY term
+    ON CONFLICT(term) DO UPDATE SET
+        frequency = excluded.frequency,
+        term_norm = COALESCE(kg_terms.term_norm, excluded.term_norm)
+"""
+
+# Terms that lost their last card get no row from the GROUP BY above
+_FREQUENCY_ZERO = """
+    UPDATE kg_terms SET frequency = 0
+    WHERE frequency != 0 AND %s
+      AND NOT EXISTS (SELECT 1 FROM kg_card_terms c WHERE c.term = kg_terms.term)
+"""
+
+
+@_graph_write
+def update_term_frequencies(terms=None):
+    """Recompute term frequencies from kg_card_terms and upsert into kg_terms.
+
+    Terms without any card left keep their kg_terms row (embedding,
+    definition) with frequency 0.
+
+    Args:
+        terms: Only recount these terms (written or removed since the last
+            recount, e.g. the set returned by save_card_terms_bulk); None
+            recounts the whole vocabulary.
+    """
     db = _get_db()
     try:
-        db.execute("""
-            INSERT INTO kg_terms (term, frequency)
-            SELECT term, COUNT(*) AS frequency
-            FROM kg_card_terms
-            GROUP BY term
-            ON CONFLICT(term) DO UPDATE SET frequency = excluded.frequency
-        """)
+        if terms is None:
+            db.execute(_FREQUENCY_UPSERT % "WHERE 1")
+            db.execute(_FREQUENCY_ZERO % "1")
+        else:
+            terms = list(terms)
+            for i in range(0, len(terms), 500):
+                chunk = terms[i:i + 500]
+                where = "term IN (%s)" % ",".join("?" * len(chunk))
+                db.execute(_FREQUENCY_UPSERT % ("WHERE " + where), chunk)
+                db.execute(_FREQUENCY_ZERO % where, chunk)
         db.commit()
     except sqlite3.Error as e:
         logger.error("kg_store: Error updating term frequencies: %s", e)
         db.rollback()
 
 
+def load_term_vocabulary():
+    """Set of normalized kg_terms keys (TermExtractor.score vocabulary)."""
+    db = _get_db()
+    return {r[0] for r in db.execute("SELECT term_norm FROM kg_terms WHERE term_norm IS NOT NULL")}
+
+
 def get_term_frequency(term):
     """Return frequency for a single term, or 0 if not found."""
     db = _get_db()
@@ -217,6 +798,7 @@ def get_term_frequency(term):
 #  Edges
 # ---------------------------------------------------------------------------
 
+@_graph_write
 def save_edges(edges_list):
     """Insert or replace edges.
 
@@ -225,21 +807,64 @@ def save_edges(edges_list):
     """
     db = _get_db()
     try:
-        for term_a, term_b, weight in edges_list:
-            db.execute(
-                """
-                INSERT INTO kg_edges (term_a, term_b, weight)
-                VALUES (?, ?, ?)
-                ON CONFLICT(term_a, term_b) DO UPDATE SET weight = excluded.weight
-                """,
-                (term_a, term_b, weight),
-            )
+        db.executemany(
+            """
+            INSERT INTO kg_edges (term_a, term_b, weight)
+            VALUES (?, ?, ?)
+            ON CONFLICT(term_a, term_b) DO UPDATE SET weight = excluded.weight
+            """,
+            edges_list,
+        )
         db.commit()
     except sqlite3.Error as e:
         logger.error("kg_store: Error saving edges: %s", e)
         db.rollback()
 
 
+def _swap_edges(db, rows):
+    """Replace kg_edges by a freshly filled table (no commit).
+
+    *rows* is an iterable of (term_a, term_b, weight, score) or a SELECT
+    statement producing them. The new table is filled without indexes,
+    then renamed over kg_edges and indexed once — cheaper than deleting
+    and re-inserting every row through the primary-key and term_b indexes.
+    """
+    db.execute("DROP TABLE IF EXISTS kg_edges_staging")
+    db.execute("""
+        CREATE TABLE kg_edges_staging (
+            term_a     TEXT,
+            term_b     TEXT,
+            weight     INTEGER,
+            score      REAL,
+            PRIMARY KEY (term_a, term_b)
+        )
+    """)
+    insert = "INSERT OR REPLACE INTO kg_edges_staging (term_a, term_b, weight, score) "
+    if isinstance(rows, str):
+        db.execute(insert + rows)
+    else:
+        db.executemany(insert + "VALUES (?, ?, ?, ?)", rows)
+    db.execute("DROP TABLE kg_edges")
+    db.execute("ALTER TABLE kg_edges_staging RENAME TO kg_edges")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_kg_edges_term_b ON kg_edges(term_b)")
+
+
+@_graph_write
+def replace_all_edges(edges_list):
+    """Atomically replace every edge.
+
+    Args:
+        edges_list: Iterable of (term_a, term_b, weight, score) tuples.
+    """
+    db = _get_db()
+    try:
+        _swap_edges(db, edges_list)
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+
+
 def get_all_edges(min_weight=1):
     """Return all edges with weight >= min_weight as list of dicts."""
     db = _get_db()
@@ -265,34 +890,50 @@ def get_connected_terms(term):
 
 
 def get_term_expansions(term, max_terms=5, db=None):
-    """Get co-occurrence expansions for a term, sorted by edge weight.
+    """Get co-occurrence expansions for a term, best edge first.
+
+    Edges are ranked by their NPMI score (GraphIndexBuilder), then by
+    weight; edges without a score (legacy rebuilds) rank by weight alone.
 
-    Returns list of (term, weight) tuples sorted by weight descending.
+    Returns list of (term, weight) tuples; weight is the shared-card count.
     """
     conn = db or _get_db()
     rows = conn.execute(
-        "SELECT term_b, weight FROM kg_edges WHERE term_a = ? "
-        "UNION "
-        "SELECT term_a, weight FROM kg_edges WHERE term_b = ? "
-        "ORDER BY weight DESC LIMIT ?",
-        (term, term, max_terms)
+        "SELECT other, weight FROM ("
+        "  SELECT term_b AS other, weight, score FROM kg_edges WHERE term_a = ?1"
+        "  UNION ALL"
+        "  SELECT term_a, weight, score FROM kg_edges WHERE term_b = ?1"
+        ") ORDER BY COALESCE(score, 0) DESC, weight DESC LIMIT ?2",
+        (term, max_terms)
     ).fetchall()
     return [(r[0], r[1]) for r in rows]
 
 
 def exact_term_lookup(query, db=None):
-    """Case-insensitive exact match in kg_terms.
+    """Case-insensitive exact match in kg_terms (index seek on term_norm).
 
-    Returns the canonical term string if found, None otherwise.
+    Returns the canonical term string if found, None otherwise. When
+    several spellings share a key the most frequent one wins.
     """
     conn = db or _get_db()
     row = conn.execute(
-        "SELECT term FROM kg_terms WHERE LOWER(term) = LOWER(?) LIMIT 1",
-        (query,)
+        "SELECT term FROM kg_terms WHERE term_norm = ? ORDER BY frequency DESC LIMIT 1",
+        (normalize_term(query),)
     ).fetchone()
     return row[0] if row else None
 
 
+def prefix_term_lookup(prefix, limit=3, db=None):
+    """Most frequent kg_terms starting with *prefix* (case-insensitive range seek)."""
+    conn = db or _get_db()
+    rows = conn.execute(
+        "SELECT term FROM kg_terms WHERE term_norm >= ? AND term_norm < ? "
+        "ORDER BY frequency DESC LIMIT ?",
+        _prefix_bounds(prefix) + (int(limit),)
+    ).fetchall()
+    return [r[0] for r in rows]
+
+
 def load_term_embeddings(db=None):
     """Load all term embeddings from kg_terms.
 
@@ -305,10 +946,26 @@ def load_term_embeddings(db=None):
     return {r[0]: r[1] for r in rows}
 
 
+def get_term_embeddings_watermark(db=None):
+    """Return (row_count, rowid sum) of the embedded kg_terms rows.
+
+    Terms are embedded once and never re-embedded in place, so this changes
+    whenever a term gains an embedding or an embedded term is deleted; used
+    to decide whether the on-disk term index snapshot is still current.
+    Only reads record headers, not the embedding BLOBs.
+    """
+    conn = db or _get_db()
+    row = conn.execute(
+        "SELECT COUNT(*), TOTAL(rowid) FROM kg_terms WHERE embedding IS NOT NULL"
+    ).fetchone()
+    return row[0], row[1]
+
+
 # ---------------------------------------------------------------------------
 #  Definitions
 # ---------------------------------------------------------------------------
 
+@_writes
 def save_definition(term, definition, source_card_ids, generated_by):
     """Insert or replace a term definition.
 
@@ -370,6 +1027,8 @@ def get_definition(term):
 def search_terms_exact(query):
     """Return terms matching exact or prefix match against kg_card_terms.
 
+    Case-insensitive (see normalize_term); served by idx_kg_card_terms_norm.
+
     Args:
         query: Search string.
 
@@ -378,8 +1037,8 @@ def search_terms_exact(query):
     """
     db = _get_db()
     rows = db.execute(
-        "SELECT DISTINCT term FROM kg_card_terms WHERE term = ? OR term LIKE ?",
-        (query, query + "%"),
+        "SELECT DISTINCT term FROM kg_card_terms WHERE term_norm >= ? AND term_norm < ?",
+        _prefix_bounds(query),
     ).fetchall()
     return [r["term"] for r in rows]
 
@@ -397,6 +1056,7 @@ def get_unembedded_terms():
     return [r["term"] for r in rows]
 
 
+@_writes
 def save_term_embedding(term, embedding_bytes):
     """Save embedding BLOB for a term (upserts the kg_terms row if needed).
 
@@ -408,11 +1068,11 @@ def save_term_embedding(term, embedding_bytes):
     try:
         db.execute(
             """
-            INSERT INTO kg_terms (term, frequency, embedding)
-            VALUES (?, 0, ?)
+            INSERT INTO kg_terms (term, term_norm, frequency, embedding)
+            VALUES (?, ?, 0, ?)
             ON CONFLICT(term) DO UPDATE SET embedding = excluded.embedding
             """,
-            (term, embedding_bytes),
+            (term, normalize_term(term), embedding_bytes),
         )
         db.commit()
     except sqlite3.Error as e:
@@ -531,44 +1191,87 @@ def get_graph_status():
 #  Deck Cross-Links
 # ---------------------------------------------------------------------------
 
-def compute_deck_links(min_shared=3, max_links=200):
-    """Compute cross-links between decks based on shared terms.
-
-    Returns the number of links computed.
+def compute_deck_links(min_shared=3, max_links=None, full=False):
+    """Update cross-links between decks based on shared terms.
+
+    Each deck is its sparse term vector in kg_deck_terms (term -> card
+    count), which the kg_card_terms triggers keep current. Only decks in
+    kg_dirty_decks — a term entered or left the deck since the last run —
+    are compared against the others; links between two clean decks are
+    kept. Every pair sharing at least *min_shared* terms is stored, with
+    the five terms most strongly shared (by the smaller of the two card
+    counts) as top_terms. Pass ``full=True`` after changing *min_shared*.
+    *max_links* is accepted for compatibility and ignored: the cap is
+    applied when reading, by get_deck_cross_links(max_links).
+
+    The vectors are read and compared on the calling thread's reader; only
+    the link swap runs on the writer (run_write). It clears the dirty marks
+    that were read, except for decks whose terms changed in the meantime —
+    those stay marked for the next run.
+
+    Returns the number of links stored.
     """
     db = _get_db()
-    db.execute("DELETE FROM kg_deck_links")
-
-    rows = db.execute("""
-        SELECT a.deck_id AS deck_a, b.deck_id AS deck_b,
-               COUNT(DISTINCT a.term) AS shared_terms,
-               GROUP_CONCAT(DISTINCT a.term) AS terms
-        FROM kg_card_terms a
-        JOIN kg_card_terms b ON a.term = b.term AND a.deck_id < b.deck_id
-        WHERE a.deck_id IS NOT NULL AND b.deck_id IS NOT NULL
-        GROUP BY a.deck_id, b.deck_id
-        HAVING shared_terms >= ?
-        ORDER BY shared_terms DESC
-        LIMIT ?
-    """, (min_shared, max_links)).fetchall()
-
-    for r in rows:
-        all_terms = r["terms"].split(",") if r["terms"] else []
-        top = all_terms[:5]
-        db.execute(
-            "INSERT OR REPLACE INTO kg_deck_links VALUES (?, ?, ?, ?)",
-            (r["deck_a"], r["deck_b"], r["shared_terms"], json.dumps(top))
-        )
-    db.commit()
-    logger.info("compute_deck_links: %d links computed (min_shared=%d)", len(rows), min_shared)
-    return len(rows)
+    marked = {r[0] for r in db.execute("SELECT deck_id FROM kg_dirty_decks")}
+    dirty = set(marked)
+    if full:
+        dirty.update(r[0] for r in db.execute("SELECT DISTINCT deck_id FROM kg_deck_terms"))
+
+    links = {}
+    vectors = {}
+    if dirty:
+        for deck_id, term, count in db.execute("SELECT deck_id, term, count FROM kg_deck_terms"):
+            vectors.setdefault(deck_id, {})[term] = count
+        for deck_id in sorted(d for d in dirty if d in vectors):
+            vec = vectors[deck_id]
+            for other, other_vec in vectors.items():
+                if other == deck_id or (other in dirty and other < deck_id):
+                    continue  # pair already handled from the other side
+                shared = vec.keys() & other_vec.keys()
+                if len(shared) >= min_shared:
+                    top = heapq.nlargest(5, shared, key=lambda t: (min(vec[t], other_vec[t]), t))
+                    links[(min(deck_id, other), max(deck_id, other))] = (len(shared), top)
+
+    def apply():
+        wdb = _get_db()
+        try:
+            if full:
+                wdb.execute("DELETE FROM kg_deck_links")
+            elif dirty:
+                marks = ','.join('?' * len(dirty))
+                wdb.execute("DELETE FROM kg_deck_links WHERE deck_a IN (%s) OR deck_b IN (%s)"
+                            % (marks, marks), list(dirty) * 2)
+            if marked:
+                current = {}
+                marks = ','.join('?' * len(marked))
+                for deck_id, term, count in wdb.execute(
+                        "SELECT deck_id, term, count FROM kg_deck_terms WHERE deck_id IN (%s)"
+                        % marks, list(marked)):
+                    current.setdefault(deck_id, {})[term] = count
+                wdb.executemany("DELETE FROM kg_dirty_decks WHERE deck_id = ?",
+                                [(d,) for d in marked if current.get(d) == vectors.get(d)])
+            wdb.executemany(
+                "INSERT OR REPLACE INTO kg_deck_links VALUES (?, ?, ?, ?)",
+                [(a, b, n, json.dumps(top, ensure_ascii=False)) for (a, b), (n, top) in links.items()],
+            )
+            wdb.commit()
+        except sqlite3.Error:
+            wdb.rollback()
+            raise
+        return wdb.execute("SELECT COUNT(*) FROM kg_deck_links").fetchone()[0]
+
+    total = run_write(apply)
+    logger.info("compute_deck_links: %d dirty decks, %d links updated, %d total (min_shared=%d)",
+                len(dirty), len(links), total, min_shared)
+    return total
 
 
-def get_deck_cross_links():
-    """Return all deck cross-links for graph rendering."""
+def get_deck_cross_links(max_links=200):
+    """Return the *max_links* strongest deck cross-links for graph rendering."""
     db = _get_db()
     rows = db.execute(
-        "SELECT deck_a, deck_b, shared_terms, top_terms FROM kg_deck_links"
+        "SELECT deck_a, deck_b, shared_terms, top_terms FROM kg_deck_links "
+        "ORDER BY shared_terms DESC LIMIT ?", (int(max_links),)
     ).fetchall()
     return [
         {
@@ -586,6 +1289,7 @@ def get_deck_cross_links():
 #  Card Content Cache
 # ---------------------------------------------------------------------------
 
+@_writes
 def save_card_content(card_id, question, answer, deck_name):
     """Cache card question/answer text for offline search and benchmark use.
 
@@ -616,8 +1320,54 @@ def save_card_content(card_id, question, answer, deck_name):
         db.rollback()
 
 
+@_writes
+def save_card_content_bulk(rows):
+    """Cache many cards' question/answer text in one transaction.
+
+    Rows whose question, answer and deck are unchanged are not rewritten
+    (the background indexer calls this for every card on every start).
+
+    Args:
+        rows: Iterable of (card_id, question, answer, deck_name).
+
+    Returns:
+        Number of rows inserted or changed.
+    """
+    now = datetime.now().isoformat()
+    params = [(int(cid), q, a, d, now) for cid, q, a, d in rows]
+    if not params:
+        return 0
+    db = _get_db()
+    try:
+        cur = db.executemany(
+            """
+            INSERT INTO card_content (card_id, question, answer, deck_name, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(card_id) DO UPDATE SET
+                question   = excluded.question,
+                answer     = excluded.answer,
+                deck_name  = excluded.deck_name,
+                updated_at = excluded.updated_at
+            WHERE question IS NOT excluded.question
+               OR answer IS NOT excluded.answer
+               OR deck_name IS NOT excluded.deck_name
+            """,
+            params,
+        )
+        db.commit()
+    except sqlite3.Error as e:
+        logger.error("kg_store: Error saving card content for %d cards: %s", len(params), e)
+        db.rollback()
+        return 0
+    return cur.rowcount  # direct changes only, not the FTS triggers
+
+
 def search_card_content(query_text, limit=20):
-    """Simple LIKE search on cached card question+answer fields.
+    """Full-text search on cached card question+answer fields.
+
+    Word/prefix matches (diacritics folded) come first, ranked by BM25;
+    remaining slots are filled with substring matches from the trigram
+    index. Falls back to LIKE when FTS5 is unavailable.
 
     Args:
         query_text: Search string (partial match).
@@ -627,17 +1377,48 @@ def search_card_content(query_text, limit=20):
         List of dicts with keys: card_id, question, answer, deck_name.
     """
     db = _get_db()
-    pattern = "%%%s%%" % query_text.replace("%", "\\%")
-    rows = db.execute(
-        """
-        SELECT card_id, question, answer, deck_name
-        FROM card_content
-        WHERE question LIKE ? OR answer LIKE ?
-        LIMIT ?
-        """,
-        (pattern, pattern, limit),
-    ).fetchall()
-    return [dict(r) for r in rows]
+    if not _has_table(db, 'card_content_fts'):
+        pattern = "%%%s%%" % query_text.replace("%", "\\%")
+        rows = db.execute(
+            """
+            SELECT card_id, question, answer, deck_name
+            FROM card_content
+            WHERE question LIKE ? OR answer LIKE ?
+            LIMIT ?
+            """,
+            (pattern, pattern, limit),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    results = []
+    match = _fts_prefix_query(query_text)
+    if match:
+        results = [dict(r) for r in db.execute(
+            """
+            SELECT c.card_id, c.question, c.answer, c.deck_name
+            FROM card_content_fts f JOIN card_content c ON c.card_id = f.rowid
+            WHERE card_content_fts MATCH ?
+            ORDER BY bm25(card_content_fts)
+            LIMIT ?
+            """,
+            (match, limit),
+        ).fetchall()]
+    if len(results) < limit and len(query_text.strip()) >= 3 \
+            and _has_table(db, 'card_content_trigram'):
+        seen = {r["card_id"] for r in results}
+        for r in db.execute(
+            """
+            SELECT c.card_id, c.question, c.answer, c.deck_name
+            FROM card_content_trigram f JOIN card_content c ON c.card_id = f.rowid
+            WHERE card_content_trigram MATCH ?
+            ORDER BY bm25(card_content_trigram)
+            LIMIT ?
+            """,
+            (_fts_phrase(query_text.strip()), limit),
+        ):
+            if r["card_id"] not in seen and len(results) < limit:
+                results.append(dict(r))
+    return results
 
 
 def get_card_content(card_id):
@@ -660,10 +1441,26 @@ def get_all_card_content():
 
 
 def search_decks_by_term(query):
-    """Find deck_ids that contain cards with the given term (exact or partial match)."""
+    """Find deck_ids that contain cards with the given term (exact or partial match).
+
+    Ordered by the BM25 rank of the best matching term.
+    """
     db = _get_db()
+    match_sql, params = _term_match(db, query)
     rows = db.execute(
-        "SELECT DISTINCT deck_id FROM kg_card_terms WHERE term LIKE ?",
-        (f"%{query}%",)
+        "SELECT ct.deck_id FROM (%s) m JOIN kg_card_terms ct ON ct.term = m.term "
+        "GROUP BY ct.deck_id ORDER BY MIN(m.rank)" % match_sql,
+        params
     ).fetchall()
     return [r["deck_id"] for r in rows if r["deck_id"]]
+
+
+def search_card_ids_by_term(query, limit=None):
+    """Card ids whose KG terms contain *query*, best BM25 term rank first."""
+    db = _get_db()
+    match_sql, params = _term_match(db, query)
+    sql = ("SELECT ct.card_id FROM (%s) m JOIN kg_card_terms ct ON ct.term = m.term "
+           "GROUP BY ct.card_id ORDER BY MIN(m.rank)" % match_sql)
+    if limit:
+        sql += " LIMIT %d" % int(limit)
+    return [r["card_id"] for r in db.execute(sql, params).fetchall()]
@@ -17,3 +17,16 @@ if PROJECT_ROOT not in sys.path:
 def tmp_db(tmp_path):
     """Provides a temporary SQLite database path for storage tests."""
     return str(tmp_path / "test_sessions.db")
+
+
+@pytest.fixture
+def kg_db(monkeypatch):
+    """Empty in-memory Knowledge Graph database injected into storage.kg_store."""
+    import sqlite3
+    import storage.kg_store as kg
+    db = sqlite3.connect(":memory:", check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    kg._init_kg_schema(db)
+    monkeypatch.setattr(kg, "_db", db)
+    yield db
+    db.close()
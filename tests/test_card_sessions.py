@@ -4,6 +4,7 @@ These tests use a real temporary SQLite database (not mocks).
 """
 
 import json
+import threading
 import storage.card_sessions as cs
 
 
@@ -299,3 +300,209 @@ class TestEdgeCases:
         # steps and citations are present — either raw string or parsed; crucially no exception
         assert "steps" in msg
         assert "citations" in msg
+
+
+class TestWriteBehindMessages:
+    """save_message() through the connection pool: queued, coalesced, then committed."""
+
+    def setup_method(self):
+        import tempfile
+        self._dir = tempfile.mkdtemp()
+        self._orig_path = cs._DB_PATH
+        cs._DB_PATH = self._dir + "/card_sessions.db"
+        cs._db = None
+        cs._card_decks.clear()
+
+    def teardown_method(self):
+        from storage import db_pool
+        db_pool.close_pool(cs._DB_PATH)
+        cs._DB_PATH = self._orig_path
+        cs._card_decks.clear()
+
+    def _hold_writer(self):
+        """Block the writer so the following saves queue up behind it."""
+        import threading
+        gate = threading.Event()
+        cs._pool().submit(gate.wait)
+        return gate
+
+    def test_queued_messages_are_committed_together(self, monkeypatch):
+        monkeypatch.setattr(cs, "_get_decks_for_cards", lambda ids: {cid: (7, "Anatomie") for cid in ids})
+        gate = self._hold_writer()
+        for i in range(6):
+            assert cs.save_message(800 + i % 2, {"text": f"Msg {i}", "sender": "user"}) is True
+        assert len(cs._pending_messages) == 6
+        gate.set()
+
+        result = cs.load_card_session(800)  # waits for the queued messages
+        assert [m["text"] for m in result["messages"]] == ["Msg 0", "Msg 2", "Msg 4"]
+        assert result["session"]["deck_id"] == 7
+        assert cs._pending_messages == []
+
+    def test_limit_applies_per_card_in_one_flush(self, monkeypatch):
+        monkeypatch.setattr(cs, "MAX_MESSAGES_PER_CARD", 3)
+        gate = self._hold_writer()
+        for i in range(10):
+            cs.save_message(900 + i % 2, {"text": f"Msg {i:02d}", "sender": "user"})
+        gate.set()
+        assert cs.flush_messages(timeout=5)
+
+        assert [m["text"] for m in cs.load_card_session(900)["messages"]] == ["Msg 04", "Msg 06", "Msg 08"]
+        assert [m["text"] for m in cs.load_card_session(901)["messages"]] == ["Msg 05", "Msg 07", "Msg 09"]
+
+    def test_deck_lookups_use_sessions_and_cache(self, monkeypatch):
+        looked_up = []
+
+        def fake_lookup(card_ids):
+            looked_up.append((list(card_ids), threading.current_thread()))
+            return {cid: (3, "Physiologie") for cid in card_ids}
+
+        monkeypatch.setattr(cs, "_get_decks_for_cards", fake_lookup)
+        cs.save_card_session(1000, {"session": {"deck_id": 5, "deck_name": "Biochemie"}})
+        cs.save_message(1000, {"text": "A", "sender": "user"})
+        cs.save_message(1001, {"text": "B", "sender": "user"})
+        assert cs.flush_messages(timeout=5)
+        cs.save_message(1001, {"text": "C", "sender": "user"})
+        assert cs.flush_messages(timeout=5)
+
+        # Anki is asked on the saving thread, never on the writer
+        assert looked_up == [([1001], threading.current_thread())]
+        assert cs.load_card_session(1000)["messages"][0]["deck_id"] == 5
+        assert [m["deck_id"] for m in cs.load_card_session(1001)["messages"]] == [3, 3]
+
+    def test_failing_message_is_dropped_alone(self, monkeypatch):
+        monkeypatch.setattr(cs, "_get_decks_for_cards", lambda ids: {})
+        gate = self._hold_writer()
+        cs.save_message(1050, {"id": "ok-1", "text": "vorher", "sender": "user"})
+        cs.save_message(1050, {"id": "bad", "text": {"not": "bindable"}, "sender": "user"})
+        cs.save_message(1051, {"id": "ok-2", "text": "nachher", "sender": "user"})
+        gate.set()
+        assert cs.flush_messages(timeout=5) is False
+
+        assert [m["id"] for m in cs.load_card_session(1050)["messages"]] == ["ok-1"]
+        assert [m["id"] for m in cs.load_card_session(1051)["messages"]] == ["ok-2"]
+
+    def test_reads_do_not_wait_for_a_busy_writer(self, monkeypatch):
+        import time
+        monkeypatch.setattr(cs, "PENDING_READ_WAIT_S", 0.05)
+        gate = self._hold_writer()
+        cs.save_message(1060, {"text": "wartet", "sender": "user"})
+        t0 = time.perf_counter()
+        assert cs.load_messages_page(1060)["messages"] == []
+        assert time.perf_counter() - t0 < 2
+        gate.set()
+        assert cs.flush_messages(timeout=5)
+        assert [m["text"] for m in cs.load_messages_page(1060)["messages"]] == ["wartet"]
+
+    def test_flush_makes_messages_durable(self):
+        import sqlite3
+        cs.save_message(1100, {"id": "m-durable", "text": "bleibt", "sender": "user"})
+        assert cs.flush(timeout=5)
+        fresh = sqlite3.connect(cs._DB_PATH)
+        assert fresh.execute("SELECT text FROM messages WHERE id = 'm-durable'").fetchone()[0] == "bleibt"
+        fresh.close()
+
+
+class TestMessagePages:
+    """Keyset-paginated message loading with on-demand JSON columns."""
+
+    def setup_method(self):
+        TestCardSessionsCRUD._fresh_db(self)
+        for i in range(7):
+            cs.save_message(1200, {
+                "id": f"m{i}", "text": f"Msg {i}", "sender": "assistant" if i % 2 else "user",
+                # m3 and m4 share a timestamp: the id breaks the tie
+                "created_at": "2024-01-01T00:00:%02d" % (i if i != 4 else 3),
+                "steps": [{"step": i}] if i % 2 else None,
+            })
+
+    def teardown_method(self):
+        if cs._db:
+            cs._db.close()
+            cs._db = None
+
+    def test_pages_walk_back_without_gaps(self):
+        first = cs.load_messages_page(1200, limit=3)
+        assert [m["id"] for m in first["messages"]] == ["m4", "m5", "m6"]
+        assert first["has_more"]
+        assert first["before"] == {"created_at": "2024-01-01T00:00:03", "id": "m4"}
+
+        second = cs.load_messages_page(1200, first["before"]["created_at"], 3,
+                                       before_id=first["before"]["id"])
+        assert [m["id"] for m in second["messages"]] == ["m1", "m2", "m3"]
+
+        last = cs.load_messages_page(1200, second["before"]["created_at"], 3,
+                                     before_id=second["before"]["id"])
+        assert [m["id"] for m in last["messages"]] == ["m0"]
+        assert last == {"messages": last["messages"], "has_more": False, "before": None}
+
+    def test_heavy_columns_load_on_demand(self):
+        page = cs.load_messages_page(1200, limit=2)
+        assert all("steps" not in m for m in page["messages"])
+        assert [m["has_details"] for m in page["messages"]] == [True, False]
+
+        details = cs.load_message_details(["m5", "m6", "missing"])
+        assert details["m5"]["steps"] == [{"step": 5}]
+        assert details["m6"]["steps"] is None
+        assert "missing" not in details
+
+    def test_session_page_includes_meta_and_sections(self):
+        cs.save_section(1200, {"id": "s1", "title": "Review", "performance_data": {"score": 80}})
+        result = cs.load_card_session_page(1200, limit=4)
+        assert result["session"]["card_id"] == 1200
+        assert result["sections"][0]["performance_data"] == {"score": 80}
+        assert len(result["messages"]) == 4 and result["has_more"]
+
+    def test_page_uses_card_time_index(self):
+        plan = cs._db.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM messages WHERE card_id = ? "
+            "ORDER BY created_at DESC, id DESC LIMIT 31", (1200,)).fetchall()
+        assert "idx_messages_card_time" in plan[0][3]
+
+
+class TestMessagePayloads:
+    """Heavy JSON columns live compressed and deduplicated in message_payloads."""
+
+    def setup_method(self):
+        TestCardSessionsCRUD._fresh_db(self)
+
+    def teardown_method(self):
+        if cs._db:
+            cs._db.close()
+            cs._db = None
+
+    def test_repeated_payloads_are_stored_once_and_compressed(self):
+        citations = {"1": {"title": "Herzzyklus " * 50, "url": "https://example.org"}}
+        for i in range(3):
+            cs.save_message(1300, {"id": f"p{i}", "text": "t", "sender": "assistant",
+                                   "citations": citations, "steps": [{"i": i}]})
+
+        rows = cs._db.execute("SELECT codec, size, length(data) FROM message_payloads").fetchall()
+        assert len(rows) == 4  # one citations payload + three different steps
+        assert any(codec == "zlib" and stored < size for codec, size, stored in rows)
+
+        inline = cs._db.execute(
+            "SELECT COUNT(*) FROM messages WHERE citations IS NOT NULL OR steps IS NOT NULL").fetchone()[0]
+        assert inline == 0
+        loaded = cs.load_card_session(1300)["messages"]
+        assert [m["citations"] for m in loaded] == [citations] * 3
+        assert [m["steps"] for m in loaded] == [[{"i": 0}], [{"i": 1}], [{"i": 2}]]
+        assert all("citations_ref" not in m for m in loaded)
+
+    def test_migration_moves_inline_json_out_of_rows(self):
+        now = "2024-01-01T00:00:00"
+        cs._db.execute("INSERT INTO card_sessions (card_id, created_at, updated_at) VALUES (1400, ?, ?)",
+                       (now, now))
+        cs._db.execute(
+            "INSERT INTO messages (id, card_id, text, sender, created_at, steps, agent_cells)"
+            " VALUES ('legacy', 1400, 'alt', 'assistant', ?, '[{\"s\": 1}]', '[{\"text\": \"Zelle\"}]')",
+            (now,))
+        cs._db.commit()
+        # Rows written by an older version are still readable before migrating
+        assert cs.load_card_session(1400)["messages"][0]["steps"] == [{"s": 1}]
+
+        assert cs._migrate_inline_payloads(cs._db) == 1
+        row = cs._db.execute("SELECT steps, steps_ref, agent_cells_ref FROM messages").fetchone()
+        assert row[0] is None and row[1] is not None and row[2] is not None
+        assert cs.load_message_details(["legacy"])["legacy"]["agent_cells"] == [{"text": "Zelle"}]
+        assert cs.load_deck_messages(0)[0]["steps"] == [{"s": 1}]
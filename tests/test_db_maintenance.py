@@ -0,0 +1,119 @@
+"""Tests for storage/db_maintenance.py — idle-time checkpoint, optimize and compaction."""
+
+import pytest
+
+import storage.card_sessions as cs
+import storage.db_maintenance as dbm
+from storage import db_pool
+
+
+def _facts(**overrides):
+    facts = {'wal_bytes': 0, 'page_count': 100, 'freelist_count': 0, 'page_size': 4096,
+             'auto_vacuum': 0, 'has_stats': True, 'session': 1.0, 'changes': 0}
+    facts.update(overrides)
+    return facts
+
+
+class TestPlan:
+
+    def test_nothing_due_on_a_quiet_database(self):
+        state = {task: {'last_run_at': 1000.0, 'session': 1.0, 'changes_at': 0}
+                 for task in dbm.TASKS}
+        assert dbm.plan(_facts(), state, now=1000.0) == []
+
+    def test_large_wal_is_checkpointed(self):
+        due = dbm.plan(_facts(wal_bytes=dbm.WAL_CHECKPOINT_BYTES), {}, now=0)
+        assert [task for task, _ in due] == ['checkpoint']
+
+    def test_small_wal_waits_for_the_interval(self):
+        state = {'checkpoint': {'last_run_at': 0.0}}
+        assert dbm.plan(_facts(wal_bytes=4096), state, now=60.0) == []
+        due = dbm.plan(_facts(wal_bytes=4096), state, now=dbm.CHECKPOINT_INTERVAL_S)
+        assert due == [('checkpoint', 'hourly')]
+
+    def test_optimize_after_churn_counts_this_session_only(self):
+        last = {task: {'last_run_at': 0.0, 'session': 1.0, 'changes_at': 100}
+                for task in ('prune', 'optimize')}
+        facts = _facts(changes=100 + dbm.OPTIMIZE_MIN_CHANGES)
+        assert [t for t, _ in dbm.plan(facts, last, now=1.0)] == ['prune', 'optimize']
+        assert dbm.plan(_facts(changes=200), last, now=1.0) == []
+        # A restarted writer counts from zero: its whole churn is new
+        restarted = _facts(session=2.0, changes=dbm.OPTIMIZE_MIN_CHANGES)
+        assert [t for t, _ in dbm.plan(restarted, last, now=1.0)] == ['prune', 'optimize']
+
+    def test_payload_prune_runs_before_optimize(self):
+        last = {task: {'last_run_at': 0.0, 'session': 1.0, 'changes_at': 0} for task in dbm.TASKS}
+        due = dbm.plan(_facts(changes=dbm.PRUNE_MIN_CHANGES), last, now=1.0)
+        assert due == [('prune', '%d rows changed' % dbm.PRUNE_MIN_CHANGES)]
+        assert dbm.plan(_facts(changes=1), last, now=dbm.PRUNE_INTERVAL_S)[0] == ('prune', 'daily')
+
+    def test_missing_statistics_trigger_analyze(self):
+        assert dbm.plan(_facts(has_stats=False), {}, now=0) == [
+            ('optimize', 'no planner statistics')]
+
+    def test_compaction_needs_absolute_and_relative_free_space(self):
+        free = dbm.COMPACT_MIN_FREE_PAGES
+        assert dbm.plan(_facts(page_count=free * 100, freelist_count=free), {}, now=0) == []
+        due = dbm.plan(_facts(page_count=free * 2, freelist_count=free), {}, now=0)
+        assert [t for t, _ in due] == ['compact', 'checkpoint']
+
+
+class TestMaintain:
+
+    @pytest.fixture
+    def pooled(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "card_sessions.db")
+        monkeypatch.setattr(cs, "_DB_PATH", path)
+        monkeypatch.setattr(cs, "_db", None)
+        yield path
+        db_pool.close_pool(path)
+
+    def _fill_and_delete(self, rows=12000):
+        blob = b"\x01" * 1024
+        cs.save_embeddings_bulk([(i, blob, "h%d" % i, "m", 0) for i in range(rows)])
+        cs.delete_embeddings(list(range(rows)))
+
+    def test_compacts_checkpoints_and_records_runs(self, pooled):
+        self._fill_and_delete()
+        actions = dbm.run()
+        assert [a['task'] for a in actions] == ['prune', 'optimize', 'compact', 'checkpoint']
+        assert 'auto_vacuum=incremental' in actions[2]['result']
+        assert all(a['durationMs'] >= 0 for a in actions)
+
+        status = dbm.status()
+        assert status['autoVacuum'] == 2
+        assert status['freePages'] < dbm.COMPACT_MIN_FREE_PAGES
+        assert set(status['lastRuns']) == set(dbm.TASKS)
+        assert status['pragmas']['journal_mode'] == 'wal'
+        assert status['pragmas']['temp_store'] == 2  # MEMORY
+        assert status['due'] == []
+
+        # Second compaction only releases pages incrementally
+        self._fill_and_delete()
+        assert 'incremental_vacuum' in dbm.run(tasks=['compact'])[0]['result']
+
+    def test_prune_deletes_unreferenced_payloads(self, pooled):
+        shared = [{"url": "https://example.org", "title": "Quelle"}]
+        for card_id in (1, 2):
+            cs.save_card_session(card_id, {"messages": [
+                {"id": "m%d" % card_id, "text": "x", "sender": "assistant", "citations": shared}]})
+        cs.delete_card_session(1)
+        assert dbm.run(tasks=['prune'])[0]['result'] == '0 payloads deleted'  # still used by m2
+        cs.delete_card_session(2)
+        assert dbm.run(tasks=['prune'])[0]['result'] == '1 payloads deleted'
+
+    def test_run_if_idle_waits_for_a_quiet_writer(self, pooled, monkeypatch):
+        cs.save_query_embeddings("m", [("frage", b"\x00" * 8)])
+        assert dbm.run_if_idle() is None
+        monkeypatch.setattr(dbm, "IDLE_SECONDS", 0)
+        future = dbm.run_if_idle()
+        assert future is not None
+        assert isinstance(future.result(5), list)
+
+    def test_injected_connection_runs_inline(self, monkeypatch):
+        import sqlite3
+        db = sqlite3.connect(":memory:")
+        monkeypatch.setattr(cs, "_db", db)
+        assert dbm.run(tasks=['optimize'])[0]['task'] == 'optimize'
+        assert dbm.status()['lastRuns']['optimize']['result'] in ('analyze', 'optimize')
+        db.close()
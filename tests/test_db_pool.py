@@ -0,0 +1,192 @@
+"""Tests for storage/db_pool.py — per-thread readers and the group-committing writer."""
+
+import sqlite3
+import threading
+
+import pytest
+
+import storage.card_sessions as cs
+import storage.kg_store as kg
+from storage import db_pool
+
+
+@pytest.fixture
+def pool(tmp_path):
+    p = db_pool.ConnectionPool(str(tmp_path / "pool.db"))
+    p.write(lambda: p.connection().execute("CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)"))
+    yield p
+    p.close()
+
+
+def _insert(pool, v, fail=False):
+    db = pool.connection()
+    db.execute("INSERT INTO t (v) VALUES (?)", (v,))
+    db.commit()
+    if fail:
+        raise ValueError(v)
+    return v
+
+
+def _count(pool):
+    return pool.reader().execute("SELECT COUNT(*) FROM t").fetchone()[0]
+
+
+class TestConnections:
+
+    def test_each_thread_gets_its_own_read_only_reader(self, pool):
+        pool.write(_insert, pool, "a")
+        seen = {}
+
+        def read(name):
+            conn = pool.connection()
+            seen[name] = (conn, conn.execute("SELECT v FROM t").fetchone()[0])
+
+        threads = [threading.Thread(target=read, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert [v for _, v in seen.values()] == ["a"] * 4
+        assert len({id(conn) for conn, _ in seen.values()}) == 4
+        assert isinstance(pool.connection(), db_pool.ReadConnection)
+        with pytest.raises(sqlite3.OperationalError):
+            pool.connection().execute("INSERT INTO t (v) VALUES ('x')")
+
+    def test_reader_sees_committed_writes(self, pool):
+        assert _count(pool) == 0
+        pool.write(_insert, pool, "a")
+        assert _count(pool) == 1
+
+
+class TestWriter:
+
+    def test_queued_writes_share_one_commit(self, pool):
+        commits = []
+        gate = threading.Event()
+        pool.submit(gate.wait)  # hold the writer so the next submits queue up
+        futures = [pool.submit(_insert, pool, str(i)) for i in range(20)]
+        pool._conn.set_trace_callback(
+            lambda sql: commits.append(sql) if sql == "COMMIT" else None)
+        gate.set()
+        assert pool.flush(timeout=5)
+        assert [f.result() for f in futures] == [str(i) for i in range(20)]
+        assert _count(pool) == 20
+        assert len(commits) <= 2
+
+    def test_failing_write_rolls_back_alone(self, pool):
+        gate = threading.Event()
+        pool.submit(gate.wait)
+        ok = pool.submit(_insert, pool, "ok")
+        bad = pool.submit(_insert, pool, "bad", fail=True)
+        gate.set()
+        assert ok.result(5) == "ok"
+        with pytest.raises(ValueError):
+            bad.result(5)
+        assert [r[0] for r in pool.reader().execute("SELECT v FROM t")] == ["ok"]
+
+    def test_write_from_writer_thread_runs_inline(self, pool):
+        def outer():
+            return pool.write(_insert, pool, "inner")
+        assert pool.write(outer) == "inner"
+        assert _count(pool) == 1
+
+    def test_flush_makes_submitted_writes_durable(self, pool):
+        for i in range(5):
+            pool.submit(_insert, pool, str(i))
+        assert pool.flush(timeout=5)
+        fresh = sqlite3.connect(pool.path)
+        assert fresh.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 5
+        fresh.close()
+
+    def test_executescript_with_triggers(self, pool):
+        def script():
+            pool.connection().executescript("""
+                CREATE TABLE log (v TEXT);
+                CREATE TRIGGER t_ai AFTER INSERT ON t BEGIN
+                    INSERT INTO log (v) VALUES (new.v || ';');
+                END;
+            """)
+        pool.write(script)
+        pool.write(_insert, pool, "a")
+        assert pool.reader().execute("SELECT v FROM log").fetchone()[0] == "a;"
+
+    def test_write_times_out_but_still_commits(self, pool):
+        gate = threading.Event()
+        pool.submit(gate.wait)
+        pool.write_timeout = 0.1
+        with pytest.raises(db_pool.WriteTimeout):
+            pool.write(_insert, pool, "late")
+        gate.set()
+        assert pool.flush(timeout=5)
+        assert _count(pool) == 1
+
+    def test_decorated_write_raises_on_timeout(self, pool):
+        written = db_pool.writes(lambda: pool)(lambda v: _insert(pool, v))
+        gate = threading.Event()
+        pool.submit(gate.wait)
+        pool.write_timeout = 0.1
+        with pytest.raises(db_pool.WriteTimeout):
+            written("late")
+        gate.set()
+        assert pool.flush(timeout=5)
+        assert _count(pool) == 1
+        assert written("on time") == "on time"
+
+    def test_job_breaking_the_transaction_fails_alone(self, pool):
+        def ends_transaction():
+            pool._conn.execute("COMMIT")  # the savepoints are gone now
+
+        gate = threading.Event()
+        pool.submit(gate.wait)
+        broken = pool.submit(ends_transaction)
+        after = pool.submit(_insert, pool, "after")
+        gate.set()
+        with pytest.raises(sqlite3.Error):
+            broken.result(5)
+        assert after.result(5) == "after"
+        assert pool.write(_insert, pool, "still alive") == "still alive"
+        assert _count(pool) == 2
+
+    def test_closed_pool_rejects_writes(self, tmp_path):
+        p = db_pool.ConnectionPool(str(tmp_path / "closed.db"))
+        p.close()
+        with pytest.raises(sqlite3.ProgrammingError):
+            p.submit(lambda: None)
+
+
+class TestStorageModules:
+
+    @pytest.fixture
+    def pooled(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "card_sessions.db")
+        monkeypatch.setattr(cs, "_DB_PATH", path)
+        monkeypatch.setattr(cs, "_db", None)
+        monkeypatch.setattr(kg, "_db", None)
+        yield path
+        db_pool.close_pool(path)
+
+    def test_card_sessions_write_on_writer_and_read_anywhere(self, pooled):
+        assert cs.save_card_session(1, {"session": {"note_id": 10, "deck_id": 2}})
+        assert cs.update_summary(1, "Zusammenfassung")
+        assert cs._get_db() is db_pool.get_pool(pooled).reader()
+
+        loaded = {}
+        t = threading.Thread(target=lambda: loaded.update(cs.load_card_session(1)))
+        t.start()
+        t.join()
+        assert loaded["session"]["summary"] == "Zusammenfassung"
+
+    def test_query_hit_counter_is_queued(self, pooled):
+        cs.save_query_embeddings("m", [("frage", b"\x00" * 8)])
+        assert cs.load_query_embeddings("m", ["frage"]) == {"frage": b"\x00" * 8}
+        assert cs.flush(timeout=5)
+        hits = cs._get_db().execute("SELECT hits FROM query_embeddings").fetchone()[0]
+        assert hits == 1
+
+    def test_kg_store_shares_the_pool(self, pooled):
+        kg.save_card_terms_bulk([(1, ["Herz", "Niere"], 5)])
+        generation = kg.graph_generation()
+        kg.update_term_frequencies()
+        assert kg.graph_generation() == generation + 1
+        assert sorted(kg.get_card_terms(1)) == ["Herz", "Niere"]
+        assert kg.get_term_frequency("Herz") == 1
@@ -0,0 +1,114 @@
+"""Tests for ai/embed_cache.py — two-level query-embedding cache.
+
+Uses a real temporary SQLite database; the /embed backend is never called.
+"""
+
+import sqlite3
+
+import pytest
+
+import storage.card_sessions as cs
+from ai.embed_cache import QueryEmbeddingCache, normalize_text
+from ai.embeddings import EmbeddingManager
+
+
+@pytest.fixture
+def cache_db(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "card_sessions.db")
+    monkeypatch.setattr(cs, "_DB_PATH", db_path)
+    db = sqlite3.connect(db_path, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    cs._init_schema(db)
+    cs._migrate_schema(db)
+    monkeypatch.setattr(cs, "_db", db)
+    yield db
+    db.close()
+
+
+class TestNormalization:
+
+    def test_whitespace_and_unicode_form(self):
+        composed = "D\u00fcnndarm"
+        decomposed = "Du\u0308nndarm"
+        assert normalize_text("  %s \n\t Jejunum " % decomposed) == "%s Jejunum" % composed
+
+    def test_truncates_like_embed_call(self):
+        assert len(normalize_text("x" * 5000)) == 2000
+
+
+class TestQueryEmbeddingCache:
+
+    def test_miss_then_memory_hit(self, cache_db):
+        cache = QueryEmbeddingCache("m")
+        assert cache.get_many(["Niere"]) == [None]
+        cache.put_many(["Niere"], [[1.0, 2.0]])
+        assert cache.get_many(["  Niere "]) == [[1.0, 2.0]]
+        stats = cache.stats()
+        assert stats["misses"] == 1
+        assert stats["memory_hits"] == 1
+
+    def test_disk_hit_survives_new_instance(self, cache_db):
+        QueryEmbeddingCache("m").put_many(["Leber", "Milz"], [[1.0], [0.5]])
+        fresh = QueryEmbeddingCache("m")
+        assert fresh.get_many(["Milz", "Leber", "Herz"]) == [[0.5], [1.0], None]
+        assert fresh.stats()["disk_hits"] == 2
+        # second lookup is served from memory
+        fresh.get_many(["Milz"])
+        assert fresh.stats()["memory_hits"] == 1
+
+    def test_model_is_part_of_key(self, cache_db):
+        QueryEmbeddingCache("a").put_many(["Leber"], [[1.0]])
+        assert QueryEmbeddingCache("b").get_many(["Leber"]) == [None]
+
+    def test_empty_vectors_not_stored(self, cache_db):
+        cache = QueryEmbeddingCache("m")
+        cache.put_many(["a", "b"], [None, []])
+        assert cache_db.execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0] == 0
+
+    def test_memory_capacity(self, cache_db):
+        cache = QueryEmbeddingCache("m", capacity=2)
+        cache.put_many(["a", "b", "c"], [[1.0], [2.0], [3.0]])
+        assert cache.stats()["memory_entries"] == 2
+        assert cache.get_many(["a"]) == [[1.0]]
+        assert cache.stats()["disk_hits"] == 1
+
+    def test_prune_keeps_recently_used(self, cache_db):
+        cache = QueryEmbeddingCache("m")
+        cache.put_many(["old", "new"], [[1.0], [2.0]])
+        cache_db.execute("UPDATE query_embeddings SET last_used_at = '2000-01-01 00:00:00' "
+                         "WHERE rowid = (SELECT MIN(rowid) FROM query_embeddings)")
+        cache_db.commit()
+        assert cs.prune_query_embeddings(1) == 1
+        assert QueryEmbeddingCache("m").get_many(["old", "new"]) == [None, [2.0]]
+
+
+class TestManagerCaching:
+
+    def test_only_misses_reach_backend(self, cache_db, monkeypatch):
+        mgr = EmbeddingManager()
+        sent = []
+
+        def fake_remote(texts):
+            sent.append(list(texts))
+            return [[float(len(t))] for t in texts]
+
+        monkeypatch.setattr(mgr, "_embed_remote", fake_remote)
+        assert mgr.embed_texts(["ab", "abc"]) == [[2.0], [3.0]]
+        assert mgr.embed_texts(["abc", "abcd"]) == [[3.0], [4.0]]
+        assert sent == [["ab", "abc"], ["abcd"]]
+
+    def test_use_cache_false_bypasses(self, cache_db, monkeypatch):
+        mgr = EmbeddingManager()
+        sent = []
+        monkeypatch.setattr(mgr, "_embed_remote", lambda texts: sent.append(texts) or [[1.0]])
+        mgr.embed_texts(["card"], use_cache=False)
+        mgr.embed_texts(["card"], use_cache=False)
+        assert len(sent) == 2
+        assert mgr.cache_stats()["misses"] == 0
+
+    def test_backend_failure_not_cached(self, cache_db, monkeypatch):
+        mgr = EmbeddingManager()
+        monkeypatch.setattr(mgr, "_embed_remote", lambda texts: [])
+        assert mgr.embed_texts(["x"]) == []
+        monkeypatch.setattr(mgr, "_embed_remote", lambda texts: [[1.0]])
+        assert mgr.embed_texts(["x"]) == [[1.0]]
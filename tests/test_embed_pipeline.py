@@ -0,0 +1,102 @@
+"""Tests for ai/embed_pipeline.py — adaptive, pipelined /embed backfill."""
+
+import threading
+
+from ai.embed_pipeline import AdaptiveEmbedPipeline, EmbedError, RateLimited
+
+
+def _items(n):
+    return [{'card_id': i, 'text': 'card %d' % i} for i in range(n)]
+
+
+def _pipeline(embed_fn, **kwargs):
+    kwargs.setdefault('base_backoff', 0.001)
+    kwargs.setdefault('sleep', lambda s: None)
+    return AdaptiveEmbedPipeline(embed_fn, **kwargs)
+
+
+def _echo(texts):
+    return [[float(t.split()[1])] for t in texts]
+
+
+class TestPipeline:
+
+    def test_embeds_everything_once(self):
+        stored = {}
+        pipe = _pipeline(_echo, batch_size=8, min_batch=4)
+        n = pipe.run(_items(100), lambda batch, vecs: stored.update(
+            (item['card_id'], vec) for item, vec in zip(batch, vecs)))
+        assert n == 100
+        assert stored == {i: [float(i)] for i in range(100)}
+        assert pipe.error is None
+
+    def test_batches_run_concurrently(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+        release = threading.Event()
+
+        def slow(texts):
+            with lock:
+                active.append(1)
+                peak.append(len(active))
+            release.wait(0.05)
+            with lock:
+                active.pop()
+            return _echo(texts)
+
+        pipe = _pipeline(slow, batch_size=4, min_batch=4, concurrency=3, max_concurrency=3)
+        pipe.run(_items(40), lambda b, v: None)
+        assert max(peak) > 1
+
+    def test_fast_successes_grow_batch_and_concurrency(self):
+        pipe = _pipeline(_echo, batch_size=8, min_batch=4, max_batch=64,
+                         concurrency=1, max_concurrency=4)
+        pipe.run(_items(400), lambda b, v: None)
+        assert pipe.batch_size > 8
+        assert pipe.concurrency > 1
+
+    def test_rate_limit_shrinks_and_retries(self):
+        calls = {'n': 0}
+
+        def throttled(texts):
+            calls['n'] += 1
+            if calls['n'] <= 2:
+                raise RateLimited(retry_after=0)
+            return _echo(texts)
+
+        done = []
+        pipe = _pipeline(throttled, batch_size=32, min_batch=4, concurrency=1, max_concurrency=1)
+        assert pipe.run(_items(32), lambda b, v: done.extend(b)) == 32
+        assert pipe.stats['throttled'] == 2
+        assert pipe.batch_size < 32
+        assert sorted(item['card_id'] for item in done) == list(range(32))
+
+    def test_non_retryable_error_stops(self):
+        def denied(texts):
+            raise EmbedError("HTTP 401", retryable=False)
+
+        pipe = _pipeline(denied)
+        assert pipe.run(_items(10), lambda b, v: None) == 0
+        assert isinstance(pipe.error, EmbedError)
+        assert pipe.stats['retries'] == 0
+
+    def test_gives_up_after_max_retries(self):
+        def flaky(texts):
+            raise EmbedError("HTTP 503")
+
+        pipe = _pipeline(flaky, max_retries=2, concurrency=1)
+        assert pipe.run(_items(5), lambda b, v: None) == 0
+        assert pipe.stats['retries'] == 2
+        assert pipe.error is not None
+
+    def test_empty_response_stops(self):
+        pipe = _pipeline(lambda texts: [])
+        assert pipe.run(_items(5), lambda b, v: None) == 0
+        assert pipe.error is not None
+
+    def test_cancel(self):
+        seen = []
+        pipe = _pipeline(_echo, batch_size=4, min_batch=4, concurrency=1, max_concurrency=1)
+        pipe.run(_items(100), lambda b, v: seen.extend(b), cancelled=lambda: len(seen) >= 8)
+        assert 8 <= len(seen) < 100
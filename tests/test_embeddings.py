@@ -0,0 +1,170 @@
+"""Tests for ai/embeddings.py — EmbeddingManager index loading and search.
+
+Uses a real temporary SQLite database; the /embed backend is never called.
+"""
+
+import sqlite3
+import struct
+
+import pytest
+
+import storage.card_sessions as cs
+from ai.embeddings import EmbeddingManager
+from ai.vector_index import has_numpy
+
+
+def _vec(dim, hot, value=1.0):
+    v = [0.0] * dim
+    v[hot] = value
+    return struct.pack('<%df' % dim, *v)
+
+
+class _SmallManager(EmbeddingManager):
+    EMBEDDING_DIM = 8
+    MIN_SIMILARITY = 0.0
+
+
+@pytest.fixture
+def emb_db(tmp_path, monkeypatch):
+    """Point card_sessions at a temp DB file (the snapshot lives next to it)."""
+    db_path = str(tmp_path / "card_sessions.db")
+    monkeypatch.setattr(cs, "_DB_PATH", db_path)
+    db = sqlite3.connect(db_path, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    cs._init_schema(db)
+    cs._migrate_schema(db)
+    monkeypatch.setattr(cs, "_db", db)
+    yield db
+    db.close()
+
+
+class TestIndexLoading:
+
+    def test_search_loads_from_db(self, emb_db):
+        cs.save_embedding(1, _vec(8, 0), "h1", "m")
+        cs.save_embedding(2, _vec(8, 1), "h2", "m")
+        mgr = _SmallManager()
+        results = mgr.search([0, 1, 0, 0, 0, 0, 0, 0], top_k=1)
+        assert results[0][0] == 2
+
+    def test_snapshot_written_and_reused(self, emb_db, tmp_path):
+        cs.save_embedding(1, _vec(8, 0), "h1", "m")
+        _SmallManager().load_index()
+        assert (tmp_path / "card_sessions.embeddings.vec").exists()
+
+        mgr = _SmallManager()
+        mgr.load_index()
+        assert len(mgr._index) == 1
+        assert mgr._index.is_mapped() == has_numpy()
+
+    def test_snapshot_picks_up_newer_rows(self, emb_db):
+        cs.save_embedding(1, _vec(8, 0), "h1", "m")
+        _SmallManager().load_index()
+
+        cs.save_embedding(2, _vec(8, 3), "h2", "m")
+        cs.save_embedding(1, _vec(8, 5), "h1b", "m")
+        mgr = _SmallManager()
+        assert mgr.search([0, 0, 0, 0, 0, 1, 0, 0], top_k=1)[0][0] == 1
+        assert mgr.search([0, 0, 0, 1, 0, 0, 0, 0], top_k=1)[0][0] == 2
+
+    def test_snapshot_rebuilt_after_delete(self, emb_db):
+        cs.save_embedding(1, _vec(8, 0), "h1", "m")
+        cs.save_embedding(2, _vec(8, 1), "h2", "m")
+        _SmallManager().load_index()
+
+        cs.delete_embedding(2)
+        mgr = _SmallManager()
+        mgr.load_index()
+        assert 2 not in mgr._index
+        assert len(mgr._index) == 1
+
+    def test_get_vectors_returns_indexed_cards_only(self, emb_db):
+        cs.save_embedding(1, _vec(8, 0, 2.0), "h1", "m")
+        vectors = _SmallManager().get_vectors([1, 99])
+        assert list(vectors) == [1]
+        assert vectors[1][0] == pytest.approx(1.0)
+
+    def test_snapshot_drops_deleted_rows_without_rebuild(self, emb_db):
+        for i in range(3):
+            cs.save_embedding(i, _vec(8, i), "h%d" % i, "m")
+        _SmallManager().load_index()
+        cs.delete_embedding(1)
+
+        mgr = _SmallManager()
+        mgr.load_index()
+        assert len(mgr._index) == 2 and 1 not in mgr._index
+
+    def test_search_many_skips_missing_embeddings(self, emb_db):
+        cs.save_embedding(1, _vec(8, 0), "h1", "m")
+        cs.save_embedding(2, _vec(8, 1), "h2", "m")
+        per_query, fused = _SmallManager().search_many(
+            [[1, 0, 0, 0, 0, 0, 0, 0], [], [0, 1, 0, 0, 0, 0, 0, 0]], top_k=1, fuse=True)
+        assert [r[0][0] if r else None for r in per_query] == [1, None, 2]
+        assert len(fused) == 1
+
+
+class TestCardSync:
+
+    def test_forget_cards_removes_db_rows_and_index_entries(self, emb_db):
+        for i in range(3):
+            cs.save_embedding(i, _vec(8, i), "h%d" % i, "m")
+        mgr = _SmallManager()
+        mgr.load_index()
+        assert mgr.forget_cards([0, 5]) == 1
+        assert cs.load_embedded_card_ids() == {1, 2}
+        assert 0 not in {cid for cid, _ in mgr.search([1, 0, 0, 0, 0, 0, 0, 0], top_k=3)}
+
+    def test_prune_index_keeps_live_cards(self, emb_db):
+        for i in range(4):
+            cs.save_embedding(i, _vec(8, i), "h%d" % i, "m")
+        mgr = _SmallManager()
+        mgr.load_index()
+        assert mgr.prune_index([0, 2]) == 2
+        assert set(mgr._index.ids) == {0, 2}
+        assert mgr.save_index_snapshot()
+        assert mgr._index.tombstones == 0
+
+    def test_embedding_states_track_source_mod(self, emb_db):
+        cs.save_embedding(1, _vec(8, 0), "h1", "m", source_mod=100)
+        cs.save_embedding(2, _vec(8, 1), "h2", "m")
+        assert cs.load_embedding_states() == {1: ("h1", 100), 2: ("h2", None)}
+        cs.touch_embedding_mods([(2, 200)])
+        assert cs.load_embedding_states()[2] == ("h2", 200)
+
+    def test_save_embeddings_bulk_upserts(self, emb_db):
+        cs.save_embedding(1, _vec(8, 0), "old", "m")
+        assert cs.save_embeddings_bulk([(1, _vec(8, 1), "new", "m", 5),
+                                        (2, _vec(8, 2), "h2", "m", 6)]) == 2
+        assert cs.load_embedding_states() == {1: ("new", 5), 2: ("h2", 6)}
+        assert _SmallManager().search([0, 1, 0, 0, 0, 0, 0, 0], top_k=1)[0][0] == 1
+
+
+class TestQuantizedStorage:
+
+    def test_quantized_blobs_are_smaller_and_searchable(self, emb_db):
+        mgr = _SmallManager()
+        mgr._index_options.update(quantization="int8", quantize_storage=True)
+        blob = mgr._encode_embedding([0, 0, 3, 0, 0, 0, 0, 0])
+        assert len(blob) == 8 + 4
+        cs.save_embedding(7, blob, "h", "m")
+
+        fresh = _SmallManager()
+        assert fresh.search([0, 0, 1, 0, 0, 0, 0, 0], top_k=1)[0][0] == 7
+
+
+@pytest.mark.skipif(not has_numpy(), reason="IVF needs NumPy")
+class TestIVFSnapshot:
+
+    def test_load_trains_and_persists_ivf(self, emb_db, tmp_path):
+        for i in range(40):
+            cs.save_embedding(i, _vec(8, i % 8, 1.0 + i), "h%d" % i, "m")
+        mgr = _SmallManager()
+        mgr._index_options.update(ivf=True, ivf_lists=4, ivf_min_rows=10)
+        mgr.load_index()
+        assert (tmp_path / "card_sessions.embeddings.ivf").exists()
+
+        fresh = _SmallManager()
+        fresh._index_options.update(ivf=True, ivf_lists=4, ivf_min_rows=10)
+        fresh.load_index()
+        assert not fresh._index.ivf_needs_training()
+        assert fresh.search([0, 0, 1, 0, 0, 0, 0, 0], top_k=1)[0][0] % 8 == 2
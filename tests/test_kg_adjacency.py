@@ -0,0 +1,73 @@
+"""Tests for storage/kg_adjacency.py — in-memory CSR view of the KG."""
+
+import sqlite3
+
+import pytest
+
+import storage.kg_store as kg
+from storage import kg_adjacency
+
+
+@pytest.fixture(autouse=True)
+def _fresh_cache():
+    kg_adjacency.clear_cache()
+    yield
+    kg_adjacency.clear_cache()
+
+
+def _seed_graph():
+    """Four cards around the small intestine, their frequencies and three edges."""
+    for card_id, terms in enumerate([
+        ["Dünndarm", "Jejunum", "Ileum"],
+        ["Dünndarm", "Jejunum"],
+        ["Dünndarm", "Ileum"],
+        ["Herz"],
+    ]):
+        kg.save_card_terms(card_id, terms, deck_id=1)
+    kg.update_term_frequencies()
+    kg.save_edges([("Dünndarm", "Jejunum", 2), ("Dünndarm", "Ileum", 3), ("Ileum", "Jejunum", 1)])
+
+
+class TestKGAdjacency:
+
+    def test_matches_sql_lookups(self, kg_db):
+        _seed_graph()
+        graph = kg_adjacency.get_adjacency()
+        for term in ["Dünndarm", "Jejunum", "Ileum", "Herz", "Milz"]:
+            assert graph.expansions(term, max_terms=5) == kg.get_term_expansions(term)
+        for query in ["DUENNDARM", "dünndarm", "herz", "Milz"]:
+            assert graph.lookup(query) == kg.exact_term_lookup(query)
+        assert graph.frequency("Dünndarm") == 3
+        assert graph.frequency("Milz") == 0
+
+    def test_csr_layout(self, kg_db):
+        _seed_graph()
+        graph = kg_adjacency.get_adjacency()
+        assert graph.edge_count == 3
+        assert len(graph.offsets) == len(graph) + 1
+        assert graph.expansions("Dünndarm", max_terms=1) == [("Ileum", 3)]
+
+    def test_cached_until_generation_bump(self, kg_db):
+        _seed_graph()
+        graph = kg_adjacency.get_adjacency()
+        assert kg_adjacency.get_adjacency() is graph
+
+        kg_db.execute("INSERT INTO kg_edges (term_a, term_b, weight) VALUES ('Herz', 'Ileum', 9)")
+        assert kg_adjacency.get_adjacency().expansions("Herz") == []
+
+        kg.save_edges([("Herz", "Jejunum", 4)])
+        fresh = kg_adjacency.get_adjacency()
+        assert fresh is not graph
+        assert dict(fresh.expansions("Herz")) == {"Ileum": 9, "Jejunum": 4}
+
+    def test_builder_bumps_generation(self, kg_db):
+        _seed_graph()
+        from ai.kg_builder import GraphIndexBuilder
+        before = kg.graph_generation()
+        GraphIndexBuilder().build(min_weight=2)
+        assert kg.graph_generation() > before
+        assert kg_adjacency.get_adjacency().expansions("Jejunum") == [("Dünndarm", 2)]
+
+    def test_unreadable_db_returns_none(self):
+        db = sqlite3.connect(":memory:")
+        assert kg_adjacency.get_adjacency(db) is None
@@ -135,6 +135,213 @@ class TestGraphIndexBuilder(_BaseKGBuilderTest):
         key = tuple(sorted(["Fibrin", "Thrombin"]))
         assert key in pairs, f"Expected edge {key} after build(), got {list(pairs)}"
 
+    def test_build_recounts_written_and_changed_terms(self, monkeypatch):
+        kg.save_card_terms(700, ["Fibrin", "Thrombin"], deck_id=1)
+        kg.save_card_terms(701, ["Plasmin"], deck_id=1)
+        builder = self._make_builder()
+        builder.build(terms={"Fibrin"})  # no fingerprints yet: everything
+        assert kg.get_term_frequency("Plasmin") == 1
+
+        recounted = []
+        update = kg.update_term_frequencies
+        monkeypatch.setattr(kg, "update_term_frequencies",
+                            lambda terms=None: (recounted.append(terms), update(terms)))
+        kg.delete_card_terms(701)
+        kg._db.execute("INSERT INTO kg_card_terms (card_id, term, deck_id) VALUES (702, 'Faktor X', 1)")
+        builder.build(terms={"Fibrin"})
+
+        assert recounted == [{"Fibrin", "Plasmin", "Faktor X"}]
+        assert kg.get_term_frequency("Plasmin") == 0
+        assert kg.get_term_frequency("Faktor X") == 1
+        builder.build(terms=set())
+        assert recounted[1:] == []
+
+
+class TestIncrementalEdges(_BaseKGBuilderTest):
+
+    def _builder(self):
+        from ai.kg_builder import GraphIndexBuilder
+        return GraphIndexBuilder()
+
+    @staticmethod
+    def _edges():
+        return {(e["term_a"], e["term_b"]): e["weight"] for e in kg.get_all_edges(min_weight=1)}
+
+    @staticmethod
+    def _naive_pairs():
+        from collections import Counter
+        from itertools import combinations
+        cards = {}
+        for row in kg._db.execute("SELECT card_id, term FROM kg_card_terms"):
+            cards.setdefault(row[0], set()).add(row[1])
+        counts = Counter()
+        for terms in cards.values():
+            counts.update(combinations(sorted(terms), 2))
+        return counts
+
+    def test_matches_full_recount_after_edits(self):
+        import random
+        rng = random.Random(7)
+        vocab = ["T%d" % i for i in range(15)]
+        builder = self._builder()
+        for card_id in range(30):
+            kg.save_card_terms(card_id, rng.sample(vocab, rng.randint(1, 6)), deck_id=1)
+        builder.compute_edges(min_weight=2, top_k=len(vocab))
+        for _ in range(3):
+            for card_id in rng.sample(range(40), 10):
+                kg.delete_card_terms(card_id)
+                if rng.random() < 0.8:
+                    kg.save_card_terms(card_id, rng.sample(vocab, rng.randint(1, 6)), deck_id=1)
+            builder.compute_edges(min_weight=2, top_k=len(vocab))
+            stored = {(r[0], r[1]): r[2] for r in kg._db.execute(
+                "SELECT term_a, term_b, count FROM kg_pair_counts")}
+            naive = self._naive_pairs()
+            assert stored == dict(naive)
+            assert self._edges() == {p: w for p, w in naive.items() if w >= 2}
+
+    def test_only_dirty_cards_are_processed(self):
+        kg.save_card_terms(1, ["A", "B", "C"], deck_id=1)
+        kg.save_card_terms(2, ["A", "B"], deck_id=1)
+        builder = self._builder()
+        builder.compute_edges(min_weight=2)
+        assert kg._db.execute("SELECT COUNT(*) FROM kg_dirty_cards").fetchone()[0] == 0
+
+        kg.save_card_terms(3, ["B", "C"], deck_id=1)
+        assert [r[0] for r in kg._db.execute("SELECT card_id FROM kg_dirty_cards")] == [3]
+        builder.compute_edges(min_weight=2)
+        assert self._edges() == {("A", "B"): 2, ("B", "C"): 2}
+
+    def test_deleted_card_drops_its_edges(self):
+        kg.save_card_terms(1, ["Fibrin", "Thrombin"], deck_id=1)
+        kg.save_card_terms(2, ["Fibrin", "Thrombin"], deck_id=1)
+        builder = self._builder()
+        builder.compute_edges(min_weight=2)
+        assert self._edges() == {("Fibrin", "Thrombin"): 2}
+        kg.delete_card_terms(2)
+        builder.compute_edges(min_weight=2)
+        assert self._edges() == {}
+        assert kg._db.execute("SELECT COUNT(*) FROM kg_card_fingerprints").fetchone()[0] == 1
+
+    def test_unchanged_card_is_skipped(self):
+        kg.save_card_terms(1, ["A", "B"], deck_id=1)
+        builder = self._builder()
+        builder.compute_edges(min_weight=1)
+        kg.save_card_terms(1, ["A", "B"], deck_id=2)  # deck move only, same terms
+        kg.delete_card_terms(1)
+        kg.save_card_terms(1, ["B", "A"], deck_id=2)
+        builder.compute_edges(min_weight=1)
+        assert self._edges() == {("A", "B"): 1}
+
+    def test_card_edited_between_read_and_write_stays_dirty(self):
+        from ai.kg_builder import GraphIndexBuilder
+        kg.save_card_terms(1, ["A", "B"], deck_id=1)
+        kg.save_card_terms(2, ["A", "B"], deck_id=1)
+        seen, changes = GraphIndexBuilder._read_card_changes(kg._db, [1, 2])
+        kg.save_card_terms(2, ["A", "C"], deck_id=1)
+        GraphIndexBuilder._apply_card_changes(kg._db, seen, changes)
+        kg._db.commit()
+
+        assert [r[0] for r in kg._db.execute("SELECT card_id FROM kg_dirty_cards")] == [2]
+        assert [r[0] for r in kg._db.execute("SELECT card_id FROM kg_card_fingerprints")] == [1]
+        self._builder().compute_edges(min_weight=1)
+        assert self._edges() == dict(self._naive_pairs())
+
+
+class TestPooledComputeEdges:
+    """compute_edges() against the connection pool: reads stay off the writer."""
+
+    def setup_method(self):
+        import tempfile
+        import storage.card_sessions as cs
+        self._cs = cs
+        self._orig = (kg._db, cs._DB_PATH)
+        kg._db = None
+        cs._DB_PATH = tempfile.mkdtemp() + "/card_sessions.db"
+
+    def teardown_method(self):
+        from storage import db_pool
+        db_pool.close_pool(self._cs._DB_PATH)
+        kg._db, self._cs._DB_PATH = self._orig
+
+    def test_reads_and_ranking_run_on_the_calling_thread(self, monkeypatch):
+        import threading
+        from ai.kg_builder import GraphIndexBuilder
+        for card_id in range(6):
+            kg.save_card_terms(card_id, ["A", "B", "C%d" % (card_id % 2)], deck_id=1)
+        builder = GraphIndexBuilder()
+        builder.compute_edges(min_weight=2)
+        kg.save_card_terms(6, ["A", "C0"], deck_id=1)
+
+        threads = []
+        for name in ("_read_card_changes", "_rank_neighbours"):
+            original = getattr(GraphIndexBuilder, name)
+
+            def recording(*args, _original=original):
+                threads.append(threading.current_thread())
+                return _original(*args)
+            monkeypatch.setattr(GraphIndexBuilder, name, staticmethod(recording))
+        builder.compute_edges(min_weight=2)
+
+        assert threads == [threading.current_thread()] * 2
+        edges = {(e["term_a"], e["term_b"]): e["weight"] for e in kg.get_all_edges(min_weight=1)}
+        assert edges == {("A", "B"): 6, ("A", "C0"): 4, ("A", "C1"): 3, ("B", "C0"): 3, ("B", "C1"): 3}
+
+
+class TestTopKEdges(_BaseKGBuilderTest):
+
+    def _builder(self):
+        from ai.kg_builder import GraphIndexBuilder
+        return GraphIndexBuilder()
+
+    def _hub_collection(self):
+        # "Hub" is on every card; the rare pair only shares two cards
+        for card_id in range(20):
+            terms = ["Hub", "H%d" % (card_id % 5)]
+            if card_id < 2:
+                terms += ["Rare", "Rarer"]
+            kg.save_card_terms(card_id, terms, deck_id=1)
+
+    def test_neighbour_lists_are_bounded(self):
+        self._hub_collection()
+        self._builder().compute_edges(min_weight=2, top_k=2)
+        per_term = kg._db.execute(
+            "SELECT term, COUNT(*) FROM kg_term_topk GROUP BY term").fetchall()
+        assert per_term and max(r[1] for r in per_term) <= 2
+
+    def test_rare_terms_keep_their_best_neighbour(self):
+        self._hub_collection()
+        self._builder().compute_edges(min_weight=2, top_k=1)
+        assert [t for t, _ in kg.get_term_expansions("Rare", max_terms=1)] == ["Rarer"]
+        edge = kg._db.execute(
+            "SELECT weight, score FROM kg_edges WHERE term_a = 'Rare' AND term_b = 'Rarer'"
+        ).fetchone()
+        assert edge[0] == 2 and edge[1] > 0.5
+
+    def test_incremental_matches_full_rebuild(self):
+        self._hub_collection()
+        builder = self._builder()
+        builder.compute_edges(min_weight=2, top_k=2)
+        kg.save_card_terms(2, ["Hub", "Rare", "Rarer"], deck_id=1)
+        builder.compute_edges(min_weight=2, top_k=2)
+        incremental = {(e["term_a"], e["term_b"]) for e in kg.get_all_edges(min_weight=1)}
+        builder.compute_edges(min_weight=2, top_k=2, full=True)
+        full = {(e["term_a"], e["term_b"]) for e in kg.get_all_edges(min_weight=1)}
+        assert ("Rare", "Rarer") in incremental
+        assert incremental == full
+
+    def test_small_writer_jobs_keep_edges_across_chunks(self, monkeypatch):
+        import ai.kg_builder as kb
+        monkeypatch.setattr(kb, "_TERM_CHUNK", 2)
+        self._hub_collection()
+        builder = self._builder()
+        builder.compute_edges(min_weight=2, top_k=3)
+        kg.save_card_terms(2, ["Hub", "Rare", "Rarer", "H1"], deck_id=1)
+        kg.save_card_terms(7, ["Hub", "Rare"], deck_id=1)
+        builder.compute_edges(min_weight=2, top_k=3)
+        incremental = {(e["term_a"], e["term_b"]): e["weight"] for e in kg.get_all_edges(min_weight=1)}
+        builder.compute_edges(min_weight=2, top_k=3, full=True)
+        assert incremental == {(e["term_a"], e["term_b"]): e["weight"] for e in kg.get_all_edges(min_weight=1)}
+
 
 import unittest
 
@@ -25,6 +25,9 @@ def _make_test_db():
     ]
     db.executemany("INSERT INTO kg_edges VALUES (?, ?, ?)", edges)
     db.commit()
+    # Pre-term_norm schema above — migrate it like an existing user DB
+    from storage.kg_store import _migrate_kg_schema
+    _migrate_kg_schema(db)
     return db
 
 
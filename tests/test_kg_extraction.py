@@ -0,0 +1,129 @@
+"""Tests for ai/kg_extraction.py — resumable KG term-extraction queue."""
+
+import storage.kg_store as kg
+from ai.embed_pipeline import EmbedError, RateLimited
+from ai.kg_extraction import run_extraction_queue
+
+
+def _seed_cards(n=40):
+    """Card content for cards 1..n (enqueue_extraction skips cards without it)."""
+    kg.save_card_content_bulk([(i, "Frage %d" % i, "Antwort %d" % i, "Deck") for i in range(1, n + 1)])
+
+
+def _fast(**kwargs):
+    kwargs.setdefault('base_backoff', 0.001)
+    kwargs.setdefault('sleep', lambda s: None)
+    kwargs.setdefault('batch_size', 5)
+    kwargs.setdefault('min_batch', 5)
+    return kwargs
+
+
+def _extract(cards):
+    return {c['card_id']: ["Term%d" % (c['card_id'] % 7)] for c in cards if c['card_id'] % 10}
+
+
+class TestQueue:
+
+    def test_enqueue_skips_cards_with_terms_or_without_content(self, kg_db):
+        _seed_cards()
+        kg.save_card_terms(1, ["Herz"], deck_id=1)
+        assert kg.enqueue_extraction([(1, 1), (2, 1), (3, 1), (99, 1)]) == 2
+        assert kg.enqueue_extraction([(2, 1), (3, 1)]) == 0
+        assert kg.extraction_queue_stats() == {'pending': 2}
+
+    def test_drains_queue_and_records_status(self, kg_db):
+        _seed_cards()
+        kg.enqueue_extraction((i, 1) for i in range(1, 41))
+        stats = run_extraction_queue(_extract, **_fast())
+        assert stats['cards'] == 40 and stats['error'] is None
+        assert kg.extraction_queue_stats() == {'done': 36, 'empty': 4}
+        assert kg.get_card_terms(3) == ["Term3"]
+        assert "Term3" in stats['written_terms'] and len(stats['written_terms']) == stats['terms']
+        # nothing left to send on the next run
+        assert kg.enqueue_extraction((i, 1) for i in range(1, 41)) == 0
+
+    def test_cancelled_run_resumes_where_it_stopped(self, kg_db):
+        _seed_cards()
+        kg.enqueue_extraction((i, 1) for i in range(1, 41))
+        seen = []
+
+        def counting(cards):
+            seen.extend(c['card_id'] for c in cards)
+            return _extract(cards)
+
+        run_extraction_queue(counting, cancelled=lambda: len(seen) >= 10,
+                             **_fast(concurrency=1, max_concurrency=1))
+        first = set(seen)
+        assert kg.extraction_queue_stats().get('running') is None
+        run_extraction_queue(counting, **_fast())
+        assert len(seen) == 40 and first.isdisjoint(seen[len(first):])
+
+    def test_rate_limit_is_retried(self, kg_db):
+        _seed_cards(10)
+        kg.enqueue_extraction((i, 1) for i in range(1, 11))
+        calls = {'n': 0}
+
+        def throttled(cards):
+            calls['n'] += 1
+            if calls['n'] == 1:
+                raise RateLimited(retry_after=0)
+            return _extract(cards)
+
+        stats = run_extraction_queue(throttled, **_fast(concurrency=1, max_concurrency=1))
+        assert stats['throttled'] == 1 and stats['cards'] == 10
+
+    def test_quota_stop_keeps_cards_pending(self, kg_db):
+        _seed_cards(10)
+        kg.enqueue_extraction((i, 1) for i in range(1, 11))
+
+        def denied(cards):
+            raise EmbedError("HTTP 403", retryable=False)
+
+        stats = run_extraction_queue(denied, **_fast())
+        assert stats['error'] == "HTTP 403"
+        row = kg_db.execute("SELECT status, attempts, last_error FROM kg_extraction_queue "
+                            "WHERE card_id = 1").fetchone()
+        assert tuple(row) == ('pending', 0, "HTTP 403")
+
+    def test_repeated_failures_mark_cards_failed(self, kg_db):
+        _seed_cards(1)
+        kg.enqueue_extraction([(1, 1)])
+
+        def broken(cards):
+            raise EmbedError("HTTP 503")
+
+        for _ in range(2):
+            run_extraction_queue(broken, max_attempts=2, **_fast(max_retries=0))
+        assert kg.extraction_queue_stats() == {'failed': 1}
+        assert kg.enqueue_extraction([(1, 1)]) == 0  # cooldown
+        assert kg.enqueue_extraction([(1, 1)], retry_failed_after=-1) == 1
+
+    def test_deleted_terms_are_queued_again(self, kg_db):
+        _seed_cards(3)
+        kg.enqueue_extraction([(3, 1)])
+        run_extraction_queue(_extract, **_fast())
+        kg.delete_card_terms(3)
+        assert kg.enqueue_extraction([(3, 1)]) == 1
+
+
+class TestLocalFirst:
+
+    def test_confident_cards_never_reach_the_llm(self, kg_db):
+        from ai.term_extractor import TermExtractor
+        kg.save_card_content_bulk([
+            (101, "Welche Funktion hat der Musculus biceps brachii?",
+             "Beugung im Ellenbogengelenk und Supination des Unterarms", "Deck"),
+            (102, "Reaktion von NaCl und H2SO4?", "NaHSO4 + HCl", "Deck"),
+        ])
+        kg.enqueue_extraction([(101, 1), (102, 1)])
+        sent = []
+
+        def llm(cards):
+            sent.extend(c['card_id'] for c in cards)
+            return {c['card_id']: ["Schwefelsäure"] for c in cards}
+
+        stats = run_extraction_queue(llm, local_extractor=TermExtractor(), **_fast())
+        assert sent == [102]
+        assert stats['local'] == 1 and stats['llm'] == 1 and stats['cards'] == 2
+        assert "Ellenbogengelenk" in kg.get_card_terms(101)
+        assert kg.extraction_queue_stats(by_method=True) == {('done', 'local'): 1, ('done', 'llm'): 1}
@@ -3,6 +3,7 @@
 These tests use an in-memory SQLite database (no Anki dependency).
 """
 
+import json
 import sqlite3
 import struct
 import storage.kg_store as kg
@@ -133,6 +134,33 @@ class TestTermFrequencies(_BaseKGTest):
         kg.update_term_frequencies()
         assert kg.get_term_frequency("Gamma") == 1
 
+    def test_bulk_save_and_targeted_update(self):
+        written = kg.save_card_terms_bulk([
+            (40, ["Alpha", "Beta"], 1),
+            (41, ["Alpha"], 2, ["Alpha"]),
+        ])
+        assert written == {"Alpha", "Beta"}
+        assert kg.get_cards_with_terms() == {40, 41}
+        kg.save_card_terms(42, ["Delta"], deck_id=1)
+        kg.update_term_frequencies(terms=["Alpha"])
+        assert kg.get_term_frequency("Alpha") == 2
+        assert kg.get_term_frequency("Beta") == 0  # not recounted yet
+        assert kg.get_term_frequency("Delta") == 0
+        kg.update_term_frequencies(written)
+        assert kg.get_term_frequency("Beta") == 1
+
+    def test_term_without_cards_drops_to_zero(self):
+        kg.save_card_terms(50, ["Alpha", "Beta"], deck_id=1)
+        kg.save_card_terms(51, ["Gamma"], deck_id=1)
+        kg.update_term_frequencies()
+        kg.delete_card_terms(50)
+        kg.update_term_frequencies(terms=["Beta"])
+        assert kg.get_term_frequency("Beta") == 0
+        assert kg.get_term_frequency("Alpha") == 1  # not recounted
+        kg.delete_card_terms(51)
+        kg.update_term_frequencies()
+        assert kg.get_term_frequency("Alpha") == kg.get_term_frequency("Gamma") == 0
+
 
 class TestEdges(_BaseKGTest):
 
@@ -165,6 +193,17 @@ class TestEdges(_BaseKGTest):
     def test_no_connections_returns_empty(self):
         assert kg.get_connected_terms("isolated_node") == []
 
+    def test_replace_all_edges_swaps_table(self):
+        kg.save_edges([("Old", "Edge", 9)])
+        kg.replace_all_edges([("Herz", "EKG", 5, 0.7), ("EKG", "Infarkt", 3, None)])
+        assert {(e["term_a"], e["term_b"]): e["weight"] for e in kg.get_all_edges()} == {
+            ("Herz", "EKG"): 5, ("EKG", "Infarkt"): 3}
+        assert kg.get_term_expansions("EKG") == [("Herz", 5), ("Infarkt", 3)]
+        indexes = {r[0] for r in kg._db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'kg_edges'")}
+        assert "idx_kg_edges_term_b" in indexes
+        assert not kg._has_table(kg._db, "kg_edges_staging")
+
 
 class TestDefinitions(_BaseKGTest):
 
@@ -301,6 +340,13 @@ class TestDeckCrossLinks(_BaseKGTest):
         count = kg.compute_deck_links(min_shared=2)
         assert count >= 1
 
+    def test_compute_deck_links_accepts_max_links(self):
+        kg.save_card_terms(100, ["Kollagen", "Prolin"], deck_id=1)
+        kg.save_card_terms(200, ["Kollagen", "Prolin"], deck_id=2)
+        kg.save_card_terms(300, ["Kollagen", "Prolin"], deck_id=3)
+        assert kg.compute_deck_links(2, 1) == 3
+        assert len(kg.get_deck_cross_links(max_links=1)) == 1
+
     def test_get_deck_cross_links_format(self):
         kg.save_card_terms(100, ["Kollagen", "Prolin", "Elastin"], deck_id=1)
         kg.save_card_terms(200, ["Kollagen", "Prolin"], deck_id=2)
@@ -313,6 +359,70 @@ class TestDeckCrossLinks(_BaseKGTest):
         assert "weight" in links[0]
         assert links[0]["type"] == "crosslink"
 
+    def _links(self):
+        return {(r["deck_a"], r["deck_b"]): r["shared_terms"]
+                for r in kg._db.execute("SELECT * FROM kg_deck_links")}
+
+    def _self_join_links(self, min_shared):
+        return {(r[0], r[1]): r[2] for r in kg._db.execute("""
+            SELECT a.deck_id, b.deck_id, COUNT(DISTINCT a.term)
+            FROM kg_card_terms a JOIN kg_card_terms b ON a.term = b.term AND a.deck_id < b.deck_id
+            GROUP BY a.deck_id, b.deck_id HAVING COUNT(DISTINCT a.term) >= ?
+        """, (min_shared,))}
+
+    def test_deck_terms_rollup_follows_card_terms(self):
+        kg.save_card_terms(1, ["Kollagen", "Prolin"], deck_id=1)
+        kg.save_card_terms(2, ["Kollagen"], deck_id=1)
+        rollup = lambda: {(r[0], r[1]): r[2] for r in kg._db.execute(
+            "SELECT deck_id, term, count FROM kg_deck_terms")}
+        assert rollup() == {(1, "Kollagen"): 2, (1, "Prolin"): 1}
+        kg.save_card_terms(2, ["Kollagen"], deck_id=2)  # card moved
+        kg.delete_card_terms(1)
+        assert rollup() == {(2, "Kollagen"): 1}
+
+    def test_incremental_links_match_full_recompute(self):
+        decks = {1: ["A", "B", "C", "D"], 2: ["A", "B", "C"], 3: ["B", "C", "D"], 4: ["X"]}
+        for deck_id, terms in decks.items():
+            for i, term in enumerate(terms):
+                kg.save_card_terms(deck_id * 100 + i, [term], deck_id=deck_id)
+        kg.compute_deck_links(min_shared=2)
+        assert self._links() == self._self_join_links(2)
+        assert kg._db.execute("SELECT COUNT(*) FROM kg_dirty_decks").fetchone()[0] == 0
+
+        # Re-saving known terms does not dirty the deck; new terms do
+        kg.save_card_terms(100, ["A"], deck_id=1)
+        kg.save_card_terms(400, ["X", "B", "C"], deck_id=4)
+        kg.delete_card_terms(201)
+        dirty = {r[0] for r in kg._db.execute("SELECT deck_id FROM kg_dirty_decks")}
+        assert dirty == {2, 4}
+        kg.compute_deck_links(min_shared=2)
+        assert self._links() == self._self_join_links(2)
+        top = json.loads(kg._db.execute(
+            "SELECT top_terms FROM kg_deck_links WHERE deck_a = 3 AND deck_b = 4").fetchone()[0])
+        assert sorted(top) == ["B", "C"]
+
+    def test_deck_changed_during_compute_stays_dirty(self, monkeypatch):
+        kg.save_card_terms(1, ["A", "B"], deck_id=1)
+        kg.save_card_terms(2, ["A", "B"], deck_id=2)
+        kg.save_card_terms(3, ["A", "B"], deck_id=3)
+        run_write = kg.run_write
+
+        def change_then_write(fn, *args):
+            kg.save_card_terms(4, ["C"], deck_id=2)  # lands after the read
+            return run_write(fn, *args)
+
+        monkeypatch.setattr(kg, "run_write", change_then_write)
+        assert kg.compute_deck_links(min_shared=2) == 3
+        dirty = {r[0] for r in kg._db.execute("SELECT deck_id FROM kg_dirty_decks")}
+        assert dirty == {2}
+
+    def test_rollup_backfilled_for_existing_db(self):
+        kg.save_card_terms(1, ["Kollagen", "Prolin"], deck_id=1)
+        kg.save_card_terms(2, ["Kollagen", "Prolin"], deck_id=2)
+        kg._db.executescript("DELETE FROM kg_deck_terms; DELETE FROM kg_dirty_decks;")
+        kg._init_kg_schema(kg._db)
+        assert kg.compute_deck_links(min_shared=2) == 1
+
     def test_search_decks_by_term(self):
         kg.save_card_terms(100, ["Kollagen"], deck_id=1)
         kg.save_card_terms(200, ["Kollagen"], deck_id=2)
@@ -326,6 +436,102 @@ class TestDeckCrossLinks(_BaseKGTest):
         assert 1 in deck_ids
 
 
+class TestTermNormalization(_BaseKGTest):
+    """normalize_term and the term_norm columns maintained by the writers."""
+
+    def test_normalize_term(self):
+        assert kg.normalize_term("  Dünndarm ") == "duenndarm"
+        assert kg.normalize_term("Straße") == "strasse"
+        assert kg.normalize_term("Du\u0308nndarm") == kg.normalize_term("Dünndarm")
+
+    def test_save_card_terms_fills_term_norm(self):
+        kg.save_card_terms(1, ["Glukose-6-Phosphat"], deck_id=1)
+        kg.update_term_frequencies()
+        row = kg._db.execute("SELECT term_norm FROM kg_card_terms").fetchone()
+        assert row[0] == "glukose-6-phosphat"
+        assert kg.exact_term_lookup("GLUKOSE-6-PHOSPHAT") == "Glukose-6-Phosphat"
+
+    def test_search_terms_exact_case_insensitive_prefix(self):
+        kg.save_card_terms(1, ["Ösophagus"], deck_id=1)
+        assert kg.search_terms_exact("oesoph") == ["Ösophagus"]
+
+
+class TestFullTextSearch(_BaseKGTest):
+    """FTS5 indexes over card_content and the term vocabulary."""
+
+    def _seed(self):
+        kg.save_card_content_bulk([
+            (1, "Was ist Herzinsuffizienz?", "Unzureichende Pumpleistung", "Kardio"),
+            (2, "Aufbau der Dünndarmwand", "Mukosa, Submukosa", "GI"),
+            (3, "Dünndarm Abschnitte", "Duodenum, Jejunum, Ileum", "GI"),
+        ])
+
+    def test_word_match_folds_diacritics(self):
+        self._seed()
+        hits = [r["card_id"] for r in kg.search_card_content("dunndarm")]
+        assert sorted(hits) == [2, 3]  # "Dünndarm" and prefix of "Dünndarmwand"
+
+    def test_substring_inside_compound(self):
+        self._seed()
+        assert [r["card_id"] for r in kg.search_card_content("insuffizienz")] == [1]
+
+    def test_index_follows_updates_and_deletes(self):
+        self._seed()
+        kg.save_card_content_bulk([(3, "Dickdarm Abschnitte", "Zäkum, Kolon", "GI")])
+        kg._db.execute("DELETE FROM card_content WHERE card_id = 1")
+        kg._db.commit()
+        assert [r["card_id"] for r in kg.search_card_content("Kolon")] == [3]
+        assert kg.search_card_content("Herzinsuffizienz") == []
+
+    def test_existing_rows_indexed_on_creation(self):
+        self._seed()
+        kg._db.executescript("DROP TABLE card_content_fts; DROP TABLE card_content_trigram;")
+        kg._init_kg_schema(kg._db)
+        assert [r["card_id"] for r in kg.search_card_content("Jejunum")] == [3]
+
+    def test_like_fallback_without_fts(self):
+        self._seed()
+        kg.save_card_terms(1, ["Herzinsuffizienz"], deck_id=7)
+        kg._db.executescript(
+            "DROP TABLE card_content_fts; DROP TABLE card_content_trigram; DROP TABLE kg_terms_fts;")
+        assert [r["card_id"] for r in kg.search_card_content("insuffizienz")] == [1]
+        assert kg.search_decks_by_term("insuff") == [7]
+
+    def test_card_ids_by_term_substring(self):
+        kg.save_card_terms(1, ["Herzinsuffizienz"], deck_id=1)
+        kg.save_card_terms(2, ["Niereninsuffizienz", "Niere"], deck_id=1)
+        kg.save_card_terms(3, ["Leber"], deck_id=1)
+        assert set(kg.search_card_ids_by_term("insuffizienz")) == {1, 2}
+        assert kg.search_card_ids_by_term("Dünn") == []
+
+    def test_term_leaves_index_with_last_card(self):
+        kg.save_card_terms(1, ["Glykolyse"], deck_id=1)
+        kg.save_card_terms(2, ["Glykolyse"], deck_id=1)
+        assert kg._db.execute("SELECT COUNT(*) FROM kg_terms_fts").fetchone()[0] == 1
+        kg.delete_card_terms(1)
+        assert kg.search_card_ids_by_term("glyko") == [2]
+        kg.delete_card_terms(2)
+        assert kg._db.execute("SELECT COUNT(*) FROM kg_terms_fts").fetchone()[0] == 0
+
+
+class TestCardContentBulk(_BaseKGTest):
+    """save_card_content_bulk writes new/changed rows only."""
+
+    def test_inserts_and_skips_unchanged(self):
+        rows = [(1, "Q1", "A1", "Deck"), (2, "Q2", "A2", "Deck")]
+        assert kg.save_card_content_bulk(rows) == 2
+        assert kg.save_card_content_bulk(rows) == 0
+        assert kg.get_card_content(2)["answer"] == "A2"
+
+    def test_updates_changed_rows(self):
+        kg.save_card_content_bulk([(1, "Q1", "A1", "Deck"), (2, "Q2", "A2", "Deck")])
+        assert kg.save_card_content_bulk([(1, "Q1", "A1", "Deck"), (2, "Q2", "A2 neu", "Deck")]) == 1
+        assert kg.get_card_content(2)["answer"] == "A2 neu"
+
+    def test_empty(self):
+        assert kg.save_card_content_bulk([]) == 0
+
+
 import unittest
 
 
@@ -348,6 +554,8 @@ class TestKgStoreEnrichment(unittest.TestCase):
                  ('Jejunum', 'Ileum', 5)]
         self.db.executemany("INSERT INTO kg_edges VALUES (?, ?, ?)", edges)
         self.db.commit()
+        # Pre-term_norm schema above — migrate it like an existing user DB
+        kg._migrate_kg_schema(self.db)
 
     def test_get_term_expansions_sorted_by_weight(self):
         from storage.kg_store import get_term_expansions
@@ -374,6 +582,27 @@ class TestKgStoreEnrichment(unittest.TestCase):
         from storage.kg_store import exact_term_lookup
         self.assertIsNone(exact_term_lookup('Quantenmechanik', db=self.db))
 
+    def test_exact_term_lookup_umlaut_spelling(self):
+        from storage.kg_store import exact_term_lookup
+        self.assertEqual(exact_term_lookup('DÜNNDARM', db=self.db), 'Duenndarm')
+
+    def test_exact_term_lookup_uses_index(self):
+        from storage.kg_store import normalize_term
+        plan = self.db.execute(
+            "EXPLAIN QUERY PLAN SELECT term FROM kg_terms WHERE term_norm = ? "
+            "ORDER BY frequency DESC LIMIT 1", (normalize_term('Ileum'),)).fetchall()
+        self.assertIn('idx_kg_terms_norm', ' '.join(str(tuple(r)) for r in plan))
+
+    def test_prefix_term_lookup_by_frequency(self):
+        from storage.kg_store import prefix_term_lookup
+        self.assertEqual(prefix_term_lookup('du', limit=3, db=self.db), ['Duodenum', 'Duenndarm'])
+
+    def test_migration_is_idempotent(self):
+        from storage.kg_store import _migrate_kg_schema
+        _migrate_kg_schema(self.db)
+        nulls = self.db.execute("SELECT COUNT(*) FROM kg_terms WHERE term_norm IS NULL").fetchone()[0]
+        self.assertEqual(nulls, 0)
+
     def test_load_term_embeddings_empty(self):
         from storage.kg_store import load_term_embeddings
         self.assertEqual(load_term_embeddings(db=self.db), {})
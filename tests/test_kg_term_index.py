@@ -0,0 +1,126 @@
+"""Tests for ai/kg_term_index.py — matrix-backed KG term embedding index."""
+
+import math
+import random
+import struct
+
+import pytest
+
+import storage.kg_store as kg
+from ai.kg_enrichment import (_embedding_expand_terms, _shares_stem,
+                              EMB_EXPANSION_TOP_K, EMB_SIMILARITY_MIN)
+from ai.kg_term_index import KGTermIndex, as_term_index, load_term_index
+
+DIM = 16
+
+
+def _unit(vec):
+    norm = math.sqrt(sum(v * v for v in vec))
+    return [v / norm for v in vec]
+
+
+def _random_terms(n, seed=0):
+    rng = random.Random(seed)
+    stems = ["Darm", "Herz", "Niere", "Leber", "Milz", "Lunge", "Magen", "Nerv"]
+    vectors = {}
+    for i in range(n):
+        term = "%s%s%d" % (rng.choice(stems), rng.choice(["", "wand", "zelle"]), i)
+        vectors[term] = _unit([rng.gauss(0, 1) for _ in range(DIM)])
+    return vectors
+
+
+def _brute_force(vectors, query, top_k, min_score, accept=lambda t: True):
+    q = _unit(query)
+    scored = [(t, sum(a * b for a, b in zip(q, v))) for t, v in vectors.items() if accept(t)]
+    scored = [(t, s) for t, s in scored if s >= min_score]
+    scored.sort(key=lambda x: x[1], reverse=True)
+    return [t for t, _ in scored[:top_k]]
+
+
+class TestSearch:
+
+    def test_matches_full_scan_with_filter(self):
+        vectors = _random_terms(300)
+        index = KGTermIndex.from_vectors(vectors)
+        rng = random.Random(1)
+        queries = [[rng.gauss(0, 1) for _ in range(DIM)] for _ in range(5)]
+
+        def reject_darm(_, term):
+            return not term.startswith("Darm")
+
+        hits = index.search(queries, top_k=10, min_score=0.0, accept=reject_darm)
+        for query, result in zip(queries, hits):
+            expected = _brute_force(vectors, query, 10, 0.0, lambda t: not t.startswith("Darm"))
+            assert [t for t, _ in result] == expected
+
+    def test_zero_and_mismatched_queries_get_no_results(self):
+        index = KGTermIndex.from_vectors(_random_terms(20))
+        assert index.search([[0.0] * DIM, [1.0] * 3, None]) == [[], [], []]
+
+    def test_reads_like_a_dict(self):
+        vectors = _random_terms(5)
+        index = as_term_index(vectors)
+        assert set(index) == set(vectors) and len(index) == 5
+        term = next(iter(vectors))
+        assert term in index
+        assert index[term] == pytest.approx(vectors[term], abs=1e-6)
+        assert not as_term_index({})
+        assert as_term_index(index) is index
+
+
+class TestExpandTerms:
+
+    def test_matches_legacy_linear_scan(self):
+        """Sentence expansion equals filtering every term, then taking the top."""
+        vectors = _random_terms(400, seed=3)
+        terms = ["Darm", "Herzwand7"]
+        rng = random.Random(4)
+        sentence = _unit([rng.gauss(0, 1) for _ in range(DIM)])
+        # Make many terms similar to the sentence so the stem filter matters
+        for term in list(vectors)[:120]:
+            vectors[term] = _unit([s + 0.15 * rng.gauss(0, 1) for s in sentence])
+
+        result = _embedding_expand_terms(terms, vectors, {}, sentence_embedding=sentence)
+        terms_lower = {t.lower() for t in terms}
+        expected = _brute_force(
+            vectors, sentence, EMB_EXPANSION_TOP_K * 2, EMB_SIMILARITY_MIN,
+            lambda t: t.lower() not in terms_lower and not any(
+                _shares_stem(t.lower(), q) for q in terms_lower))
+        assert [t for t, _ in result['_sentence']] == expected
+
+    def test_term_level_skips_self_and_sentence_hits(self):
+        vectors = {"Dünndarm": _unit([1, 0.1, 0]), "Duenndarm": _unit([1, 0.12, 0]),
+                   "Jejunum": _unit([1, 0.2, 0]), "Milz": _unit([0, 0, 1])}
+        result = _embedding_expand_terms(
+            ["Dünndarm"], vectors, {"Dünndarm": [1, 0.1, 0]},
+            sentence_embedding=[1, 0.2, 0])
+        assert [t for t, _ in result["_sentence"]] == ["Jejunum"]
+        assert [t for t, _ in result["Dünndarm"]] == ["Duenndarm"]
+
+
+class TestSnapshot:
+
+    def _embed(self, term, vec):
+        kg.save_term_embedding(term, struct.pack('<%df' % len(vec), *vec))
+
+    def test_snapshot_reused_until_terms_change(self, kg_db, tmp_path):
+        for term, vec in _random_terms(30).items():
+            self._embed(term, vec)
+        prefix = str(tmp_path / "terms")
+        first = load_term_index(prefix, model="m")
+        assert len(first) == 30 and (tmp_path / "terms.vec").exists()
+
+        mapped = load_term_index(prefix, model="m")
+        assert mapped.terms == first.terms
+        probe = [1.0] * DIM
+        expected = first.search([probe], top_k=3)[0]
+        got = mapped.search([probe], top_k=3)[0]
+        assert [t for t, _ in got] == [t for t, _ in expected]
+        assert [s for _, s in got] == pytest.approx([s for _, s in expected], abs=1e-6)
+
+        self._embed("Neu", [1.0] * DIM)
+        assert "Neu" in load_term_index(prefix, model="m")
+        assert len(load_term_index(prefix, model="other")) == 31
+
+    def test_no_embeddings_gives_empty_index(self, kg_db, tmp_path):
+        assert len(load_term_index(str(tmp_path / "terms"))) == 0
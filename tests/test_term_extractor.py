@@ -1,12 +1,12 @@
 """Tests for ai/term_extractor.py — local term extraction (no LLM)."""
 
 try:
-    from ai.term_extractor import TermExtractor, compute_collocations
+    from ai.term_extractor import TermExtractor, compute_collocations, LOCAL_CONFIDENCE_THRESHOLD
 except ImportError:
     import sys
     import os
     sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
-    from ai.term_extractor import TermExtractor, compute_collocations
+    from ai.term_extractor import TermExtractor, compute_collocations, LOCAL_CONFIDENCE_THRESHOLD
 
 
 class TestTermExtractor:
@@ -44,6 +44,11 @@ class TestTermExtractor:
         for sw in ("the", "through"):
             assert sw not in lower, f"Stopword '{sw}' should be filtered"
 
+    def test_capitalised_domain_nouns_are_kept(self):
+        """Stopwords match lowercased only: 'Therapie' or 'Zelle' stay terms."""
+        result = self.extractor.extract("Die Therapie der Zelle beginnt nach der Diagnose")
+        assert result == ["Therapie", "Zelle", "Diagnose"]
+
     # ------------------------------------------------------------------ #
     # test_filters_short_words                                             #
     # ------------------------------------------------------------------ #
@@ -247,3 +252,44 @@ class TestPMICollocation:
         assert "Osteogenesis imperfecta" in terms
         assert "Osteogenesis" not in terms  # merged into compound
 
+
+
+class TestScore:
+
+    def test_plain_anatomy_card_is_confident(self):
+        """A noun-heavy German card stays local."""
+        result = TermExtractor().score(
+            "Welche Funktion hat der Musculus biceps brachii?",
+            "Beugung im Ellenbogengelenk und Supination des Unterarms")
+        assert result.confidence >= LOCAL_CONFIDENCE_THRESHOLD
+        assert "Ellenbogengelenk" in result.terms
+
+    def test_chemistry_goes_to_llm(self):
+        """Sum formulas / reaction equations are left to the LLM."""
+        result = TermExtractor().score("Reaktion von NaCl und H2SO4?", "NaHSO4 + HCl")
+        assert result.confidence < LOCAL_CONFIDENCE_THRESHOLD
+        assert "chemistry" in result.reasons
+
+    def test_abbreviation_heavy_card_is_penalised(self):
+        result = TermExtractor().score("Was ist ACE, ARB, AT1R, RAAS?", "ACE KDH AZV")
+        assert "abbreviations" in result.reasons
+        assert result.confidence < LOCAL_CONFIDENCE_THRESHOLD
+
+    def test_near_empty_card_needs_no_llm(self):
+        result = TermExtractor().score("Ja", "Nein")
+        assert result.terms == [] and result.confidence == 1.0
+
+    def test_unknown_vocabulary_lowers_confidence(self):
+        extractor = TermExtractor()
+        question = "Welche Funktion hat die Aorta ascendens?"
+        known = extractor.score(question, vocabulary={"aorta", "ascendens"})
+        unknown = extractor.score(question, vocabulary={"milz"})
+        assert known.confidence > unknown.confidence
+        assert "unknown_vocabulary" in unknown.reasons
+
+    def test_vocabulary_uses_kg_term_keys(self):
+        """Decomposed umlauts match the NFC keys kg_store.normalize_term stores."""
+        import unicodedata
+        question = unicodedata.normalize("NFD", "Welche Aufgabe hat der Dünndarm?")
+        result = TermExtractor().score(question, vocabulary={"duenndarm", "aufgabe"})
+        assert "unknown_vocabulary" not in result.reasons
@@ -0,0 +1,416 @@
+"""Tests for ai/vector_index.py — contiguous embedding index.
+
+Run against whichever backend is installed (NumPy or pure Python); results
+must be identical in both.
+"""
+
+import math
+import random
+import struct
+
+import pytest
+
+from ai.vector_index import (
+    VectorIndex, decode_vector, encode_vector, fuse_max, has_numpy,
+    parse_prefix_dim, parse_quantization,
+)
+
+
+def _unit(*xs):
+    n = math.sqrt(sum(x * x for x in xs))
+    return [x / n for x in xs]
+
+
+class TestVectorIndex:
+
+    def _index(self):
+        idx = VectorIndex(3)
+        idx.build([1, 2, 3], [[1, 0, 0], [0, 1, 0], [1, 1, 0]])
+        return idx
+
+    def test_build_normalizes_rows(self):
+        idx = self._index()
+        vec = idx.get_vector(3)
+        assert abs(math.sqrt(sum(v * v for v in vec)) - 1.0) < 1e-6
+
+    def test_search_orders_by_cosine(self):
+        idx = self._index()
+        results = idx.search([1, 0.1, 0], top_k=3)
+        assert [cid for cid, _ in results] == [1, 3, 2]
+        assert results[0][1] > results[1][1] > results[2][1]
+
+    def test_top_k_limits_results(self):
+        idx = self._index()
+        assert len(idx.search([1, 1, 0], top_k=2)) == 2
+
+    def test_exclude_and_min_score(self):
+        idx = self._index()
+        results = idx.search([1, 0, 0], top_k=3, exclude=[1], min_score=0.5)
+        assert [cid for cid, _ in results] == [3]
+
+    def test_add_inserts_and_replaces(self):
+        idx = self._index()
+        idx.add(4, [0, 0, 2])
+        assert len(idx) == 4
+        assert idx.search([0, 0, 1], top_k=1)[0][0] == 4
+        idx.add(4, [0, 3, 0])
+        assert len(idx) == 4
+        assert idx.get_vector(4) == _unit(0, 1, 0)
+
+    def test_add_grows_beyond_initial_capacity(self):
+        idx = VectorIndex(2)
+        for i in range(600):
+            idx.add(i, [1.0, float(i)])
+        assert len(idx) == 600
+        assert idx.search([1, 0], top_k=1)[0][0] == 0
+        assert 599 in idx
+
+    def test_build_from_bytes_skips_wrong_dim(self):
+        idx = VectorIndex(3)
+        good = struct.pack('<3f', 0.0, 1.0, 0.0)
+        bad = struct.pack('<2f', 1.0, 0.0)
+        assert idx.build_from_bytes([1, 2], [good, bad]) == 1
+        assert 1 in idx and 2 not in idx
+
+    def test_empty_index(self):
+        idx = VectorIndex(3)
+        assert idx.search([1, 0, 0]) == []
+        assert idx.get_vector(1) is None
+
+
+class TestSnapshot:
+
+    def test_save_and_load_roundtrip(self, tmp_path):
+        prefix = str(tmp_path / "idx")
+        idx = VectorIndex(3)
+        idx.build([10, 20], [[1, 0, 0], [0, 2, 0]])
+        idx.save(prefix, {"watermark": "2026-01-01 00:00:00"})
+
+        loaded, meta = VectorIndex.load(prefix, 3)
+        assert meta["watermark"] == "2026-01-01 00:00:00"
+        assert loaded.ids == [10, 20]
+        assert loaded.search([0, 1, 0], top_k=1)[0][0] == 20
+
+    def test_loaded_snapshot_accepts_updates(self, tmp_path):
+        prefix = str(tmp_path / "idx")
+        idx = VectorIndex(3)
+        idx.build([1], [[1, 0, 0]])
+        idx.save(prefix)
+
+        loaded, _ = VectorIndex.load(prefix, 3)
+        loaded.add(1, [0, 0, 1])
+        loaded.add(2, [0, 1, 0])
+        assert not loaded.is_mapped()
+        assert loaded.get_vector(1) == [0.0, 0.0, 1.0]
+        assert len(loaded) == 2
+
+    def test_missing_or_mismatched_snapshot(self, tmp_path):
+        prefix = str(tmp_path / "idx")
+        assert VectorIndex.load(prefix, 3) == (None, None)
+        idx = VectorIndex(3)
+        idx.build([1], [[1, 0, 0]])
+        idx.save(prefix)
+        assert VectorIndex.load(prefix, 4) == (None, None)
+
+
+    def test_frozen_snapshot_ignores_later_writes(self, tmp_path):
+        prefix = str(tmp_path / "idx")
+        idx = VectorIndex(3)
+        idx.build([1, 2, 3], [[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+        state = idx.snapshot()
+        idx.add(1, [0, 1, 1])
+        idx.add(4, [1, 1, 1])
+        idx.remove(2)
+        idx.write_snapshot(state, prefix)
+
+        loaded, _ = VectorIndex.load(prefix, 3)
+        assert loaded.ids == [1, 2, 3]
+        assert loaded.search([1, 0, 0], top_k=1)[0][0] == 1
+        assert idx.search([1, 0, 0], top_k=1)[0][0] == 4
+
+
+class TestQuantization:
+
+    def test_encode_decode_layouts(self):
+        vec = [0.5, -0.25, 0.125, 1.0, -1.0, 0.0]
+        for mode, size in ((None, 24), ("float16", 12), ("int8", 10)):
+            blob = encode_vector(vec, mode)
+            assert len(blob) == size
+            decoded = decode_vector(blob, 6)
+            assert all(abs(a - b) < 0.01 for a, b in zip(vec, decoded))
+
+    def test_decode_rejects_unknown_length(self):
+        assert decode_vector(b"\x00" * 7, 6) is None
+
+    def test_parse_quantization(self):
+        assert parse_quantization("none") is None
+        assert parse_quantization("int8") == "int8"
+        with pytest.raises(ValueError):
+            parse_quantization("int4")
+
+    @pytest.mark.parametrize("mode", ["float16", "int8"])
+    def test_quantized_search_matches_exact(self, mode):
+        rnd = random.Random(7)
+        ids = list(range(400))
+        vectors = [[rnd.gauss(0, 1) for _ in range(16)] for _ in ids]
+        exact = VectorIndex(16)
+        exact.build(ids, vectors)
+        quant = VectorIndex(16, quantization=mode, rescore_candidates=50)
+        quant.build(ids, vectors)
+        for _ in range(5):
+            q = [rnd.gauss(0, 1) for _ in range(16)]
+            want = exact.search(q, top_k=5, exclude=[0])
+            got = quant.search(q, top_k=5, exclude=[0])
+            assert [c for c, _ in got] == [c for c, _ in want]
+            assert all(abs(a - b) < 1e-5 for (_, a), (_, b) in zip(got, want))
+
+    def test_build_from_mixed_layouts(self):
+        idx = VectorIndex(6, quantization="int8")
+        blobs = [encode_vector([1, 0, 0, 0, 0, 0]), encode_vector([0, 1, 0, 0, 0, 0], "float16"),
+                 encode_vector([0, 0, 1, 0, 0, 0], "int8")]
+        assert idx.build_from_bytes([1, 2, 3], blobs) == 3
+        assert idx.search([0, 0, 1, 0, 0, 0], top_k=1)[0][0] == 3
+
+    def test_quantized_snapshot_roundtrip(self, tmp_path):
+        prefix = str(tmp_path / "idx")
+        idx = VectorIndex(3, quantization="int8", rescore_candidates=1)
+        idx.build([1, 2], [[1, 0, 0], [0, 1, 0]])
+        idx.save(prefix)
+        loaded, meta = VectorIndex.load(prefix, 3, quantization="int8", rescore_candidates=1)
+        assert meta["quantization"] == ("int8" if has_numpy() else None)
+        assert loaded.search([0, 1, 0], top_k=1)[0][0] == 2
+
+
+class TestPrefixStage:
+
+    def _data(self, n=400, dim=16, seed=11):
+        rnd = random.Random(seed)
+        return list(range(n)), [[rnd.gauss(0, 1) for _ in range(dim)] for _ in range(n)]
+
+    def test_parse_prefix_dim(self):
+        assert parse_prefix_dim(0, 16) is None
+        assert parse_prefix_dim(16, 16) is None
+        assert parse_prefix_dim("8", 16) == 8
+        with pytest.raises(ValueError):
+            parse_prefix_dim("half", 16)
+
+    def test_prefix_search_returns_exact_scores(self):
+        ids, vectors = self._data()
+        exact = VectorIndex(16)
+        exact.build(ids, vectors)
+        prefixed = VectorIndex(16, rescore_candidates=20, prefix_dim=8)
+        prefixed.build(ids, vectors)
+        q = vectors[5]
+        got = prefixed.search(q, top_k=3)
+        assert got[0][0] == 5
+        want = dict(exact.search(q, top_k=len(ids)))
+        assert all(abs(score - want[cid]) < 1e-5 for cid, score in got)
+
+    def test_rescore_pool_covers_top_k(self):
+        ids, vectors = self._data()
+        exact = VectorIndex(16)
+        exact.build(ids, vectors)
+        prefixed = VectorIndex(16, rescore_candidates=5, prefix_dim=4)
+        prefixed.build(ids, vectors)
+        q = vectors[0]
+        assert len(prefixed.search(q, top_k=50, exclude=[0])) == 50
+
+    def test_prefix_add_and_snapshot(self, tmp_path):
+        prefix = str(tmp_path / "idx")
+        ids, vectors = self._data(n=30)
+        idx = VectorIndex(16, rescore_candidates=3, prefix_dim=8)
+        idx.build(ids, vectors)
+        idx.add(100, [3] * 8 + [0] * 8)
+        assert idx.search([1] * 8 + [0] * 8, top_k=1)[0][0] == 100
+        idx.save(prefix)
+
+        loaded, meta = VectorIndex.load(prefix, 16, rescore_candidates=3, prefix_dim=8)
+        assert meta["prefix_dim"] == 8
+        assert loaded.search(vectors[7], top_k=1)[0][0] == 7
+        other, _ = VectorIndex.load(prefix, 16, rescore_candidates=3, prefix_dim=4)
+        assert other.search(vectors[7], top_k=1)[0][0] == 7
+
+
+@pytest.mark.skipif(not has_numpy(), reason="IVF needs NumPy")
+class TestIVF:
+
+    def _clustered(self, n=600, dim=16, seed=3):
+        rnd = random.Random(seed)
+        centers = [[rnd.gauss(0, 1) for _ in range(dim)] for _ in range(12)]
+        vectors = [[c + 0.2 * rnd.gauss(0, 1) for c in centers[i % 12]] for i in range(n)]
+        return list(range(n)), vectors
+
+    def _index(self, **kw):
+        ids, vectors = self._clustered()
+        idx = VectorIndex(16, ivf=True, ivf_min_rows=100, **kw)
+        idx.build(ids, vectors)
+        return idx, vectors
+
+    def test_small_index_stays_exact(self):
+        ids, vectors = self._clustered(n=50)
+        idx = VectorIndex(16, ivf=True, ivf_min_rows=100)
+        idx.build(ids, vectors)
+        assert not idx.ivf_needs_training()
+        assert idx.search(vectors[3], top_k=1)[0][0] == 3
+
+    def test_all_probes_match_exact_scan(self):
+        idx, vectors = self._index(ivf_lists=8)
+        exact = VectorIndex(16)
+        exact.build(idx.ids, vectors)
+        q = vectors[10]
+        got = idx.search(q, top_k=10, exclude=[10], nprobe=8)
+        assert got == exact.search(q, top_k=10, exclude=[10])
+
+    def test_probing_finds_own_cluster(self):
+        idx, vectors = self._index(ivf_probes=2)
+        for key in (0, 5, 77):
+            assert idx.search(vectors[key], top_k=1)[0][0] == key
+
+    def test_add_after_training(self):
+        idx, vectors = self._index()
+        idx.add(1000, vectors[4])
+        assert {c for c, _ in idx.search(vectors[4], top_k=2)} == {4, 1000}
+
+    def test_retrain_after_doubling(self):
+        idx, vectors = self._index()
+        assert not idx.ivf_needs_training()
+        for i, vec in enumerate(vectors * 2):
+            idx.add(2000 + i, vec)
+        assert idx.ivf_needs_training()
+
+    def test_zero_query_with_trained_lists(self):
+        idx, _ = self._index()
+        assert idx.search([0.0] * 16) == []
+        assert idx.search_many([[0.0] * 16]) == ([[]], None)
+
+    @pytest.mark.skipif(not has_numpy(), reason="IVF needs NumPy")
+    def test_fit_is_discarded_after_compaction(self):
+        idx, vectors = self._index()
+        fitted = idx.fit_ivf()
+        for key in range(300):
+            idx.remove(key)
+        idx.compact()
+        assert not idx.install_ivf(fitted)
+        assert idx.search(vectors[400], top_k=1)[0][0] == 400
+        assert idx.install_ivf(idx.fit_ivf())
+
+    @pytest.mark.skipif(not has_numpy(), reason="IVF needs NumPy")
+    def test_fit_is_discarded_after_update_but_kept_after_append(self):
+        idx, vectors = self._index()
+        fitted = idx.fit_ivf()
+        idx.update(5, vectors[6])
+        assert not idx.install_ivf(fitted)
+
+        fitted = idx.fit_ivf()
+        idx.add(5000, vectors[4])
+        assert idx.install_ivf(fitted)
+        assert {c for c, _ in idx.search(vectors[4], top_k=2)} == {4, 5000}
+
+    def test_snapshot_keeps_lists(self, tmp_path):
+        prefix = str(tmp_path / "idx")
+        idx, vectors = self._index(ivf_lists=6)
+        idx.save(prefix)
+        loaded, meta = VectorIndex.load(prefix, 16, ivf=True, ivf_min_rows=100)
+        assert meta["ivf_lists"] == 6
+        assert not loaded.ivf_needs_training()
+        assert loaded.search(vectors[9], top_k=1)[0][0] == 9
+        plain, _ = VectorIndex.load(prefix, 16)
+        assert plain.search(vectors[9], top_k=1)[0][0] == 9
+
+
+class TestMaintenance:
+
+    def _index(self, n=10):
+        idx = VectorIndex(3)
+        idx.build(range(n), [[1, i, 0] for i in range(n)])
+        return idx
+
+    def test_remove_tombstones_row(self):
+        idx = self._index()
+        assert idx.remove(0)
+        assert not idx.remove(0)
+        assert 0 not in idx and len(idx) == 9
+        assert idx.tombstones == 1
+        assert idx.get_vector(0) is None
+        assert all(cid != 0 for cid, _ in idx.search([1, 0, 0], top_k=10))
+
+    def test_update_requires_existing_key(self):
+        idx = self._index()
+        assert not idx.update(99, [0, 0, 1])
+        assert idx.update(3, [0, 0, 1])
+        assert idx.search([0, 0, 1], top_k=1)[0][0] == 3
+
+    def test_compact_keeps_live_rows(self):
+        idx = self._index()
+        for key in (1, 4, 7):
+            idx.remove(key)
+        assert idx.compact() == 3
+        assert idx.tombstones == 0
+        assert idx.ids == [0, 2, 3, 5, 6, 8, 9]
+        assert idx.search([1, 5, 0], top_k=1)[0][0] == 5
+        idx.add(4, [1, 4, 0])
+        assert idx.search([1, 4, 0], top_k=1)[0][0] == 4
+
+    def test_remove_compacts_automatically(self):
+        idx = self._index(n=40)
+        idx._COMPACT_MIN = 4
+        for key in range(10):
+            idx.remove(key)
+        assert idx.tombstones < 10
+        assert len(idx) == 30
+
+    def test_remove_from_mapped_snapshot(self, tmp_path):
+        prefix = str(tmp_path / "idx")
+        self._index().save(prefix)
+        loaded, _ = VectorIndex.load(prefix, 3)
+        loaded.remove(2)
+        assert loaded.is_mapped() == has_numpy()
+        loaded.save(prefix)
+        reloaded, meta = VectorIndex.load(prefix, 3)
+        assert meta["count"] == 9 and 2 not in reloaded
+
+    def test_duplicate_keys_keep_last(self):
+        idx = VectorIndex(3)
+        idx.build([1, 2, 1], [[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+        assert len(idx) == 2
+        assert idx.search([0, 0, 1], top_k=3)[0][0] == 1
+        assert [cid for cid, _ in idx.search([1, 0, 0], top_k=3, min_score=0.5)] == []
+
+
+class TestSearchMany:
+
+    def _data(self, n=300, dim=12, seed=5):
+        rnd = random.Random(seed)
+        return list(range(n)), [[rnd.gauss(0, 1) for _ in range(dim)] for _ in range(n)]
+
+    @pytest.mark.parametrize("opts", [{}, {"prefix_dim": 6, "rescore_candidates": 20},
+                                      {"quantization": "int8", "rescore_candidates": 20}])
+    def test_matches_single_searches(self, opts):
+        ids, vectors = self._data()
+        idx = VectorIndex(12, **opts)
+        idx.build(ids, vectors)
+        queries = [vectors[1], vectors[50], vectors[99]]
+        per_query, fused = idx.search_many(queries, top_k=5, exclude=[50])
+        assert fused is None
+        for q, got in zip(queries, per_query):
+            want = idx.search(q, top_k=5, exclude=[50])
+            # the shared candidate pool can only improve on a single search
+            assert len(got) == len(want)
+            assert all(g >= w - 1e-6 for (_, g), (_, w) in zip(got, want))
+            if not opts:
+                assert [c for c, _ in got] == [c for c, _ in want]
+
+    def test_fused_keeps_best_score(self):
+        idx = VectorIndex(3)
+        idx.build([1, 2, 3], [[1, 0, 0], [0, 1, 0], [1, 1, 0]])
+        per_query, fused = idx.search_many([[1, 0, 0], [0, 1, 0]], top_k=2, fuse=True)
+        assert [c for c, _ in per_query[0]] == [1, 3]
+        assert [c for c, _ in fused] == [1, 2]
+        assert fused == fuse_max(per_query, 2)
+
+    def test_zero_query_and_empty_input(self):
+        idx = VectorIndex(3)
+        idx.build([1], [[1, 0, 0]])
+        per_query, _ = idx.search_many([[0, 0, 0], [1, 0, 0]], top_k=1)
+        assert per_query[0] == [] and per_query[1][0][0] == 1
+        assert idx.search_many([], top_k=3, fuse=True) == ([], [])
@@ -134,14 +134,13 @@ class AIRequestThread(QThread):
             if card_ctx and card_ctx.get('cardId'):
                 try:
                     try:
-                        from ..storage.card_sessions import load_card_session
+                        from ..storage.card_sessions import load_messages_page
                     except ImportError:
-                        from storage.card_sessions import load_card_session
+                        from storage.card_sessions import load_messages_page
                     card_id = card_ctx['cardId']
-                    session_data = load_card_session(card_id)
-                    db_messages = session_data.get('messages', [])
+                    db_messages = load_messages_page(card_id, limit=10)['messages']
                     if db_messages:
-                        recent = db_messages[-10:]
+                        recent = db_messages
                         card_history = [
                             {'role': 'user' if m.get('sender') == 'user' else 'assistant',
                              'content': m.get('text', '')}
@@ -408,11 +407,9 @@ class SearchCardsThread(QThread):
             vector_ids = set()
             scores = {}
             hit_count = {}  # how many queries found each card
-            for qi, emb in enumerate(query_embs or []):
-                if not emb:
-                    continue
-                results = self.emb_mgr.search(emb, top_k=self.top_k * 2)
-                for cid, score in (results or []):
+            per_query, _ = self.emb_mgr.search_many(query_embs or [], top_k=self.top_k * 2)
+            for results in per_query:
+                for cid, score in results:
                     vector_ids.add(cid)
                     # Keep the best score across all queries
                     if score > scores.get(cid, 0):
@@ -431,19 +428,13 @@ class SearchCardsThread(QThread):
             sql_ids = set()
             try:
                 try:
-                    from ..storage.kg_store import _get_db as kg_get_db
+                    from ..storage.kg_store import search_card_ids_by_term
                 except ImportError:
-                    from storage.kg_store import _get_db as kg_get_db
-                db = kg_get_db()
+                    from storage.kg_store import search_card_ids_by_term
                 # Search card text via kg_card_terms (terms contain keywords)
                 keywords = [w for w in self.query.split() if len(w) >= 3]
                 for kw in keywords:
-                    rows = db.execute(
-                        "SELECT DISTINCT card_id FROM kg_card_terms WHERE term LIKE ?",
-                        (f"%{kw}%",)
-                    ).fetchall()
-                    for r in rows:
-                        sql_ids.add(r[0])
+                    sql_ids.update(search_card_ids_by_term(kw))
             except Exception as e:
                 logger.debug("SQL keyword search failed (non-critical): %s", e)
 
@@ -535,12 +526,7 @@ class SearchCardsThread(QThread):
 
             # === CLUSTER COMPUTATION ===
             # Compute pairwise similarity to find semantic clusters
-            card_embs = {}
-            with self.emb_mgr._lock:
-                for cid in card_ids:
-                    if cid in self.emb_mgr._card_ids:
-                        idx = self.emb_mgr._card_ids.index(cid)
-                        card_embs[cid] = self.emb_mgr._index[idx]
+            card_embs = self.emb_mgr.get_vectors(card_ids)
 
             # Compute all pairwise similarities
             cids_list = list(card_embs.keys())
@@ -1184,6 +1170,8 @@ class ChatbotWidget(QWidget):
             'generateSectionTitle': self._msg_generate_section_title,
             # Card Sessions (SQLite)
             'loadCardSession': self._msg_load_card_session,
+            'loadCardMessages': self._msg_load_card_messages,
+            'loadMessageDetails': self._msg_load_message_details,
             'saveCardSession': self._msg_save_card_session,
             'saveCardMessage': self._msg_save_card_message,
             'saveCardSection': self._msg_save_card_section,
@@ -1270,6 +1258,7 @@ class ChatbotWidget(QWidget):
             'getGraphData': self._msg_get_graph_data,
             'getTermCards': self._msg_get_term_cards,
             'getGraphStatus': self._msg_get_graph_status,
+            'getDbMaintenanceStatus': self._msg_get_db_maintenance_status,
             'getCardKGTerms': self._msg_get_card_kg_terms,
             'getTermDefinition': self._msg_get_term_definition,
             'searchGraph': self._msg_search_graph,
@@ -1414,12 +1403,38 @@ class ChatbotWidget(QWidget):
             self._send_to_frontend("sectionTitleGenerated", parsed)
 
     def _msg_load_card_session(self, data):
-        from ..storage.card_sessions import load_card_session
+        from ..storage.card_sessions import load_card_session_page
         card_id = int(data) if isinstance(data, (int, str)) else data.get('cardId', 0)
-        result = load_card_session(card_id)
+        result = load_card_session_page(card_id)
         payload = {"type": "cardSessionLoaded", "cardId": card_id, "data": result}
         self._send_to_frontend_with_event("cardSessionLoaded", payload, "ankiCardSessionLoaded")
 
+    def _msg_load_card_messages(self, data):
+        """Older page of a card's chat (scrolling up), keyed by the 'before' cursor."""
+        from ..storage.card_sessions import load_messages_page
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except (json.JSONDecodeError, TypeError) as e:
+                logger.warning("Failed to parse data for loadCardMessages: %s", e)
+                return
+        card_id = int(data.get('cardId') or 0)
+        before = data.get('before') or {}
+        result = load_messages_page(card_id, before.get('created_at'), before_id=before.get('id'))
+        self._send_to_frontend("cardMessagesPage", result, {"cardId": card_id})
+
+    def _msg_load_message_details(self, data):
+        """JSON columns (steps, citations, agent cells, ...) for the given message ids."""
+        from ..storage.card_sessions import load_message_details
+        if isinstance(data, str):
+            try:
+                data = json.loads(data)
+            except (json.JSONDecodeError, TypeError) as e:
+                logger.warning("Failed to parse data for loadMessageDetails: %s", e)
+                return
+        result = load_message_details(data.get('messageIds') or [])
+        self._send_to_frontend("cardMessageDetails", result, {"cardId": data.get('cardId')})
+
     def _msg_save_card_session(self, data):
         from ..storage.card_sessions import save_card_session
         if isinstance(data, str):
@@ -3221,6 +3236,18 @@ class ChatbotWidget(QWidget):
             logger.exception("getGraphStatus failed")
             self._send_to_js({"type": "graph.status", "data": {"totalCards": 0, "totalTerms": 0}})
 
+    def _msg_get_db_maintenance_status(self, data):
+        """Return SQLite maintenance status (last runs, WAL size, due tasks)."""
+        try:
+            from ..storage.db_maintenance import status
+        except ImportError:
+            from storage.db_maintenance import status
+        try:
+            self._send_to_js({"type": "db.maintenanceStatus", "data": status()})
+        except Exception:
+            logger.exception("getDbMaintenanceStatus failed")
+            self._send_to_js({"type": "db.maintenanceStatus", "data": {}})
+
     def _msg_get_card_kg_terms(self, data):
         """Return KG terms for a specific card (for reviewer marking)."""
         try:
@@ -3598,11 +3625,7 @@ class ChatbotWidget(QWidget):
                 return
 
             # Load embeddings for these cards
-            card_embs = {}
-            with emb_mgr._lock:
-                for i, cid in enumerate(emb_mgr._card_ids):
-                    if cid in card_ids:
-                        card_embs[cid] = emb_mgr._index[i]
+            card_embs = emb_mgr.get_vectors(card_ids)
 
             if len(card_embs) < 4:
                 self._send_to_js({"type": "graph.subClusters", "data": {